@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+from fixtures import fake_qemu_command
+
+from qmp_client import allocate_qmp_endpoint, has_unix_sockets
+from vm_supervisor import RUNNING, EXITED
+from vm_agent import RemoteSupervisor, connect_agent, read_tail
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def bench_endpoint(tmp):
+    if has_unix_sockets():
+        return f"unix:{tmp}/agent.sock"
+    return rf"pipe:\\.\pipe\ultimate-qemu-bench-{os.getpid()}"
+
+
+class Waiter:
+    # Records when each VM first reached a state, for any thread to wait on.
+    def __init__(self):
+        self.seen = {}
+        self.cond = threading.Condition()
+
+    def mark(self, key):
+        with self.cond:
+            self.seen.setdefault(key, time.perf_counter())
+            self.cond.notify_all()
+
+    def wait(self, keys, timeout):
+        with self.cond:
+            if not self.cond.wait_for(lambda: all(k in self.seen for k in keys), timeout):
+                missing = [k for k in keys if k not in self.seen]
+                raise RuntimeError(f"{len(missing)} of {len(keys)} never arrived, e.g. {missing[:3]}")
+        return [self.seen[k] for k in keys]
+
+
+async def open_subscribers(endpoint, n, waiter):
+    # n bare clients that only count the VMs they saw exit.
+    clients = []
+    for c in range(n):
+        def on_push(kind, data, c=c):
+            if kind == "state" and data["state"] == EXITED:
+                waiter.mark((c, data["id"]))
+        client = await connect_agent(endpoint, spawn=False, on_push=on_push)
+        await client.request("hello", name=f"bench-subscriber-{c}")
+        await client.request("subscribe", output=False)
+        clients.append(client)
+    return clients
+
+
+def bench_agent(vms=20, clients=20, rpcs=500, timeout=60.0):
+    # Returns one dict per step. Raises if a VM or a push goes missing, or the
+    # VMs do not survive their client going away.
+    steps = []
+    running, ready = Waiter(), Waiter()
+    def on_state(info):
+        if info["state"] == RUNNING:
+            running.mark(info["id"])
+    def on_event(vm_id, name, data):
+        if name == "QMP_READY":
+            ready.mark(vm_id)
+    with tempfile.TemporaryDirectory() as tmp:
+        endpoint = bench_endpoint(tmp)
+        registry = os.path.join(tmp, "running.json")
+        t0 = time.perf_counter()
+        sup = RemoteSupervisor(endpoint, "bench", log_dir=tmp, registry=registry,
+                               on_state=on_state, on_event=on_event).start()
+        steps.append({"step": "spawn agent and connect", "seconds": time.perf_counter() - t0})
+        agent_pid = sup.agent_info["pid"]
+        subscribers = []
+        try:
+            times = []
+            for _ in range(rpcs):
+                t = time.perf_counter()
+                sup.status()
+                times.append(time.perf_counter() - t)
+            steps.append({"step": "request round trip", "seconds": percentile(times, 0.5), "p99": percentile(times, 0.99)})
+
+            ids = list(range(1, vms + 1))
+            launched = {}
+            t0 = time.perf_counter()
+            for vm_id in ids:
+                qmp = allocate_qmp_endpoint(vm_id)
+                launched[vm_id] = time.perf_counter()
+                sup.launch(vm_id, f"bench{vm_id}", fake_qemu_command("-m", "128", "-qmp", f"{qmp},server=on,wait=off"),
+                           admit=False, qmp=qmp)
+            at_running = running.wait(ids, timeout)
+            at_ready = ready.wait(ids, timeout)
+            wall = time.perf_counter() - t0
+            steps.append({"step": "launch to running push", "seconds": percentile([r - launched[i] for i, r in zip(ids, at_running)], 0.5),
+                          "vms": vms, "wall": wall})
+            steps.append({"step": "launch to QMP ready push", "seconds": percentile([r - launched[i] for i, r in zip(ids, at_ready)], 0.5),
+                          "p95": percentile([r - launched[i] for i, r in zip(ids, at_ready)], 0.95)})
+
+            # The launching client goes away; a new one finds every VM running
+            # and can drive it over QMP.
+            sup.shutdown(stop_vms=False)
+            t0 = time.perf_counter()
+            sup = RemoteSupervisor(endpoint, "bench-again", log_dir=tmp, registry=registry, spawn=False).start()
+            steps.append({"step": "reconnect and resync", "seconds": time.perf_counter() - t0})
+            if sup.agent_info["pid"] != agent_pid:
+                raise RuntimeError("a second agent was started")
+            lost = [i for i in ids if sup.state(i) != RUNNING or not sup.vms[i].qmp_ready]
+            if lost:
+                raise RuntimeError(f"{len(lost)} VMs did not survive their client going away, e.g. {lost[:3]}")
+            t0 = time.perf_counter()
+            statuses = [f.result(timeout) for f in [sup.qmp_call(i, "query-status") for i in ids]]
+            if any(s["status"] != "running" for s in statuses):
+                raise RuntimeError("query-status through the agent did not report running")
+            steps.append({"step": "QMP query through agent", "seconds": (time.perf_counter() - t0) / vms, "vms": vms})
+            if not any("console line" in line for line in read_tail(sup.vms[ids[0]].log_path, 10)) \
+                    or not sup.tail(ids[0], 10):
+                raise RuntimeError("the agent did not log VM output")
+
+            # A dropped connection is re-established by the client on its own.
+            sup.loop.call_soon_threadsafe(sup.agent._writer.transport.abort)
+            deadline = time.monotonic() + timeout
+            while sup.connections < 2 or not sup.agent.connected:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("the client did not reconnect")
+                time.sleep(0.01)
+            if sup.active() != [sup.vms[i] for i in ids]:
+                raise RuntimeError("VMs went missing across a reconnect")
+
+            # Stopping all VMs, as seen by every subscriber.
+            exited = Waiter()
+            subscribers = sup.call(open_subscribers(endpoint, clients, exited))
+            t0 = time.perf_counter()
+            sup.stop_all()
+            at_exit = exited.wait([(c, i) for c in range(clients) for i in ids], timeout)
+            steps.append({"step": "stop all, pushed to every client", "seconds": max(at_exit) - t0,
+                          "clients": clients, "pushes": clients * vms})
+            status = sup.status()
+            if status["active"] or len(status["clients"]) != clients + 1:
+                raise RuntimeError(f"agent status after stop all: {status}")
+        finally:
+            for client in subscribers:
+                sup.call(client.close())
+            if sup.agent is not None and sup.agent.connected:
+                sup.call(sup.agent.request("shutdown", stop_vms=True))
+            sup.shutdown(stop_vms=False)
+            wait_for_exit(agent_pid, timeout)
+    return steps
+
+
+def wait_for_exit(pid, timeout):
+    # An agent spawned by this process has to be reaped here; pid_alive
+    # would see the zombie as alive.
+    from vm_registry import pid_alive
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                return
+        except ChildProcessError:
+            if not pid_alive(pid):
+                return
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"the agent (pid {pid}) did not exit")
+        time.sleep(0.05)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end VM agent round trips, launches, reconnects and "
+                                                 "push fan-out, with fake VMs.")
+    parser.add_argument("--vms", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=20, help="extra subscribed clients")
+    parser.add_argument("--rpcs", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+    steps = bench_agent(args.vms, args.clients, args.rpcs)
+    if args.json:
+        print(json.dumps(steps, indent=2))
+        return
+    for s in steps:
+        extra = {k: v for k, v in s.items() if k not in ("step", "seconds")}
+        print(f"{s['step']:<34} {1000 * s['seconds']:9.2f}ms  " + "  ".join(
+            f"{k}: {1000 * v:.2f}ms" if isinstance(v, float) else f"{k}: {v}" for k, v in extra.items()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
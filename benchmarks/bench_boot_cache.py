@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from fixtures import fake_qemu_executable, make_fake_iso
+
+from profile_store import QemuProfile
+from qemu_command import build_command
+from qmp_client import allocate_qmp_endpoint
+from vm_supervisor import VmSupervisor, ACTIVE_STATES
+from boot_cache import BootCache
+
+# Ready detection tuned for the fake guest: its "boot" is a few seconds of
+# busy CPU, after which it idles.
+READY = {"min_uptime": 0.5, "idle_seconds": 1.0, "poll": 0.2}
+
+
+def bench_profile(i, qemu, iso):
+    prof = QemuProfile(f"bench-fast-{i}")
+    prof.id = i
+    prof.qemu_path = qemu
+    prof.iso = iso
+    prof.ram = 128
+    prof.cpus = 1
+    prof.fast_start = True
+    return prof
+
+
+def launch(sup, prof, cache, boot_seconds):
+    # (launch command, cache entry used or None, time of launch)
+    os.environ["FAKE_QEMU_GUEST_BOOT"] = str(boot_seconds)
+    qmp = allocate_qmp_endpoint(prof.id)
+    cmd = build_command(prof, qmp=qmp)
+    saved = cache.lookup(prof, cmd)
+    t0 = time.perf_counter()
+    sup.launch(prof.id, prof.name, cmd + cache.restore_args(saved) if saved else cmd, qmp=qmp)
+    return cmd, saved, t0
+
+
+def wait_running(sup, vm_id, timeout=30.0):
+    # Until QMP answers that the guest runs: the VM is usable.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        vm = sup.vms[vm_id]
+        if vm.state not in ACTIVE_STATES:
+            raise RuntimeError(f"{vm.name} exited: {vm.error or vm.exit_code}")
+        if vm.qmp_ready and sup.qmp_call(vm_id, "query-status").result(timeout).get("status") == "running":
+            return
+        time.sleep(0.02)
+    raise RuntimeError(f"VM {vm_id} did not run within {timeout}s")
+
+
+def cold_boot(sup, prof, cache, boot_seconds):
+    # Launch to guest settled, then the state capture.
+    cmd, saved, t0 = launch(sup, prof, cache, boot_seconds)
+    if saved is not None:
+        raise RuntimeError(f"{prof.name}: unexpected cache hit")
+    entry = sup.call(cache.capture_when_ready(sup, prof.id, prof, cmd, **READY), timeout=boot_seconds + 60)
+    if entry is None:
+        raise RuntimeError(f"{prof.name} stopped before its state was saved")
+    total = time.perf_counter() - t0
+    sup.stop(prof.id)
+    cache.settle(entry["key"], prof)
+    return {"ready_s": total - entry["seconds"], "save_s": entry["seconds"], "size": entry["size"]}
+
+
+def resume(sup, prof, cache):
+    _, saved, t0 = launch(sup, prof, cache, 0)
+    if saved is None:
+        raise RuntimeError(f"{prof.name}: no saved state to resume")
+    wait_running(sup, prof.id)
+    seconds = time.perf_counter() - t0
+    sup.stop(prof.id)
+    cache.settle(saved["key"], prof)
+    return seconds
+
+
+def bench_boot_cache(boot_seconds=3.0, resumes=5):
+    # Returns one dict per step. Raises if the cache hits, misses or evicts
+    # when it should not.
+    steps = []
+    with tempfile.TemporaryDirectory() as tmp:
+        qemu = fake_qemu_executable(tmp)
+        iso = make_fake_iso(os.path.join(tmp, "install.iso"))
+        cache = BootCache(os.path.join(tmp, "cache"))
+        sup = VmSupervisor(log_dir=tmp).start()
+        cache.is_running = lambda profile_id: sup.state(profile_id) in ACTIVE_STATES
+        try:
+            prof = bench_profile(1, qemu, iso)
+            cold = cold_boot(sup, prof, cache, boot_seconds)
+            steps.append({"step": "cold boot until ready", "seconds": cold["ready_s"], "save_seconds": cold["save_s"]})
+            times = [resume(sup, prof, cache) for _ in range(resumes)]
+            steps.append({"step": "resume from saved state", "seconds": min(times), "worst": max(times),
+                          "hits": cache.stats["hits"]})
+            # Invalidation: a changed ISO drops the state, a changed profile misses it.
+            later = os.path.getmtime(iso) + 2
+            os.utime(iso, (later, later))
+            if cache.lookup(prof, build_command(prof)) is not None or cache.entries:
+                raise RuntimeError("a state survived a change of its ISO")
+            cold_boot(sup, prof, cache, boot_seconds)
+            prof.ram = 256
+            if cache.lookup(prof, build_command(prof)) is not None:
+                raise RuntimeError("a state matched a different command line")
+            prof.ram = 128
+            # LRU: room for two states; the least recently used one goes.
+            cache.max_bytes = 2 * cold["size"]
+            others = [bench_profile(i, qemu, iso) for i in (2, 3)]
+            cold_boot(sup, others[0], cache, 0)
+            resume(sup, prof, cache)
+            cold_boot(sup, others[1], cache, 0)
+            kept = sorted(e["profile_id"] for e in cache.entries.values())
+            if kept != [1, 3]:
+                raise RuntimeError(f"LRU kept profiles {kept}, expected [1, 3]")
+            steps.append({"step": "LRU eviction", "seconds": 0.0, "evicted": cache.stats["evicted"],
+                          "invalidated": cache.stats["invalidated"]})
+        finally:
+            sup.shutdown()
+            os.environ.pop("FAKE_QEMU_GUEST_BOOT", None)
+    for s in steps:
+        s["boot_seconds"] = boot_seconds
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold boot versus resume from the boot cache, with fake VMs "
+                                                 "whose guests take --boot-seconds to settle.")
+    parser.add_argument("--boot-seconds", type=float, default=3.0)
+    parser.add_argument("--resumes", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+    steps = bench_boot_cache(args.boot_seconds, args.resumes)
+    if args.json:
+        print(json.dumps(steps, indent=2))
+        return
+    for s in steps:
+        extra = {k: v for k, v in s.items() if k not in ("step", "seconds", "boot_seconds")}
+        print(f"{s['step']:<26} {s['seconds']:7.3f}s  " + "  ".join(f"{k}: {v:.3f}" if isinstance(v, float) else f"{k}: {v}"
+                                                               for k, v in extra.items()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from fixtures import serve_directory, make_payload
+
+from iso_downloader import SegmentedDownloader, download_single_stream, make_session
+
+
+def bench_download(size_mb=64, rate_limit=None, segment_counts=(1, 2, 4, 8),
+                   chunk_sizes=(8192, 64 * 1024, 256 * 1024, 1024 * 1024)):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        src = make_payload(os.path.join(tmp, "payload.iso"), size_mb * 1024 * 1024)
+        server, base = serve_directory(tmp, rate_limit=rate_limit)
+        url = f"{base}/payload.iso"
+        try:
+            dest = os.path.join(tmp, "single.iso")
+            t0 = time.perf_counter()
+            download_single_stream(url, dest)
+            elapsed = time.perf_counter() - t0
+            results.append({"mode": "single-stream", "segments": 1, "chunk_size": 8192,
+                            "seconds": elapsed, "mib_per_s": size_mb / elapsed})
+            os.remove(dest)
+            for segments in segment_counts:
+                for chunk in chunk_sizes:
+                    dest = os.path.join(tmp, f"seg{segments}-{chunk}.iso")
+                    session = make_session(segments)
+                    t0 = time.perf_counter()
+                    SegmentedDownloader(url, dest, segments=segments, chunk_size=chunk, session=session).run()
+                    elapsed = time.perf_counter() - t0
+                    session.close()
+                    if os.path.getsize(dest) != os.path.getsize(src):
+                        raise RuntimeError(f"size mismatch for {dest}")
+                    results.append({"mode": "segmented", "segments": segments, "chunk_size": chunk,
+                                    "seconds": elapsed, "mib_per_s": size_mb / elapsed})
+                    os.remove(dest)
+        finally:
+            server.shutdown()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare single-stream and segmented ISO downloads against a local HTTP server.")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="per-connection cap in MiB/s, imitates a throttled mirror")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+    rate = args.rate_limit * 1024 * 1024 if args.rate_limit else None
+    results = bench_download(args.size_mb, rate)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['mode']:<14} segments={r['segments']:<2} chunk={r['chunk_size']:<8} "
+              f"{r['seconds']:7.3f}s {r['mib_per_s']:8.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
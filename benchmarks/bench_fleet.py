@@ -0,0 +1,132 @@
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from fixtures import fake_qemu_command
+
+from qmp_client import allocate_qmp_endpoint
+from vm_supervisor import VmSupervisor, STOP_POWERDOWN, STOP_QUIT, STOP_KILL
+from fleet import start_fleet, stop_fleet, restart_fleet, tally, STARTED, STOP_OUTCOMES
+
+# Guests that power off when asked, ignore the ACPI button, or are wedged and
+# ignore quit too: (share of the fleet, fake_qemu environment, expected end).
+GUESTS = (
+    (2, {}, STOP_POWERDOWN),
+    (1, {"FAKE_QEMU_POWERDOWN_DELAY": "-1"}, STOP_QUIT),
+    (1, {"FAKE_QEMU_POWERDOWN_DELAY": "-1", "FAKE_QEMU_WEDGED": "1"}, STOP_KILL),
+)
+
+
+def fleet_launches(ids, boot_delay, env_of=lambda vm_id: {}):
+    # fake_qemu opens QMP boot_delay seconds after it starts, like a guest
+    # that takes a while to come up; `env` sets its per-VM behaviour.
+    launches = []
+    for vm_id in ids:
+        qmp = allocate_qmp_endpoint(vm_id)
+        env = dict(env_of(vm_id), FAKE_QEMU_BOOT_DELAY=str(boot_delay))
+        cmd = ["env"] + [f"{k}={v}" for k, v in env.items()] + \
+            fake_qemu_command("-m", "128", "-qmp", f"{qmp},server=on,wait=off")
+        launches.append((vm_id, f"fleet{vm_id}", cmd, {"qmp": qmp}))
+    return launches
+
+
+def guest_kind(vm_id):
+    slot = vm_id % sum(share for share, _, _ in GUESTS)
+    for share, env, expected in GUESTS:
+        if slot < share:
+            return env, expected
+        slot -= share
+
+
+def timed_start(sup, launches, concurrency, stagger, timeout):
+    # Results plus the most VMs that were booting at once.
+    spans = []
+    def on_result(r):
+        if r.outcome == STARTED:
+            now = time.perf_counter()
+            spans.append((now - r.seconds, now))
+    t0 = time.perf_counter()
+    results = sup.call(start_fleet(sup, launches, concurrency, stagger, timeout, on_result))
+    wall = time.perf_counter() - t0
+    bad = [str(r) for r in results if r.outcome != STARTED]
+    if bad:
+        raise RuntimeError(f"{len(bad)} VMs did not start, e.g. {bad[:3]}")
+    edges = sorted([(a, 1) for a, _ in spans] + [(b, -1) for _, b in spans])
+    booting = peak = 0
+    for _, step in edges:
+        booting += step
+        peak = max(peak, booting)
+    return results, wall, peak
+
+
+def bench_fleet(vms=16, concurrency=4, stagger=0.05, boot_delay=0.3, powerdown_timeout=1.0, quit_timeout=0.5,
+                timeout=60.0):
+    # Returns one dict per step. Raises if a gate is not kept, a VM ends
+    # another way than its guest should, or the shutdown runs serially.
+    steps = []
+    ids = list(range(1, vms + 1))
+    with tempfile.TemporaryDirectory() as tmp:
+        sup = VmSupervisor(log_dir=tmp).start()
+        try:
+            results, wall, peak = timed_start(sup, fleet_launches(ids, boot_delay), vms, 0.0, timeout)
+            steps.append({"step": "start all at once", "seconds": wall, "vms": vms, "booting at once": peak})
+            sup.call(stop_fleet(sup, ids, powerdown_timeout, quit_timeout))
+
+            results, wall, peak = timed_start(sup, fleet_launches(ids, boot_delay), concurrency, stagger, timeout)
+            if peak > concurrency:
+                raise RuntimeError(f"{peak} VMs booted at once with a limit of {concurrency}")
+            steps.append({"step": "staggered start", "seconds": wall, "vms": vms, "booting at once": peak,
+                          "p50 to running": sorted(r.seconds for r in results)[vms // 2]})
+            sup.call(stop_fleet(sup, ids, powerdown_timeout, quit_timeout))
+
+            kinds = {vm_id: guest_kind(vm_id) for vm_id in ids}
+            timed_start(sup, fleet_launches(ids, boot_delay, lambda vm_id: kinds[vm_id][0]), vms, 0.0, timeout)
+            t0 = time.perf_counter()
+            results = sup.call(stop_fleet(sup, ids, powerdown_timeout, quit_timeout))
+            wall = time.perf_counter() - t0
+            wrong = [f"{r} (expected {STOP_OUTCOMES[kinds[r.vm_id][1]]})" for r in results
+                     if r.outcome != STOP_OUTCOMES[kinds[r.vm_id][1]]]
+            if wrong:
+                raise RuntimeError(f"{len(wrong)} VMs ended the wrong way, e.g. {wrong[:3]}")
+            if wall > powerdown_timeout + quit_timeout + 1.0:
+                raise RuntimeError(f"graceful stop took {wall:.1f}s; the deadlines are "
+                                   f"{powerdown_timeout}s + {quit_timeout}s")
+            steps.append({"step": "graceful stop with escalation", "seconds": wall, "vms": vms, "ended": tally(results)})
+            for outcome in (STOP_POWERDOWN, STOP_QUIT, STOP_KILL):
+                times = sorted(r.seconds for r in results if r.outcome == STOP_OUTCOMES[outcome])
+                steps.append({"step": f"  {STOP_OUTCOMES[outcome]}", "seconds": times[len(times) // 2], "vms": len(times)})
+
+            launches = fleet_launches(ids, boot_delay)
+            sup.call(start_fleet(sup, launches, vms, 0.0, timeout))
+            t0 = time.perf_counter()
+            results = sup.call(restart_fleet(sup, launches, concurrency, stagger, timeout,
+                                             powerdown_timeout, quit_timeout))
+            steps.append({"step": "restart", "seconds": time.perf_counter() - t0, "vms": vms, "ended": tally(results)})
+        finally:
+            sup.shutdown(timeout=quit_timeout)
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Staggered fleet starts and graceful parallel shutdown with "
+                                                 "per-VM escalation, with fake VMs.")
+    parser.add_argument("--vms", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stagger", type=float, default=0.05)
+    parser.add_argument("--boot-delay", type=float, default=0.3, help="seconds each fake VM takes to answer QMP")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+    steps = bench_fleet(args.vms, args.concurrency, args.stagger, args.boot_delay)
+    if args.json:
+        print(json.dumps(steps, indent=2))
+        return
+    for s in steps:
+        extra = {k: v for k, v in s.items() if k not in ("step", "seconds")}
+        print(f"{s['step']:<32} {s['seconds']:8.2f}s  " + "  ".join(
+            f"{k}: {v:.2f}s" if isinstance(v, float) else f"{k}: {v}" for k, v in extra.items()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
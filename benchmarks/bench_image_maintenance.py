@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+
+from fixtures import ROOT
+
+from image_maintenance import MaintenanceQueue, COMPACT, DONE, FAILED, TMP_SUFFIX, allocated_bytes
+
+FAKE_QEMU_IMG = os.path.join(ROOT, "benchmarks", "fake_qemu_img.py")
+BLOCK = 1024 * 1024
+
+
+def make_image(path, size_mb, used=0.25):
+    # A fully allocated raw image: `used` of it data, the rest written zeros,
+    # like a guest disk after files were deleted. Returns its sha256.
+    digest = hashlib.sha256()
+    data_blocks = int(size_mb * used)
+    with open(path, "wb") as f:
+        for i in range(size_mb):
+            block = (i.to_bytes(4, "little") * (BLOCK // 4)) if i < data_blocks else bytes(BLOCK)
+            f.write(block)
+            digest.update(block)
+        f.flush()
+        os.fsync(f.fileno())
+    return digest.hexdigest()
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_queue(paths, jobs, bandwidth=None, in_use=None):
+    updates = []
+    queue = MaintenanceQueue(jobs=jobs, bandwidth=bandwidth, in_use=in_use, on_update=updates.append)
+    t0 = time.perf_counter()
+    submitted = [queue.submit(None, p, COMPACT, qemu_img=FAKE_QEMU_IMG) for p in paths]
+    finished = [j.future.result() for j in submitted]
+    seconds = time.perf_counter() - t0
+    queue.shutdown()
+    return finished, seconds, len(updates)
+
+
+def bench_image_maintenance(images=4, size_mb=64, bandwidth_mb=64):
+    # Returns one dict per step. Raises if a compacted image changed content.
+    steps = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"disk{i}.raw") for i in range(images)]
+        total = images * size_mb * BLOCK
+        for label, jobs, bw in (("one job at a time", 1, None), (f"{images} jobs", images, None),
+                                (f"{images} jobs, {bandwidth_mb} MiB/s cap", images, bandwidth_mb)):
+            sums = [make_image(p, size_mb) for p in paths]
+            finished, seconds, updates = run_queue(paths, jobs, bw and bw * BLOCK)
+            failed = [f"{j.disk}: {j.error}" for j in finished if j.state != DONE]
+            if failed:
+                raise RuntimeError("; ".join(failed))
+            if [sha256(p) for p in paths] != sums:
+                raise RuntimeError(f"{label}: compacted images differ from the originals")
+            steps.append({"step": label, "jobs": jobs, "bandwidth_mb": bw, "seconds": seconds,
+                          "mib_per_s": total / BLOCK / seconds, "progress_updates": updates,
+                          "reclaimed": sum(j.reclaimed for j in finished)})
+        # A running VM's disk is refused, and a failing qemu-img leaves the original alone.
+        make_image(paths[0], size_mb)
+        before = allocated_bytes(paths[0])
+        finished, _, _ = run_queue(paths[:1], 1, in_use=lambda path: "bench-vm")
+        if finished[0].state != FAILED or allocated_bytes(paths[0]) != before:
+            raise RuntimeError("a disk in use was compacted")
+        os.environ["FAKE_QEMU_IMG_FAIL"] = "0.5"
+        try:
+            finished, _, _ = run_queue(paths[:1], 1)
+        finally:
+            del os.environ["FAKE_QEMU_IMG_FAIL"]
+        if finished[0].state != FAILED or os.path.exists(paths[0] + TMP_SUFFIX) or allocated_bytes(paths[0]) != before:
+            raise RuntimeError("a failed compaction left files behind or touched the image")
+    for s in steps:
+        s["images"] = images
+        s["size_mb"] = size_mb
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact fully allocated raw images through the maintenance "
+                                                 "queue with a fake qemu-img: job and bandwidth caps, "
+                                                 "progress and space reclaimed.")
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--bandwidth-mb", type=int, default=64, help="cap for the last step in MiB/s (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+    steps = bench_image_maintenance(args.images, args.size_mb, args.bandwidth_mb)
+    if args.json:
+        print(json.dumps(steps, indent=2))
+        return
+    for s in steps:
+        print(f"{s['step']:<28} {s['seconds']:7.3f}s {s['mib_per_s']:8.1f} MiB/s  "
+              f"progress updates: {s['progress_updates']:<5} reclaimed: {s['reclaimed'] / BLOCK:.0f} MiB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_buffer import LogBuffer
+
+SAMPLE_LINES = (
+    "[    0.000000] Linux version 6.8.0 (buildd@lcy02-amd64) #31-Ubuntu SMP",
+    "qemu-system-x86_64: warning: host doesn't support requested feature: CPUID.80000001H:ECX.svm [bit 2]",
+    "systemd[1]: Started Journal Service.",
+    "kernel: EXT4-fs error (device vda1): ext4_find_entry: reading directory lblock 0",
+)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def produce(sink, vm_id, rate, seconds, stop):
+    # Paced in 10 ms slices so the target rate holds over the whole run.
+    per_slice = max(1, int(rate / 100))
+    n = 0
+    start = time.perf_counter()
+    while not stop.is_set():
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            break
+        target = int(elapsed * rate) + per_slice
+        while n < target:
+            sink(vm_id, f"{SAMPLE_LINES[n % len(SAMPLE_LINES)]} #{n}")
+            n += 1
+        time.sleep(0.01)
+    return n
+
+
+def run_producers(sink, rate, seconds, vms):
+    stop = threading.Event()
+    counts = [0] * vms
+    def worker(i):
+        counts[i] = produce(sink, i, rate / vms, seconds, stop)
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(vms)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts), time.perf_counter() - t0
+
+
+def bench_buffer(rate=100_000, seconds=5.0, vms=8, interval=0.1, lines_per_source=5000):
+    # Producers on worker threads, a consumer draining every interval as the GUI would.
+    buf = LogBuffer(lines_per_source)
+    stop = threading.Event()
+    batches = []
+    def consume():
+        while not stop.is_set():
+            time.sleep(interval)
+            lines, dropped = buf.drain()
+            batches.append((len(lines), dropped))
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    total, elapsed = run_producers(lambda vm_id, line: buf.append(vm_id, line), rate, seconds, vms)
+    stop.set()
+    consumer.join()
+    retained = sum(len(buf.lines(source)) for source in buf.sources())
+    return {"mode": "buffer", "target_lines_per_s": rate, "lines": total, "seconds": elapsed,
+            "lines_per_s": total / elapsed, "batches": len(batches),
+            "max_batch": max((b for b, _ in batches), default=0),
+            "dropped_from_batches": sum(d for _, d in batches),
+            "retained_lines": retained, "retained_cap": lines_per_source * vms, "peak_rss_mb": peak_rss_mb()}
+
+
+def bench_view(rate=100_000, seconds=5.0, vms=8, interval_ms=100):
+    # The real LogView on an offscreen Qt platform; a 10 ms timer measures how
+    # long the event loop is blocked by batch appends.
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+    app = QApplication.instance() or QApplication(sys.argv)
+    from ultimate_qemu_frontendc import LogView
+    view = LogView(interval_ms=interval_ms)
+    for i in range(vms):
+        view.set_source_name(i, f"vm{i}")
+    flushes = []
+    original_flush = view.flush
+    def timed_flush():
+        t0 = time.perf_counter()
+        original_flush()
+        flushes.append(time.perf_counter() - t0)
+    view.flush_timer.timeout.disconnect()
+    view.flush_timer.timeout.connect(timed_flush)
+    stalls = []
+    last = [time.perf_counter()]
+    def tick():
+        now = time.perf_counter()
+        stalls.append(now - last[0] - 0.01)
+        last[0] = now
+    ticker = QTimer()
+    ticker.timeout.connect(tick)
+    ticker.start(10)
+    result = {}
+    def producers():
+        result["lines"], result["seconds"] = run_producers(lambda vm_id, line: view.append(line, vm_id),
+                                                           rate, seconds, vms)
+    thread = threading.Thread(target=producers, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        app.processEvents()
+        time.sleep(0.001)
+    timed_flush()
+    ticker.stop()
+    return {"mode": "view", "target_lines_per_s": rate, "lines": result["lines"], "seconds": result["seconds"],
+            "lines_per_s": result["lines"] / result["seconds"], "flushes": len(flushes),
+            "mean_flush_ms": 1000 * sum(flushes) / max(len(flushes), 1),
+            "max_flush_ms": 1000 * max(flushes, default=0),
+            "max_event_loop_stall_ms": 1000 * max(stalls, default=0),
+            "view_lines": view.text.blockCount(), "peak_rss_mb": peak_rss_mb()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stress the bounded log buffer and batched log view.")
+    parser.add_argument("--rate", type=int, default=100_000, help="lines per second over all VMs (default: %(default)s)")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--vms", type=int, default=8, help="producer threads, one per simulated VM")
+    parser.add_argument("--gui", action="store_true", help="also drive the Qt log view (needs PyQt5)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+    results = [bench_buffer(args.rate, args.seconds, args.vms)]
+    if args.gui:
+        results.append(bench_view(args.rate, args.seconds, args.vms))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f"{r['mode']:<7} {r['lines']:>9} lines in {r['seconds']:6.2f}s = {r['lines_per_s']:>9.0f} lines/s "
+              f"(target {r['target_lines_per_s']})")
+        if r["mode"] == "buffer":
+            print(f"        {r['batches']} batches, largest {r['max_batch']}, {r['dropped_from_batches']} dropped; "
+                  f"{r['retained_lines']} lines retained (cap {r['retained_cap']})")
+        else:
+            print(f"        {r['flushes']} flushes, mean {r['mean_flush_ms']:.1f} ms, max {r['max_flush_ms']:.1f} ms; "
+                  f"event loop stalled at most {r['max_event_loop_stall_ms']:.1f} ms; {r['view_lines']} lines shown")
+        if r["peak_rss_mb"] is not None:
+            print(f"        peak RSS {r['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
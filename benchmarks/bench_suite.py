@@ -0,0 +1,427 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+from fixtures import ROOT, fake_qemu_command, make_iso_tree, make_fake_iso
+
+from profile_store import ProfileStore, QemuProfile
+from profile_index import ProfileIndex
+from qemu_command import build_command, format_command
+from host_caps import HostCaps
+from iso_index import IsoLibraryIndex, describe_entry
+from vm_supervisor import VmSupervisor
+from qmp_client import allocate_qmp_endpoint
+from telemetry import TelemetryCollector
+
+# Headless benchmarks of the frontend's hot paths. Each result is
+#   {"name", "params", "value", "unit", "better": "lower"|"higher", ...extra}
+# and --compare matches results by name and params, so runs from two
+# commits can be diffed.
+
+GROUPS = ("profiles", "iso", "commands", "download", "qmp", "telemetry", "updates", "maintenance", "bootcache", "agent", "fleet")
+FULL = {"profiles": (10, 1000, 10000), "iso_files": 50000, "commands": 1000, "download_mb": 64, "vms": (1, 8, 32),
+        "telemetry_vms": 50, "maintenance_mb": 128,
+        "boot_seconds": 3.0, "agent": (100, 200), "fleet": (32, 4)}
+QUICK = {"profiles": (10, 1000), "iso_files": 5000, "commands": 200, "download_mb": 16, "vms": (1, 4),
+         "telemetry_vms": 10, "maintenance_mb": 32,
+         "boot_seconds": 1.0, "agent": (10, 10), "fleet": (8, 2)}
+
+
+def result(name, params, value, unit, better="lower", **extra):
+    r = {"name": name, "params": params, "value": value, "unit": unit, "better": better}
+    r.update(extra)
+    return r
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    value = fn(*args)
+    return time.perf_counter() - t0, value
+
+
+def best(fn, *args, repeat=5):
+    # Best of several runs for read-only steps; single runs of sub-millisecond
+    # work are too noisy to compare between commits.
+    runs = [timed(fn, *args) for _ in range(repeat)]
+    return min(t for t, _ in runs), runs[-1][1]
+
+
+def log(text):
+    print(text, file=sys.stderr, flush=True)
+
+
+def sample_profile(i, disk=""):
+    prof = QemuProfile(f"bench-{i}")
+    prof.qemu_path = "/usr/bin/qemu-system-x86_64"
+    prof.ram = 1024 + (i % 8) * 512
+    prof.cpus = 1 + i % 4
+    prof.iso = f"/isos/image{i % 50}.iso" if i % 3 else ""
+    prof.disk = disk
+    prof.extra = "-vga virtio" if i % 5 == 0 else ""
+    prof.usb_devices = ["046d:c52b"] if i % 7 == 0 else []
+    prof.performance = i % 2 == 0
+    prof.disk_bus = "virtio-scsi" if i % 4 == 0 else "virtio-blk"
+    prof.snapshots = [f"snap{j}" for j in range(i % 4)]
+    prof.tags = ["web", "prod"] if i % 3 == 0 else ["db"]
+    return prof
+
+
+# ===== Profile store =====
+def bench_profiles(counts):
+    results = []
+    for n in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "profiles.db")
+            store = ProfileStore(db)
+            profiles = [sample_profile(i) for i in range(n)]
+            seconds, _ = timed(lambda: [store.save(p) for p in profiles])
+            results.append(result("profiles.save_all", {"profiles": n}, seconds, "s", per_op_us=1e6 * seconds / n))
+            store.close()
+            seconds, store = timed(ProfileStore, db)
+            results.append(result("profiles.open", {"profiles": n}, seconds, "s"))
+            seconds, summaries = timed(store.summaries)
+            results.append(result("profiles.load_profiles", {"profiles": n}, seconds, "s", rows=len(summaries)))
+            # As-you-type search: each keystroke of "image4 prod", then clearing it.
+            index = ProfileIndex(summaries)
+            query = "image4 prod"
+            def type_query():
+                for i in range(1, len(query) + 1):
+                    index.filter(query[:i])
+                index.filter("")
+            seconds, _ = best(type_query)
+            results.append(result("profiles.search_keystroke", {"profiles": n}, 1e3 * seconds / (len(query) + 1), "ms"))
+            seconds, _ = timed(store.all)
+            results.append(result("profiles.load_all", {"profiles": n}, seconds, "s"))
+            rounds = min(n, 100)
+            def resave():
+                for p in profiles[:rounds]:
+                    p.ram += 1
+                    store.save(p)
+            seconds, _ = timed(resave)
+            results.append(result("profiles.save_one", {"profiles": n}, 1e6 * seconds / rounds, "us"))
+            store.close()
+        log(f"profiles: {n} done")
+    return results
+
+
+# ===== ISO library =====
+def bench_iso_library(files):
+    results = []
+    params = {"files": files}
+    with tempfile.TemporaryDirectory() as tmp:
+        lib = make_iso_tree(os.path.join(tmp, "library"), files)
+        index_path = os.path.join(tmp, "index.json")
+        index = IsoLibraryIndex(index_path)
+        seconds, entries = timed(index.scan, lib)
+        results.append(result("iso.scan_cold", params, seconds, "s", isos=len(entries)))
+        seconds, _ = timed(index.save)
+        results.append(result("iso.save_index", params, seconds, "s", bytes=os.path.getsize(index_path)))
+        seconds, index = best(IsoLibraryIndex, index_path)
+        results.append(result("iso.load_index", params, seconds, "s"))
+        # What refresh_iso_library does before the background rescan returns.
+        seconds, _ = best(lambda: [describe_entry(e) for e in index.cached_entries(lib)])
+        results.append(result("iso.cached_listing", params, seconds, "s"))
+        seconds, _ = best(index.scan, lib)
+        results.append(result("iso.scan_warm", params, seconds, "s"))
+        changed = os.path.join(lib, "group000", "dir00000")
+        make_fake_iso(os.path.join(changed, "new.iso"), "NEW")
+        seconds, _ = timed(index.rescan_dir, lib, changed)
+        results.append(result("iso.rescan_dir", params, seconds, "s"))
+    log(f"iso library: {files} files done")
+    return results
+
+
+# ===== Command building =====
+def bench_commands(count):
+    caps = HostCaps("linux", "x86_64", ("kvm", "tcg"), io_uring=True, aio_native=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        disks = []
+        for i in range(10):
+            path = os.path.join(tmp, f"disk{i}.img")
+            with open(path, "wb") as f:
+                f.truncate(1024 * 1024)
+            disks.append(path)
+        profiles = [sample_profile(i, disks[i % 10] if i % 2 else "") for i in range(count)]
+        qmp = "unix:/tmp/bench-qmp.sock"
+        build_command(profiles[0], qmp=qmp, caps=caps)  # warm the image inspector cache
+        seconds, cmds = best(lambda: [build_command(p, qmp=qmp, caps=caps) for p in profiles])
+        results = [result("commands.build", {"profiles": count}, 1e6 * seconds / count, "us")]
+        seconds, _ = best(lambda: [format_command(c) for c in cmds])
+        results.append(result("commands.format", {"profiles": count}, 1e6 * seconds / count, "us"))
+    log(f"commands: {count} done")
+    return results
+
+
+# ===== Downloads =====
+def bench_downloads(size_mb):
+    from bench_download import bench_download
+    results = []
+    for r in bench_download(size_mb, segment_counts=(1, 4, 8), chunk_sizes=(256 * 1024,)):
+        results.append(result(f"download.{r['mode']}", {"size_mb": size_mb, "segments": r["segments"],
+                                                        "chunk_size": r["chunk_size"]},
+                              r["mib_per_s"], "MiB/s", better="higher", seconds=r["seconds"]))
+    log(f"download: {size_mb} MiB done")
+    return results
+
+
+# ===== Update checker =====
+def bench_updates():
+    from bench_update_check import bench_update_check
+    results = []
+    for step in bench_update_check():
+        results.append(result("updates.check", {"step": step["step"], "delay_ms": step["delay_ms"]},
+                              step["seconds"], "s", requests=sum(step["requests"].values()),
+                              not_modified=step["not_modified"], bytes=step["bytes"]))
+    log("updates done")
+    return results
+
+
+# ===== Disk maintenance =====
+def bench_maintenance(size_mb, images=4):
+    from bench_image_maintenance import bench_image_maintenance
+    results = []
+    for step in bench_image_maintenance(images, size_mb):
+        results.append(result("maintenance.compact", {"step": step["step"], "images": images, "size_mb": size_mb},
+                              step["mib_per_s"], "MiB/s", better="higher", seconds=step["seconds"],
+                              reclaimed=step["reclaimed"], progress_updates=step["progress_updates"]))
+    log(f"maintenance: {images} x {size_mb} MiB done")
+    return results
+
+
+# ===== Boot cache =====
+def bench_bootcache(boot_seconds):
+    from bench_boot_cache import bench_boot_cache
+    results = []
+    for step in bench_boot_cache(boot_seconds, resumes=3)[:2]:
+        results.append(result("bootcache.start", {"step": step["step"], "boot_seconds": boot_seconds},
+                              step["seconds"], "s"))
+    log(f"bootcache: {boot_seconds}s guest boot done")
+    return results
+
+
+# ===== VM agent =====
+def bench_vm_agent(vms, clients):
+    from bench_agent import bench_agent
+    results = []
+    for step in bench_agent(vms, clients):
+        results.append(result("agent.latency", {"step": step["step"], "vms": vms, "clients": clients},
+                              step["seconds"], "s"))
+    log(f"agent: {vms} VMs, {clients} clients done")
+    return results
+
+
+# ===== Fleet operations =====
+def bench_fleet_ops(vms, concurrency):
+    from bench_fleet import bench_fleet
+    results = []
+    for step in bench_fleet(vms, concurrency):
+        results.append(result("fleet.time", {"step": step["step"].strip(), "vms": step["vms"], "concurrency": concurrency},
+                              step["seconds"], "s"))
+    log(f"fleet: {vms} VMs, {concurrency} booting at once done")
+    return results
+
+
+# ===== Launch to QMP ready =====
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def bench_qmp_ready(counts, timeout=60.0):
+    results = []
+    launched = {}
+    ready = {}
+    done = threading.Condition()
+    def on_event(vm_id, name, data):
+        if name == "QMP_READY":
+            with done:
+                ready[vm_id] = time.perf_counter()
+                done.notify_all()
+    with tempfile.TemporaryDirectory() as tmp:
+        sup = VmSupervisor(log_dir=tmp, on_event=on_event).start()
+        next_id = 1
+        try:
+            for n in counts:
+                ids = list(range(next_id, next_id + n))
+                next_id += n
+                t0 = time.perf_counter()
+                for vm_id in ids:
+                    qmp = allocate_qmp_endpoint(vm_id)
+                    launched[vm_id] = time.perf_counter()
+                    sup.launch(vm_id, f"bench{vm_id}", fake_qemu_command("-m", "128", "-qmp", f"{qmp},server=on,wait=off"),
+                               qmp=qmp)
+                with done:
+                    done.wait_for(lambda: all(i in ready for i in ids), timeout)
+                wall = time.perf_counter() - t0
+                latencies = [ready[i] - launched[i] for i in ids if i in ready]
+                if len(latencies) < n:
+                    raise RuntimeError(f"only {len(latencies)} of {n} fake VMs reached QMP in {timeout}s")
+                results.append(result("qmp.ready_p50", {"vms": n}, percentile(latencies, 0.5), "s",
+                                      p95=percentile(latencies, 0.95), max=max(latencies), wall=wall))
+                sup.stop_all()
+                log(f"qmp: {n} VMs done")
+        finally:
+            sup.shutdown()
+    return results
+
+
+# ===== Telemetry =====
+def bench_telemetry(vms, passes=20, timeout=60.0):
+    # CPU time of one sampling pass over `vms` running fake VMs, measured as
+    # process CPU (the pass runs on the supervisor thread), with and without
+    # the QMP blockstats queries.
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sup = VmSupervisor(log_dir=tmp).start()
+        try:
+            for vm_id in range(1, vms + 1):
+                qmp = allocate_qmp_endpoint(10000 + vm_id)
+                sup.launch(vm_id, f"bench{vm_id}", fake_qemu_command("-m", "128", "-qmp", f"{qmp},server=on,wait=off",
+                                                                     "-drive", f"file={tmp}/d{vm_id}.img,id=disk0"),
+                           qmp=qmp)
+            deadline = time.monotonic() + timeout
+            while not all(vm.qmp_ready for vm in sup.vms.values()):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"fake VMs did not reach QMP in {timeout}s")
+                time.sleep(0.05)
+            for qmp_stats in (False, True):
+                collector = TelemetryCollector(sup, qmp_stats=qmp_stats)
+                sup.call(collector.sample())
+                cpu = []
+                wall = []
+                for _ in range(passes):
+                    c0, w0 = time.process_time(), time.perf_counter()
+                    sampled = sup.call(collector.sample())
+                    cpu.append(time.process_time() - c0)
+                    wall.append(time.perf_counter() - w0)
+                if len(sampled) != vms:
+                    raise RuntimeError(f"sampled {len(sampled)} of {vms} VMs")
+                results.append(result("telemetry.pass_cpu", {"vms": vms, "qmp": qmp_stats}, 1000 * min(cpu), "ms",
+                                      median_ms=1000 * percentile(cpu, 0.5), wall_ms=1000 * percentile(wall, 0.5)))
+        finally:
+            sup.shutdown()
+    log(f"telemetry: {vms} VMs done")
+    return results
+
+
+# ===== Reporting =====
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def result_key(r):
+    return r["name"], json.dumps(r["params"], sort_keys=True)
+
+
+def merge_best(runs):
+    # Keep each result's best value over repeated runs of the whole suite.
+    merged = {}
+    for results in runs:
+        for r in results:
+            key = result_key(r)
+            old = merged.get(key)
+            if old is None or (r["value"] > old["value"] if r["better"] == "higher" else r["value"] < old["value"]):
+                merged[key] = r
+    return list(merged.values())
+
+
+def compare(old_results, new_results, threshold):
+    # Positive change = slower/worse. Returns the regressions beyond threshold.
+    old = {result_key(r): r for r in old_results}
+    regressions = []
+    for r in new_results:
+        base = old.get(result_key(r))
+        if base is None or not base["value"] or not r["value"]:
+            continue
+        if r["better"] == "higher":
+            change = base["value"] / r["value"] - 1
+        else:
+            change = r["value"] / base["value"] - 1
+        flag = "REGRESSION" if change > threshold else ("improved" if change < -threshold else "")
+        print(f"{r['name']:<26} {json.dumps(r['params']):<48} {base['value']:>12.4g} -> {r['value']:>12.4g} "
+              f"{r['unit']:<6} {100 * change:+7.1f}% {flag}")
+        if change > threshold:
+            regressions.append(r)
+    return regressions
+
+
+def run_group(name, run, skipped):
+    # A group whose optional dependency is missing is skipped and noted in the
+    # report rather than aborting the whole suite.
+    try:
+        return run()
+    except ImportError as e:
+        skipped[name] = f"missing {e.name or e}"
+        log(f"{name}: skipped, {skipped[name]}")
+        return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark profile storage, ISO scans, command building, "
+                                                 "downloads, QMP start-up latency, telemetry sampling and "
+                                                 "update checks, disk maintenance, fast start, the VM agent "
+                                                 "and fleet start/stop; "
+                                                 "prints JSON.")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast check")
+    parser.add_argument("--only", help=f"comma-separated groups: {','.join(GROUPS)}")
+    parser.add_argument("-o", "--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--repeat", type=int, default=3, help="run everything this many times and keep the best "
+                                                               "value of each result (default: %(default)s)")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="compare with an earlier run; exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change counted as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+    sizes = QUICK if args.quick else FULL
+    groups = args.only.split(",") if args.only else GROUPS
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown group(s): {', '.join(sorted(unknown))}")
+    benches = {
+        "profiles": lambda: bench_profiles(sizes["profiles"]),
+        "iso": lambda: bench_iso_library(sizes["iso_files"]),
+        "commands": lambda: bench_commands(sizes["commands"]),
+        "download": lambda: bench_downloads(sizes["download_mb"]),
+        "qmp": lambda: bench_qmp_ready(sizes["vms"]),
+        "telemetry": lambda: bench_telemetry(sizes["telemetry_vms"]),
+        "updates": lambda: bench_updates(),
+        "maintenance": lambda: bench_maintenance(sizes["maintenance_mb"]),
+        "bootcache": lambda: bench_bootcache(sizes["boot_seconds"]),
+        "agent": lambda: bench_vm_agent(*sizes["agent"]),
+        "fleet": lambda: bench_fleet_ops(*sizes["fleet"]),
+    }
+    runs, skipped = [], {}
+    for _ in range(max(1, args.repeat)):
+        results = []
+        for name, run in benches.items():
+            if name in groups and name not in skipped:
+                results += run_group(name, run, skipped)
+        runs.append(results)
+    results = merge_best(runs)
+    report = {"meta": dict(metadata(), quick=args.quick, repeat=args.repeat, skipped=skipped), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    elif not args.compare:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"comparing {old['meta'].get('commit') or args.compare} -> {report['meta']['commit'] or 'this run'}")
+        return 1 if compare(old["results"], results, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
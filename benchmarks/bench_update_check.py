@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from fixtures import serve_directory
+
+from update_checker import UpdateChecker, UPDATE_SOURCES
+
+# A local mirror laid out like the real ones: several releases per source,
+# a newest directory that has no images yet, and versions that only sort
+# right numerically (12.11 > 12.9).
+MIRROR_FILES = (
+    "ubuntu/22.04/ubuntu-22.04.5-desktop-amd64.iso", "ubuntu/22.04/SHA256SUMS",
+    "ubuntu/24.04/ubuntu-24.04.2-desktop-amd64.iso", "ubuntu/24.04/ubuntu-24.04.2-live-server-amd64.iso",
+    "ubuntu/24.04/SHA256SUMS", "ubuntu/25.10/ubuntu-25.10-desktop-amd64.iso", "ubuntu/26.04/",
+    "fedora/40/Workstation/x86_64/iso/Fedora-Workstation-Live-x86_64-40-1.14.iso",
+    "fedora/40/Workstation/x86_64/iso/Fedora-Workstation-40-1.14-x86_64-CHECKSUM",
+    "fedora/42/Workstation/x86_64/iso/Fedora-Workstation-Live-42-1.1.x86_64.iso",
+    "fedora/42/Workstation/x86_64/iso/Fedora-Workstation-42-1.1-x86_64-CHECKSUM",
+    "debian/current/amd64/iso-cd/debian-12.9.0-amd64-netinst.iso",
+    "debian/current/amd64/iso-cd/debian-12.11.0-amd64-netinst.iso",
+    "debian/current/amd64/iso-cd/debian-edu-12.11.0-amd64-netinst.iso",
+    "debian/current/amd64/iso-cd/SHA256SUMS",
+    "qemu/w64/2024/qemu-w64-setup-20241220.exe",
+    "qemu/w64/2025/qemu-w64-setup-20250326.exe", "qemu/w64/2025/qemu-w64-setup-20250422.exe",
+)
+MIRROR_PATHS = {"ubuntu-lts": "ubuntu/", "fedora-workstation": "fedora/",
+                "debian-netinst": "debian/current/amd64/iso-cd/", "qemu-w64": "qemu/w64/"}
+EXPECTED = {"ubuntu-lts": "24.04.2", "fedora-workstation": "42-1.1", "debian-netinst": "12.11.0",
+            "qemu-w64": "20250422"}
+IMAGE_SIZE = 3 * 1024 ** 3  # sparse; only HEAD ever asks for it
+
+
+def make_mirror(root):
+    for rel in MIRROR_FILES:
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not rel.endswith("/"):
+            with open(path, "wb") as f:
+                if rel.endswith((".iso", ".exe")):
+                    f.truncate(IMAGE_SIZE)
+                else:
+                    f.write(b"0" * 64 + b"  placeholder\n")
+    return root
+
+
+def local_sources(base_url):
+    return [dict(s, index=f"{base_url}/{MIRROR_PATHS[s['id']]}") for s in UPDATE_SOURCES]
+
+
+def publish(root, rel):
+    # Adds a file and moves its directory's mtime forward, so the index
+    # validators change even within the same second.
+    path = os.path.join(root, rel)
+    with open(path, "wb") as f:
+        f.truncate(IMAGE_SIZE)
+    folder = os.path.dirname(path)
+    later = os.path.getmtime(folder) + 2
+    os.utime(folder, (later, later))
+
+
+def run_check(sources, cache_path, server, force=False, workers=None):
+    checker = UpdateChecker(sources, cache_path, **({"max_workers": workers} if workers else {}))
+    server.requests.clear()
+    t0 = time.perf_counter()
+    results = checker.check(force=force)
+    seconds = time.perf_counter() - t0
+    errors = [f"{r['id']}: {r['error']}" for r in results if r["error"]]
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return {"seconds": seconds, "requests": dict(server.requests), "not_modified": checker.stats["not_modified"],
+            "bytes": checker.stats["bytes"], "versions": {r["id"]: r["version"] for r in results}}
+
+
+def expect(step, versions, expected):
+    if versions != expected:
+        raise RuntimeError(f"{step}: found {versions}, expected {expected}")
+
+
+def bench_update_check(delay=0.05):
+    # Returns one dict per step. Raises if any step finds the wrong versions.
+    steps = []
+    with tempfile.TemporaryDirectory() as tmp:
+        mirror = make_mirror(os.path.join(tmp, "mirror"))
+        server, base = serve_directory(mirror, delay=delay)
+        sources = local_sources(base)
+        cache = os.path.join(tmp, "updates.json")
+        try:
+            serial = run_check(sources, os.path.join(tmp, "serial.json"), server, workers=1)
+            expect("serial", serial["versions"], EXPECTED)
+            steps.append(dict(serial, step="cold, one source at a time"))
+            cold = run_check(sources, cache, server)
+            expect("cold", cold["versions"], EXPECTED)
+            steps.append(dict(cold, step="cold, concurrent"))
+            fresh = run_check(sources, cache, server)
+            expect("within TTL", fresh["versions"], EXPECTED)
+            steps.append(dict(fresh, step="within TTL"))
+            forced = run_check(sources, cache, server, force=True)
+            expect("forced", forced["versions"], EXPECTED)
+            steps.append(dict(forced, step="forced, mirror unchanged"))
+            publish(mirror, "debian/current/amd64/iso-cd/debian-12.12.0-amd64-netinst.iso")
+            changed = run_check(sources, cache, server, force=True)
+            expect("after release", changed["versions"], dict(EXPECTED, **{"debian-netinst": "12.12.0"}))
+            steps.append(dict(changed, step="forced, one new release"))
+        finally:
+            server.shutdown()
+    for s in steps:
+        s["delay_ms"] = 1000 * delay
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the update checker against a local mirror: "
+                                                 "concurrency, conditional requests and the TTL cache.")
+    parser.add_argument("--delay-ms", type=float, default=50.0, help="server latency per request (default: %(default)s)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+    steps = bench_update_check(args.delay_ms / 1000)
+    if args.json:
+        print(json.dumps(steps, indent=2))
+        return
+    for s in steps:
+        requests = ", ".join(f"{n} {m}" for m, n in sorted(s["requests"].items())) or "none"
+        print(f"{s['step']:<28} {1000 * s['seconds']:8.1f} ms  requests: {requests:<14} "
+              f"304s: {s['not_modified']:<3} index bytes: {s['bytes']}")
+    print("versions:", ", ".join(f"{k} {v}" for k, v in steps[-1]["versions"].items()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import asyncio
+
+# Stand-in for qemu-system-* used by the benchmarks and for manual testing of
+# the supervisor, QMP client and agent without a real QEMU. It accepts a QEMU
+# command line, serves QMP on the -qmp endpoint and keeps minimal VM state.
+#
+# Environment knobs:
+#   FAKE_QEMU_BOOT_DELAY      seconds before the QMP socket is opened
+#   FAKE_QEMU_POWERDOWN_DELAY seconds from system_powerdown to exit (-1 = ignore)
+#   FAKE_QEMU_WEDGED          1 = answer quit but keep running, like a QEMU
+#                             stuck in I/O; only SIGKILL ends it
+#   FAKE_QEMU_OUTPUT_LINES    lines of console noise to print at start
+#   FAKE_QEMU_GUEST_BOOT      seconds of busy CPU after a cold start, like a
+#                             booting guest (skipped with -incoming or -loadvm)
+
+
+def parse_args(argv):
+    opts = {"qmp": None, "drives": {}, "smp": 1, "incoming": None, "loadvm": None}
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        val = argv[i + 1] if i + 1 < len(argv) else ""
+        if a == "-qmp":
+            opts["qmp"] = val.split(",")[0]
+            i += 1
+        elif a == "-smp":
+            opts["smp"] = int(val.split(",")[0].split("=")[-1] or 1)
+            i += 1
+        elif a == "-drive":
+            fields = dict(f.split("=", 1) for f in val.replace(",,", "\0").split(",") if "=" in f)
+            if "id" in fields:
+                opts["drives"][fields["id"]] = fields.get("file", "").replace("\0", ",")
+            i += 1
+        elif a == "-incoming":
+            opts["incoming"] = val
+            i += 1
+        elif a == "-loadvm":
+            opts["loadvm"] = val
+            i += 1
+        i += 1
+    return opts
+
+
+class FakeVm:
+    def __init__(self, opts):
+        self.opts = opts
+        self.status = "inmigrate" if opts["incoming"] else "running"
+        self.drives = dict(opts["drives"])
+        self.snapshots = {}
+        self.devices = {}
+        self.nodes = {}
+        self.clients = set()
+        self.powerdown_delay = float(os.environ.get("FAKE_QEMU_POWERDOWN_DELAY", "0.2"))
+        self.wedged = os.environ.get("FAKE_QEMU_WEDGED") == "1"
+        self.quit_event = asyncio.Event()
+        self.exit_code = 0
+
+    def event(self, name, data=None):
+        now = time.time()
+        msg = {"event": name, "data": data or {},
+               "timestamp": {"seconds": int(now), "microseconds": int((now % 1) * 1e6)}}
+        line = json.dumps(msg).encode() + b"\n"
+        for w in list(self.clients):
+            w.write(line)
+
+    async def delayed_quit(self, delay, code=0):
+        await asyncio.sleep(delay)
+        self.exit_code = code
+        self.event("SHUTDOWN", {"guest": True, "reason": "guest-shutdown"})
+        self.quit_event.set()
+
+    def hmp(self, line):
+        parts = line.split()
+        if not parts:
+            return ""
+        if parts[0] == "savevm" and len(parts) > 1:
+            self.snapshots[parts[1]] = time.time()
+            return ""
+        if parts[0] == "loadvm" and len(parts) > 1:
+            return "" if parts[1] in self.snapshots else f"Error: Snapshot '{parts[1]}' does not exist\r\n"
+        if parts[0] == "delvm" and len(parts) > 1:
+            self.snapshots.pop(parts[1], None)
+            return ""
+        if parts[:2] == ["info", "snapshots"]:
+            return "".join(f"{i}  {n}\r\n" for i, n in enumerate(self.snapshots, 1))
+        return ""
+
+    def execute(self, cmd, args):
+        if cmd == "qmp_capabilities":
+            return {}
+        if cmd == "query-status":
+            return {"status": self.status, "running": self.status == "running", "singlestep": False}
+        if cmd == "stop":
+            self.status = "paused"
+            self.event("STOP")
+            return {}
+        if cmd == "cont":
+            self.status = "running"
+            self.event("RESUME")
+            return {}
+        if cmd == "system_powerdown":
+            self.event("POWERDOWN")
+            if self.powerdown_delay >= 0:
+                asyncio.get_running_loop().create_task(self.delayed_quit(self.powerdown_delay))
+            return {}
+        if cmd == "quit":
+            if self.wedged:
+                return {}
+            self.exit_code = 0
+            asyncio.get_running_loop().call_later(0.01, self.quit_event.set)
+            return {}
+        if cmd == "human-monitor-command":
+            return self.hmp(args.get("command-line", ""))
+        if cmd == "blockdev-change-medium":
+            dev = args.get("id") or args.get("device")
+            if dev not in self.drives:
+                raise KeyError(f"Device '{dev}' not found")
+            self.drives[dev] = args["filename"]
+            self.event("DEVICE_TRAY_MOVED", {"device": dev, "tray-open": False})
+            return {}
+        if cmd == "eject":
+            dev = args.get("id") or args.get("device")
+            if dev not in self.drives:
+                raise KeyError(f"Device '{dev}' not found")
+            self.drives[dev] = ""
+            self.event("DEVICE_TRAY_MOVED", {"device": dev, "tray-open": True})
+            return {}
+        if cmd == "blockdev-add":
+            self.nodes[args["node-name"]] = args
+            return {}
+        if cmd == "blockdev-del":
+            self.nodes.pop(args["node-name"], None)
+            return {}
+        if cmd == "device_add":
+            self.devices[args["id"]] = args
+            return {}
+        if cmd == "device_del":
+            if args["id"] not in self.devices:
+                raise KeyError(f"Device '{args['id']}' not found")
+            del self.devices[args["id"]]
+            asyncio.get_running_loop().call_later(0.01, self.event, "DEVICE_DELETED", {"device": args["id"]})
+            return {}
+        if cmd == "query-block":
+            return [{"device": d, "inserted": {"file": f, "image": {"filename": f, "snapshots": [
+                {"name": n, "id": str(i)} for i, n in enumerate(self.snapshots, 1)]}} if f else None}
+                for d, f in self.drives.items()]
+        if cmd == "query-cpus-fast":
+            return [{"cpu-index": i, "thread-id": os.getpid(), "qom-path": f"/machine/unattached/device[{i}]"}
+                    for i in range(self.opts["smp"])]
+        if cmd == "query-blockstats":
+            return [{"device": d, "stats": {"rd_bytes": 0, "wr_bytes": 0, "rd_operations": 0, "wr_operations": 0}}
+                    for d in self.drives]
+        if cmd == "migrate-incoming":
+            asyncio.get_running_loop().call_later(0.05, self.finish_incoming)
+            return {}
+        if cmd == "migrate":
+            uri = args.get("uri", "")
+            if uri.startswith("file:"):
+                with open(uri[5:], "wb") as f:
+                    f.write(b"FAKE-QEMU-STATE\n")
+            asyncio.get_running_loop().call_later(0.05, self.event, "MIGRATION", {"status": "completed"})
+            return {}
+        if cmd == "query-migrate":
+            return {"status": "completed"}
+        raise LookupError(f"The command {cmd} has not been found")
+
+    def finish_incoming(self):
+        self.status = "paused"
+        self.event("MIGRATION", {"status": "completed"})
+
+    async def handle(self, reader, writer):
+        writer.write(json.dumps({"QMP": {"version": {"qemu": {"major": 9, "minor": 0, "micro": 0}, "package": "fake"},
+                                         "capabilities": []}}).encode() + b"\n")
+        self.clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    writer.write(b'{"error": {"class": "GenericError", "desc": "JSON parse error"}}\n')
+                    continue
+                reply = {}
+                if "id" in msg:
+                    reply["id"] = msg["id"]
+                try:
+                    reply["return"] = self.execute(msg.get("execute"), msg.get("arguments", {}))
+                except LookupError as e:
+                    reply["error"] = {"class": "CommandNotFound" if "not been found" in str(e) else "DeviceNotFound",
+                                      "desc": str(e).strip("'\"")}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+
+def load_state(uri):
+    # -incoming file:PATH or exec:cat PATH; the VM runs once it is loaded.
+    path = uri[5:] if uri.startswith("file:") else uri.split(None, 1)[-1].strip("'")
+    try:
+        with open(path, "rb") as f:
+            return f.read(16) == b"FAKE-QEMU-STATE\n"
+    except OSError:
+        return False
+
+
+async def boot_storm(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        spin = time.monotonic() + 0.02
+        while time.monotonic() < spin:
+            pass
+        await asyncio.sleep(0)
+
+
+async def main(argv):
+    opts = parse_args(argv)
+    for i in range(int(os.environ.get("FAKE_QEMU_OUTPUT_LINES", "3"))):
+        print(f"fake-qemu: console line {i}", flush=True)
+    await asyncio.sleep(float(os.environ.get("FAKE_QEMU_BOOT_DELAY", "0")))
+    vm = FakeVm(opts)
+    if opts["incoming"] and opts["incoming"] != "defer":
+        if not load_state(opts["incoming"]):
+            print("qemu-system: load of migration failed: Invalid argument", file=sys.stderr, flush=True)
+            return 1
+        vm.status = "running"
+    elif not opts["loadvm"]:
+        asyncio.get_running_loop().create_task(boot_storm(float(os.environ.get("FAKE_QEMU_GUEST_BOOT", "0"))))
+    server = None
+    if opts["qmp"]:
+        kind, _, addr = opts["qmp"].partition(":")
+        if kind == "unix":
+            if os.path.exists(addr):
+                os.remove(addr)
+            server = await asyncio.start_unix_server(vm.handle, addr)
+        else:
+            host, _, port = addr.rpartition(":")
+            server = await asyncio.start_server(vm.handle, host or "127.0.0.1", int(port))
+    await vm.quit_event.wait()
+    if server:
+        server.close()
+    return vm.exit_code
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(asyncio.run(main(sys.argv[1:])))
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+
+# Stand-in for qemu-img used by the maintenance benchmark: "convert" copies
+# the image byte for byte, leaving all-zero blocks as holes the way real
+# qemu-img does, honours -r (bytes/s) and prints -p progress. Image formats
+# are not interpreted, so -O/-c/-B only affect the arguments it accepts.
+#
+# Environment knobs:
+#   FAKE_QEMU_IMG_FAIL   exit with an error after this fraction of the copy
+
+BLOCK = 64 * 1024
+
+
+def parse_convert(argv):
+    opts = {"progress": False, "rate": None}
+    args = []
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a == "-p":
+            opts["progress"] = True
+        elif a == "-c":
+            pass
+        elif a in ("-f", "-O", "-B", "-F", "-o"):
+            i += 1
+        elif a == "-r":
+            opts["rate"] = int(argv[i + 1])
+            i += 1
+        else:
+            args.append(a)
+        i += 1
+    if len(args) != 2:
+        sys.exit("fake qemu-img: convert needs a source and a destination")
+    return opts, args[0], args[1]
+
+
+def convert(argv):
+    opts, src, dst = parse_convert(argv)
+    size = os.path.getsize(src)
+    fail_at = float(os.environ.get("FAKE_QEMU_IMG_FAIL", "2")) * size
+    zero = bytes(BLOCK)
+    started = time.monotonic()
+    shown = -1
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        done = 0
+        while done < size:
+            block = fin.read(BLOCK)
+            if block == zero[:len(block)]:
+                fout.seek(len(block), os.SEEK_CUR)
+            else:
+                fout.write(block)
+            done += len(block)
+            if done >= fail_at:
+                sys.exit("fake qemu-img: simulated write error")
+            if opts["rate"]:
+                ahead = done / opts["rate"] - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+            pct = int(100 * done / size)
+            if opts["progress"] and pct != shown:
+                shown = pct
+                sys.stdout.write(f"    ({pct:.2f}/100%)\r")
+                sys.stdout.flush()
+        fout.truncate(size)
+    if opts["progress"]:
+        sys.stdout.write("    (100.00/100%)\r\n")
+
+
+def main(argv):
+    if not argv or argv[0] != "convert":
+        sys.exit(f"fake qemu-img: {argv[0] if argv else 'no command'} is not supported")
+    convert(argv[1:])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
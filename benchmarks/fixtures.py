@@ -0,0 +1,217 @@
+import os
+import re
+import sys
+import shlex
+import time
+import threading
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    # Serves files from server.root with single-range support and an optional
+    # per-connection byte-rate cap to imitate throttled mirrors.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _resolve(self):
+        path = os.path.normpath(os.path.join(self.server.root, unquote(self.path.split("?", 1)[0].lstrip("/"))))
+        if not path.startswith(self.server.root) or not os.path.exists(path):
+            return None
+        return path
+
+    def _not_modified(self, etag, mtime):
+        match = self.headers.get("If-None-Match")
+        if match is not None:
+            return match == etag
+        since = self.headers.get("If-Modified-Since")
+        if since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send_index(self, path, body=True):
+        # Apache-style autoindex page, with validators from the directory mtime.
+        mtime = os.path.getmtime(path)
+        etag = f'"d-{int(mtime):x}"'
+        if self._not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        names = sorted(n + "/" if os.path.isdir(os.path.join(path, n)) else n for n in os.listdir(path))
+        page = "".join(f'<a href="{quote(n)}">{n}</a>\n' for n in names)
+        data = f'<html><body><h1>Index</h1><a href="?C=N;O=D">Name</a>\n<a href="../">Parent Directory</a>\n{page}</body></html>'.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(int(mtime)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def _begin(self):
+        # Counts requests per method and applies the optional per-request delay.
+        with self.server.lock:
+            self.server.requests[self.command] += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        path = self._resolve()
+        if not path:
+            self.send_error(404)
+            return None
+        if os.path.isdir(path):
+            if not self.path.split("?", 1)[0].endswith("/"):
+                self.send_response(301)
+                self.send_header("Location", self.path + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self._send_index(path, self.command == "GET")
+            return None
+        return path
+
+    def _send_headers(self, path):
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        start, end = 0, size - 1
+        status = 200
+        m = _RANGE_RE.match(self.headers.get("Range", ""))
+        if m and self.server.ranges:
+            start = int(m.group(1))
+            end = min(int(m.group(2)) if m.group(2) else size - 1, size - 1)
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", f'"{size:x}-{int(mtime):x}"')
+        self.send_header("Last-Modified", self.date_time_string(int(mtime)))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        path = self._begin()
+        if path:
+            self._send_headers(path)
+
+    def do_GET(self):
+        path = self._begin()
+        if not path:
+            return
+        start, end = self._send_headers(path)
+        remaining = end - start + 1
+        rate = self.server.rate_limit
+        block = 64 * 1024
+        began = time.monotonic()
+        sent = 0
+        with open(path, "rb") as f:
+            f.seek(start)
+            while remaining > 0:
+                data = f.read(min(block, remaining))
+                if not data:
+                    break
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(data)
+                sent += len(data)
+                if rate:
+                    ahead = sent / rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+
+def serve_directory(root, rate_limit=None, ranges=True, delay=0.0):
+    # Directories are served as autoindex pages that honour conditional
+    # requests; server.requests counts requests by method.
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    server.daemon_threads = True
+    server.root = os.path.abspath(root)
+    server.rate_limit = rate_limit
+    server.ranges = ranges
+    server.delay = delay
+    server.lock = threading.Lock()
+    server.requests = Counter()
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def make_payload(path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        left = size
+        while left > 0:
+            f.write(block[:min(left, len(block))])
+            left -= len(block)
+    return path
+
+
+FAKE_QEMU = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_qemu.py")
+
+
+def fake_qemu_command(*args):
+    # A launchable "qemu-system" command line backed by fake_qemu.py.
+    return [sys.executable, FAKE_QEMU] + list(args)
+
+
+def fake_qemu_executable(folder):
+    # fake_qemu.py behind one executable path, for profiles (QEMU path is a
+    # single file there). POSIX shells only.
+    path = os.path.join(folder, "qemu-system-x86_64")
+    with open(path, "w") as f:
+        f.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(FAKE_QEMU)} "$@"\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+def make_fake_iso(path, label="BENCH", size=None):
+    # Sparse file with just an ISO9660 primary volume descriptor.
+    pvd = bytearray(2048)
+    pvd[0] = 1
+    pvd[1:6] = b"CD001"
+    pvd[8:40] = b"LINUX".ljust(32)
+    pvd[40:72] = label.encode("ascii")[:32].ljust(32)
+    pvd[80:84] = (18).to_bytes(4, "little")
+    pvd[128:130] = (2048).to_bytes(2, "little")
+    pvd[813:829] = b"2024042512000000"
+    with open(path, "wb") as f:
+        f.seek(16 * 2048)
+        f.write(pvd)
+        if size:
+            f.truncate(size)
+    return path
+
+
+def make_iso_tree(root, files=50000, per_dir=100, iso_every=5):
+    # files spread over nested directories; every iso_every-th one is an ISO.
+    made = 0
+    dirs = 0
+    while made < files:
+        d = os.path.join(root, f"group{dirs // 50:03d}", f"dir{dirs:05d}")
+        os.makedirs(d, exist_ok=True)
+        for i in range(min(per_dir, files - made)):
+            if made % iso_every == 0:
+                make_fake_iso(os.path.join(d, f"image{made:06d}.iso"), f"IMG{made}")
+            else:
+                open(os.path.join(d, f"file{made:06d}.txt"), "wb").close()
+            made += 1
+        dirs += 1
+    return root
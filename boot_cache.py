@@ -0,0 +1,445 @@
+import os
+import sys
+import json
+import time
+import shlex
+import asyncio
+import hashlib
+import threading
+
+from disk_image import inspector, ImageFormatError
+from snapshot_engine import profile_disks
+from telemetry import read_proc, load_psutil, PROC_ROOT
+from vm_supervisor import ACTIVE_STATES
+
+BOOT_CACHE_DIR = "boot_cache"
+BOOT_CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 16 * 1024 ** 3
+SNAPSHOT_NAME = "uqf-fast-start"
+SAVE_TIMEOUT = 600.0
+RESUME_GRACE = 30.0  # a resumed VM crashing this soon means the saved state is bad
+WRITE_POLL = 2.0      # seconds between checks for guest disk writes of a snapshot-backed run
+
+# Backends: a migration stream in a file (-incoming), for VMs with no
+# writable disk, or an internal qcow2 snapshot of RAM and disks (-loadvm).
+STATE_FILE = "file"
+SAVEVM = "savevm"
+
+# A guest counts as ready once it has been up for READY_MIN_UPTIME seconds
+# and its QEMU process stayed under READY_IDLE_PCT of a host CPU for
+# READY_IDLE_SECONDS in a row: the boot storm is over, the login screen waits.
+READY_MIN_UPTIME = 10.0
+READY_IDLE_PCT = 15.0
+READY_IDLE_SECONDS = 5.0
+READY_TIMEOUT = 900.0
+
+# Options the frontend adds per launch; they are not part of the machine.
+_VOLATILE_OPTIONS = ("-qmp", "-incoming", "-loadvm")
+
+
+class BootCacheError(Exception):
+    pass
+
+
+def command_hash(cmd):
+    # Hash of a launch command minus its QMP endpoint and restore options, so
+    # a cached state only matches the exact machine it was saved from.
+    stable = []
+    skip = False
+    for arg in cmd:
+        if skip:
+            skip = False
+        elif arg in _VOLATILE_OPTIONS:
+            skip = True
+        else:
+            stable.append(arg)
+    return hashlib.sha256("\0".join(stable).encode("utf-8", "surrogateescape")).hexdigest()[:20]
+
+
+def fast_start_backend(prof, cmd):
+    # (backend, None) or (None, reason fast start cannot be used).
+    disks = [] if "-snapshot" in cmd else profile_disks(prof)
+    for disk in disks:
+        fmt = prof.disk_format if disk == prof.disk and prof.disk_format else inspector.format_of(disk, None)
+        if fmt != "qcow2":
+            return None, (f"{os.path.basename(disk)} is {fmt or 'unreadable'}; saved states of VMs with "
+                          f"writable disks live in qcow2 snapshots")
+    return (SAVEVM if disks else STATE_FILE), None
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [os.path.abspath(path), None, None]
+    return [os.path.abspath(path), st.st_mtime_ns, st.st_size]
+
+
+def _fast_start_snapshot(disk):
+    try:
+        snaps = inspector.inspect(disk).get("snapshots") or []
+    except (OSError, ImageFormatError):
+        return None
+    found = [s for s in snaps if s["name"] == SNAPSHOT_NAME]
+    return found[-1] if found else None
+
+
+def generation(prof, backend):
+    # What the saved state depends on besides the command line: each file
+    # the VM reads (ISOs, firmware, read-only disks and backing files) by
+    # mtime and size, and for snapshot-backed disks the fast-start snapshot
+    # itself. Writable disks are compared separately (see disk_stamps).
+    files = [p for p in [prof.iso] + list(prof.secondary_isos) if p]
+    if prof.ovmf_enabled and prof.ovmf_path:
+        files.append(prof.ovmf_path)
+    gen = []
+    for disk in profile_disks(prof):
+        if backend == SAVEVM:
+            snap = _fast_start_snapshot(disk)
+            gen.append([os.path.abspath(disk), snap and snap["id"], snap and snap["date"]])
+        else:
+            files.append(disk)
+        try:
+            files += [link["filename"] for link in inspector.chain(disk)[1:]]
+        except ImageFormatError:
+            pass
+    return gen + [_stamp(p) for p in files]
+
+
+def disk_stamps(prof, backend):
+    # Writable disks as last seen after a fast-started run that did not write
+    # to them (-loadvm itself rewrites qcow2 metadata); anything else changing
+    # them (a guest write, a cold boot, qemu-img) invalidates the state.
+    return [_stamp(d) for d in profile_disks(prof)] if backend == SAVEVM else []
+
+
+async def _guest_writes(client):
+    # Write requests of the guest to all its drives since QEMU started;
+    # QEMU's own snapshot bookkeeping is not counted.
+    stats = await client.execute("query-blockstats", timeout=10.0)
+    return sum(s["stats"].get("wr_operations", 0) for s in stats)
+
+
+def _qemu_version(client):
+    v = ((client.greeting or {}).get("QMP") or {}).get("version", {}).get("qemu", {})
+    return v.get("major", 0), v.get("minor", 0)
+
+
+def migration_uris(path, version):
+    # (save URI, restore URI): the file: transport exists since QEMU 8.2,
+    # older builds stream through cat.
+    if version >= (8, 2):
+        return f"file:{path}", f"file:{path}"
+    if sys.platform == "win32":
+        raise BootCacheError("saving the VM state to a file needs QEMU 8.2 or newer on Windows")
+    return f"exec:cat > {shlex.quote(path)}", f"exec:cat {shlex.quote(path)}"
+
+
+def _cpu_seconds(pid):
+    if os.path.isdir(os.path.join(PROC_ROOT, "self")):
+        return read_proc(pid)[0]
+    psutil = load_psutil()
+    if psutil is None:
+        return None
+    times = psutil.Process(pid).cpu_times()
+    return times.user + times.system
+
+
+def _exited(vm):
+    # The process is checked too where it is ours: it exits before the state says so.
+    return vm.state not in ACTIVE_STATES or (vm.proc is not None and vm.proc.returncode is not None)
+
+
+async def wait_until_ready(vm, min_uptime=READY_MIN_UPTIME, idle_pct=READY_IDLE_PCT, idle_seconds=READY_IDLE_SECONDS,
+                           timeout=READY_TIMEOUT, poll=0.5):
+    # True once the guest settles (see READY_*), False if the VM stops first.
+    # Without a way to read its CPU time, the minimum uptime alone decides.
+    started = time.monotonic()
+    idle_since = None
+    last = None
+    while time.monotonic() - started < timeout:
+        if vm.pid is None or _exited(vm):
+            return False
+        now = time.monotonic()
+        try:
+            cpu = _cpu_seconds(vm.pid)
+        except (OSError, ValueError, IndexError):
+            return False
+        if cpu is None:
+            if now - started >= min_uptime:
+                return True
+        elif last is not None:
+            busy = 100 * (cpu - last[1]) / (now - last[0])
+            idle_since = (idle_since or now) if busy < idle_pct else None
+            if now - started >= min_uptime and idle_since is not None and now - idle_since >= idle_seconds:
+                return True
+        if cpu is not None:
+            last = (now, cpu)
+        await asyncio.sleep(poll)
+    raise BootCacheError(f"the guest did not settle within {timeout:.0f}s")
+
+
+class BootCache:
+    # Saved machine states for instant VM starts, one per profile, under
+    # `root` with an index.json. An entry is keyed by profile id and the hash
+    # of the launch command; it stays valid while generation() and
+    # disk_stamps() still match, and is dropped otherwise. Entries are evicted
+    # least recently used first once their sizes add up to more than
+    # max_bytes. is_running(profile_id) keeps the snapshots of running VMs.
+    def __init__(self, root=BOOT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, is_running=None):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.max_bytes = max_bytes
+        self.is_running = is_running
+        self._lock = threading.RLock()
+        self.entries = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidated": 0, "evicted": 0}
+        self._clean = {}  # key -> disk stamps of its running VM at its last check without guest writes
+        self._trackers = set()
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == BOOT_CACHE_VERSION:
+                self.entries = data.get("entries", {})
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self._lock:
+            data = {"version": BOOT_CACHE_VERSION, "entries": self.entries}
+            os.makedirs(self.root, exist_ok=True)
+            tmp = self.index_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp, self.index_path)
+
+    @staticmethod
+    def key(prof, cmd):
+        return f"{prof.id}-{command_hash(cmd)}"
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(e["size"] for e in self.entries.values())
+
+    def lookup(self, prof, cmd):
+        # The valid entry for launching prof with cmd, or None. Stale entries
+        # of the profile are dropped on the way.
+        key = self.key(prof, cmd)
+        with self._lock:
+            entry = self.entries.get(key)
+            reason = self._stale(entry, prof, cmd) if entry else "none saved"
+            if reason:
+                self.stats["misses"] += 1
+                if entry:
+                    self.stats["invalidated"] += 1
+                    self.discard(key, reason)
+                return None
+            self.stats["hits"] += 1
+            entry["last_used"] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._save_quietly()
+            return dict(entry, key=key)
+
+    def _stale(self, entry, prof, cmd):
+        backend, why_not = fast_start_backend(prof, cmd)
+        if backend != entry["backend"]:
+            return why_not or "the disk layout changed"
+        if entry["backend"] == STATE_FILE and not os.path.exists(entry["path"]):
+            return "the state file is gone"
+        if generation(prof, backend) != entry["generation"]:
+            return "an image, ISO or firmware file changed"
+        if disk_stamps(prof, backend) != entry["disks"]:
+            return "a disk was changed outside a fast start"
+        return None
+
+    def restore_args(self, entry):
+        if entry["backend"] == STATE_FILE:
+            return ["-incoming", entry["restore_uri"]]
+        return ["-loadvm", SNAPSHOT_NAME]
+
+    def settle(self, key, prof):
+        # A run started from (or saved into) this entry has ended. The next
+        # -loadvm would throw away anything it wrote to its disks, so the
+        # entry is kept only if the disks are as track_writes() last saw them
+        # with no guest writes. Returns whether it was kept.
+        with self._lock:
+            clean = self._clean.pop(key, None)
+            entry = self.entries.get(key)
+            if entry is None:
+                return False
+            if entry["backend"] != SAVEVM:
+                return True
+            stamps = disk_stamps(prof, SAVEVM)
+            if stamps != clean:
+                self.stats["invalidated"] += 1
+                self.discard(key, "the guest wrote to its disks")
+                return False
+            entry["disks"] = stamps
+            self._save_quietly()
+            return True
+
+    async def track_writes(self, client, key, prof, baseline=0, poll=WRITE_POLL):
+        # Runs alongside a VM started from (or saved into) a snapshot-backed
+        # entry, until its QMP stops answering. The disk stamps taken just
+        # before each check that finds no new guest writes tell settle() what
+        # clean disks look like; the first write discards the entry at once.
+        while key in self.entries:
+            stamps = disk_stamps(prof, SAVEVM)
+            try:
+                writes = await _guest_writes(client)
+            except Exception:  # QMP errors, timeouts and the VM exiting all end the run's tracking
+                return
+            with self._lock:
+                if writes > baseline:
+                    self._clean.pop(key, None)
+                    if key in self.entries:
+                        self.stats["invalidated"] += 1
+                        self.discard(key, "the guest wrote to its disks")
+                    return
+                self._clean[key] = stamps
+            await asyncio.sleep(poll)
+
+    async def track_resumed(self, supervisor, vm_id, key, prof, poll=WRITE_POLL):
+        # track_writes() for a VM launched from entry key, once its QMP is up.
+        vm = supervisor.vms.get(vm_id)
+        entry = self.entries.get(key)
+        if entry is None or entry["backend"] != SAVEVM:
+            return
+        while vm is not None and not vm.qmp_ready:
+            if _exited(vm):
+                return
+            await asyncio.sleep(0.1)
+        if vm is not None:
+            await self.track_writes(vm.qmp, key, prof, 0, poll)
+
+    def discard(self, key, reason=""):
+        # Forgets an entry and deletes its state file. A fast-start snapshot
+        # is left in the image; the next save replaces it.
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            if entry["backend"] == STATE_FILE:
+                try:
+                    os.remove(entry["path"])
+                except OSError:
+                    pass
+            self._save_quietly()
+
+    def forget_profile(self, profile_id, keep=None):
+        with self._lock:
+            for key in [k for k, e in self.entries.items() if e["profile_id"] == profile_id and k != keep]:
+                self.discard(key)
+
+    def _save_quietly(self):
+        try:
+            self.save()
+        except OSError:
+            pass
+
+    async def capture(self, client, prof, cmd, qemu_img=None):
+        # Saves the running VM's state over QMP and records it. The guest is
+        # paused while its RAM is written, then continues.
+        backend, why_not = fast_start_backend(prof, cmd)
+        if backend is None:
+            raise BootCacheError(why_not)
+        key = self.key(prof, cmd)
+        started = time.monotonic()
+        entry = {"profile_id": prof.id, "name": prof.name, "backend": backend, "created": time.time(),
+                 "hits": 0, "qemu_img": qemu_img}
+        if backend == SAVEVM:
+            # Paused (which drains in-flight I/O) so the guest write count
+            # matches the snapshot exactly; savevm leaves a stopped VM stopped.
+            await client.execute("stop")
+            try:
+                baseline = await _guest_writes(client)
+                out = await client.execute("human-monitor-command", {"command-line": f"savevm {SNAPSHOT_NAME}"},
+                                           timeout=SAVE_TIMEOUT)
+            finally:
+                await client.execute("cont")
+            if out and out.strip():
+                raise BootCacheError(out.strip())
+            for disk in profile_disks(prof):
+                inspector.invalidate(disk)
+            snap = _fast_start_snapshot(prof.disk or profile_disks(prof)[0])
+            entry.update(size=snap["vm_state_size"] if snap else 0,
+                         images=[os.path.abspath(d) for d in profile_disks(prof)])
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            path = os.path.abspath(os.path.join(self.root, f"{key}.state"))
+            tmp = path + ".tmp"
+            save_uri, restore_uri = migration_uris(tmp, _qemu_version(client))
+            await client.execute("stop")
+            try:
+                await client.execute("migrate", {"uri": save_uri})
+                while True:
+                    status = (await client.execute("query-migrate")).get("status")
+                    if status == "completed":
+                        break
+                    if status in ("failed", "cancelled"):
+                        raise BootCacheError(f"saving the VM state {status}")
+                    if time.monotonic() - started > SAVE_TIMEOUT:
+                        await client.execute("migrate_cancel")
+                        raise BootCacheError("saving the VM state timed out")
+                    await asyncio.sleep(0.1)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                await client.execute("cont")
+            entry.update(path=path, restore_uri=migration_uris(path, _qemu_version(client))[1],
+                         size=os.path.getsize(path))
+        entry.update(generation=generation(prof, backend), disks=disk_stamps(prof, backend),
+                     seconds=time.monotonic() - started, last_used=time.time())
+        with self._lock:
+            self.forget_profile(prof.id, keep=key)
+            self.entries[key] = entry
+            self._clean.pop(key, None)
+            self._save_quietly()
+        if backend == SAVEVM:
+            # The VM keeps running from the saved point.
+            task = asyncio.get_running_loop().create_task(self.track_writes(client, key, prof, baseline))
+            self._trackers.add(task)
+            task.add_done_callback(self._trackers.discard)
+        await asyncio.get_running_loop().run_in_executor(None, self.evict, key)
+        return dict(entry, key=key)
+
+    async def capture_when_ready(self, supervisor, vm_id, prof, cmd, qemu_img=None, **ready):
+        # For a VM just launched cold: waits for QMP and for the guest to
+        # settle, then captures. Returns the entry, or None if the VM stopped.
+        vm = supervisor.vms.get(vm_id)
+        while vm is not None and not vm.qmp_ready:
+            if _exited(vm):
+                return None
+            await asyncio.sleep(0.1)
+        if vm is None or not await wait_until_ready(vm, **ready):
+            return None
+        return await self.capture(vm.qmp, prof, cmd, qemu_img)
+
+    def evict(self, protect=None):
+        # Least recently used first, until the cache fits in max_bytes.
+        while True:
+            with self._lock:
+                if self.total_bytes() <= self.max_bytes:
+                    return
+                candidates = [(e["last_used"], k) for k, e in self.entries.items()
+                              if k != protect and not (self.is_running and self.is_running(e["profile_id"]))]
+                if not candidates:
+                    return
+                key = min(candidates)[1]
+                entry = self.entries[key]
+            if entry["backend"] == SAVEVM and entry.get("qemu_img"):
+                self._delete_snapshots(entry)
+            self.discard(key, "evicted")
+            self.stats["evicted"] += 1
+
+    def _delete_snapshots(self, entry):
+        from provisioning import run_qemu_img, TemplateError
+        for path in entry.get("images", []):
+            if _fast_start_snapshot(path) is None:
+                continue
+            try:
+                run_qemu_img(entry["qemu_img"], ["snapshot", "-d", SNAPSHOT_NAME, path])
+            except (TemplateError, OSError):
+                pass
+            inspector.invalidate(path)
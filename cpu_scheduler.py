@@ -0,0 +1,364 @@
+import os
+import sys
+import glob
+import ctypes
+import threading
+
+from qemu_command import command_resources
+
+SYSFS_ROOT = "/sys"
+DEFAULT_CPU_OVERCOMMIT = 1.0
+DEFAULT_RAM_OVERCOMMIT = 1.0
+
+
+class AdmissionError(Exception):
+    pass
+
+
+def parse_cpulist(text):
+    # sysfs cpulist format: "0-3,8,10-11"
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus):
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _total_ram_mb():
+    if sys.platform == "win32":
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(status)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys // (1024 * 1024)
+        return 0
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+class HostTopology:
+    # Logical CPUs grouped by physical core and NUMA node. core_of maps a CPU
+    # to a (package, core) key shared by its SMT siblings.
+    __slots__ = ("core_of", "node_of", "nodes", "node_ram_mb")
+
+    def __init__(self, core_of, node_of, node_ram_mb):
+        self.core_of = core_of
+        self.node_of = node_of
+        self.nodes = {}
+        for cpu in sorted(node_of):
+            self.nodes.setdefault(node_of[cpu], []).append(cpu)
+        self.node_ram_mb = node_ram_mb
+
+    @property
+    def cpus(self):
+        return sorted(self.core_of)
+
+    @property
+    def ram_mb(self):
+        return sum(self.node_ram_mb.values())
+
+    def describe(self):
+        cores = len(set(self.core_of.values()))
+        return (f"{len(self.core_of)} CPUs on {cores} cores, {len(self.nodes)} NUMA node(s), "
+                f"{self.ram_mb // 1024} GB RAM")
+
+
+def flat_topology(cpu_count=None, ram_mb=None):
+    # One node, every CPU its own core: used where sysfs is unavailable.
+    cpus = range(cpu_count or os.cpu_count() or 1)
+    return HostTopology({c: (0, c) for c in cpus}, {c: 0 for c in cpus},
+                        {0: _total_ram_mb() if ram_mb is None else ram_mb})
+
+
+def read_topology(root=SYSFS_ROOT):
+    # Reads /sys/devices/system/{cpu,node}; root can point at a copy of that
+    # tree (or a hand-made one) to check placement for another machine.
+    cpu_dir = os.path.join(root, "devices", "system", "cpu")
+    online = _read(os.path.join(cpu_dir, "online"))
+    if online is None:
+        if root == SYSFS_ROOT:
+            return flat_topology()
+        online = format_cpulist(int(os.path.basename(p)[3:]) for p in glob.glob(os.path.join(cpu_dir, "cpu[0-9]*")))
+    core_of = {}
+    for cpu in parse_cpulist(online):
+        topo = os.path.join(cpu_dir, f"cpu{cpu}", "topology")
+        package = _read(os.path.join(topo, "physical_package_id"))
+        core = _read(os.path.join(topo, "core_id"))
+        core_of[cpu] = (int(package), int(core)) if package is not None and core is not None else (0, -1 - cpu)
+    if not core_of:
+        return flat_topology()
+    node_of = {}
+    node_ram_mb = {}
+    for node_dir in glob.glob(os.path.join(root, "devices", "system", "node", "node[0-9]*")):
+        node = int(os.path.basename(node_dir)[4:])
+        cpulist = _read(os.path.join(node_dir, "cpulist"))
+        for cpu in parse_cpulist(cpulist or ""):
+            if cpu in core_of:
+                node_of[cpu] = node
+        node_ram_mb[node] = 0
+        for line in (_read(os.path.join(node_dir, "meminfo")) or "").splitlines():
+            fields = line.split()
+            if len(fields) >= 4 and fields[2] == "MemTotal:":
+                node_ram_mb[node] = int(fields[3]) // 1024
+    for cpu in core_of:
+        node_of.setdefault(cpu, 0)
+    if not node_ram_mb or not any(node_ram_mb.values()):
+        node_ram_mb = {0: _total_ram_mb()}
+    return HostTopology(core_of, node_of, node_ram_mb)
+
+
+class Placement:
+    __slots__ = ("vm_id", "vcpus", "ram_mb", "cpus", "node")
+
+    def __init__(self, vm_id, vcpus, ram_mb, cpus, node=None):
+        self.vm_id = vm_id
+        self.vcpus = vcpus
+        self.ram_mb = ram_mb
+        self.cpus = cpus  # host CPU for each vCPU index
+        self.node = node
+
+    def __str__(self):
+        where = f"node {self.node}" if self.node is not None else "all nodes"
+        return f"{self.vcpus} vCPU(s) on CPUs {format_cpulist(set(self.cpus))} ({where}), {self.ram_mb} MB"
+
+
+class CpuScheduler:
+    # Admission control and vCPU placement for the VMs this host runs.
+    # A VM is admitted while the vCPUs and RAM of all admitted VMs stay within
+    # cpu_ratio x logical CPUs and ram_ratio x host RAM. Each vCPU gets its
+    # own host CPU, filling distinct physical cores before SMT siblings, on a
+    # single NUMA node whenever one can take the whole VM as well as the host
+    # could. VMs that do not fit can wait in a FIFO queue; they are admitted
+    # by release() as others exit. external() may return registry entries of
+    # VMs started by other frontends so their usage is counted too.
+    def __init__(self, topology, cpu_ratio=DEFAULT_CPU_OVERCOMMIT, ram_ratio=DEFAULT_RAM_OVERCOMMIT, external=None):
+        self.topology = topology
+        self.cpu_ratio = cpu_ratio
+        self.ram_ratio = ram_ratio
+        self.external = external
+        self._placements = {}
+        self._external = {}
+        self._queue = []
+        self._lock = threading.Lock()
+
+    @property
+    def cpu_capacity(self):
+        return int(len(self.topology.core_of) * self.cpu_ratio)
+
+    @property
+    def ram_capacity_mb(self):
+        return int(self.topology.ram_mb * self.ram_ratio)
+
+    def _all(self):
+        return list(self._placements.values()) + list(self._external.values())
+
+    def usage(self):
+        with self._lock:
+            placements = self._all()
+        return sum(p.vcpus for p in placements), sum(p.ram_mb for p in placements)
+
+    def placements(self):
+        with self._lock:
+            return dict(self._placements)
+
+    def queued(self):
+        with self._lock:
+            return [entry[0] for entry in self._queue]
+
+    def _sync_external(self):
+        if self.external is None:
+            return
+        own = {str(vm_id) for vm_id in self._placements}
+        external = {}
+        for key, entry in self.external().items():
+            if str(key) in own:
+                continue
+            vcpus, ram_mb = command_resources(entry.get("cmd") or [])
+            external[key] = Placement(key, vcpus, ram_mb, entry.get("cpus") or [])
+        self._external = external
+
+    def _check(self, vcpus, ram_mb):
+        placements = self._all()
+        used_cpus = sum(p.vcpus for p in placements)
+        used_ram = sum(p.ram_mb for p in placements)
+        if used_cpus + vcpus > self.cpu_capacity:
+            return (f"needs {vcpus} vCPU(s) but {used_cpus} of {self.cpu_capacity} are committed "
+                    f"(CPU overcommit {self.cpu_ratio:g})")
+        if used_ram + ram_mb > self.ram_capacity_mb:
+            return (f"needs {ram_mb} MB RAM but {used_ram} of {self.ram_capacity_mb} MB are committed "
+                    f"(RAM overcommit {self.ram_ratio:g})")
+        return None
+
+    def _pick(self, cpus, vcpus, load, core_load):
+        # Greedy: least-loaded CPU, then least-loaded physical core, so every
+        # core gets one vCPU before any SMT sibling gets a second.
+        load = dict(load)
+        core_load = dict(core_load)
+        picked = []
+        for _ in range(vcpus):
+            cpu = min(cpus, key=lambda c: (load[c], core_load[self.topology.core_of[c]], c))
+            load[cpu] += 1
+            core_load[self.topology.core_of[cpu]] += 1
+            picked.append(cpu)
+        return picked, max(load[c] for c in picked)
+
+    def place(self, vm_id, vcpus, ram_mb):
+        # Placement against current load, without admitting.
+        topo = self.topology
+        load = {cpu: 0 for cpu in topo.core_of}
+        core_load = {core: 0 for core in topo.core_of.values()}
+        node_ram = dict.fromkeys(topo.nodes, 0)
+        for p in self._all():
+            for cpu in p.cpus:
+                if cpu in load:
+                    load[cpu] += 1
+                    core_load[topo.core_of[cpu]] += 1
+            if p.node is not None:
+                node_ram[p.node] = node_ram.get(p.node, 0) + p.ram_mb
+        cpus, worst = self._pick(topo.cpus, vcpus, load, core_load)
+        best = Placement(vm_id, vcpus, ram_mb, cpus)
+        if len(topo.nodes) > 1:
+            candidates = []
+            for node, node_cpus in topo.nodes.items():
+                if node_ram[node] + ram_mb > topo.node_ram_mb.get(node, 0):
+                    continue
+                picked, node_worst = self._pick(node_cpus, vcpus, load, core_load)
+                if node_worst <= worst:
+                    candidates.append((node_worst, node_ram[node] - topo.node_ram_mb.get(node, 0), node, picked))
+            if candidates:
+                _, _, node, picked = min(candidates)
+                best = Placement(vm_id, vcpus, ram_mb, picked, node)
+        elif topo.nodes:
+            best.node = next(iter(topo.nodes))
+        return best
+
+    def request(self, vm_id, vcpus, ram_mb, on_admit=None):
+        # Admits the VM and returns its Placement. If it does not fit, raises
+        # AdmissionError, or queues it and returns None when on_admit is given;
+        # on_admit(placement) is then called from the release() that frees room.
+        with self._lock:
+            self._release(vm_id)
+            self._sync_external()
+            if vcpus > self.cpu_capacity or ram_mb > self.ram_capacity_mb:
+                raise AdmissionError(f"needs {vcpus} vCPU(s) and {ram_mb} MB but this host admits at most "
+                                     f"{self.cpu_capacity} vCPU(s) and {self.ram_capacity_mb} MB")
+            problem = self._check(vcpus, ram_mb) if not self._queue else "other VMs are already waiting"
+            if problem is None:
+                placement = self._placements[vm_id] = self.place(vm_id, vcpus, ram_mb)
+                return placement
+            if on_admit is None:
+                raise AdmissionError(problem)
+            self._queue.append((vm_id, vcpus, ram_mb, on_admit))
+            return None
+
+    def admit(self, vm_id, vcpus, ram_mb):
+        return self.request(vm_id, vcpus, ram_mb)
+
+    def _release(self, vm_id):
+        self._placements.pop(vm_id, None)
+        self._queue = [entry for entry in self._queue if entry[0] != vm_id]
+
+    def release(self, vm_id):
+        # Frees the VM's share (or drops it from the queue) and admits queued
+        # VMs in order for as long as the next one fits.
+        admitted = []
+        with self._lock:
+            self._release(vm_id)
+            self._sync_external()
+            while self._queue and self._check(*self._queue[0][1:3]) is None:
+                queued_id, vcpus, ram_mb, on_admit = self._queue.pop(0)
+                placement = self._placements[queued_id] = self.place(queued_id, vcpus, ram_mb)
+                admitted.append((on_admit, placement))
+        for on_admit, placement in admitted:
+            on_admit(placement)
+        return [placement for _, placement in admitted]
+
+
+# ===== Affinity =====
+def set_thread_affinity(thread_id, cpus):
+    # Pins one OS thread (QEMU reports vCPU threads by native thread id).
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(thread_id, cpus)
+        return True
+    if sys.platform == "win32":
+        mask = sum(1 << c for c in cpus if c < 64)  # processor group 0 only
+        if not mask:
+            return False
+        kernel32 = ctypes.windll.kernel32
+        THREAD_SET_INFORMATION, THREAD_QUERY_INFORMATION = 0x0020, 0x0040
+        handle = kernel32.OpenThread(THREAD_SET_INFORMATION | THREAD_QUERY_INFORMATION, False, thread_id)
+        if not handle:
+            raise OSError(f"cannot open thread {thread_id}")
+        try:
+            return bool(kernel32.SetThreadAffinityMask(handle, ctypes.c_size_t(mask)))
+        finally:
+            kernel32.CloseHandle(handle)
+    return False  # macOS has no hard affinity
+
+
+def set_process_affinity(pid, cpus):
+    # For detached launches: threads QEMU creates later inherit this set.
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(pid, cpus)
+        return True
+    if sys.platform == "win32":
+        mask = sum(1 << c for c in cpus if c < 64)
+        if not mask:
+            return False
+        kernel32 = ctypes.windll.kernel32
+        PROCESS_SET_INFORMATION, PROCESS_QUERY_INFORMATION = 0x0200, 0x0400
+        handle = kernel32.OpenProcess(PROCESS_SET_INFORMATION | PROCESS_QUERY_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            return bool(kernel32.SetProcessAffinityMask(handle, ctypes.c_size_t(mask)))
+        finally:
+            kernel32.CloseHandle(handle)
+    return False
+
+
+def pin_vcpu_threads(placement, vcpu_threads):
+    # vcpu_threads: query-cpus-fast result. Returns {vCPU index: host CPU} for
+    # the threads that were pinned.
+    pinned = {}
+    for entry in vcpu_threads:
+        index = entry.get("cpu-index", 0)
+        if not placement.cpus or "thread-id" not in entry:
+            continue
+        cpu = placement.cpus[index % len(placement.cpus)]
+        try:
+            if set_thread_affinity(entry["thread-id"], {cpu}):
+                pinned[index] = cpu
+        except OSError:
+            pass
+    return pinned
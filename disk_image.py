@@ -0,0 +1,238 @@
+import os
+import mmap
+import time
+import struct
+import threading
+
+QCOW_MAGIC = b"QFI\xfb"
+QCOW2_EXT_END = 0x00000000
+QCOW2_EXT_BACKING_FORMAT = 0xE2792ACA
+QCOW2_EXT_DATA_FILE = 0x44415441
+QCOW2_INCOMPAT_DIRTY = 1 << 0
+QCOW2_INCOMPAT_CORRUPT = 1 << 1
+QCOW2_INCOMPAT_DATA_FILE = 1 << 2
+QCOW2_INCOMPAT_COMPRESSION = 1 << 3
+MAX_CHAIN_DEPTH = 32
+# QEMU's default when nothing can be read, e.g. a disk that does not exist yet.
+DEFAULT_FORMAT = "qcow2"
+
+
+class ImageFormatError(Exception):
+    pass
+
+
+def _qcow2_header_extensions(m, start, end):
+    exts = {}
+    off = start
+    while off + 8 <= end:
+        ext_type, length = struct.unpack_from(">II", m, off)
+        if ext_type == QCOW2_EXT_END:
+            break
+        exts[ext_type] = bytes(m[off + 8:off + 8 + length])
+        off += 8 + ((length + 7) & ~7)
+    return exts
+
+
+def _qcow2_snapshots(m, offset, count):
+    snaps = []
+    for _ in range(count):
+        if offset + 40 > len(m):
+            raise ImageFormatError("snapshot table is truncated")
+        (_l1_off, _l1_size, id_len, name_len, date_sec, _date_nsec,
+         vm_clock_ns, vm_state_size, extra_len) = struct.unpack_from(">QIHHIIQII", m, offset)
+        pos = offset + 40
+        extra = bytes(m[pos:pos + extra_len])
+        if extra_len >= 8:
+            vm_state_size = struct.unpack_from(">Q", extra, 0)[0]
+        disk_size = struct.unpack_from(">Q", extra, 8)[0] if extra_len >= 16 else None
+        pos += extra_len
+        snap_id = bytes(m[pos:pos + id_len]).decode("utf-8", "replace")
+        pos += id_len
+        name = bytes(m[pos:pos + name_len]).decode("utf-8", "replace")
+        pos += name_len
+        snaps.append({
+            "id": snap_id,
+            "name": name,
+            "date": date_sec,
+            "vm_clock": vm_clock_ns / 1e9,
+            "vm_state_size": vm_state_size,
+            "disk_size": disk_size,
+        })
+        offset = (pos + 7) & ~7
+    return snaps
+
+
+def _read_qcow2(m, info):
+    version = struct.unpack_from(">I", m, 4)[0]
+    if version == 1:
+        backing_off, backing_len = struct.unpack_from(">QI", m, 8)
+        info.update(format="qcow", version=1, virtual_size=struct.unpack_from(">Q", m, 24)[0])
+        if backing_off:
+            info["backing_file"] = bytes(m[backing_off:backing_off + backing_len]).decode("utf-8", "replace")
+        return info
+    if version not in (2, 3) or len(m) < 72:
+        raise ImageFormatError(f"unsupported qcow2 version {version}")
+    (backing_off, backing_len, cluster_bits, size, crypt_method, _l1_size, _l1_off,
+     _rc_off, _rc_clusters, nb_snapshots, snapshots_off) = struct.unpack_from(">QIIQIIQQIIQ", m, 8)
+    info.update(format="qcow2", version=version, virtual_size=size, cluster_size=1 << cluster_bits,
+                encrypted=crypt_method != 0)
+    header_len = 72
+    if version == 3:
+        incompat, _compat, _autoclear, refcount_order, header_len = struct.unpack_from(">QQQII", m, 72)
+        info.update(dirty=bool(incompat & QCOW2_INCOMPAT_DIRTY),
+                    corrupt=bool(incompat & QCOW2_INCOMPAT_CORRUPT),
+                    refcount_bits=1 << refcount_order)
+        if incompat & QCOW2_INCOMPAT_COMPRESSION and header_len > 104:
+            info["compression"] = ("zlib", "zstd")[m[104]] if m[104] < 2 else str(m[104])
+    # Header extensions sit between the header and the backing file name (or cluster end).
+    ext_end = backing_off if backing_off else min(len(m), 1 << cluster_bits)
+    exts = _qcow2_header_extensions(m, header_len, ext_end)
+    if backing_off:
+        if backing_off + backing_len > len(m):
+            raise ImageFormatError("backing file name is truncated")
+        info["backing_file"] = bytes(m[backing_off:backing_off + backing_len]).decode("utf-8", "replace")
+        if QCOW2_EXT_BACKING_FORMAT in exts:
+            info["backing_format"] = exts[QCOW2_EXT_BACKING_FORMAT].decode("ascii", "replace")
+    if QCOW2_EXT_DATA_FILE in exts:
+        info["data_file"] = exts[QCOW2_EXT_DATA_FILE].decode("utf-8", "replace")
+    info["snapshots"] = _qcow2_snapshots(m, snapshots_off, nb_snapshots) if nb_snapshots else []
+    return info
+
+
+def _detect_other(m, info):
+    # Formats QEMU can run but we only identify; raw is whatever is left.
+    head = bytes(m[:512])
+    size = len(m)
+    if head[:4] == b"KDMV":
+        info.update(format="vmdk", virtual_size=struct.unpack_from("<Q", head, 12)[0] * 512)
+    elif head.startswith(b"# Disk DescriptorFile"):
+        info["format"] = "vmdk"
+    elif head[:8] == b"vhdxfile":
+        info["format"] = "vhdx"
+    elif head[:4] == b"QED\x00":
+        info.update(format="qed", virtual_size=struct.unpack_from("<Q", head, 48)[0])
+    elif len(head) >= 72 and struct.unpack_from("<I", head, 64)[0] == 0xBEDA107F:
+        info["format"] = "vdi"
+        if len(head) >= 0x178:
+            info["virtual_size"] = struct.unpack_from("<Q", head, 0x170)[0]
+    elif head[:8] == b"conectix" or (size >= 512 and m[size - 512:size - 504] == b"conectix"):
+        footer = head if head[:8] == b"conectix" else bytes(m[size - 512:size])
+        info.update(format="vpc", virtual_size=struct.unpack_from(">Q", footer, 48)[0])
+    else:
+        info.update(format="raw", virtual_size=size)
+        if size >= 32768 + 6 and m[32769:32774] == b"CD001":
+            info["iso9660"] = True
+    return info
+
+
+def read_image_info(path):
+    # Header-only inspection through mmap: nothing past the metadata is paged in.
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        blocks = getattr(st, "st_blocks", None)
+        info = {
+            "filename": path,
+            "format": "raw",
+            "virtual_size": st.st_size,
+            "file_size": st.st_size,
+            "actual_size": blocks * 512 if blocks is not None else st.st_size,
+            "mtime": st.st_mtime,
+        }
+        if st.st_size == 0:
+            return info
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            try:
+                if m[:4] == QCOW_MAGIC and len(m) >= 32:
+                    return _read_qcow2(m, info)
+                return _detect_other(m, info)
+            except struct.error:
+                raise ImageFormatError(f"{path}: header is truncated")
+
+
+def resolve_backing(path, backing_file):
+    # Relative backing names are relative to the directory of the overlay.
+    if backing_file.startswith(("json:", "nbd:", "http:", "https:")) or os.path.isabs(backing_file):
+        return backing_file
+    return os.path.join(os.path.dirname(os.path.abspath(path)), backing_file)
+
+
+def human_size(n):
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if n < 1024 or unit == "TiB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+def describe_image(info):
+    text = f"{info['format']}, {human_size(info['virtual_size'])} virtual, {human_size(info['actual_size'])} on disk"
+    if info.get("backing_file"):
+        text += f", backing {os.path.basename(info['backing_file'])}"
+    if info.get("snapshots"):
+        text += f", {len(info['snapshots'])} snapshot(s)"
+    if info.get("dirty") or info.get("corrupt"):
+        text += ", marked " + ("corrupt" if info.get("corrupt") else "dirty")
+    return text
+
+
+def snapshot_summary(snap):
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap["date"])) if snap["date"] else "-"
+    return f"{snap['name']} (id {snap['id']}, {when}, vm state {human_size(snap['vm_state_size'])})"
+
+
+class ImageInspector:
+    # Caches read_image_info by (path, mtime_ns, size): a stat per lookup, and the
+    # header is only reparsed after the file changes.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def inspect(self, path):
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit is not None and hit[0] == stamp:
+            return hit[1]
+        info = read_image_info(path)
+        with self._lock:
+            self._cache[key] = (stamp, info)
+        return info
+
+    def chain(self, path):
+        # The image followed by each backing file; a missing backing file ends
+        # the chain with an entry carrying "error".
+        chain = []
+        seen = set()
+        while path and len(chain) < MAX_CHAIN_DEPTH:
+            key = os.path.abspath(path)
+            if key in seen:
+                raise ImageFormatError(f"backing chain loops back to {path}")
+            seen.add(key)
+            try:
+                info = self.inspect(path)
+            except (OSError, ImageFormatError) as e:
+                chain.append({"filename": path, "error": getattr(e, "strerror", None) or str(e)})
+                break
+            chain.append(info)
+            backing = info.get("backing_file")
+            if not backing or backing.startswith(("json:", "nbd:", "http:", "https:")):
+                break
+            path = resolve_backing(path, backing)
+        return chain
+
+    def format_of(self, path, default=DEFAULT_FORMAT):
+        try:
+            return self.inspect(path)["format"]
+        except (OSError, ImageFormatError, ValueError):
+            return default
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(os.path.abspath(path), None)
+
+
+inspector = ImageInspector()
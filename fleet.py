@@ -0,0 +1,161 @@
+import asyncio
+
+from cpu_scheduler import AdmissionError
+from vm_supervisor import ACTIVE_STATES, QUEUED, RUNNING, STOP_POWERDOWN, STOP_QUIT, STOP_TERMINATE, STOP_KILL
+
+# Bulk start/stop/restart of many VMs under a VmSupervisor or the agent's
+# RemoteSupervisor. The coroutines run on the supervisor's loop:
+#   supervisor.call(stop_fleet(supervisor, ids), wait=False)
+
+FLEET_CONCURRENCY = 2     # VMs booting at the same time
+FLEET_STAGGER = 2.0       # seconds between two launches
+GATE_TIMEOUT = 120.0      # a VM not running by then frees its slot anyway
+POWERDOWN_TIMEOUT = 60.0  # ACPI shutdown, before QMP quit
+QUIT_TIMEOUT = 10.0       # QMP quit (SIGTERM without QMP), before SIGKILL
+GATE_POLL = 0.05
+
+START = "start"
+STOP = "stop"
+
+# Outcomes of a start.
+STARTED = "running"
+QUEUED_OUTCOME = "queued"
+SLOW = "still starting"
+ALREADY_RUNNING = "already running"
+FAILED = "failed"
+# Outcomes of a stop, by the step that ended the VM.
+NOT_RUNNING = "not running"
+STOP_OUTCOMES = {STOP_POWERDOWN: "powered off", STOP_QUIT: "quit", STOP_TERMINATE: "terminated", STOP_KILL: "killed"}
+
+
+class FleetResult:
+    __slots__ = ("vm_id", "name", "action", "outcome", "seconds", "error")
+
+    def __init__(self, vm_id, name, action, outcome, seconds=0.0, error=""):
+        self.vm_id = vm_id
+        self.name = name
+        self.action = action
+        self.outcome = outcome
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.outcome != FAILED
+
+    def __str__(self):
+        text = f"{self.name}: {self.action} -> {self.outcome}"
+        if self.outcome not in (ALREADY_RUNNING, NOT_RUNNING):
+            text += f" in {self.seconds:.1f}s"
+        return text + (f" ({self.error})" if self.error else "")
+
+
+def tally(results):
+    # "2 powered off, 1 killed": how many VMs ended each way.
+    counts = {}
+    for r in results:
+        counts[r.outcome] = counts.get(r.outcome, 0) + 1
+    return ", ".join(f"{n} {outcome}" for outcome, n in counts.items())
+
+
+async def start_fleet(supervisor, launches, concurrency=FLEET_CONCURRENCY, stagger=FLEET_STAGGER,
+                      gate_timeout=GATE_TIMEOUT, on_result=None):
+    # launches: (vm_id, name, cmd, options) in start order; options go to
+    # launch_async (queue, admit, qmp, restart policy). At most `concurrency`
+    # VMs boot at once and launches are at least `stagger` seconds apart; a
+    # slot frees when its VM runs (and answers QMP, if it has QMP), is queued
+    # for capacity or fails, so boot-time disk I/O does not pile up.
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max(1, concurrency))
+    results = []
+    gates = []
+    last = None
+    for vm_id, name, cmd, options in launches:
+        vm = supervisor.vms.get(vm_id)
+        if vm is not None and vm.state in ACTIVE_STATES:
+            results.append(_report(FleetResult(vm_id, name, START, ALREADY_RUNNING), on_result))
+            continue
+        await slots.acquire()
+        if last is not None:
+            await asyncio.sleep(max(0.0, last + stagger - loop.time()))
+        last = loop.time()
+        result = FleetResult(vm_id, name, START, FAILED)
+        results.append(result)
+        try:
+            vm = await supervisor.launch_async(vm_id, name, cmd, **options)
+        except (RuntimeError, AdmissionError) as e:
+            result.error = str(e)
+            slots.release()
+            _report(result, on_result)
+            continue
+        gates.append(loop.create_task(_gate(vm, result, last, gate_timeout, slots, on_result)))
+    await asyncio.gather(*gates)
+    return results
+
+
+async def _gate(vm, result, launched, timeout, slots, on_result):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            if vm.state == QUEUED:
+                result.outcome = QUEUED_OUTCOME
+                break
+            if vm.state not in ACTIVE_STATES:
+                result.error = vm.error or f"exit code {vm.exit_code}"
+                break
+            if vm.state == RUNNING and (vm.qmp_endpoint is None or vm.qmp_ready):
+                result.outcome = STARTED
+                break
+            if loop.time() - launched >= timeout:
+                result.outcome = SLOW
+                break
+            await asyncio.sleep(GATE_POLL)
+    finally:
+        result.seconds = loop.time() - launched
+        slots.release()
+    _report(result, on_result)
+
+
+async def stop_fleet(supervisor, vm_ids, powerdown_timeout=POWERDOWN_TIMEOUT, quit_timeout=QUIT_TIMEOUT,
+                     on_result=None):
+    # Every VM at once: the ACPI power button, then per VM QMP quit after
+    # powerdown_timeout and SIGKILL after quit_timeout more. Guests that
+    # ignore ACPI cost their own deadline, not everyone's.
+    return list(await asyncio.gather(*(_stop_one(supervisor, vm_id, powerdown_timeout, quit_timeout, on_result)
+                                       for vm_id in vm_ids)))
+
+
+async def _stop_one(supervisor, vm_id, powerdown_timeout, quit_timeout, on_result):
+    loop = asyncio.get_running_loop()
+    vm = supervisor.vms.get(vm_id)
+    if vm is None or vm.state not in ACTIVE_STATES:
+        return _report(FleetResult(vm_id, vm.name if vm else str(vm_id), STOP, NOT_RUNNING), on_result)
+    result = FleetResult(vm_id, vm.name, STOP, FAILED)
+    t0 = loop.time()
+    try:
+        await supervisor.stop_async(vm_id, quit_timeout, powerdown_timeout)
+        result.outcome = STOP_OUTCOMES.get(vm.stopped_by, "stopped")
+    except RuntimeError as e:
+        result.error = str(e)
+    result.seconds = loop.time() - t0
+    return _report(result, on_result)
+
+
+async def restart_fleet(supervisor, launches, concurrency=FLEET_CONCURRENCY, stagger=FLEET_STAGGER,
+                        gate_timeout=GATE_TIMEOUT, powerdown_timeout=POWERDOWN_TIMEOUT, quit_timeout=QUIT_TIMEOUT,
+                        on_result=None):
+    # The running ones down gracefully and in parallel, then all up again
+    # staggered.
+    launches = list(launches)
+    running = [launch[0] for launch in launches if supervisor.state(launch[0]) in ACTIVE_STATES]
+    stopped = await stop_fleet(supervisor, running, powerdown_timeout, quit_timeout, on_result)
+    return stopped + await start_fleet(supervisor, launches, concurrency, stagger, gate_timeout, on_result)
+
+
+def _report(result, on_result):
+    if on_result is not None:
+        try:
+            on_result(result)
+        except Exception:
+            pass  # a failing callback must not stop the rest of the fleet
+    return result
@@ -0,0 +1,171 @@
+import os
+import sys
+import mmap
+import ctypes
+import platform
+import threading
+
+HUGEPAGE_MOUNT_DEFAULT = "/dev/hugepages"
+# Guest architectures a hardware accelerator can run for each host architecture.
+NATIVE_GUESTS = {
+    "x86_64": ("x86_64", "i386"),
+    "aarch64": ("aarch64", "arm"),
+}
+
+
+def normalize_arch(machine):
+    machine = machine.lower()
+    if machine in ("amd64", "x86_64", "x64"):
+        return "x86_64"
+    if machine in ("arm64", "aarch64", "armv8l"):
+        return "aarch64"
+    return machine
+
+
+class HostCaps:
+    # What the host can do for a QEMU guest. Detection is done once by
+    # detect_host_caps(); the command builder only reads these fields, so
+    # any combination can be constructed directly.
+    __slots__ = ("platform", "arch", "accels", "io_uring", "aio_native", "hugepage_path", "hugepages_free_mb")
+
+    def __init__(self, platform="linux", arch="x86_64", accels=("tcg",), io_uring=False, aio_native=False,
+                 hugepage_path="", hugepages_free_mb=0):
+        self.platform = platform
+        self.arch = arch
+        self.accels = tuple(accels)
+        self.io_uring = io_uring
+        self.aio_native = aio_native
+        self.hugepage_path = hugepage_path
+        self.hugepages_free_mb = hugepages_free_mb
+
+    def accel_for(self, guest_arch):
+        # Hardware acceleration only runs guests of the host's own architecture.
+        if guest_arch in NATIVE_GUESTS.get(self.arch, (self.arch,)):
+            for accel in ("kvm", "whpx", "hvf"):
+                if accel in self.accels:
+                    return accel
+        return "tcg"
+
+    def __repr__(self):
+        return "HostCaps(" + ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__) + ")"
+
+
+def _kvm_available():
+    return os.path.exists("/dev/kvm") and os.access("/dev/kvm", os.R_OK | os.W_OK)
+
+
+def _whpx_available():
+    # WHvGetCapability(WHvCapabilityCodeHypervisorPresent) from the Windows Hypervisor Platform.
+    try:
+        whp = ctypes.WinDLL("WinHvPlatform.dll")
+        present = ctypes.c_int(0)
+        written = ctypes.c_uint32(0)
+        hr = whp.WHvGetCapability(0, ctypes.byref(present), ctypes.sizeof(present), ctypes.byref(written))
+        return hr == 0 and bool(present.value)
+    except (OSError, AttributeError):
+        return False
+
+
+def _hvf_available():
+    try:
+        libc = ctypes.CDLL(None)
+        value = ctypes.c_int(0)
+        size = ctypes.c_size_t(ctypes.sizeof(value))
+        rc = libc.sysctlbyname(b"kern.hv_support", ctypes.byref(value), ctypes.byref(size), None, 0)
+        return rc == 0 and bool(value.value)
+    except (OSError, AttributeError):
+        return False
+
+
+def _kernel_at_least(major, minor):
+    try:
+        parts = platform.release().split("-")[0].split(".")
+        return (int(parts[0]), int(parts[1])) >= (major, minor)
+    except (ValueError, IndexError):
+        return False
+
+
+def _io_uring_enabled():
+    # io_uring needs Linux 5.1+ and can be switched off by sysctl.
+    if not _kernel_at_least(5, 1):
+        return False
+    try:
+        with open("/proc/sys/kernel/io_uring_disabled") as f:
+            return f.read().strip() == "0"
+    except OSError:
+        return True
+
+
+def _links_liburing(qemu_path):
+    # A QEMU built without liburing rejects aio=io_uring, so look for the
+    # library in the binary's dynamic string table instead of guessing.
+    try:
+        with open(qemu_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m.find(b"liburing.so") != -1
+    except (OSError, ValueError):
+        return False
+
+
+def _hugepages():
+    mount = ""
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == "hugetlbfs":
+                    mount = fields[1]
+                    break
+    except OSError:
+        return "", 0
+    free = size_kb = 0
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("HugePages_Free:"):
+                    free = int(line.split()[1])
+                elif line.startswith("Hugepagesize:"):
+                    size_kb = int(line.split()[1])
+    except (OSError, ValueError):
+        return mount, 0
+    return mount, free * size_kb // 1024
+
+
+def detect_host_caps(qemu_path=""):
+    accels = []
+    io_uring = aio_native = False
+    hugepage_path, hugepages_free_mb = "", 0
+    if sys.platform.startswith("linux"):
+        if _kvm_available():
+            accels.append("kvm")
+        aio_native = True
+        io_uring = _io_uring_enabled() and bool(qemu_path) and _links_liburing(qemu_path)
+        hugepage_path, hugepages_free_mb = _hugepages()
+    elif sys.platform == "win32":
+        if _whpx_available():
+            accels.append("whpx")
+        aio_native = True
+    elif sys.platform == "darwin":
+        if _hvf_available():
+            accels.append("hvf")
+    accels.append("tcg")
+    return HostCaps(sys.platform, normalize_arch(platform.machine()), accels, io_uring, aio_native,
+                    hugepage_path, hugepages_free_mb)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def host_caps(qemu_path=""):
+    # Cached per QEMU binary (path + mtime), since io_uring support depends on the build.
+    try:
+        key = (qemu_path, os.stat(qemu_path).st_mtime_ns) if qemu_path else ("", 0)
+    except OSError:
+        key = (qemu_path, 0)
+    with _cache_lock:
+        caps = _cache.get(key)
+    if caps is None:
+        caps = detect_host_caps(qemu_path)
+        with _cache_lock:
+            _cache[key] = caps
+    return caps
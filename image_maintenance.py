@@ -0,0 +1,439 @@
+import os
+import re
+import sys
+import time
+import shutil
+import asyncio
+import threading
+
+from disk_image import inspector, resolve_backing, human_size, ImageFormatError
+from snapshot_engine import profile_disks
+
+COMPACT = "compact"
+COMPRESS = "compress"
+CONVERT = "convert"
+MERGE = "merge"
+OPERATIONS = (COMPACT, COMPRESS, CONVERT, MERGE)
+CONVERT_FORMATS = ("qcow2", "raw")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+DEFAULT_JOBS = 2
+TMP_SUFFIX = ".maint.tmp"
+NICE_INCREMENT = 10
+_PROGRESS_RE = re.compile(rb"\((\d+(?:\.\d+)?)/100%\)")
+_FORMAT_EXTENSIONS = {"qcow2": ".qcow2", "raw": ".raw"}
+
+
+class MaintenanceError(Exception):
+    pass
+
+
+def allocated_bytes(path):
+    # Space the file really takes: sparse raw images and punched-out qcow2
+    # clusters are not counted.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    blocks = getattr(st, "st_blocks", None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def output_format(operation, source_format, target_format=None):
+    if operation == COMPRESS:
+        return "qcow2"
+    if operation == CONVERT:
+        return target_format
+    return source_format
+
+
+def output_path(path, source_format, new_format):
+    # A format change renames disk.raw to disk.qcow2 (and back); other names
+    # are kept, since QEMU's format is detected from the header anyway.
+    root, ext = os.path.splitext(path)
+    if new_format != source_format and ext.lower() == _FORMAT_EXTENSIONS.get(source_format):
+        return root + _FORMAT_EXTENSIONS[new_format]
+    return path
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def disk_user(profiles, path):
+    # The first of profiles with path anywhere in one of its disks' backing chains.
+    key = _key(path)
+    for prof in profiles:
+        for disk in profile_disks(prof):
+            try:
+                chain = [link["filename"] for link in inspector.chain(disk)]
+            except ImageFormatError:
+                chain = [disk]
+            if any(_key(link) == key for link in chain):
+                return prof
+    return None
+
+
+def pinned_format(prof, disk):
+    # The format the profile launches disk with, if it keeps one.
+    if prof is not None and prof.disk and prof.disk_format and _key(prof.disk) == _key(disk):
+        return prof.disk_format
+    return None
+
+
+def retarget_profile(prof, old, new, new_format=None):
+    # Points prof's disks at a rewritten image (renamed, or in another format);
+    # True if anything changed.
+    changed = False
+    for disk in profile_disks(prof):
+        if _key(disk) == _key(old):
+            if prof.disk == disk:
+                prof.disk = new
+                prof.disk_format = new_format or prof.disk_format
+            else:
+                prof.extra = prof.extra.replace(disk, new)
+            changed = True
+    return changed
+
+
+def maintenance_command(qemu_img, operation, src, info, dst=None, target_format=None, rate=None):
+    # qemu-img arguments for one job; -p prints progress, -r caps bytes/s.
+    # convert skips zero clusters when writing, which is what compacts.
+    limit = ["-r", str(int(rate))] if rate else []
+    if operation == MERGE:
+        return [qemu_img, "commit", "-p"] + limit + ["-f", info["format"], src]
+    fmt = output_format(operation, info["format"], target_format)
+    cmd = [qemu_img, "convert", "-p"] + limit + ["-f", info["format"], "-O", fmt]
+    if operation == COMPRESS:
+        cmd.append("-c")
+    if info.get("backing_file") and fmt != "raw":
+        # Keep overlays as overlays: only clusters that differ from the base are written.
+        # Raw has no backing file, so a raw conversion flattens the whole chain.
+        backing = resolve_backing(src, info["backing_file"])
+        cmd += ["-B", backing, "-F", info.get("backing_format") or inspector.format_of(backing)]
+    return cmd + [src, dst]
+
+
+class MaintenanceJob:
+    __slots__ = ("job_id", "profile", "disk", "operation", "target_format", "state", "progress", "error",
+                 "before", "after", "new_path", "new_format", "started", "ended", "future", "_proc", "_cancel")
+
+    def __init__(self, job_id, profile, disk, operation, target_format=None):
+        self.job_id = job_id
+        self.profile = profile
+        self.disk = disk
+        self.operation = operation
+        self.target_format = target_format
+        self.state = QUEUED
+        self.progress = 0.0
+        self.error = ""
+        self.before = None
+        self.after = None
+        self.new_path = None
+        self.new_format = None
+        self.started = None
+        self.ended = None
+        self.future = None
+        self._proc = None
+        self._cancel = False
+
+    @property
+    def reclaimed(self):
+        if self.before is None or self.after is None:
+            return None
+        return self.before - self.after
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def describe(self):
+        what = self.operation if self.operation != CONVERT else f"convert to {self.target_format}"
+        who = f"{self.profile.name}: " if self.profile is not None else ""
+        text = f"{who}{what} {os.path.basename(self.disk)}"
+        if self.state == RUNNING:
+            return f"{text} - {self.progress:.0f}%"
+        if self.state == DONE:
+            saved = self.reclaimed
+            text += f" - {'reclaimed' if saved >= 0 else 'grew by'} {human_size(abs(saved))}"
+            text += f" ({human_size(self.before)} -> {human_size(self.after)}, {self.ended - self.started:.1f}s)"
+            if self.new_path:
+                text += f", now {os.path.basename(self.new_path)}"
+            return text
+        if self.state == FAILED:
+            return f"{text} - failed: {self.error}"
+        return f"{text} - {self.state}"
+
+
+class MaintenanceQueue:
+    # Image maintenance through qemu-img on its own asyncio loop thread: each
+    # job is a coroutine driving one qemu-img process and parsing its -p
+    # progress. At most `jobs` run at once; `bandwidth` (bytes/s, None for no
+    # cap) is split evenly between those slots and passed to qemu-img -r, and
+    # the processes run at lower CPU priority, so running VMs keep their I/O.
+    #
+    # Only stopped VMs are touched: in_use(path) returns the name of a running
+    # VM using a disk (anywhere in its chain) or None, and is checked again
+    # when a job actually starts. dependents(path) lists images backed by a
+    # path (profile names or file names); format changes, and merges into a
+    # base that also backs something else, are refused.
+    # on_update(job) runs on the queue thread at every state or progress change.
+    def __init__(self, jobs=DEFAULT_JOBS, bandwidth=None, in_use=None, dependents=None, on_update=None):
+        self.max_jobs = jobs
+        self.bandwidth = bandwidth
+        self.in_use = in_use
+        self.dependents = dependents
+        self.on_update = on_update
+        self.jobs = {}
+        self._ids = 0
+        self._lock = threading.Lock()
+        self._busy = set()
+        self._running = 0
+        self._slots = None
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_loop, name="image-maintenance", daemon=True)
+            self._thread.start()
+            self._ready.wait()
+        return self
+
+    def _run_loop(self):
+        self.loop = asyncio.ProactorEventLoop() if sys.platform == "win32" else asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._slots = asyncio.Condition()
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def shutdown(self, timeout=10):
+        if self._thread is None:
+            return
+        for job in list(self.jobs.values()):
+            self.cancel(job.job_id)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # ---- Public, thread-safe API ----
+    def submit(self, profile, disk, operation, target_format=None, qemu_img=None):
+        # Returns the job; job.future resolves to it once finished (never raises).
+        if operation not in OPERATIONS:
+            raise ValueError(f"unknown maintenance operation {operation!r}")
+        if operation == CONVERT and target_format not in CONVERT_FORMATS:
+            raise ValueError(f"cannot convert to {target_format!r}")
+        self.start()
+        with self._lock:
+            self._ids += 1
+            job = MaintenanceJob(self._ids, profile, os.path.abspath(disk), operation, target_format)
+            self.jobs[job.job_id] = job
+        job.future = asyncio.run_coroutine_threadsafe(self._run_job(job, qemu_img), self.loop)
+        self._notify(job)
+        return job
+
+    def set_limits(self, jobs=None, bandwidth=False):
+        # New limits apply to jobs that start afterwards; bandwidth=None removes the cap.
+        if jobs is not None:
+            self.max_jobs = max(1, jobs)
+        if bandwidth is not False:
+            self.bandwidth = bandwidth or None
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._wake(), self.loop)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel = True
+        if job._proc is not None and job._proc.returncode is None:
+            self.loop.call_soon_threadsafe(job._proc.kill)
+        return True
+
+    def busy(self, path):
+        # True while a queued or running job will write this image.
+        key = _key(path)
+        with self._lock:
+            return any(key in self._job_paths(j)
+                       for j in self.jobs.values() if not j.finished)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def clear_finished(self):
+        with self._lock:
+            for job_id in [i for i, j in self.jobs.items() if j.finished]:
+                del self.jobs[job_id]
+
+    # ---- Loop-side implementation ----
+    def _job_paths(self, job):
+        # Every file the job writes, normalized: the image, and for a merge its base.
+        paths = {_key(job.disk)}
+        if job.operation == MERGE:
+            try:
+                backing = inspector.inspect(job.disk).get("backing_file")
+            except (OSError, ImageFormatError):
+                backing = None
+            if backing:
+                paths.add(_key(resolve_backing(job.disk, backing)))
+        return paths
+
+    def _notify(self, job):
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception:
+                pass
+
+    async def _wake(self):
+        async with self._slots:
+            self._slots.notify_all()
+
+    def _rate(self):
+        return int(self.bandwidth / self.max_jobs) if self.bandwidth else None
+
+    async def _run_job(self, job, qemu_img):
+        async with self._slots:
+            await self._slots.wait_for(lambda: job._cancel or self._running < self.max_jobs)
+            if job._cancel:
+                job.state = CANCELLED
+                self._notify(job)
+                return job
+            self._running += 1
+        try:
+            await self._execute(job, qemu_img)
+        except (MaintenanceError, OSError, ImageFormatError) as e:
+            job.state = CANCELLED if job._cancel else FAILED
+            job.error = str(e)
+        finally:
+            job.ended = time.time()
+            async with self._slots:
+                self._running -= 1
+                self._slots.notify_all()
+            self._notify(job)
+        return job
+
+    def _check(self, job, info):
+        # Everything that makes a job unsafe, checked when it starts.
+        if self.in_use:
+            paths = [job.disk]
+            if job.operation == MERGE and info.get("backing_file"):
+                paths.append(resolve_backing(job.disk, info["backing_file"]))
+            for path in paths:
+                user = self.in_use(path)
+                if user:
+                    raise MaintenanceError(f"{user} is running from {os.path.basename(path)}; stop it first")
+        if not os.access(job.disk, os.W_OK):
+            raise MaintenanceError("the image is read-only (a template?)")
+        pinned = pinned_format(job.profile, job.disk)
+        if pinned and pinned != info["format"]:
+            # A guest can write any header into a raw disk it owns; qemu-img
+            # must not follow a backing file from it.
+            raise MaintenanceError(f"the header says {info['format']} but {job.profile.name} runs it as {pinned}")
+        new_format = output_format(job.operation, info["format"], job.target_format)
+        if job.operation != MERGE and info.get("snapshots"):
+            raise MaintenanceError(f"it has {len(info['snapshots'])} internal snapshot(s), which qemu-img convert would drop")
+        if job.operation == MERGE:
+            if not info.get("backing_file"):
+                raise MaintenanceError("it has no backing file to merge into")
+            base = resolve_backing(job.disk, info["backing_file"])
+            if not os.access(base, os.W_OK):
+                raise MaintenanceError(f"{os.path.basename(base)} is read-only (a template?)")
+            own = {os.path.basename(job.disk), job.profile.name if job.profile is not None else None}
+            others = [d for d in (self.dependents(base) if self.dependents else []) if d not in own]
+            if others:
+                raise MaintenanceError(f"{os.path.basename(base)} also backs {', '.join(others[:3])}")
+        elif new_format != info["format"]:
+            if self.dependents and self.dependents(job.disk):
+                raise MaintenanceError(f"other images use it as their backing file in {info['format']} format")
+            if job.operation == COMPRESS and info["format"] not in CONVERT_FORMATS:
+                raise MaintenanceError(f"cannot compress {info['format']} images")
+            dest = output_path(job.disk, info["format"], new_format)
+            if _key(dest) != _key(job.disk) and os.path.lexists(dest):
+                raise MaintenanceError(f"{os.path.basename(dest)} already exists; move it away first")
+        return new_format
+
+    async def _execute(self, job, qemu_img):
+        if qemu_img is None:
+            raise MaintenanceError("qemu-img not found next to the QEMU executable or on PATH")
+        with self._lock:
+            writes = self._job_paths(job)
+            if writes & self._busy:
+                raise MaintenanceError("another job is already writing this image")
+            self._busy |= writes
+        try:
+            info = inspector.inspect(job.disk)
+            new_format = self._check(job, info)
+            base = resolve_backing(job.disk, info["backing_file"]) if job.operation == MERGE else None
+            measured = [job.disk] + ([base] if base else [])
+            job.before = sum(allocated_bytes(p) for p in measured)
+            job.state = RUNNING
+            job.started = time.time()
+            self._notify(job)
+            tmp = None if job.operation == MERGE else job.disk + TMP_SUFFIX
+            cmd = maintenance_command(qemu_img, job.operation, job.disk, info, tmp, job.target_format, self._rate())
+            try:
+                await self._run_qemu_img(job, cmd)
+                if tmp is not None:
+                    shutil.copymode(job.disk, tmp)
+                    dest = output_path(job.disk, info["format"], new_format)
+                    if _key(dest) != _key(job.disk) and os.path.lexists(dest):
+                        raise MaintenanceError(f"{os.path.basename(dest)} appeared while converting; "
+                                               f"{os.path.basename(job.disk)} is unchanged")
+                    os.replace(tmp, dest)
+                    if dest != job.disk:
+                        os.remove(job.disk)
+                        job.new_path = dest
+                        measured = [dest]
+                    if new_format != info["format"]:
+                        job.new_format = new_format
+            finally:
+                if tmp is not None and os.path.exists(tmp):
+                    os.remove(tmp)
+                for p in measured + [job.disk]:
+                    inspector.invalidate(p)
+            job.after = sum(allocated_bytes(p) for p in measured)
+            job.progress = 100.0
+            job.state = DONE
+        finally:
+            with self._lock:
+                self._busy -= writes
+
+    async def _run_qemu_img(self, job, cmd):
+        kwargs = {}
+        if sys.platform == "win32":
+            kwargs["creationflags"] = 0x08000000 | 0x00004000  # CREATE_NO_WINDOW, BELOW_NORMAL_PRIORITY_CLASS
+        elif hasattr(os, "nice"):
+            kwargs["preexec_fn"] = lambda: os.nice(NICE_INCREMENT)
+        proc = job._proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, **kwargs)
+        errors = asyncio.ensure_future(proc.stderr.read())
+        pending = b""
+        while True:
+            data = await proc.stdout.read(4096)
+            if not data:
+                break
+            # Progress lines end in \r; keep only the newest value per read.
+            pending = (pending + data)[-256:]
+            found = _PROGRESS_RE.findall(pending)
+            if found:
+                value = float(found[-1])
+                if value != job.progress:
+                    job.progress = value
+                    self._notify(job)
+        code = await proc.wait()
+        stderr = (await errors).decode("utf-8", "replace").strip()
+        job._proc = None
+        if job._cancel:
+            raise MaintenanceError("cancelled")
+        if code != 0:
+            raise MaintenanceError(stderr or f"qemu-img exited with {code}")
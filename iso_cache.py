@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+
+HASH_BLOCK_SIZE = 1024 * 1024
+DIGEST_CACHE_VERSION = 1
+STORE_INDEX_VERSION = 1
+
+
+def sha256_file(path, block_size=HASH_BLOCK_SIZE):
+    h = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def parse_checksum_file(text, filename):
+    # Understands GNU "<hex>  <file>" / "<hex> *<file>" and BSD "SHA256 (<file>) = <hex>" lines.
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("SHA256 (") and ") = " in line:
+            name, digest = line[len("SHA256 ("):].rsplit(") = ", 1)
+        else:
+            parts = line.split(None, 1)
+            if len(parts) != 2:
+                continue
+            digest, name = parts
+            name = name.lstrip("*")
+        if os.path.basename(name.strip()) == filename and len(digest.strip()) == 64:
+            return digest.strip().lower()
+    return None
+
+
+def _stat_key(st):
+    return [st.st_size, st.st_mtime_ns]
+
+
+class DigestCache:
+    # SHA-256 digests keyed by absolute path and validated against (size, mtime),
+    # so re-checking an unchanged multi-GB image costs a single stat().
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == DIGEST_CACHE_VERSION:
+                    self._entries = data.get("entries", {})
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry and entry[:2] == _stat_key(st):
+            return entry[2]
+        return None
+
+    def put(self, path, digest):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            self._entries[path] = _stat_key(st) + [digest]
+            self._dirty = True
+
+    def digest(self, path):
+        cached = self.get(path)
+        if cached:
+            return cached
+        digest = sha256_file(path)
+        self.put(path, digest)
+        return digest
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            live = {p: e for p, e in self._entries.items() if os.path.exists(p)}
+            self._entries = live
+            self._dirty = False
+            data = {"version": DIGEST_CACHE_VERSION, "entries": live}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+
+def reflink(src, dst):
+    # Copy-on-write clone (btrfs/XFS) via the FICLONE ioctl; False when unsupported.
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    FICLONE = 0x40049409
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+class IsoStore:
+    # Content-addressed ISO store. Objects live under root/objects/<aa>/<sha256>.iso
+    # and identical images elsewhere are replaced by hardlinks (or reflinks) to one copy.
+    # Files on a different volume than the store share a per-volume canonical copy instead.
+    def __init__(self, root, digest_cache):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.index_path = os.path.join(root, "index.json")
+        self.digests = digest_cache
+        self._lock = threading.Lock()
+        self._index = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == STORE_INDEX_VERSION:
+                    self._index = data.get("objects", {})
+            except (OSError, ValueError):
+                self._index = {}
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest + ".iso")
+
+    def _store_dev(self):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        return os.stat(self.objects_dir).st_dev
+
+    def _canonical(self, digest, dev):
+        with self._lock:
+            path = self._index.get(digest, {}).get(str(dev))
+        if path and os.path.exists(path):
+            return path
+        return None
+
+    def _set_canonical(self, digest, dev, path):
+        with self._lock:
+            self._index.setdefault(digest, {})[str(dev)] = path
+
+    def _replace_with_link(self, canonical, path):
+        tmp = path + ".dedup-tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(canonical, tmp)
+        except OSError:
+            if not reflink(canonical, tmp):
+                return False
+        os.replace(tmp, path)
+        return True
+
+    def ingest(self, path, digest=None):
+        # Returns the number of bytes freed by linking path to an existing copy.
+        path = os.path.abspath(path)
+        digest = digest or self.digests.digest(path)
+        st = os.stat(path)
+        dev = st.st_dev
+        canonical = self._canonical(digest, dev)
+        if canonical is None and dev == self._store_dev():
+            obj = self.object_path(digest)
+            if not os.path.exists(obj):
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                try:
+                    os.link(path, obj)
+                except OSError:
+                    obj = None
+            canonical = obj
+        if canonical is None:
+            self._set_canonical(digest, dev, path)
+            return 0
+        self._set_canonical(digest, dev, canonical)
+        cst = os.stat(canonical)
+        if cst.st_ino == st.st_ino or cst.st_size != st.st_size:
+            return 0
+        if not self._replace_with_link(canonical, path):
+            return 0
+        self.digests.put(path, digest)
+        return st.st_size
+
+    def _iter_isos(self, dirs, files):
+        for f in files:
+            yield f
+        for d in dirs:
+            if not d or not os.path.isdir(d):
+                continue
+            for dirpath, _, names in os.walk(d):
+                for name in names:
+                    if name.lower().endswith(".iso"):
+                        yield os.path.join(dirpath, name)
+
+    def dedup_dirs(self, dirs, files=(), progress_cb=None):
+        seen = set()
+        store_prefix = os.path.abspath(self.root) + os.sep
+        report = {"files": 0, "linked": 0, "bytes_freed": 0}
+        for path in self._iter_isos(dirs, files):
+            full = os.path.abspath(path)
+            if full in seen or full.startswith(store_prefix):
+                continue
+            seen.add(full)
+            report["files"] += 1
+            if progress_cb:
+                progress_cb(full)
+            try:
+                freed = self.ingest(full)
+            except OSError:
+                continue
+            if freed:
+                report["linked"] += 1
+                report["bytes_freed"] += freed
+        report.update(self.collect())
+        self.save()
+        return report
+
+    def collect(self):
+        # Removes objects nothing links to any more (st_nlink == 1: every
+        # library copy was deleted) and index entries of copies that are gone.
+        report = {"collected": 0, "bytes_collected": 0}
+        removed = set()
+        for dirpath, _, names in os.walk(self.objects_dir):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                    if not name.endswith(".iso") or st.st_nlink != 1:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    continue
+                removed.add(path)
+                report["collected"] += 1
+                report["bytes_collected"] += st.st_size
+            if dirpath != self.objects_dir and not os.listdir(dirpath):
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+        with self._lock:
+            for digest in list(self._index):
+                devs = self._index[digest]
+                for dev, path in list(devs.items()):
+                    if path in removed or not os.path.exists(path):
+                        del devs[dev]
+                if not devs:
+                    del self._index[digest]
+        return report
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            data = {"version": STORE_INDEX_VERSION, "objects": self._index}
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.index_path)
+        self.digests.save()
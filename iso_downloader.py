@@ -0,0 +1,409 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_SEGMENTS = 4
+DEFAULT_CHUNK_SIZE = 256 * 1024
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+PART_SUFFIX = ".part"
+JOURNAL_SUFFIX = ".part.json"
+JOURNAL_VERSION = 1
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumMismatch(DownloadError):
+    pass
+
+
+class DownloadProgress:
+    def __init__(self, total, downloaded, rate, eta, segments_active):
+        self.total = total
+        self.downloaded = downloaded
+        self.rate = rate
+        self.eta = eta
+        self.segments_active = segments_active
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 0
+        return int(self.downloaded * 100 / self.total)
+
+
+def format_rate(rate):
+    for unit in ("B/s", "KiB/s", "MiB/s"):
+        if rate < 1024:
+            return f"{rate:.1f} {unit}"
+        rate /= 1024.0
+    return f"{rate:.1f} GiB/s"
+
+
+def format_eta(eta):
+    if eta is None:
+        return "--:--"
+    eta = int(eta)
+    h, rem = divmod(eta, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+def make_session(pool_size=DEFAULT_SEGMENTS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, 1), max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class _Segment:
+    def __init__(self, start, end, done=0):
+        self.start = start
+        self.end = end  # inclusive
+        self.done = done
+
+    @property
+    def length(self):
+        return self.end - self.start + 1
+
+    @property
+    def complete(self):
+        return self.done >= self.length
+
+    def to_list(self):
+        return [self.start, self.end, self.done]
+
+
+class InlineHasher:
+    # SHA-256 over a file written out of order. Bytes at the hash frontier are
+    # hashed straight from the network buffer; ranges that land ahead of it are
+    # only recorded and read back (from the page cache) once the frontier arrives.
+    # A whole-file digest cannot be assembled from per-segment ones; the
+    # alternative to reading back is holding those ranges in memory. Reads run
+    # with the lock released so segments keep writing, and once the frontier
+    # reaches a segment's write point the rest of it is hashed from its buffers.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._h = hashlib.sha256()
+        self.pos = 0
+        self._starts = {}
+        self._ends = {}
+        self._draining = False
+
+    def _add_range(self, start, end):
+        if start in self._ends:
+            prev = self._ends.pop(start)
+            self._starts[prev] = end
+            self._ends[end] = prev
+        else:
+            self._starts[start] = end
+            self._ends[end] = start
+
+    def _drain(self):
+        # Called with the lock held. One thread drains at a time; ranges fed
+        # while it reads are recorded and picked up by its next pass.
+        if self._draining:
+            return
+        self._draining = True
+        try:
+            while self.pos in self._starts:
+                end = self._starts.pop(self.pos)
+                del self._ends[end]
+                self._lock.release()
+                try:
+                    self._hash_file(self.pos, end)
+                finally:
+                    self._lock.acquire()
+                self.pos = end
+        finally:
+            self._draining = False
+
+    def _hash_file(self, pos, end):
+        with open(self.path, "rb") as f:
+            f.seek(pos)
+            while pos < end:
+                data = f.read(min(1024 * 1024, end - pos))
+                if not data:
+                    raise DownloadError("short read while hashing")
+                self._h.update(data)
+                pos += len(data)
+
+    def feed(self, offset, data):
+        with self._lock:
+            if offset == self.pos and not self._draining:
+                self._h.update(data)
+                self.pos += len(data)
+                self._drain()
+            else:
+                self._add_range(offset, offset + len(data))
+
+    def mark_written(self, start, end):
+        if end > start:
+            with self._lock:
+                self._add_range(start, end)
+                self._drain()
+
+    def hexdigest(self):
+        with self._lock:
+            return self._h.hexdigest()
+
+
+# Fetches a URL as concurrent HTTP Range segments written in place into a
+# preallocated .part file. A sidecar journal records each segment's progress
+# so an interrupted download resumes from the bytes already on disk.
+class SegmentedDownloader:
+    def __init__(self, url, dest, segments=DEFAULT_SEGMENTS, chunk_size=DEFAULT_CHUNK_SIZE,
+                 session=None, progress_cb=None, progress_interval=0.5, retries=5, timeout=30,
+                 expected_sha256=None):
+        self.url = url
+        self.dest = dest
+        self.part_path = dest + PART_SUFFIX
+        self.journal_path = dest + JOURNAL_SUFFIX
+        self.segment_count = max(1, int(segments))
+        self.chunk_size = chunk_size
+        self.session = session or make_session(self.segment_count)
+        self._own_session = session is None
+        self.progress_cb = progress_cb
+        self.progress_interval = progress_interval
+        self.retries = retries
+        self.timeout = timeout
+        self.expected_sha256 = expected_sha256.lower() if expected_sha256 else None
+        self.sha256 = None
+        self.hasher = InlineHasher(self.part_path)
+        self.total = 0
+        self.resumed_bytes = 0
+        self._segments = []
+        self._validator = {}
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._errors = []
+
+    def cancel(self):
+        self._cancel.set()
+
+    # ---- Probing & journal ----
+    def _probe(self):
+        r = self.session.get(self.url, headers={"Range": "bytes=0-0"}, stream=True,
+                             allow_redirects=True, timeout=self.timeout)
+        try:
+            r.raise_for_status()
+            final_url = r.url
+            validator = {"etag": r.headers.get("ETag", ""),
+                         "last_modified": r.headers.get("Last-Modified", "")}
+            if r.status_code == 206 and "/" in r.headers.get("Content-Range", ""):
+                total = r.headers["Content-Range"].rsplit("/", 1)[1]
+                if total.isdigit():
+                    return final_url, int(total), True, validator
+            return final_url, int(r.headers.get("content-length", 0)), False, validator
+        finally:
+            r.close()
+
+    def _plan(self, total, ranged):
+        if not ranged or total <= 0:
+            # Unknown length: stream until the server closes the response.
+            return [_Segment(0, total - 1 if total > 0 else 2 ** 62)]
+        count = min(self.segment_count, max(1, total // MIN_SEGMENT_SIZE))
+        size = total // count
+        segs = []
+        for i in range(count):
+            start = i * size
+            end = total - 1 if i == count - 1 else start + size - 1
+            segs.append(_Segment(start, end))
+        return segs
+
+    def _load_journal(self, total, validator):
+        if not (os.path.exists(self.journal_path) and os.path.exists(self.part_path)):
+            return None
+        try:
+            with open(self.journal_path, "r") as f:
+                j = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (j.get("version") != JOURNAL_VERSION or j.get("url") != self.url
+                or j.get("total") != total or j.get("validator") != validator
+                or os.path.getsize(self.part_path) != total):
+            return None
+        return [_Segment(*s) for s in j.get("segments", [])]
+
+    def _write_journal(self):
+        with self._lock:
+            data = {
+                "version": JOURNAL_VERSION,
+                "url": self.url,
+                "total": self.total,
+                "validator": self._validator,
+                "segments": [s.to_list() for s in self._segments],
+            }
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.journal_path)
+
+    def _preallocate(self):
+        with open(self.part_path, "wb") as f:
+            if self.total:
+                f.truncate(self.total)
+
+    # ---- Transfer ----
+    def _fetch_segment(self, seg, url, ranged):
+        attempt = 0
+        # Unbuffered so the hasher can read back ranges written by other segments.
+        with open(self.part_path, "r+b", buffering=0) as f:
+            while not seg.complete and not self._cancel.is_set():
+                headers = {}
+                if ranged:
+                    headers["Range"] = f"bytes={seg.start + seg.done}-{seg.end}"
+                elif seg.done:
+                    # Server cannot resume, start this stream over.
+                    with self._lock:
+                        seg.done = 0
+                    self.hasher.reset()
+                try:
+                    with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+                        r.raise_for_status()
+                        if ranged and r.status_code != 206:
+                            raise DownloadError("server ignored Range request")
+                        f.seek(seg.start + seg.done)
+                        for chunk in r.iter_content(chunk_size=self.chunk_size):
+                            if self._cancel.is_set():
+                                return
+                            if not chunk:
+                                continue
+                            remaining = seg.length - seg.done
+                            if len(chunk) > remaining:
+                                chunk = chunk[:remaining]
+                            f.write(chunk)
+                            self.hasher.feed(seg.start + seg.done, chunk)
+                            with self._lock:
+                                seg.done += len(chunk)
+                            if seg.complete:
+                                break
+                    if not ranged and not self.total:
+                        with self._lock:
+                            seg.end = seg.start + seg.done - 1
+                        return
+                except (requests.RequestException, DownloadError, OSError) as e:
+                    attempt += 1
+                    if attempt > self.retries or isinstance(e, DownloadError):
+                        with self._lock:
+                            self._errors.append(e)
+                        return
+                    self._cancel.wait(min(2 ** attempt, 30))
+
+    def _downloaded(self):
+        with self._lock:
+            return sum(s.done for s in self._segments)
+
+    def run(self):
+        try:
+            return self._run()
+        finally:
+            if self._own_session:
+                self.session.close()
+
+    def _run(self):
+        url, total, ranged, validator = self._probe()
+        self.total = total
+        self._validator = validator
+        segments = self._load_journal(total, validator) if ranged else None
+        if segments is None:
+            segments = self._plan(total, ranged)
+            self._preallocate()
+        self._segments = segments
+        self.resumed_bytes = self._downloaded()
+        self.hasher.reset()
+        for seg in self._segments:
+            self.hasher.mark_written(seg.start, seg.start + seg.done)
+
+        workers = []
+        for seg in self._segments:
+            if seg.complete:
+                continue
+            t = threading.Thread(target=self._fetch_segment, args=(seg, url, ranged), daemon=True)
+            t.start()
+            workers.append(t)
+
+        started = time.monotonic()
+        last_journal = started
+        rate = 0.0
+        last_bytes, last_time = self.resumed_bytes, started
+        while any(t.is_alive() for t in workers):
+            [t for t in workers if t.is_alive()][0].join(self.progress_interval)
+            now = time.monotonic()
+            done = self._downloaded()
+            inst = (done - last_bytes) / max(now - last_time, 1e-6)
+            rate = inst if rate == 0 else 0.7 * rate + 0.3 * inst
+            last_bytes, last_time = done, now
+            if ranged and now - last_journal >= 1.0:
+                self._write_journal()
+                last_journal = now
+            self._report(done, rate, sum(t.is_alive() for t in workers))
+
+        done = self._downloaded()
+        if ranged:
+            self._write_journal()
+        if self._cancel.is_set():
+            raise DownloadCancelled(self.url)
+        if self._errors or not all(s.complete for s in self._segments):
+            raise DownloadError(self._errors[0] if self._errors else "download incomplete")
+        if not ranged and not total:
+            self.total = done
+        self._report(done, 0.0, 0)
+        if self.hasher.pos != self.total:
+            raise DownloadError("hash frontier did not reach end of file")
+        self.sha256 = self.hasher.hexdigest()
+        if self.expected_sha256 and self.sha256 != self.expected_sha256:
+            os.remove(self.part_path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            raise ChecksumMismatch(f"SHA-256 mismatch: expected {self.expected_sha256}, got {self.sha256}")
+        os.replace(self.part_path, self.dest)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        return self.dest
+
+    def _report(self, done, rate, active):
+        if not self.progress_cb:
+            return
+        eta = (self.total - done) / rate if rate > 0 and self.total else None
+        self.progress_cb(DownloadProgress(self.total, done, rate, eta, active))
+
+
+def fetch_expected_sha256(iso, session=None):
+    # ISO_LIST entries may carry a literal "sha256" or a "checksum_url" to a SUMS file.
+    if iso.get("sha256"):
+        return iso["sha256"].lower()
+    url = iso.get("checksum_url")
+    if not url:
+        return None
+    from iso_cache import parse_checksum_file
+    get = session.get if session else requests.get
+    r = get(url, timeout=30)
+    r.raise_for_status()
+    return parse_checksum_file(r.text, iso["filename"])
+
+
+def download_single_stream(url, dest, chunk_size=8192, session=None):
+    # The original one-request path, kept for comparison benchmarks.
+    get = session.get if session else requests.get
+    r = get(url, stream=True)
+    r.raise_for_status()
+    with open(dest, "wb") as f:
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            if chunk:
+                f.write(chunk)
+    return dest
@@ -0,0 +1,195 @@
+import os
+import json
+import mmap
+import struct
+import threading
+
+INDEX_VERSION = 1
+ISO_SECTOR = 2048
+PVD_OFFSET = 16 * ISO_SECTOR
+
+
+def _strip(raw):
+    return raw.decode("ascii", "replace").strip(" \x00")
+
+
+def _iso_date(raw):
+    # ISO9660 dec-datetime "YYYYMMDDHHMMSScc" + tz byte; all zeros/spaces means unset.
+    text = raw[:14].decode("ascii", "replace")
+    if not text.isdigit() or text.strip("0") == "":
+        return ""
+    return f"{text[0:4]}-{text[4:6]}-{text[6:8]} {text[8:10]}:{text[10:12]}"
+
+
+def read_iso9660_info(path):
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < PVD_OFFSET + ISO_SECTOR:
+                return None
+            with mmap.mmap(f.fileno(), PVD_OFFSET + ISO_SECTOR, access=mmap.ACCESS_READ) as m:
+                pvd = m[PVD_OFFSET:PVD_OFFSET + ISO_SECTOR]
+    except (OSError, ValueError):
+        return None
+    if pvd[0] != 1 or pvd[1:6] != b"CD001":
+        return None
+    blocks = struct.unpack_from("<I", pvd, 80)[0]
+    block_size = struct.unpack_from("<H", pvd, 128)[0] or ISO_SECTOR
+    return {
+        "system": _strip(pvd[8:40]),
+        "label": _strip(pvd[40:72]),
+        "volume_size": blocks * block_size,
+        "created": _iso_date(pvd[813:830]),
+    }
+
+
+class IsoLibraryIndex:
+    # On-disk index of ISO files under library roots. Each directory entry caches
+    # its mtime, subdirectories and ISO metadata; a rescan only re-lists
+    # directories whose mtime changed and re-reads ISOs whose size/mtime changed.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._roots = {}
+        self._scan_locks = {}
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == INDEX_VERSION:
+                    self._roots = data.get("roots", {})
+            except (OSError, ValueError):
+                self._roots = {}
+
+    def _scan_dir(self, dirs, path, recurse):
+        # Returns whether the table changed.
+        try:
+            st = os.stat(path)
+        except OSError:
+            return dirs.pop(path, None) is not None
+        changed = False
+        cached = dirs.get(path)
+        if cached is None or cached["mtime_ns"] != st.st_mtime_ns:
+            old_files = cached["files"] if cached else {}
+            files = {}
+            subdirs = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                            elif entry.name.lower().endswith(".iso") and entry.is_file():
+                                est = entry.stat()
+                                old = old_files.get(entry.name)
+                                if old and old["size"] == est.st_size and old["mtime_ns"] == est.st_mtime_ns:
+                                    files[entry.name] = old
+                                else:
+                                    info = read_iso9660_info(entry.path) or {}
+                                    info.update(size=est.st_size, mtime_ns=est.st_mtime_ns)
+                                    files[entry.name] = info
+                        except OSError:
+                            continue
+            except OSError:
+                return dirs.pop(path, None) is not None
+            cached = {"mtime_ns": st.st_mtime_ns, "files": files, "subdirs": sorted(subdirs)}
+            dirs[path] = cached
+            changed = True
+        if recurse:
+            for sub in cached["subdirs"]:
+                changed = self._scan_dir(dirs, sub, True) or changed
+        return changed
+
+    def _prune(self, dirs, root):
+        reachable = set()
+        stack = [root]
+        while stack:
+            d = stack.pop()
+            if d in reachable or d not in dirs:
+                continue
+            reachable.add(d)
+            stack.extend(dirs[d]["subdirs"])
+        stale = [d for d in dirs if d not in reachable]
+        for d in stale:
+            del dirs[d]
+        return bool(stale)
+
+    # Scans work on a private copy of the root's directory table so readers
+    # (the GUI thread) never wait on filesystem I/O. Scans of the same root
+    # (a full scan and a notification's rescan) run one at a time, or the one
+    # writing its copy back last would drop the other's updates.
+    def _scan_lock(self, root):
+        with self._lock:
+            return self._scan_locks.setdefault(root, threading.Lock())
+
+    def scan(self, root):
+        root = os.path.abspath(root)
+        with self._scan_lock(root):
+            with self._lock:
+                dirs = dict(self._roots.get(root, {}))
+            changed = self._scan_dir(dirs, root, True)
+            changed = self._prune(dirs, root) or changed
+            with self._lock:
+                self._roots[root] = dirs
+                self._dirty = self._dirty or changed
+                return self._entries(root)
+
+    def rescan_dir(self, root, path):
+        # Incremental update for a single changed directory (filesystem notification).
+        root = os.path.abspath(root)
+        path = os.path.abspath(path)
+        with self._scan_lock(root):
+            with self._lock:
+                dirs = dict(self._roots.get(root, {}))
+            before = set(dirs.get(path, {}).get("subdirs", []))
+            changed = self._scan_dir(dirs, path, False)
+            for sub in set(dirs.get(path, {}).get("subdirs", [])) - before:
+                changed = self._scan_dir(dirs, sub, True) or changed
+            changed = self._prune(dirs, root) or changed
+            with self._lock:
+                self._roots[root] = dirs
+                self._dirty = self._dirty or changed
+                return self._entries(root)
+
+    def cached_entries(self, root):
+        with self._lock:
+            return self._entries(os.path.abspath(root))
+
+    def directories(self, root):
+        with self._lock:
+            return sorted(self._roots.get(os.path.abspath(root), {}))
+
+    def _entries(self, root):
+        out = []
+        for d, info in self._roots.get(root, {}).items():
+            for name, meta in info["files"].items():
+                full = os.path.join(d, name)
+                entry = dict(meta)
+                entry["path"] = full
+                entry["relpath"] = os.path.relpath(full, root)
+                out.append(entry)
+        out.sort(key=lambda e: e["relpath"].lower())
+        return out
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {"version": INDEX_VERSION, "roots": self._roots}
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+
+def describe_entry(entry):
+    text = entry["relpath"]
+    details = []
+    if entry.get("label"):
+        details.append(entry["label"])
+    details.append(f"{entry['size'] / (1024 ** 3):.1f} GiB")
+    if entry.get("created"):
+        details.append(entry["created"][:10])
+    return f"{text}  [{', '.join(details)}]"
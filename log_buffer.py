@@ -0,0 +1,108 @@
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+SEVERITY_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+FRONTEND = "frontend"
+DEFAULT_LINES_PER_SOURCE = 5000
+DEFAULT_MAX_PENDING = 20000
+MAX_LINE_CHARS = 2000
+
+_ERROR_WORDS = ("error", "fatal", "failed", "panic", "mismatch", "could not", "cannot")
+_WARNING_WORDS = ("warning", "warn:", "deprecated")
+
+
+def classify(text):
+    # Cheap keyword match; QEMU's own diagnostics read like
+    # "qemu-system-x86_64: warning: ..." or "...: could not open ...".
+    lower = text.lower()
+    if any(w in lower for w in _ERROR_WORDS):
+        return ERROR
+    if any(w in lower for w in _WARNING_WORDS):
+        return WARNING
+    return INFO
+
+
+class LogBuffer:
+    # Bounded, thread-safe log store. Each source (a VM id, or FRONTEND for
+    # the app's own messages) keeps its last lines_per_source lines in a ring,
+    # so memory stays flat however long VMs run. Lines are (seq, time, source,
+    # severity, text) tuples; seq orders lines across sources.
+    #
+    # Producers on any thread call append(). New lines also collect in a
+    # pending batch that the GUI takes with drain(); on_pending() fires once
+    # when the batch goes from empty to non-empty, so a consumer is woken at
+    # most once per batch, not once per line. If the consumer falls behind,
+    # the oldest pending lines are dropped from the batch (they stay in the
+    # rings) and drain() reports how many.
+    def __init__(self, lines_per_source=DEFAULT_LINES_PER_SOURCE, max_pending=DEFAULT_MAX_PENDING, on_pending=None):
+        self.lines_per_source = lines_per_source
+        self.max_pending = max_pending
+        self.on_pending = on_pending
+        self._rings = {}
+        self._pending = deque(maxlen=max_pending)
+        self._dropped = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def append(self, source, text, severity=None):
+        if len(text) > MAX_LINE_CHARS:
+            text = text[:MAX_LINE_CHARS] + " ..."
+        if severity is None:
+            severity = classify(text)
+        with self._lock:
+            line = (next(self._seq), time.time(), source, severity, text)
+            ring = self._rings.get(source)
+            if ring is None:
+                ring = self._rings[source] = deque(maxlen=self.lines_per_source)
+            ring.append(line)
+            wake = not self._pending
+            if len(self._pending) == self.max_pending:
+                self._dropped += 1
+            self._pending.append(line)
+            self.total += 1
+        if wake and self.on_pending:
+            self.on_pending()
+
+    def drain(self):
+        # (lines appended since the last drain, how many of them were dropped)
+        with self._lock:
+            lines = list(self._pending)
+            self._pending.clear()
+            dropped, self._dropped = self._dropped, 0
+        return lines, dropped
+
+    def lines(self, source=None, min_severity=DEBUG, limit=None):
+        # Retained lines in order, optionally for one source and at or above a
+        # severity; limit keeps the newest.
+        with self._lock:
+            if source is None:
+                rings = [list(r) for r in self._rings.values()]
+            else:
+                rings = [list(self._rings.get(source, ()))]
+        merged = heapq.merge(*rings) if len(rings) > 1 else (rings[0] if rings else [])
+        selected = [l for l in merged if l[3] >= min_severity]
+        return selected[-limit:] if limit else selected
+
+    def sources(self):
+        with self._lock:
+            return list(self._rings)
+
+    def clear(self, source=None):
+        with self._lock:
+            if source is None:
+                self._rings.clear()
+            else:
+                self._rings.pop(source, None)
+
+
+def matches(line, source=None, min_severity=DEBUG):
+    return (source is None or line[2] == source) and line[3] >= min_severity
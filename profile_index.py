@@ -0,0 +1,112 @@
+import bisect
+
+
+def search_key(summary):
+    return "\n".join((summary.name, summary.arch, summary.iso, summary.disk, " ".join(summary.tags))).lower()
+
+
+def query_terms(query):
+    return tuple(query.lower().split())
+
+
+def _matcher(terms):
+    # Specialised for the common one-word query: a bare `in` per profile.
+    if not terms:
+        return lambda key: True
+    if len(terms) == 1:
+        term = terms[0]
+        return lambda key: term in key
+    return lambda key: all(t in key for t in terms)
+
+
+class ProfileIndex:
+    # In-memory search index over profile summaries, in id order. A query
+    # is split into words; a profile matches when every word occurs in its
+    # name, architecture, ISO path, disk path or tags (case-insensitive).
+    #
+    # filter() keeps the ids shown for the current query. Typing further
+    # narrows only those, and put()/remove() keep them up to date, returning
+    # where the shown row appeared, changed or went so a view can update
+    # that single row.
+    def __init__(self, summaries=()):
+        self.reset(summaries)
+
+    def reset(self, summaries):
+        self._entries = {s.id: (s, search_key(s)) for s in summaries}
+        self.terms = ()
+        self.shown = sorted(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, profile_id):
+        return profile_id in self._entries
+
+    def get(self, profile_id):
+        entry = self._entries.get(profile_id)
+        return entry[0] if entry else None
+
+    def matches(self, profile_id, terms=None):
+        entry = self._entries.get(profile_id)
+        return entry is not None and _matcher(self.terms if terms is None else terms)(entry[1])
+
+    def search(self, query, within=None):
+        # Ids of the profiles matching query, in id order.
+        match = _matcher(query_terms(query))
+        if within is None:
+            return sorted(i for i, (_, key) in self._entries.items() if match(key))
+        entries = self._entries
+        return [i for i in within if match(entries[i][1])]
+
+    def tagged(self, tag):
+        # Ids of the profiles carrying tag as a whole tag (case-insensitive).
+        tag = tag.lower()
+        return sorted(i for i, (s, _) in self._entries.items() if any(t.lower() == tag for t in s.tags))
+
+    def filter(self, query):
+        # Sets the shown ids. A query that only adds to the last one (more
+        # letters or more words) searches within the rows already shown.
+        terms = query_terms(query)
+        old = self.terms
+        narrower = old and all(any(o in t for t in terms) for o in old)
+        self.shown = self.search(query, self.shown if narrower else None)
+        self.terms = terms
+        return self.shown
+
+    def row(self, profile_id):
+        # Position of profile_id among the shown ids, or -1.
+        i = bisect.bisect_left(self.shown, profile_id)
+        return i if i < len(self.shown) and self.shown[i] == profile_id else -1
+
+    def put(self, summary, before_change=None):
+        # Adds or updates one profile. Returns (change, row): change is
+        # "inserted", "changed" or "removed" for the shown rows, or None when
+        # the profile is not shown before or after. before_change(change, row)
+        # is called just before the shown ids change, as Qt models need.
+        before = self.row(summary.id)
+        self._entries[summary.id] = (summary, search_key(summary))
+        shown = self.matches(summary.id)
+        if before >= 0 and shown:
+            return "changed", before
+        if before >= 0:
+            if before_change:
+                before_change("removed", before)
+            del self.shown[before]
+            return "removed", before
+        if shown:
+            row = bisect.bisect_left(self.shown, summary.id)
+            if before_change:
+                before_change("inserted", row)
+            self.shown.insert(row, summary.id)
+            return "inserted", row
+        return None, -1
+
+    def remove(self, profile_id, before_change=None):
+        # Returns the shown row the profile had, or -1.
+        row = self.row(profile_id)
+        if row >= 0:
+            if before_change:
+                before_change("removed", row)
+            del self.shown[row]
+        self._entries.pop(profile_id, None)
+        return row
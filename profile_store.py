@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA_VERSION = 1
+PROFILE_DB_FILE = "ultimate_qemu_profiles.db"
+LEGACY_PROFILE_FILE = "ultimate_qemu_profiles.json"
+
+
+class QemuProfile:
+    __slots__ = (
+        "id", "name", "qemu_path", "arch", "iso", "disk", "disk_format", "ram", "cpus", "boot", "extra",
+        "network_mode", "network_options", "usb_devices", "ovmf_enabled", "ovmf_path",
+        "snapshots", "secondary_isos", "iso_library_dir",
+        "performance", "disk_bus", "hugepages", "fast_start", "tags",
+    )
+    FIELDS = __slots__[1:]
+
+    def __init__(self, name="Default VM"):
+        self.id = None
+        self.name = name
+        self.qemu_path = ""
+        self.arch = "x86_64"
+        self.iso = ""
+        self.disk = ""
+        self.disk_format = ""  # detected once when the disk is chosen; see qemu_command.set_disk
+        self.ram = 2048
+        self.cpus = 2
+        self.boot = "ISO (cdrom)"
+        self.extra = ""
+        self.network_mode = "user"
+        self.network_options = ""
+        self.usb_devices = []
+        self.ovmf_enabled = False
+        self.ovmf_path = ""
+        self.snapshots = []
+        self.secondary_isos = []
+        self.iso_library_dir = ""
+        self.performance = False
+        self.disk_bus = "virtio-blk"
+        self.hugepages = False
+        self.fast_start = False
+        self.tags = []
+
+    def to_dict(self):
+        d = {f: getattr(self, f) for f in self.FIELDS}
+        d["schema_version"] = SCHEMA_VERSION
+        return d
+
+    @staticmethod
+    def from_dict(d, profile_id=None):
+        d = migrate_profile_dict(d)
+        p = QemuProfile()
+        p.id = profile_id
+        for f in QemuProfile.FIELDS:
+            if f in d:
+                v = d[f]
+                setattr(p, f, list(v) if isinstance(v, list) else v)
+        return p
+
+
+def migrate_profile_dict(d):
+    # Version 0 is the old ultimate_qemu_profiles.json layout: a raw __dict__
+    # dump that may lack the later list fields. Missing keys keep the defaults.
+    version = d.get("schema_version", 0)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"profile schema {version} is newer than supported ({SCHEMA_VERSION})")
+    return d
+
+
+class ProfileSummary:
+    __slots__ = ("id", "name", "arch", "iso", "disk", "tags")
+
+    def __init__(self, profile_id, name, arch, iso="", disk="", tags=()):
+        self.id = profile_id
+        self.name = name
+        self.arch = arch
+        self.iso = iso or ""
+        self.disk = disk or ""
+        self.tags = tuple(tags or ())
+
+    @staticmethod
+    def of(profile):
+        return ProfileSummary(profile.id, profile.name, profile.arch, profile.iso, profile.disk, profile.tags)
+
+
+class ProfileStore:
+    # SQLite-backed profile storage. Every save/delete is its own transaction on a
+    # single row, so a crash can never corrupt the other profiles. The list view
+    # only reads (id, name, arch) and the searched fields, pulled out of the
+    # JSON by SQLite; full records are decoded on first access.
+    def __init__(self, db_path, legacy_json=None):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._cache = {}
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " name TEXT NOT NULL,"
+            " arch TEXT NOT NULL,"
+            " schema_version INTEGER NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Golden disk templates and the qcow2 overlays cloned from them.
+        self._conn.execute("CREATE TABLE IF NOT EXISTS templates (path TEXT PRIMARY KEY, name TEXT NOT NULL, created REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS clones ("
+            " path TEXT PRIMARY KEY,"
+            " template TEXT NOT NULL,"
+            " profile_id INTEGER,"
+            " created REAL)"
+        )
+        if legacy_json:
+            self.import_legacy_json(legacy_json)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def import_legacy_json(self, path):
+        if not os.path.exists(path):
+            return 0
+        stamp = os.path.abspath(path)
+        with self._lock:
+            if self._meta("legacy_import") == stamp:
+                return 0
+            with open(path, "r") as f:
+                dicts = json.load(f)
+            profiles = [QemuProfile.from_dict(d) for d in dicts]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for p in profiles:
+                    self._insert(p)
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('legacy_import', ?)", (stamp,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            for p in profiles:
+                self._cache[p.id] = p
+        return len(profiles)
+
+    def _insert(self, p):
+        data = json.dumps(p.to_dict(), separators=(",", ":"))
+        if p.id is None:
+            cur = self._conn.execute(
+                "INSERT INTO profiles (name, arch, schema_version, data) VALUES (?, ?, ?, ?)",
+                (p.name, p.arch, SCHEMA_VERSION, data),
+            )
+            p.id = cur.lastrowid
+        else:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO profiles (id, name, arch, schema_version, data) VALUES (?, ?, ?, ?, ?)",
+                (p.id, p.name, p.arch, SCHEMA_VERSION, data),
+            )
+
+    def summaries(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, name, arch, json_extract(data, '$.iso'), json_extract(data, '$.disk'),"
+                " json_extract(data, '$.tags') FROM profiles ORDER BY id").fetchall()
+        return [ProfileSummary(i, name, arch, iso, disk, json.loads(tags) if tags else ())
+                for i, name, arch, iso, disk, tags in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def get(self, profile_id):
+        with self._lock:
+            p = self._cache.get(profile_id)
+            if p is not None:
+                return p
+            row = self._conn.execute("SELECT data FROM profiles WHERE id=?", (profile_id,)).fetchone()
+            if row is None:
+                return None
+            p = QemuProfile.from_dict(json.loads(row[0]), profile_id)
+            self._cache[profile_id] = p
+            return p
+
+    def find(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM profiles WHERE name=? ORDER BY id LIMIT 1", (name,)).fetchone()
+        return self.get(row[0]) if row else None
+
+    def all(self):
+        return [self.get(s.id) for s in self.summaries()]
+
+    def save(self, profile):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert(profile)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._cache[profile.id] = profile
+        return profile.id
+
+    def delete(self, profile_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM profiles WHERE id=?", (profile_id,))
+            self._cache.pop(profile_id, None)
+
+    def setting(self, key, default=None):
+        # Frontend-wide settings share the meta table, under a "setting." prefix.
+        with self._lock:
+            value = self._meta("setting." + key)
+        return default if value is None else json.loads(value)
+
+    def set_setting(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", ("setting." + key, json.dumps(value)))
+
+    def templates(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT path, name, created FROM templates ORDER BY name").fetchall()
+        return [{"path": r[0], "name": r[1], "created": r[2]} for r in rows]
+
+    def add_template(self, path, name):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO templates VALUES (?, ?, ?)", (path, name, time.time()))
+
+    def remove_template(self, path):
+        with self._lock:
+            self._conn.execute("DELETE FROM templates WHERE path=?", (path,))
+            self._conn.execute("DELETE FROM clones WHERE template=?", (path,))
+
+    def clones(self, template=None):
+        with self._lock:
+            if template is None:
+                rows = self._conn.execute("SELECT path, template, profile_id, created FROM clones").fetchall()
+            else:
+                rows = self._conn.execute("SELECT path, template, profile_id, created FROM clones WHERE template=?",
+                                          (template,)).fetchall()
+        return [{"path": r[0], "template": r[1], "profile_id": r[2], "created": r[3]} for r in rows]
+
+    def save_clone(self, profile, overlay, template):
+        # The profile and its clone record are committed together.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert(profile)
+                self._conn.execute("INSERT OR REPLACE INTO clones VALUES (?, ?, ?, ?)",
+                                   (overlay, template, profile.id, time.time()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._cache[profile.id] = profile
+        return profile.id
+
+    def forget_clone(self, overlay):
+        with self._lock:
+            self._conn.execute("DELETE FROM clones WHERE path=?", (overlay,))
+
+    def export_json(self, path):
+        data = [p.to_dict() for p in self.all()]
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
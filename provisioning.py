@@ -0,0 +1,219 @@
+import os
+import sys
+import stat
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from disk_image import inspector, ImageFormatError
+from profile_store import QemuProfile
+from qemu_command import qemu_img_path, set_disk
+
+DEFAULT_WORKERS = 4
+TEMPLATE_FORMATS = ("qcow2", "raw")
+
+
+class TemplateError(Exception):
+    pass
+
+
+class TemplateInUse(TemplateError):
+    def __init__(self, template, dependents):
+        super().__init__(f"{os.path.basename(template)} still backs {len(dependents)} disk(s): "
+                         + ", ".join(dependents[:5]) + (" ..." if len(dependents) > 5 else ""))
+        self.template = template
+        self.dependents = dependents
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _safe_name(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name) or "vm"
+
+
+def set_read_only(path, read_only=True):
+    mode = os.stat(path).st_mode
+    if read_only:
+        mode &= ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    else:
+        mode |= stat.S_IWUSR
+    os.chmod(path, mode)
+
+
+def run_qemu_img(qemu_img, args):
+    kwargs = {"creationflags": 0x08000000} if sys.platform == "win32" else {}  # CREATE_NO_WINDOW
+    proc = subprocess.run([qemu_img] + args, stdin=subprocess.DEVNULL, capture_output=True, **kwargs)
+    if proc.returncode != 0:
+        raise TemplateError(proc.stderr.decode("utf-8", "replace").strip() or f"qemu-img exited with {proc.returncode}")
+
+
+def create_overlay(qemu_img, template, overlay):
+    # Instant linked clone: an empty qcow2 whose reads fall through to the template.
+    fmt = inspector.inspect(template)["format"]
+    run_qemu_img(qemu_img, ["create", "-f", "qcow2", "-b", os.path.abspath(template), "-F", fmt, overlay])
+    inspector.invalidate(overlay)
+
+
+def create_blank(qemu_img, path, fmt, size_gb):
+    run_qemu_img(qemu_img, ["create", "-f", fmt, path, f"{size_gb}G"])
+    inspector.invalidate(path)
+    return path
+
+
+class CloneResult:
+    __slots__ = ("name", "path", "profile", "ok", "error")
+
+    def __init__(self, name, path, profile=None, ok=True, error=""):
+        self.name = name
+        self.path = path
+        self.profile = profile
+        self.ok = ok
+        self.error = error
+
+    def __str__(self):
+        return f"{self.name}: {os.path.basename(self.path)} " + ("created" if self.ok else f"failed: {self.error}")
+
+
+class Provisioner:
+    # Golden templates and linked clones. A template is a read-only disk listed
+    # in the profile store; clones are qcow2 overlays backed by it, created on a
+    # bounded pool and saved as new profiles together with a clone record.
+    # Dependents are derived from backing chains on disk, so a template cannot
+    # be unmarked or deleted while any profile or recorded overlay still uses it.
+    def __init__(self, store, workers=DEFAULT_WORKERS, is_running=None):
+        self.store = store
+        self.is_running = is_running
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="provision")
+        self._names_lock = threading.Lock()
+        self._reserved = set()
+
+    def templates(self):
+        return self.store.templates()
+
+    def is_template(self, path):
+        key = _key(path)
+        return any(_key(t["path"]) == key for t in self.store.templates())
+
+    def _uses(self, disk, template_key):
+        try:
+            chain = inspector.chain(disk)
+        except ImageFormatError:
+            return False
+        return any(_key(link["filename"]) == template_key for link in chain[1:])
+
+    def dependents(self, template):
+        # Names of profiles and orphaned overlays whose backing chain reaches template.
+        key = _key(template)
+        found = []
+        seen = set()
+        for prof in self.store.all():
+            if prof.disk and self._uses(prof.disk, key):
+                found.append(prof.name)
+                seen.add(_key(prof.disk))
+        for clone in self.store.clones():
+            if _key(clone["path"]) not in seen and os.path.exists(clone["path"]) and self._uses(clone["path"], key):
+                found.append(os.path.basename(clone["path"]))
+        return found
+
+    def mark_template(self, path, name=None):
+        path = os.path.abspath(path)
+        try:
+            info = inspector.inspect(path)
+        except (OSError, ImageFormatError) as e:
+            raise TemplateError(f"cannot read {path}: {e}")
+        if info["format"] not in TEMPLATE_FORMATS:
+            raise TemplateError(f"{info['format']} images cannot be used as templates")
+        if self.is_running:
+            for prof in self.store.all():
+                if prof.disk and _key(prof.disk) == _key(path) and self.is_running(prof):
+                    raise TemplateError(f"{prof.name} is running from this disk; stop it first")
+        set_read_only(path, True)
+        self.store.add_template(path, name or os.path.splitext(os.path.basename(path))[0])
+        return path
+
+    def unmark_template(self, path):
+        deps = self.dependents(path)
+        if deps:
+            raise TemplateInUse(path, deps)
+        set_read_only(path, False)
+        self.store.remove_template(os.path.abspath(path))
+
+    def delete_template(self, path):
+        deps = self.dependents(path)
+        if deps:
+            raise TemplateInUse(path, deps)
+        set_read_only(path, False)
+        os.remove(path)
+        inspector.invalidate(path)
+        self.store.remove_template(os.path.abspath(path))
+
+    def _reserve_names(self, prefix, count, dest_dir):
+        # Picks prefix-1..N, skipping names or overlay files already taken.
+        names = []
+        with self._names_lock:
+            n = 1
+            while len(names) < count:
+                name = f"{prefix}-{n}"
+                path = os.path.join(dest_dir, _safe_name(name) + ".qcow2")
+                if (name not in self._reserved and path not in self._reserved
+                        and self.store.find(name) is None and not os.path.exists(path)):
+                    self._reserved.update((name, path))
+                    names.append((name, path))
+                n += 1
+        return names
+
+    def _clone_job(self, qemu_img, template, source, name, path, progress):
+        try:
+            if qemu_img is None:
+                raise TemplateError("qemu-img not found next to the QEMU executable or on PATH")
+            create_overlay(qemu_img, template, path)
+            prof = QemuProfile.from_dict(source.to_dict())
+            prof.name = name
+            set_disk(prof, path, "qcow2")
+            prof.snapshots = []
+            self.store.save_clone(prof, path, os.path.abspath(template))
+            result = CloneResult(name, path, prof)
+        except (TemplateError, OSError, ImageFormatError) as e:
+            result = CloneResult(name, path, ok=False, error=str(e))
+        finally:
+            with self._names_lock:
+                self._reserved.difference_update((name, path))
+        if progress:
+            progress(result)
+        return result
+
+    def clone(self, template, source, count, prefix=None, dest_dir=None, progress=None):
+        # Returns one future per clone; progress(result) is called from the pool.
+        if not self.is_template(template):
+            raise TemplateError(f"{template} is not a template")
+        qemu_img = qemu_img_path(source.qemu_path)
+        dest_dir = dest_dir or os.path.dirname(os.path.abspath(template))
+        names = self._reserve_names(prefix or source.name, count, dest_dir)
+        return [self._pool.submit(self._clone_job, qemu_img, template, source, name, path, progress)
+                for name, path in names]
+
+    def rebase_profile(self, template, prof):
+        # Moves a profile that used the template directly onto its own overlay,
+        # so the source VM keeps working after its disk is frozen.
+        qemu_img = qemu_img_path(prof.qemu_path)
+        if qemu_img is None:
+            raise TemplateError("qemu-img not found next to the QEMU executable or on PATH")
+        base, _ = os.path.splitext(os.path.abspath(template))
+        path = f"{base}-{_safe_name(prof.name)}.qcow2"
+        n = 1
+        while os.path.exists(path):
+            n += 1
+            path = f"{base}-{_safe_name(prof.name)}-{n}.qcow2"
+        create_overlay(qemu_img, template, path)
+        set_disk(prof, path, "qcow2")
+        prof.snapshots = []
+        self.store.save_clone(prof, path, os.path.abspath(template))
+        return path
+
+    def submit(self, fn, *args):
+        return self._pool.submit(fn, *args)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
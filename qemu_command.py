@@ -0,0 +1,247 @@
+import os
+import shlex
+import shutil
+
+from disk_image import inspector
+from host_caps import host_caps
+from usb_inventory import usb_host_args, has_usb_controller, USB_CONTROLLER_ARGS
+
+CDROM_DRIVE_ID = "cd0"
+DISK_BUSES = ("virtio-blk", "virtio-scsi")
+USER_NETWORK_MODES = ("user", "user (NAT)")
+# Architectures whose default machine has an IDE bus for an empty, hot-swappable CD-ROM.
+IDE_CDROM_ARCHES = ("x86_64", "i386")
+
+
+class QemuCommandError(Exception):
+    pass
+
+
+def check_profile(prof):
+    if not prof.qemu_path or not os.path.exists(prof.qemu_path):
+        raise QemuCommandError("Set the correct QEMU executable.")
+
+
+def qemu_img_path(qemu_path):
+    # qemu-img ships next to the emulators; fall back to PATH.
+    if qemu_path:
+        folder = os.path.dirname(qemu_path)
+        exe = ".exe" if qemu_path.lower().endswith(".exe") else ""
+        candidate = os.path.join(folder, "qemu-img" + exe)
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which("qemu-img")
+
+
+def drive_path(path):
+    # QEMU option values use "," as separator; literal commas are doubled.
+    return path.replace(",", ",,")
+
+
+def cdrom_args(prof):
+    # Same as -cdrom (index=2, media=cdrom) but with a drive id QMP can address.
+    # On IDE machines an empty drive is created so an ISO can be inserted later.
+    if prof.iso:
+        return ["-drive", f"id={CDROM_DRIVE_ID},index=2,media=cdrom,file={drive_path(prof.iso)}"]
+    if prof.arch in IDE_CDROM_ARCHES:
+        return ["-drive", f"id={CDROM_DRIVE_ID},index=2,media=cdrom"]
+    return []
+
+
+def set_disk(prof, path, fmt=None):
+    # The format is read from the image header once, when the disk is chosen or
+    # created, and kept in the profile. Probing at every launch would let a guest
+    # that owns a raw disk write a qcow2 header with a backing file into it and
+    # read any host file on its next boot. A path that does not exist yet is
+    # probed at first launch instead.
+    if fmt is None and path == prof.disk and prof.disk_format:
+        return
+    prof.disk = path
+    prof.disk_format = fmt or (inspector.format_of(path, "") if path else "")
+
+
+def pin_disk_format(prof):
+    # Profiles saved before formats were kept are probed once; True if the
+    # profile changed and should be saved.
+    if prof.disk and not prof.disk_format:
+        prof.disk_format = inspector.format_of(prof.disk)
+        return True
+    return False
+
+
+def disk_format(prof):
+    # Launchers pin the format first; only a dry run of an old profile probes.
+    return prof.disk_format or inspector.format_of(prof.disk)
+
+
+def disk_args(prof):
+    return ["-drive", f"file={drive_path(prof.disk)},format={disk_format(prof)}"]
+
+
+# ===== Performance mode =====
+def use_hugepages(prof, caps):
+    return prof.hugepages and bool(caps.hugepage_path) and caps.hugepages_free_mb >= prof.ram
+
+
+def drive_tuning(caps):
+    # cache=none opens the image with O_DIRECT (or the platform equivalent), which
+    # native AIO needs and which avoids double caching in host and guest.
+    opts = ["cache=none", "discard=unmap"]
+    if caps.io_uring:
+        opts.append("aio=io_uring")
+    elif caps.aio_native:
+        opts.append("aio=native")
+    return ",".join(opts)
+
+
+def performance_disk_args(prof, caps):
+    # Disk on virtio with its own I/O thread, so disk emulation leaves the main loop.
+    drive = f"file={drive_path(prof.disk)},if=none,id=disk0,format={disk_format(prof)},{drive_tuning(caps)}"
+    boot = "" if prof.boot == "ISO (cdrom)" else ",bootindex=0"
+    args = ["-object", "iothread,id=io0", "-drive", drive]
+    if prof.disk_bus == "virtio-scsi":
+        return args + ["-device", "virtio-scsi-pci,id=scsi0,iothread=io0",
+                       "-device", f"scsi-hd,drive=disk0,bus=scsi0.0{boot}"]
+    return args + ["-device", f"virtio-blk-pci,drive=disk0,iothread=io0{boot}"]
+
+
+def performance_args(prof, caps):
+    accel = caps.accel_for(prof.arch)
+    cmd = ["-accel", "tcg,thread=multi" if accel == "tcg" else accel]
+    if accel in ("kvm", "hvf"):
+        cmd += ["-cpu", "host"]
+    elif accel == "tcg":
+        cmd += ["-cpu", "max"]
+    cmd += ["-m", str(prof.ram)]
+    if use_hugepages(prof, caps):
+        cmd += ["-object", f"memory-backend-file,id=mem0,size={prof.ram}M,mem-path={caps.hugepage_path},prealloc=on",
+                "-machine", "memory-backend=mem0"]
+    cmd += ["-smp", f"cpus={prof.cpus},sockets=1,cores={prof.cpus},threads=1"]
+    if prof.boot == "ISO (cdrom)":
+        cmd += ["-boot", "order=d"]
+    cmd += cdrom_args(prof)
+    if prof.disk:
+        cmd += performance_disk_args(prof, caps)
+    return cmd
+
+
+def performance_network_args(prof):
+    if prof.network_mode in USER_NETWORK_MODES:
+        return ["-netdev", "user,id=net0", "-device", "virtio-net-pci,netdev=net0"]
+    if prof.network_mode == "bridged (TAP)":
+        return ["-netdev", "tap,id=net0", "-device", "virtio-net-pci,netdev=net0"]
+    if prof.network_mode == "custom" and prof.network_options:
+        return prof.network_options.split()
+    return []
+
+
+def performance_notes(prof, caps):
+    # Human-readable reasons for each choice, shown next to the dry-run command.
+    if not prof.performance:
+        return ["Performance mode is off: default QEMU devices, TCG unless -accel is in the extra options."]
+    accel = caps.accel_for(prof.arch)
+    notes = [f"Host: {caps.platform} {caps.arch}, accelerators available: {', '.join(caps.accels)}"]
+    if accel == "tcg":
+        why = "no hardware accelerator" if caps.accels == ("tcg",) else f"{prof.arch} guest on {caps.arch} host"
+        notes.append(f"Accelerator: TCG (software emulation, multi-threaded) - {why}")
+    else:
+        notes.append(f"Accelerator: {accel.upper()}" + (", CPU model host" if accel in ("kvm", "hvf") else ""))
+    if prof.disk:
+        notes.append(f"Disk: {prof.disk_bus} with an I/O thread, {drive_tuning(caps)}")
+    if prof.hugepages:
+        if use_hugepages(prof, caps):
+            notes.append(f"Memory: {prof.ram} MB from hugepages at {caps.hugepage_path}")
+        elif not caps.hugepage_path:
+            notes.append("Memory: hugepages requested but no hugetlbfs mount found; using normal pages")
+        else:
+            notes.append(f"Memory: hugepages requested but only {caps.hugepages_free_mb} MB free; using normal pages")
+    if prof.network_mode != "custom":
+        notes.append("Network: virtio-net")
+    return notes
+
+
+def build_command(prof, usb_devices=None, qmp=None, caps=None):
+    # Pure function of the profile (and host capabilities in performance mode);
+    # the GUI and CLI both launch exactly this list.
+    if usb_devices is None:
+        usb_devices = prof.usb_devices
+    cmd = [prof.qemu_path]
+    if prof.performance:
+        cmd += performance_args(prof, caps or host_caps(prof.qemu_path))
+    else:
+        cmd += ["-m", str(prof.ram)]
+        cmd += ["-smp", str(prof.cpus)]
+        if prof.boot == "ISO (cdrom)":
+            cmd += cdrom_args(prof)
+            if prof.disk:
+                cmd += disk_args(prof)
+        else:
+            if prof.disk:
+                cmd += disk_args(prof)
+            cmd += cdrom_args(prof)
+    if prof.ovmf_enabled and prof.ovmf_path:
+        cmd += ["-drive", f"if=pflash,format=raw,readonly=on,file={drive_path(prof.ovmf_path)}"]
+    if qmp:
+        cmd += ["-qmp", f"{qmp},server=on,wait=off"]
+    if prof.extra:
+        cmd += prof.extra.split()
+    # USB
+    usb = []
+    for spec in usb_devices:
+        try:
+            usb += usb_host_args(spec)
+        except ValueError:
+            pass  # not a device spec (hand-edited profile); QEMU would refuse to start
+    if usb and not has_usb_controller(cmd):
+        cmd += USB_CONTROLLER_ARGS
+    cmd += usb
+    # Networking
+    if prof.performance:
+        cmd += performance_network_args(prof)
+    elif prof.network_mode == "user (NAT)":
+        cmd += ["-net", "nic", "-net", "user"]
+    elif prof.network_mode == "bridged (TAP)":
+        cmd += ["-net", "nic", "-net", "tap"]
+    elif prof.network_mode == "custom" and prof.network_options:
+        cmd += prof.network_options.split()
+    return cmd
+
+
+_SIZE_SUFFIXES = {"k": 1 / 1024, "m": 1, "g": 1024, "t": 1024 * 1024}
+
+
+def _parse_ram_mb(value):
+    value = value.split(",")[0]
+    if value.startswith("size="):
+        value = value[5:]
+    unit = value[-1:].lower()
+    if unit in _SIZE_SUFFIXES:
+        return int(float(value[:-1]) * _SIZE_SUFFIXES[unit])
+    return int(float(value))
+
+
+def _parse_smp(value):
+    for field in value.split(","):
+        if field.isdigit():
+            return int(field)
+        if field.startswith("cpus="):
+            return int(field[5:])
+    return 1
+
+
+def command_resources(cmd):
+    # (vCPUs, RAM in MB) a command line asks for; later options win, as in QEMU.
+    vcpus, ram_mb = 1, 128
+    for opt, val in zip(cmd, cmd[1:]):
+        try:
+            if opt == "-smp":
+                vcpus = _parse_smp(val)
+            elif opt == "-m":
+                ram_mb = _parse_ram_mb(val)
+        except ValueError:
+            pass
+    return vcpus, ram_mb
+
+
+def format_command(cmd):
+    return " ".join(shlex.quote(c) for c in cmd)
@@ -0,0 +1,786 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from profile_store import ProfileStore, PROFILE_DB_FILE, LEGACY_PROFILE_FILE
+from profile_index import ProfileIndex
+from vm_registry import RunRegistry, LOG_DIR, terminate_pid, pid_alive, vm_log_path, registry_path, db_namespace
+
+# Headless entry point. Imports only the standard library and the profile
+# store up front so it starts without PyQt5, requests or pyusb, and without
+# asyncio: each subcommand imports the modules it uses (supervisor, agent,
+# qemu-img engines), and the parser spells out their defaults.
+
+START_REPORT_TIMEOUT = 5.0  # start waits this long for VMs to report their pid
+
+
+def open_store(args):
+    return ProfileStore(args.db, legacy_json=LEGACY_PROFILE_FILE if args.db == PROFILE_DB_FILE else None)
+
+
+def resolve_profiles(store, names):
+    profiles = []
+    for name in names:
+        prof = store.get(int(name)) if name.isdigit() else None
+        prof = prof or store.find(name)
+        if prof is None:
+            raise SystemExit(f"qemu-frontend: no profile named {name!r}")
+        profiles.append(prof)
+    return profiles
+
+
+def select_profiles(store, args):
+    # Every profile with --all; else the named ones, then those carrying a
+    # --tag or matching --search, each once.
+    if args.all:
+        return store.all()
+    profiles = resolve_profiles(store, args.profiles)
+    if args.tag or args.search:
+        index = ProfileIndex(store.summaries())
+        ids = [i for tag in args.tag for i in index.tagged(tag)]
+        if args.search:
+            ids += index.search(args.search)
+        profiles += [store.get(i) for i in ids]
+    seen = set()
+    return [p for p in profiles if not (p.id in seen or seen.add(p.id))]
+
+
+def pin_format(store, prof):
+    from qemu_command import pin_disk_format
+    # Old profiles get their disk format detected once, before the first launch.
+    if pin_disk_format(prof):
+        store.save(prof)
+
+
+def launch_detached(cmd, log_path):
+    import subprocess
+    kwargs = {}
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS
+    else:
+        kwargs["start_new_session"] = True
+    with open(log_path, "ab") as log:
+        return subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, **kwargs)
+
+
+def agent_address(args):
+    # Each profile database has its own agent, since VMs are keyed by profile id.
+    from vm_agent import AgentUnavailable, agent_endpoint
+    try:
+        return args.agent or agent_endpoint(db_namespace(args.db))
+    except PermissionError as e:
+        raise AgentUnavailable(str(e))
+
+
+def qmp_endpoint(args, prof):
+    from qmp_client import allocate_qmp_endpoint
+    return allocate_qmp_endpoint(prof.id, db_namespace(args.db))
+
+
+def connect_agent(args, name, spawn=True, **callbacks):
+    # Client of the VM agent, which keeps the VMs running after we exit.
+    from vm_agent import RemoteSupervisor
+    return RemoteSupervisor(agent_address(args), name, log_dir=LOG_DIR, registry=args.registry, spawn=spawn, **callbacks).start()
+
+
+def running_agent(args):
+    # The agent if one is up (never started for a read-only command), else None.
+    from vm_agent import AgentUnavailable
+    if args.no_agent:
+        return None
+    try:
+        return connect_agent(args, "cli", spawn=False)
+    except AgentUnavailable:
+        return None
+
+
+def make_supervisor(args, store, registry, name, **callbacks):
+    # The agent's supervisor, or with --no-agent one in this process whose VMs
+    # end with it. Either way admission uses the overcommit ratios of this
+    # command line or the GUI.
+    from vm_supervisor import VmSupervisor
+    from vm_agent import AgentError
+    from cpu_scheduler import DEFAULT_CPU_OVERCOMMIT, DEFAULT_RAM_OVERCOMMIT
+    if args.no_agent:
+        return VmSupervisor(registry=registry, scheduler=make_scheduler(args, store, registry), **callbacks).start()
+    try:
+        sup = connect_agent(args, name, **callbacks)
+    except AgentError as e:
+        raise SystemExit(f"qemu-frontend: {e}; --no-agent runs VMs without it")
+    sup.set_overcommit(args.cpu_overcommit or store.setting("cpu_overcommit", DEFAULT_CPU_OVERCOMMIT),
+                       args.ram_overcommit or store.setting("ram_overcommit", DEFAULT_RAM_OVERCOMMIT))
+    return sup
+
+
+def cmd_list(args):
+    store = open_store(args)
+    running = RunRegistry(args.registry).running()
+    # The agent's VMs are in the registry while they run; with none there,
+    # listing skips asking it (and importing the client) for stopped states.
+    agent = running_agent(args) if running else None
+    vms = {}
+    if agent:
+        from vm_supervisor import ACTIVE_STATES, CRASHED
+        vms = dict(agent.vms)
+        agent.shutdown(stop_vms=False)
+    summaries = store.summaries()
+    if args.search:
+        index = ProfileIndex(summaries)
+        summaries = [index.get(i) for i in index.search(args.search)]
+    for s in summaries:
+        vm = vms.get(s.id)
+        if vm is not None and (vm.state in ACTIVE_STATES or vm.state == CRASHED):
+            state = f"{vm.state} (pid {vm.pid})" if vm.state in ACTIVE_STATES and vm.pid else vm.state
+        elif str(s.id) in running:
+            state = f"running (pid {running[str(s.id)]['pid']})"
+        else:
+            state = "stopped"
+        print(f"{s.id:>5}  {s.name:<32} {s.arch:<10} {state}")
+    return 0
+
+
+def cmd_inspect(args):
+    from qemu_command import build_command, performance_notes
+    from host_caps import host_caps
+    from disk_image import inspector, ImageFormatError
+    store = open_store(args)
+    running = RunRegistry(args.registry).running()
+    for prof in resolve_profiles(store, args.profiles):
+        info = prof.to_dict()
+        info["id"] = prof.id
+        info["command"] = build_command(prof)
+        info["performance_notes"] = performance_notes(prof, host_caps(prof.qemu_path))
+        if prof.disk:
+            try:
+                info["disk_chain"] = inspector.chain(prof.disk)
+            except ImageFormatError as e:
+                info["disk_chain"] = [{"filename": prof.disk, "error": str(e)}]
+        info["running"] = running.get(str(prof.id))
+        print(json.dumps(info, indent=2))
+    return 0
+
+
+def make_scheduler(args, store, registry):
+    # Same overcommit settings as the GUI unless given on the command line.
+    from cpu_scheduler import CpuScheduler, read_topology, DEFAULT_CPU_OVERCOMMIT, DEFAULT_RAM_OVERCOMMIT
+    if args.force:
+        return None
+    return CpuScheduler(read_topology(),
+                        args.cpu_overcommit or store.setting("cpu_overcommit", DEFAULT_CPU_OVERCOMMIT),
+                        args.ram_overcommit or store.setting("ram_overcommit", DEFAULT_RAM_OVERCOMMIT),
+                        external=registry.running)
+
+
+def cmd_start(args):
+    # Through the agent, which supervises the VMs from then on; --no-agent
+    # starts plain detached processes instead.
+    from qemu_command import build_command, check_profile, QemuCommandError
+    from vm_supervisor import ACTIVE_STATES, STARTING
+    from cpu_scheduler import AdmissionError
+    from vm_agent import AgentError
+    if args.no_agent or args.dry_run:
+        return start_detached(args)
+    store = open_store(args)
+    running = RunRegistry(args.registry).running()
+    sup = make_supervisor(args, store, None, "cli-start")
+    failures = 0
+    started = []
+    try:
+        for prof in resolve_profiles(store, args.profiles):
+            vm = sup.vms.get(prof.id)
+            if vm is not None and vm.state in ACTIVE_STATES or str(prof.id) in running:
+                pid = vm.pid if vm is not None and vm.state in ACTIVE_STATES else running[str(prof.id)]["pid"]
+                print(f"{prof.name}: already running (pid {pid})")
+                continue
+            pin_format(store, prof)
+            qmp = qmp_endpoint(args, prof)
+            cmd = build_command(prof, qmp=qmp)
+            try:
+                check_profile(prof)
+                started.append(sup.launch(prof.id, prof.name, cmd, admit=not args.force, qmp=qmp))
+            except (QemuCommandError, AdmissionError, AgentError) as e:
+                print(f"{prof.name}: could not start: {e}", file=sys.stderr)
+                failures += 1
+        deadline = time.monotonic() + START_REPORT_TIMEOUT
+        while any(vm.state == STARTING for vm in started) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        for vm in started:
+            if vm.state in ACTIVE_STATES:
+                print(f"{vm.name}: {vm.state}" + (f" (pid {vm.pid})" if vm.pid else "") +
+                      (f", {vm.placement}" if vm.placement else ""))
+            else:
+                print(f"{vm.name}: could not start: {vm.error or f'exit code {vm.exit_code}'}", file=sys.stderr)
+                failures += 1
+    finally:
+        sup.shutdown(stop_vms=False)
+    return 1 if failures else 0
+
+
+def start_detached(args):
+    from qemu_command import build_command, check_profile, format_command, command_resources, QemuCommandError
+    from cpu_scheduler import AdmissionError, set_process_affinity
+    store = open_store(args)
+    registry = RunRegistry(args.registry)
+    running = registry.running()
+    scheduler = None if args.dry_run else make_scheduler(args, store, registry)
+    failures = 0
+    for prof in resolve_profiles(store, args.profiles):
+        if args.dry_run:
+            print(format_command(build_command(prof)))
+            continue
+        if str(prof.id) in running:
+            print(f"{prof.name}: already running (pid {running[str(prof.id)]['pid']})")
+            continue
+        pin_format(store, prof)
+        qmp = qmp_endpoint(args, prof)
+        cmd = build_command(prof, qmp=qmp)
+        placement = None
+        try:
+            check_profile(prof)
+            if scheduler is not None:
+                placement = scheduler.admit(prof.id, *command_resources(cmd))
+            proc = launch_detached(cmd, vm_log_path(prof.name))
+        except (QemuCommandError, AdmissionError, OSError) as e:
+            print(f"{prof.name}: could not start: {e}", file=sys.stderr)
+            if scheduler is not None:
+                scheduler.release(prof.id)
+            failures += 1
+            continue
+        if placement is not None:
+            # Detached VMs have no supervisor to pin each vCPU thread; the
+            # whole process is confined to its CPUs, which its threads inherit.
+            try:
+                set_process_affinity(proc.pid, set(placement.cpus))
+            except OSError:
+                pass
+        registry.add(prof.id, prof.name, proc.pid, cmd, qmp=qmp, cpus=placement.cpus if placement else None)
+        print(f"{prof.name}: started (pid {proc.pid})" + (f", {placement}" if placement else ""))
+    return 1 if failures else 0
+
+
+def cmd_run(args):
+    # Foreground supervision: drains output to vm_logs/, applies the restart
+    # policy and reports every state change until all VMs have ended.
+    from qemu_command import build_command, check_profile, QemuCommandError
+    from vm_supervisor import CRASHED
+    from cpu_scheduler import AdmissionError
+    from vm_agent import AgentError
+    from telemetry import TelemetryCollector, DEFAULT_INTERVAL
+    store = open_store(args)
+    profiles = resolve_profiles(store, args.profiles)
+    def on_state(info):
+        extra = f" (exit code {info['exit_code']})" if info["exit_code"] is not None else ""
+        if info["error"]:
+            extra += f" - {info['error']}"
+        print(f"{info['name']}: {info['state']}{extra}", flush=True)
+        fast_start.ended(info)
+    def on_event(vm_id, name, data):
+        if name == "VCPUS_PINNED":
+            print(f"{sup.vms[vm_id].name}: {data['vcpus']} vCPU thread(s) pinned to CPUs {data['cpus']}", flush=True)
+    registry = RunRegistry(args.registry)
+    sup = make_supervisor(args, store, registry, "cli-run", on_state=on_state, on_event=on_event)
+    fast_start = FastStart(sup, args.boot_cache)
+    launched = []
+    telemetry = TelemetryCollector(sup, args.telemetry_interval or DEFAULT_INTERVAL).start() if args.telemetry else None
+    try:
+        for prof in profiles:
+            try:
+                check_profile(prof)
+            except QemuCommandError as e:
+                print(f"{prof.name}: could not start: {e}", file=sys.stderr)
+                continue
+            pin_format(store, prof)
+            qmp = qmp_endpoint(args, prof)
+            cmd = build_command(prof, qmp=qmp)
+            saved = fast_start.cache.lookup(prof, cmd) if args.fast_start or prof.fast_start else None
+            try:
+                sup.launch(prof.id, prof.name, cmd + fast_start.cache.restore_args(saved) if saved else cmd,
+                           queue=args.queue, admit=not args.force, restart_policy=args.restart,
+                           max_restarts=args.max_restarts, backoff=args.backoff, qmp=qmp)
+            except (AdmissionError, AgentError) as e:
+                print(f"{prof.name}: could not start: {e}", file=sys.stderr)
+                continue
+            launched.append(prof.id)
+            if args.fast_start or prof.fast_start:
+                fast_start.launched(prof, cmd, saved)
+        sup.wait_all(vm_ids=launched)
+    except KeyboardInterrupt:
+        print("Stopping...", flush=True)
+    finally:
+        if telemetry is not None:
+            telemetry.stop()
+        sup.shutdown(timeout=args.stop_timeout)
+        if telemetry is not None:
+            try:
+                print(f"{telemetry.export_csv(args.telemetry)} telemetry samples written to {args.telemetry}")
+            except OSError as e:
+                print(f"could not write {args.telemetry}: {e}", file=sys.stderr)
+    return 1 if any(sup.state(vm_id) == CRASHED for vm_id in launched) or len(launched) < len(profiles) else 0
+
+
+class FastStart:
+    # Boot cache bookkeeping for `run`: resumed VMs are watched for disk
+    # writes, which void their saved state, cold ones have their state saved
+    # once the guest settles.
+    def __init__(self, sup, root):
+        from boot_cache import BootCache
+        from vm_supervisor import ACTIVE_STATES
+        self.sup = sup
+        self.cache = BootCache(root, is_running=lambda profile_id: sup.state(profile_id) in ACTIVE_STATES)
+        self.runs = {}
+
+    def launched(self, prof, cmd, saved):
+        from boot_cache import fast_start_backend
+        from disk_image import human_size
+        from qemu_command import qemu_img_path
+        self.runs[prof.id] = (self.cache.key(prof, cmd), saved is not None, prof)
+        if saved:
+            print(f"{prof.name}: resuming the state saved {time.strftime('%Y-%m-%d %H:%M', time.localtime(saved['created']))}", flush=True)
+            self.sup.call(self.cache.track_resumed(self.sup, prof.id, saved["key"], prof), wait=False)
+            return
+        backend, why_not = fast_start_backend(prof, cmd)
+        if backend is None:
+            print(f"{prof.name}: fast start is not available: {why_not}", flush=True)
+            return
+        def saved_state(fut):
+            try:
+                entry = fut.result()
+            except Exception as e:
+                print(f"{prof.name}: could not save its state: {e}", file=sys.stderr, flush=True)
+                return
+            if entry is not None:
+                print(f"{prof.name}: state saved for fast starts ({human_size(entry['size'])}, {entry['seconds']:.1f}s)", flush=True)
+        fut = self.sup.call(self.cache.capture_when_ready(self.sup, prof.id, prof, cmd, qemu_img_path(prof.qemu_path)), wait=False)
+        fut.add_done_callback(saved_state)
+
+    def ended(self, info):
+        from boot_cache import RESUME_GRACE
+        from vm_supervisor import EXITED, CRASHED
+        if info["state"] not in (EXITED, CRASHED) or info["id"] not in self.runs:
+            return
+        key, resumed, prof = self.runs.pop(info["id"])
+        if info["state"] == CRASHED and resumed and info["ended_at"] - info["started_at"] < RESUME_GRACE:
+            self.cache.discard(key)
+            print(f"{prof.name}: could not resume from the saved state; it was discarded", flush=True)
+        elif key in self.cache.entries and not self.cache.settle(key, prof):
+            print(f"{prof.name}: wrote to its disks, so the saved state was discarded; the next start saves it again",
+                  flush=True)
+
+
+def cmd_boot_cache(args):
+    from boot_cache import BootCache
+    from disk_image import human_size
+    store = open_store(args)
+    cache = BootCache(args.boot_cache)
+    if args.action == "clear":
+        ids = [p.id for p in resolve_profiles(store, args.profiles)] if args.profiles else \
+            sorted({e["profile_id"] for e in cache.entries.values()})
+        for profile_id in ids:
+            cache.forget_profile(profile_id)
+        print(f"cleared saved states of {len(ids)} profile(s)")
+        return 0
+    for key, e in sorted(cache.entries.items(), key=lambda ke: -ke[1]["last_used"]):
+        print(f"{e['name']:<24} {e['backend']:<7} {human_size(e['size']):>10}  {e.get('hits', 0):>4} fast start(s)  "
+              f"saved {time.strftime('%Y-%m-%d %H:%M', time.localtime(e['created']))}")
+    print(f"total {human_size(cache.total_bytes())} of {human_size(cache.max_bytes)}")
+    return 0
+
+
+def cmd_stop(args):
+    # VMs of the agent are stopped by it, all at once; others (started with
+    # --no-agent) are sent SIGTERM.
+    store = open_store(args)
+    registry = RunRegistry(args.registry)
+    running = registry.running()
+    agent = running_agent(args)
+    try:
+        active = {vm.vm_id: vm for vm in agent.active()} if agent else {}
+        if args.all:
+            ids = sorted(set(active) | {int(k) for k in running})
+        else:
+            ids = [p.id for p in resolve_profiles(store, args.profiles)]
+        stopping = [active[i] for i in ids if i in active]
+        for vm in stopping:
+            agent.stop(vm.vm_id, timeout=args.stop_timeout, wait=False)
+        for vm_id in ids:
+            entry = running.get(str(vm_id))
+            if vm_id in active or not entry:
+                continue
+            terminate_pid(entry["pid"])
+            registry.remove(vm_id)
+            print(f"{entry['name']}: stopped (pid {entry['pid']})")
+        if stopping:
+            agent.wait_all(poll=0.05, vm_ids={vm.vm_id for vm in stopping})
+        for vm in stopping:
+            print(f"{vm.name}: {vm.state} (pid {vm.pid}" + (f", exit code {vm.exit_code})" if vm.exit_code is not None else ")"))
+    finally:
+        if agent:
+            agent.shutdown(stop_vms=False)
+    return 0
+
+
+def cmd_fleet(args):
+    # Many VMs at once through the agent. Starts are staggered, each boot slot
+    # freed once its VM runs; stops press every guest's power button at once
+    # and escalate to QMP quit and a kill per VM. Prints how each one ended.
+    from qemu_command import build_command, check_profile, QemuCommandError
+    from vm_supervisor import STOP_TERMINATE
+    from fleet import (start_fleet, stop_fleet, restart_fleet, tally, FleetResult, START, STOP, FAILED, ALREADY_RUNNING,
+                       STOP_OUTCOMES, FLEET_CONCURRENCY, FLEET_STAGGER, GATE_TIMEOUT, POWERDOWN_TIMEOUT, QUIT_TIMEOUT)
+    for name, default in (("concurrency", FLEET_CONCURRENCY), ("stagger", FLEET_STAGGER), ("gate_timeout", GATE_TIMEOUT),
+                          ("powerdown_timeout", POWERDOWN_TIMEOUT), ("quit_timeout", QUIT_TIMEOUT)):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    if args.action != "stop" and args.no_agent:
+        raise SystemExit(f"qemu-frontend fleet {args.action}: needs the VM agent; "
+                         f"VMs run from this command would end with it")
+    store = open_store(args)
+    registry = RunRegistry(args.registry)
+    running = registry.running()
+    profiles = select_profiles(store, args)
+    sup = running_agent(args) if args.action == "stop" else make_supervisor(args, store, None, "cli-fleet")
+    results = []
+    def report(result):
+        results.append(result)
+        print(result, flush=True)
+    t0 = time.monotonic()
+    try:
+        active = {vm.vm_id for vm in sup.active()} if sup else set()
+        for prof in profiles:
+            entry = running.get(str(prof.id))
+            if prof.id in active or not entry:
+                continue
+            # Started with --no-agent: there is no QMP session to power it down.
+            if args.action == "start":
+                report(FleetResult(prof.id, prof.name, START, ALREADY_RUNNING))
+                continue
+            t = time.monotonic()
+            terminate_pid(entry["pid"])
+            registry.remove(prof.id)
+            if args.action == "restart":
+                # Its disks stay locked until it is gone.
+                while pid_alive(entry["pid"]) and time.monotonic() - t < args.quit_timeout:
+                    time.sleep(0.05)
+            report(FleetResult(prof.id, prof.name, STOP, STOP_OUTCOMES[STOP_TERMINATE], time.monotonic() - t))
+        if args.action == "stop":
+            if active:
+                sup.call(stop_fleet(sup, [p.id for p in profiles if p.id in active],
+                                    args.powerdown_timeout, args.quit_timeout, report))
+        else:
+            launches = []
+            for prof in profiles:
+                if str(prof.id) in running and prof.id not in active and args.action == "start":
+                    continue
+                try:
+                    check_profile(prof)
+                except QemuCommandError as e:
+                    report(FleetResult(prof.id, prof.name, START, FAILED, error=str(e)))
+                    continue
+                pin_format(store, prof)
+                qmp = qmp_endpoint(args, prof)
+                launches.append((prof.id, prof.name, build_command(prof, qmp=qmp),
+                                 {"queue": True, "admit": not args.force, "qmp": qmp}))
+            if args.action == "start":
+                sup.call(start_fleet(sup, launches, args.concurrency, args.stagger, args.gate_timeout, report))
+            else:
+                sup.call(restart_fleet(sup, launches, args.concurrency, args.stagger, args.gate_timeout,
+                                       args.powerdown_timeout, args.quit_timeout, report))
+    finally:
+        if sup:
+            sup.shutdown(stop_vms=False)
+    if not results:
+        print(f"fleet {args.action}: none of the {len(profiles)} selected profile(s) needed it")
+        return 0
+    print(f"fleet {args.action}: {tally(results)} in {time.monotonic() - t0:.1f}s")
+    return 1 if any(not r.ok for r in results) else 0
+
+
+def cmd_agent(args):
+    from vm_agent import VmAgent, AgentError, IDLE_EXIT
+    if args.action == "serve":
+        try:
+            VmAgent(agent_address(args), LOG_DIR, args.registry,
+                    IDLE_EXIT if args.idle_exit is None else args.idle_exit).serve()
+        except AgentError as e:
+            raise SystemExit(f"qemu-frontend: {e}")
+        return 0
+    agent = running_agent(args)
+    if agent is None:
+        print("no VM agent is running")
+        return 1
+    try:
+        if args.action == "stop":
+            try:
+                stopped = agent.stop_agent(stop_vms=args.stop_vms)
+            except AgentError as e:
+                print(f"qemu-frontend: the agent did not stop: {e} (use --stop-vms)", file=sys.stderr)
+                return 1
+            print(f"VM agent (pid {agent.agent_info['pid']}) stopping" + (f" with {stopped} VM(s)" if stopped else ""))
+            return 0
+        status = agent.status()
+        print(f"VM agent pid {status['pid']} on {status['endpoint']}, up {status['uptime']:.0f}s")
+        print(f"  VMs: {status['active']} running of {status['vms']} known; logs in {status['log_dir']}")
+        print(f"  clients: {', '.join(status['clients'])}")
+        print(f"  requests: {status['stats'].get('requests', 0)}, pushes: {status['stats'].get('pushed', 0)}, "
+              f"output lines dropped for slow clients: {status['stats'].get('dropped', 0)}")
+        return 0
+    finally:
+        agent.shutdown(stop_vms=False)
+
+
+def cmd_snapshot(args):
+    # Offline snapshots of stopped VMs via qemu-img; running VMs are refused.
+    from snapshot_engine import SnapshotEngine, sync_profile_snapshots, profile_disks, CREATE, APPLY, DELETE
+    from disk_image import snapshot_summary
+    store = open_store(args)
+    running = RunRegistry(args.registry).running()
+    if args.all_stopped:
+        profiles = [p for p in store.all() if str(p.id) not in running and profile_disks(p)]
+    else:
+        profiles = resolve_profiles(store, args.profiles)
+    engine = SnapshotEngine(workers=args.jobs, is_running=lambda p: str(p.id) in running)
+    try:
+        if args.action == "list":
+            for prof in profiles:
+                for disk, snaps in engine.list_profile(prof).items():
+                    print(f"{prof.name}: {disk}")
+                    if isinstance(snaps, Exception):
+                        print(f"  {snaps}")
+                        continue
+                    for snap in snaps:
+                        print(f"  {snapshot_summary(snap)}")
+            return 0
+        operation = {"create": CREATE, "apply": APPLY, "delete": DELETE}[args.action]
+        failures = 0
+        for fut in engine.bulk(profiles, operation, args.name):
+            result = fut.result()
+            failures += not result.ok
+            print(result, flush=True)
+    finally:
+        engine.shutdown()
+    for prof in profiles:
+        if sync_profile_snapshots(engine, prof):
+            store.save(prof)
+    return 1 if failures else 0
+
+
+def cmd_maintain(args):
+    # Rewrites disks of stopped VMs through qemu-img, a few at a time, and
+    # reports the space each one gave back.
+    from image_maintenance import MaintenanceQueue, disk_user, retarget_profile
+    from provisioning import Provisioner
+    from snapshot_engine import profile_disks
+    from qemu_command import qemu_img_path
+    from disk_image import human_size
+    store = open_store(args)
+    running = RunRegistry(args.registry).running()
+    active = [p for p in store.all() if str(p.id) in running]
+    if args.all_stopped:
+        profiles = [p for p in store.all() if str(p.id) not in running and profile_disks(p)]
+    else:
+        profiles = resolve_profiles(store, args.profiles)
+    def in_use(path):
+        prof = disk_user(active, path)
+        return prof.name if prof is not None else None
+    prov = Provisioner(store)
+    queue = MaintenanceQueue(args.jobs, args.bandwidth * 1024 * 1024 if args.bandwidth else None,
+                             in_use=in_use, dependents=prov.dependents)
+    target = args.format if args.operation == "convert" else None
+    jobs = [queue.submit(prof, disk, args.operation, target, qemu_img=qemu_img_path(prof.qemu_path))
+            for prof in profiles for disk in profile_disks(prof) if os.path.exists(disk)]
+    failures = reclaimed = 0
+    try:
+        for job in jobs:
+            job.future.result()
+            print(job.describe(), flush=True)
+            if job.reclaimed is None:
+                failures += 1
+                continue
+            reclaimed += job.reclaimed
+            if (job.new_path or job.new_format) and retarget_profile(job.profile, job.disk, job.new_path or job.disk,
+                                                                     job.new_format):
+                store.save(job.profile)
+    finally:
+        queue.shutdown()
+        prov.shutdown()
+    print(f"{len(jobs) - failures}/{len(jobs)} image(s) ok, {human_size(max(0, reclaimed))} reclaimed")
+    return 1 if failures else 0
+
+
+def find_template(store, name):
+    for t in store.templates():
+        if name in (t["name"], t["path"]) or os.path.abspath(name) == t["path"]:
+            return t["path"]
+    raise SystemExit(f"qemu-frontend: no template named {name!r}")
+
+
+def cmd_template(args):
+    from provisioning import Provisioner, TemplateError
+    store = open_store(args)
+    running = RunRegistry(args.registry).running()
+    prov = Provisioner(store, workers=getattr(args, "jobs", 4), is_running=lambda p: str(p.id) in running)
+    try:
+        if args.action == "list":
+            for t in store.templates():
+                deps = prov.dependents(t["path"])
+                print(f"{t['name']:<24} {len(deps):>4} dependent(s)  {t['path']}")
+        elif args.action == "mark":
+            prof = resolve_profiles(store, [args.profile])[0]
+            if not prof.disk:
+                raise SystemExit(f"qemu-frontend: {prof.name} has no disk image")
+            template = prov.mark_template(prof.disk, args.name)
+            print(f"{template}: marked as template; {prof.name} now uses {prov.rebase_profile(template, prof)}")
+        elif args.action == "clone":
+            source = resolve_profiles(store, [args.source])[0]
+            failures = 0
+            for fut in prov.clone(find_template(store, args.template), source, args.count, args.prefix):
+                result = fut.result()
+                failures += not result.ok
+                print(result, flush=True)
+            return 1 if failures else 0
+        else:
+            template = find_template(store, args.template)
+            if args.action == "unmark":
+                prov.unmark_template(template)
+                print(f"{template}: no longer a template")
+            else:
+                prov.delete_template(template)
+                print(f"{template}: deleted")
+    except TemplateError as e:
+        print(f"qemu-frontend: {e}", file=sys.stderr)
+        return 1
+    finally:
+        prov.shutdown()
+    return 0
+
+
+def add_admission_arguments(p):
+    p.add_argument("--cpu-overcommit", type=float, metavar="RATIO", help="allowed vCPUs per host CPU (default: GUI setting, 1.0)")
+    p.add_argument("--ram-overcommit", type=float, metavar="RATIO", help="allowed guest RAM per host RAM (default: GUI setting, 1.0)")
+    p.add_argument("--force", action="store_true", help="skip admission control and CPU pinning")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="qemu-frontend", description="Headless launcher for Ultimate QEMU Frontend profiles.")
+    parser.add_argument("--db", default=PROFILE_DB_FILE, help="profile database (default: %(default)s)")
+    parser.add_argument("--registry", help=argparse.SUPPRESS)
+    parser.add_argument("--boot-cache", default="boot_cache", help=argparse.SUPPRESS)
+    parser.add_argument("--agent", metavar="ENDPOINT", help=argparse.SUPPRESS)
+    parser.add_argument("--no-agent", action="store_true",
+                        help="run VMs from this process (start: detached) instead of through the VM agent")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("list", help="list profiles and whether they are running")
+    p.add_argument("--search", metavar="WORDS", help="only profiles whose name, arch, ISO, disk or tags contain every word")
+    p.set_defaults(func=cmd_list)
+    p = sub.add_parser("inspect", help="show profile settings and the generated QEMU command")
+    p.add_argument("profiles", nargs="+", metavar="PROFILE", help="profile name or id")
+    p.set_defaults(func=cmd_inspect)
+    p = sub.add_parser("start", help="start one or more profiles")
+    p.add_argument("profiles", nargs="+", metavar="PROFILE", help="profile name or id")
+    p.add_argument("--dry-run", action="store_true", help="print the commands instead of running them")
+    add_admission_arguments(p)
+    p.set_defaults(func=cmd_start)
+    p = sub.add_parser("run", help="run profiles in the foreground under the supervisor")
+    p.add_argument("profiles", nargs="+", metavar="PROFILE", help="profile name or id")
+    p.add_argument("--restart", choices=("never", "on-failure", "always"), default="never", help="restart policy (default: %(default)s)")
+    p.add_argument("--max-restarts", type=int, default=5)
+    p.add_argument("--backoff", type=float, default=1.0, help="initial restart delay in seconds, doubled per attempt")
+    p.add_argument("--stop-timeout", type=float, default=10.0, help="seconds to wait after QMP quit (SIGTERM without QMP) before killing")
+    p.add_argument("--queue", action="store_true", help="wait for host capacity instead of refusing VMs that do not fit")
+    p.add_argument("--telemetry", metavar="CSV", help="sample CPU, memory, disk and network of each VM and write them here on exit")
+    p.add_argument("--telemetry-interval", type=float, metavar="SECONDS",
+                   help="seconds between samples (default: 2.0)")
+    p.add_argument("--fast-start", action="store_true", help="resume from saved states (also for profiles without "
+                                                             "fast start turned on), saving one after a cold boot")
+    add_admission_arguments(p)
+    p.set_defaults(func=cmd_run)
+    p = sub.add_parser("stop", help="stop running profiles")
+    p.add_argument("profiles", nargs="*", metavar="PROFILE", help="profile name or id")
+    p.add_argument("--all", action="store_true", help="stop every running VM")
+    p.add_argument("--stop-timeout", type=float, default=10.0, help="seconds to wait after QMP quit (SIGTERM without QMP) before killing")
+    p.set_defaults(func=cmd_stop)
+    p = sub.add_parser("fleet", help="start, stop or restart many profiles at once: staggered starts, graceful "
+                                     "parallel shutdown")
+    p.add_argument("action", choices=("start", "stop", "restart"))
+    p.add_argument("profiles", nargs="*", metavar="PROFILE", help="profile name or id")
+    p.add_argument("--tag", action="append", default=[], help="also every profile with this tag (repeatable)")
+    p.add_argument("--search", metavar="WORDS", help="also every profile whose name, arch, ISO, disk or tags "
+                                                     "contain every word")
+    p.add_argument("--all", action="store_true", help="every profile")
+    p.add_argument("--concurrency", type=int, metavar="N",
+                   help="VMs booting at the same time; the next starts once one runs (default: 2)")
+    p.add_argument("--stagger", type=float, metavar="SECONDS",
+                   help="at least this long between two launches (default: 2.0)")
+    p.add_argument("--gate-timeout", type=float, metavar="SECONDS",
+                   help="give up waiting for a VM to run and start the next one (default: 120.0)")
+    p.add_argument("--powerdown-timeout", type=float, metavar="SECONDS",
+                   help="time guests get to shut down after the ACPI power button, 0 to skip it (default: 60.0)")
+    p.add_argument("--quit-timeout", type=float, metavar="SECONDS",
+                   help="then time after QMP quit (SIGTERM without QMP) before killing (default: 10.0)")
+    add_admission_arguments(p)
+    p.set_defaults(func=cmd_fleet)
+    p = sub.add_parser("agent", help="show, stop or run the VM agent that owns running VMs")
+    p.add_argument("action", choices=("status", "stop", "serve"))
+    p.add_argument("--stop-vms", action="store_true", help="stop: also stop its VMs (refused while any run otherwise)")
+    p.add_argument("--idle-exit", type=float, metavar="SECONDS",
+                   help="serve: exit after this long without clients or VMs, 0 to never (default: 60.0)")
+    p.set_defaults(func=cmd_agent)
+    p = sub.add_parser("snapshot", help="list, create, apply or delete offline snapshots of stopped VMs")
+    snap = p.add_subparsers(dest="action", required=True)
+    for action, text in (("list", "list snapshots of every disk"), ("create", "create a snapshot"),
+                         ("apply", "revert disks to a snapshot"), ("delete", "delete a snapshot")):
+        q = snap.add_parser(action, help=text)
+        if action != "list":
+            q.add_argument("name", help="snapshot name")
+        q.add_argument("profiles", nargs="*", metavar="PROFILE", help="profile name or id")
+        q.add_argument("--all-stopped", action="store_true", help="every stopped profile that has a disk")
+        q.add_argument("-j", "--jobs", type=int, default=4, help="qemu-img processes at once (default: %(default)s)")
+        q.set_defaults(func=cmd_snapshot)
+    p = sub.add_parser("boot-cache", help="list or clear the saved VM states used for fast starts")
+    p.add_argument("action", choices=("list", "clear"))
+    p.add_argument("profiles", nargs="*", metavar="PROFILE", help="profiles to clear (default: all)")
+    p.set_defaults(func=cmd_boot_cache)
+    p = sub.add_parser("maintain", help="compact, compress, convert or merge the disks of stopped VMs")
+    p.add_argument("operation", choices=("compact", "compress", "convert", "merge"))
+    p.add_argument("profiles", nargs="*", metavar="PROFILE", help="profile name or id")
+    p.add_argument("--all-stopped", action="store_true", help="every stopped profile that has a disk")
+    p.add_argument("--format", choices=("qcow2", "raw"), default="qcow2", help="target format of convert (default: %(default)s)")
+    p.add_argument("-j", "--jobs", type=int, default=2, help="qemu-img processes at once (default: %(default)s)")
+    p.add_argument("--bandwidth", type=float, metavar="MB/S", help="total disk bandwidth for all jobs (default: unlimited)")
+    p.set_defaults(func=cmd_maintain)
+    p = sub.add_parser("template", help="manage golden disk templates and linked clones")
+    tmpl = p.add_subparsers(dest="action", required=True)
+    q = tmpl.add_parser("list", help="list templates and how many disks depend on them")
+    q = tmpl.add_parser("mark", help="freeze a profile's disk as a read-only template")
+    q.add_argument("profile", metavar="PROFILE")
+    q.add_argument("--name", help="template name (default: disk file name)")
+    q = tmpl.add_parser("clone", help="create profiles on qcow2 overlays of a template")
+    q.add_argument("template", help="template name or path")
+    q.add_argument("--from", dest="source", required=True, metavar="PROFILE", help="profile whose settings the clones copy")
+    q.add_argument("-n", "--count", type=int, default=1)
+    q.add_argument("--prefix", help="clone name prefix (default: source profile name)")
+    q.add_argument("-j", "--jobs", type=int, default=4, help="clones created at once (default: %(default)s)")
+    for action in ("unmark", "delete"):
+        q = tmpl.add_parser(action, help=f"{action} a template that no disk depends on")
+        q.add_argument("template", help="template name or path")
+    for q in tmpl.choices.values():
+        q.set_defaults(func=cmd_template)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.registry = args.registry or registry_path(args.db)
+    if args.command == "stop" and not args.all and not args.profiles:
+        raise SystemExit("qemu-frontend stop: give profile names or --all")
+    if args.command == "fleet" and not (args.all or args.profiles or args.tag or args.search):
+        raise SystemExit("qemu-frontend fleet: give profile names, --tag, --search or --all")
+    if args.command in ("snapshot", "maintain") and not args.all_stopped and not args.profiles:
+        raise SystemExit(f"qemu-frontend {args.command}: give profile names or --all-stopped")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
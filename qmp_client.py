@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import stat
+import socket
+import asyncio
+import tempfile
+import itertools
+
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class QmpError(Exception):
+    def __init__(self, error_class, desc):
+        super().__init__(f"{error_class}: {desc}")
+        self.error_class = error_class
+        self.desc = desc
+
+
+class QmpConnectionError(ConnectionError):
+    pass
+
+
+def has_unix_sockets():
+    return sys.platform != "win32" and hasattr(socket, "AF_UNIX")
+
+
+def run_dir():
+    # Private per-user directory for sockets (POSIX only), in $XDG_RUNTIME_DIR
+    # when set. The /tmp fallback has a predictable name another user could
+    # create first to plant or intercept the sockets (the agent's accepts
+    # launch requests), so it must be a real directory, ours, closed to others.
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime and os.path.isabs(runtime) and os.path.isdir(runtime):
+        path = os.path.join(runtime, "ultimate-qemu")
+    else:
+        path = os.path.join(tempfile.gettempdir(), f"ultimate-qemu-{os.getuid()}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} is not a private directory of this user; remove it and try again")
+    return path
+
+
+def allocate_qmp_endpoint(vm_id, namespace=""):
+    # Unix sockets where available; QEMU on Windows gets a loopback TCP port.
+    # namespace keeps VMs of different profile databases apart.
+    if has_unix_sockets():
+        path = os.path.join(run_dir(), f"qmp-{namespace}-{vm_id}.sock" if namespace else f"qmp-{vm_id}.sock")
+        if os.path.exists(path):
+            os.remove(path)
+        return f"unix:{path}"
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return f"tcp:127.0.0.1:{port}"
+
+
+async def open_endpoint(endpoint):
+    kind, _, addr = endpoint.partition(":")
+    if kind == "unix":
+        return await asyncio.open_unix_connection(addr, limit=STREAM_LIMIT)
+    if kind == "tcp":
+        host, _, port = addr.rpartition(":")
+        return await asyncio.open_connection(host, int(port), limit=STREAM_LIMIT)
+    if kind == "pipe":
+        # Windows named pipe; needs the proactor loop.
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=STREAM_LIMIT, loop=loop)
+        protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+        transport, _ = await loop.create_pipe_connection(lambda: protocol, addr)
+        return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+    raise ValueError(f"unsupported QMP endpoint {endpoint!r}")
+
+
+class QmpClient:
+    # One persistent QMP connection. Commands carry an id so any number can be
+    # in flight at once; replies are matched by id and asynchronous events are
+    # handed to on_event(name, data, timestamp) from the reader task.
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.greeting = None
+        self._reader = None
+        self._writer = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._reader_task = None
+        self._event_waiters = []
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self, endpoint, timeout=10.0, retry_interval=0.05):
+        # QEMU creates the socket shortly after exec, so keep retrying until timeout.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await open_endpoint(endpoint)
+                break
+            except (OSError, ConnectionError):
+                if loop.time() >= deadline:
+                    raise QmpConnectionError(f"could not connect to QMP at {endpoint}")
+                await asyncio.sleep(retry_interval)
+        line = await asyncio.wait_for(self._reader.readline(), max(deadline - loop.time(), 1.0))
+        if not line:
+            raise QmpConnectionError("QMP connection closed before greeting")
+        self.greeting = json.loads(line)
+        self._reader_task = loop.create_task(self._read_loop())
+        await self.execute("qmp_capabilities")
+        return self
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                if "event" in msg:
+                    self._dispatch_event(msg)
+                    continue
+                fut = self._pending.pop(msg.get("id"), None)
+                if fut is None or fut.done():
+                    continue
+                if "error" in msg:
+                    fut.set_exception(QmpError(msg["error"].get("class", "GenericError"), msg["error"].get("desc", "")))
+                else:
+                    fut.set_result(msg.get("return"))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._fail_pending(QmpConnectionError("QMP connection closed"))
+
+    def _dispatch_event(self, msg):
+        name = msg["event"]
+        data = msg.get("data", {})
+        ts = msg.get("timestamp", {})
+        for waiter in list(self._event_waiters):
+            want, match, fut = waiter
+            if name == want and not fut.done() and all(data.get(k) == v for k, v in match.items()):
+                fut.set_result(data)
+                self._event_waiters.remove(waiter)
+        if self.on_event:
+            try:
+                self.on_event(name, data, ts)
+            except Exception:
+                pass
+
+    def _fail_pending(self, exc):
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(exc)
+        self._pending.clear()
+        for _, _, fut in self._event_waiters:
+            if not fut.done():
+                fut.set_exception(exc)
+        self._event_waiters.clear()
+
+    async def execute(self, command, arguments=None, timeout=30.0):
+        if not self.connected:
+            raise QmpConnectionError("QMP not connected")
+        msg_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = fut
+        msg = {"execute": command, "id": msg_id}
+        if arguments:
+            msg["arguments"] = arguments
+        try:
+            self._writer.write(json.dumps(msg).encode() + b"\n")
+            await self._writer.drain()
+            return await asyncio.wait_for(fut, timeout)
+        except ConnectionError:
+            # QEMU went away mid-write, as it does after quit.
+            raise QmpConnectionError("QMP connection closed")
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def execute_many(self, commands, timeout=30.0):
+        # Pipelined: all commands are written before the first reply is awaited.
+        return await asyncio.gather(*(self.execute(c, a, timeout) for c, a in commands))
+
+    def expect_event(self, name, **match):
+        # Registers interest immediately, so call it before the command that
+        # triggers the event; await the returned future afterwards.
+        fut = asyncio.get_running_loop().create_future()
+        self._event_waiters.append((name, match, fut))
+        return fut
+
+    async def wait_event(self, name, timeout=30.0, **match):
+        return await asyncio.wait_for(self.expect_event(name, **match), timeout)
+
+    async def hmp(self, command_line, check=False):
+        # savevm/loadvm/delvm only exist as HMP commands; they report failure as text.
+        out = await self.execute("human-monitor-command", {"command-line": command_line})
+        if check and out.strip():
+            raise QmpError("GenericError", out.strip())
+        return out
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+        self._fail_pending(QmpConnectionError("QMP connection closed"))
+        self._writer = None
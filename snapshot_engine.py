@@ -0,0 +1,149 @@
+import os
+import sys
+import shlex
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from disk_image import inspector, ImageFormatError
+from qemu_command import qemu_img_path
+
+CREATE = "create"
+APPLY = "apply"
+DELETE = "delete"
+OPERATIONS = {CREATE: "-c", APPLY: "-a", DELETE: "-d"}
+DEFAULT_WORKERS = 4
+DISK_OPTIONS = ("-hda", "-hdb", "-hdc", "-hdd")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def profile_disks(prof):
+    # The main disk plus any disks added through the extra options; CD-ROMs,
+    # pflash and non-file drives are not snapshotted.
+    disks = [prof.disk] if prof.disk else []
+    try:
+        tokens = shlex.split(prof.extra or "")
+    except ValueError:
+        tokens = (prof.extra or "").split()
+    for opt, val in zip(tokens, tokens[1:]):
+        path = None
+        if opt in DISK_OPTIONS:
+            path = val
+        elif opt == "-drive":
+            fields = dict(f.split("=", 1) for f in val.replace(",,", "\0").split(",") if "=" in f)
+            if fields.get("media") != "cdrom" and fields.get("if") != "pflash" and "file" in fields:
+                path = fields["file"].replace("\0", ",")
+        if path and path not in disks:
+            disks.append(path)
+    return disks
+
+
+class SnapshotResult:
+    __slots__ = ("profile", "disk", "operation", "name", "ok", "error")
+
+    def __init__(self, profile, disk, operation, name, ok, error=""):
+        self.profile = profile
+        self.disk = disk
+        self.operation = operation
+        self.name = name
+        self.ok = ok
+        self.error = error
+
+    def __str__(self):
+        who = f"{self.profile.name}: " if self.profile is not None else ""
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return f"{who}{self.operation} {self.name!r} on {os.path.basename(self.disk)} {status}"
+
+
+class SnapshotEngine:
+    # Offline (stopped VM) snapshots through `qemu-img snapshot`. Jobs run in a
+    # bounded thread pool, one job per image at a time; listings come from the
+    # qcow2 snapshot table via the disk_image inspector and are re-read only
+    # when an image's mtime or size changes.
+    def __init__(self, workers=DEFAULT_WORKERS, is_running=None):
+        self.is_running = is_running
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot")
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _image_lock(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def list(self, path):
+        try:
+            info = inspector.inspect(path)
+        except (OSError, ImageFormatError) as e:
+            raise SnapshotError(f"{path}: {e}")
+        if info["format"] != "qcow2":
+            raise SnapshotError(f"{path}: {info['format']} images do not support snapshots")
+        return info["snapshots"]
+
+    def list_profile(self, prof):
+        listing = {}
+        for disk in profile_disks(prof):
+            try:
+                listing[disk] = self.list(disk)
+            except SnapshotError as e:
+                listing[disk] = e
+        return listing
+
+    def run(self, qemu_img, operation, path, name):
+        if operation not in OPERATIONS:
+            raise ValueError(f"unknown snapshot operation {operation!r}")
+        if operation != CREATE and not any(s["name"] == name for s in self.list(path)):
+            raise SnapshotError(f"{path}: no snapshot named {name!r}")
+        cmd = [qemu_img, "snapshot", OPERATIONS[operation], name, path]
+        kwargs = {"creationflags": 0x08000000} if sys.platform == "win32" else {}  # CREATE_NO_WINDOW
+        with self._image_lock(path):
+            try:
+                proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, **kwargs)
+            finally:
+                inspector.invalidate(path)
+        if proc.returncode != 0:
+            raise SnapshotError(proc.stderr.decode("utf-8", "replace").strip() or f"qemu-img exited with {proc.returncode}")
+
+    def _job(self, prof, qemu_img, operation, path, name):
+        try:
+            if qemu_img is None:
+                raise SnapshotError("qemu-img not found next to the QEMU executable or on PATH")
+            if self.is_running and self.is_running(prof):
+                raise SnapshotError("VM is running; stop it or use a live snapshot")
+            self.run(qemu_img, operation, path, name)
+        except (SnapshotError, OSError) as e:
+            return SnapshotResult(prof, path, operation, name, False, str(e))
+        return SnapshotResult(prof, path, operation, name, True)
+
+    def submit(self, prof, operation, name, disks=None):
+        # One future per disk, each resolving to a SnapshotResult (never raising).
+        qemu_img = qemu_img_path(prof.qemu_path)
+        return [self._pool.submit(self._job, prof, qemu_img, operation, disk, name)
+                for disk in (profile_disks(prof) if disks is None else disks)]
+
+    def bulk(self, profiles, operation, name):
+        # e.g. snapshot every stopped VM before patching: all disks of all
+        # profiles go through the same bounded pool.
+        futures = []
+        for prof in profiles:
+            futures += self.submit(prof, operation, name)
+        return futures
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def sync_profile_snapshots(engine, prof):
+    # Mirrors the main disk's snapshot names into QemuProfile.snapshots and
+    # reports whether they changed.
+    try:
+        names = [s["name"] for s in engine.list(prof.disk)] if prof.disk else []
+    except SnapshotError:
+        names = []
+    if names == prof.snapshots:
+        return False
+    prof.snapshots = names
+    return True
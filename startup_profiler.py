@@ -0,0 +1,84 @@
+import sys
+import time
+import json
+import builtins
+import threading
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    # Records wall time of first-time imports (outermost only, so nested imports
+    # are not double counted) and of named startup phases, relative to creation.
+    # Nesting is tracked per thread, since VM control is imported on a worker.
+    def __init__(self):
+        self.enabled = False
+        self.t0 = time.perf_counter()
+        self.imports = []
+        self.phases = []
+        self.marks = []
+        self._local = threading.local()
+        self._orig_import = None
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._orig_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def disable(self):
+        if self.enabled:
+            builtins.__import__ = self._orig_import
+            self.enabled = False
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self.imports.append((name, time.perf_counter() - start))
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        if self.enabled:
+            self.marks.append((name, time.perf_counter() - self.t0))
+
+    def as_dict(self):
+        return {
+            "imports": [{"module": n, "ms": round(t * 1000, 3)} for n, t in self.imports],
+            "phases": [{"phase": n, "ms": round(t * 1000, 3)} for n, t in self.phases],
+            "marks": [{"mark": n, "ms": round(t * 1000, 3)} for n, t in self.marks],
+        }
+
+    def report(self, as_json=False):
+        if as_json:
+            return json.dumps(self.as_dict(), indent=2)
+        lines = ["Imports (first load, inclusive):"]
+        for name, t in sorted(self.imports, key=lambda x: -x[1]):
+            lines.append(f"  {t * 1000:9.2f} ms  {name}")
+        lines.append("Init phases:")
+        for name, t in self.phases:
+            lines.append(f"  {t * 1000:9.2f} ms  {name}")
+        lines.append("Since process start of profiler:")
+        for name, t in self.marks:
+            lines.append(f"  {t * 1000:9.2f} ms  {name}")
+        return "\n".join(lines)
+
+
+profiler = StartupProfiler()
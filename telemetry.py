@@ -0,0 +1,307 @@
+import os
+import csv
+import time
+import array
+import asyncio
+
+from vm_supervisor import RUNNING
+
+FIELDS = ("cpu_pct", "rss_mb", "io_read_bps", "io_write_bps",
+          "disk_read_bps", "disk_write_bps", "net_rx_bps", "net_tx_bps")
+FIELD_INDEX = {name: i + 1 for i, name in enumerate(FIELDS)}  # column 0 is the sample time
+DEFAULT_INTERVAL = 2.0
+DEFAULT_CAPACITY = 300  # ten minutes at the default interval
+QMP_STATS_TIMEOUT = 1.0
+NAN = float("nan")
+
+PROC_ROOT = "/proc"
+SYSFS_NET = "/sys/class/net"
+if hasattr(os, "sysconf"):
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+else:
+    CLOCK_TICKS = 100
+    PAGE_SIZE = 4096
+
+_psutil = None
+
+
+def load_psutil():
+    # psutil is optional and only needed where there is no /proc (Windows, macOS).
+    global _psutil
+    if _psutil is None:
+        try:
+            import psutil
+            _psutil = psutil
+        except ImportError:
+            _psutil = False
+    return _psutil or None
+
+
+class TelemetryRing:
+    # Last `capacity` samples of one VM in a single flat array of doubles,
+    # one row of (time, *FIELDS) per sample: 72 bytes a sample, no per-sample
+    # objects. Missing values are NaN.
+    __slots__ = ("capacity", "width", "data", "head", "count")
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.width = len(FIELDS) + 1
+        self.data = array.array("d", bytes(8 * capacity * self.width))
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts, values):
+        i = self.head * self.width
+        self.data[i] = ts
+        self.data[i + 1:i + self.width] = array.array("d", values)
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def column(self, index):
+        # One column, oldest sample first.
+        col = self.data[index::self.width]
+        if self.count < self.capacity:
+            return col[:self.count]
+        return col[self.head:] + col[:self.head]
+
+    def series(self, field):
+        return self.column(FIELD_INDEX[field])
+
+    def times(self):
+        return self.column(0)
+
+    def latest(self):
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.capacity * self.width
+        row = self.data[i:i + self.width]
+        return dict(zip(("time",) + FIELDS, row))
+
+    def rows(self):
+        start = 0 if self.count < self.capacity else self.head
+        for n in range(self.count):
+            i = (start + n) % self.capacity * self.width
+            yield self.data[i:i + self.width]
+
+
+def _read_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 4096)
+    finally:
+        os.close(fd)
+
+
+def read_proc(pid, root=PROC_ROOT):
+    # (cpu seconds, rss bytes, storage read bytes, storage write bytes) of one
+    # process. I/O is NaN when /proc/<pid>/io is not readable (other users'
+    # processes, hardened kernels). Raises OSError once the process is gone.
+    stat = _read_file(f"{root}/{pid}/stat")
+    # The command name may contain spaces and parentheses; fields start after the last ")".
+    fields = stat[stat.rindex(b")") + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime, stime
+    rss = int(fields[21]) * PAGE_SIZE
+    read_bytes = write_bytes = NAN
+    try:
+        for line in _read_file(f"{root}/{pid}/io").splitlines():
+            if line.startswith(b"read_bytes:"):
+                read_bytes = int(line[11:])
+            elif line.startswith(b"write_bytes:"):
+                write_bytes = int(line[12:])
+    except PermissionError:
+        pass
+    return cpu, rss, read_bytes, write_bytes
+
+
+def read_psutil(proc):
+    with proc.oneshot():
+        times = proc.cpu_times()
+        rss = proc.memory_info().rss
+        try:
+            io = proc.io_counters()
+            read_bytes, write_bytes = io.read_bytes, io.write_bytes
+        except (AttributeError, _psutil.AccessDenied):  # not available on macOS
+            read_bytes = write_bytes = NAN
+    return times.user + times.system, rss, read_bytes, write_bytes
+
+
+def tap_interfaces(cmd):
+    # Host tap devices named on the command line (-netdev tap,ifname=tap0,...).
+    # QEMU exposes no per-NIC byte counters over QMP, so this is the only
+    # network source; user-mode (slirp) networking has none.
+    names = []
+    for arg in cmd:
+        if arg.startswith("tap,"):
+            for opt in arg.split(","):
+                if opt.startswith("ifname="):
+                    names.append(opt[7:])
+    return names
+
+
+def read_net(names, root=SYSFS_NET):
+    # Guest (rx, tx) bytes over the given tap devices. The host side of a tap
+    # transmits what the guest receives, so the counters are swapped.
+    rx = tx = 0
+    try:
+        for name in names:
+            rx += int(_read_file(f"{root}/{name}/statistics/tx_bytes"))
+            tx += int(_read_file(f"{root}/{name}/statistics/rx_bytes"))
+    except (OSError, ValueError):
+        return NAN, NAN
+    return rx, tx
+
+
+def _rate(now, before, dt):
+    if now != now or before != before or now < before:  # NaN or counter reset
+        return NAN
+    return (now - before) / dt
+
+
+class TelemetryCollector:
+    # Samples every running VM of a VmSupervisor each `interval` seconds on the
+    # supervisor's loop: host CPU, RSS and I/O of the QEMU process from /proc
+    # (psutil elsewhere), guest disk bytes from QMP query-blockstats (queried
+    # for all VMs at once) and tap network bytes. Counters become per-second
+    # rates, stored in one TelemetryRing per VM. Rings outlive their VM so the
+    # last run can still be viewed and exported; forget() drops one.
+    # on_sample(vm_ids) runs on the supervisor thread after each pass.
+    def __init__(self, supervisor, interval=DEFAULT_INTERVAL, capacity=DEFAULT_CAPACITY, qmp_stats=True,
+                 on_sample=None):
+        self.supervisor = supervisor
+        self.interval = interval
+        self.capacity = capacity
+        self.qmp_stats = qmp_stats
+        self.on_sample = on_sample
+        self.rings = {}
+        self.names = {}
+        self.last_pass_cpu = 0.0
+        self._prev = {}
+        self._procs = {}
+        self._taps = {}
+        self._future = None
+        self._use_proc = os.path.isdir(os.path.join(PROC_ROOT, "self"))
+
+    def start(self):
+        if self._future is None:
+            self._future = self.supervisor.call(self._run(), wait=False)
+        return self
+
+    def stop(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+    def forget(self, vm_id):
+        self.rings.pop(vm_id, None)
+        self.names.pop(vm_id, None)
+        self._prev.pop(vm_id, None)
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await self.sample()
+            await asyncio.sleep(max(0.05, self.interval - (time.monotonic() - started)))
+
+    def _read_process(self, pid):
+        if self._use_proc:
+            return read_proc(pid)
+        psutil = load_psutil()
+        if psutil is None:
+            return NAN, NAN, NAN, NAN
+        # psutil errors are not OSErrors; map them so sample() skips the VM.
+        try:
+            proc = self._procs.get(pid)
+            if proc is None:
+                proc = self._procs[pid] = psutil.Process(pid)
+            return read_psutil(proc)
+        except psutil.NoSuchProcess:
+            self._procs.pop(pid, None)
+            raise ProcessLookupError(pid)
+        except psutil.AccessDenied:
+            raise PermissionError(pid)
+
+    async def _blockstats(self, vm):
+        if not self.qmp_stats or not vm.qmp_ready or vm.qmp is None:
+            return NAN, NAN
+        try:
+            stats = await vm.qmp.execute("query-blockstats", timeout=QMP_STATS_TIMEOUT)
+        except Exception:  # QMP errors, timeouts and a VM exiting mid-query all mean "no sample"
+            return NAN, NAN
+        return (sum(s["stats"].get("rd_bytes", 0) for s in stats),
+                sum(s["stats"].get("wr_bytes", 0) for s in stats))
+
+    async def sample(self):
+        # One pass over all running VMs; returns the ids sampled.
+        vms = [vm for vm in list(self.supervisor.vms.values()) if vm.state == RUNNING and vm.pid]
+        blocks = await asyncio.gather(*(self._blockstats(vm) for vm in vms)) if vms else []
+        cpu_start = time.thread_time()
+        now = time.monotonic()
+        wall = time.time()
+        sampled = []
+        for vm, (disk_read, disk_write) in zip(vms, blocks):
+            try:
+                cpu, rss, io_read, io_write = self._read_process(vm.pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            taps = self._taps.get(vm.vm_id)
+            if taps is None or taps[0] is not vm.cmd:
+                taps = self._taps[vm.vm_id] = (vm.cmd, tap_interfaces(vm.cmd))
+            net_rx, net_tx = read_net(taps[1]) if taps[1] else (NAN, NAN)
+            raw = (vm.pid, now, cpu, io_read, io_write, disk_read, disk_write, net_rx, net_tx)
+            prev = self._prev.get(vm.vm_id)
+            self._prev[vm.vm_id] = raw
+            if prev is not None and prev[0] == vm.pid and now > prev[1]:
+                dt = now - prev[1]
+                rates = [_rate(a, b, dt) for a, b in zip(raw[2:], prev[2:])]
+                rates[0] *= 100  # cpu seconds per second -> percent of one host CPU
+            else:
+                rates = [NAN] * 7
+            ring = self.rings.get(vm.vm_id)
+            if ring is None:
+                ring = self.rings[vm.vm_id] = TelemetryRing(self.capacity)
+            self.names[vm.vm_id] = vm.name
+            ring.append(wall, (rates[0], rss / (1024 * 1024), *rates[1:]))
+            sampled.append(vm.vm_id)
+        running = {vm.vm_id for vm in vms}
+        for vm_id in [v for v in self._prev if v not in running]:
+            del self._prev[vm_id]
+            self._taps.pop(vm_id, None)
+        pids = {vm.pid for vm in vms}
+        for pid in [p for p in self._procs if p not in pids]:
+            del self._procs[pid]
+        self.last_pass_cpu = time.thread_time() - cpu_start
+        if self.on_sample:
+            self.on_sample(sampled)
+        return sampled
+
+    def export_csv(self, path, vm_ids=None):
+        # One row per sample: vm id, name, ISO time, then FIELDS; NaN is left empty.
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("vm_id", "name", "time") + FIELDS)
+            rows = 0
+            for vm_id in (vm_ids if vm_ids is not None else list(self.rings)):
+                ring = self.rings.get(vm_id)
+                if ring is None:
+                    continue
+                name = self.names.get(vm_id, vm_id)
+                for row in ring.rows():
+                    stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(row[0])) + f".{int(row[0] % 1 * 1000):03d}"
+                    writer.writerow([vm_id, name, stamp] + ["" if v != v else f"{v:.6g}" for v in row[1:]])
+                    rows += 1
+        return rows
+
+
+def format_rate(value):
+    if value != value:
+        return "-"
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GB/s"
@@ -0,0 +1,154 @@
+import os
+
+import pytest
+
+from cpu_scheduler import CpuScheduler, AdmissionError, read_topology
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text + "\n")
+
+
+def fake_sysfs(root, cores, nodes=None):
+    # cores: {cpu: (package, core_id)}; nodes: {node: ([cpus], MemTotal in MB)}.
+    system = os.path.join(root, "devices", "system")
+    write(os.path.join(system, "cpu", "online"), ",".join(str(cpu) for cpu in sorted(cores)))
+    for cpu, (package, core) in cores.items():
+        topo = os.path.join(system, "cpu", f"cpu{cpu}", "topology")
+        write(os.path.join(topo, "physical_package_id"), str(package))
+        write(os.path.join(topo, "core_id"), str(core))
+    for node, (cpus, ram_mb) in (nodes or {}).items():
+        node_dir = os.path.join(system, "node", f"node{node}")
+        write(os.path.join(node_dir, "cpulist"), ",".join(map(str, cpus)))
+        write(os.path.join(node_dir, "meminfo"), f"Node {node} MemTotal:       {ram_mb * 1024} kB\n"
+                                                 f"Node {node} MemFree:        {ram_mb * 512} kB")
+    return str(root)
+
+
+@pytest.fixture
+def smt_host(tmp_path):
+    # One node, 2 cores with 2 threads each; siblings are numbered apart, as Linux does.
+    return read_topology(fake_sysfs(tmp_path, {0: (0, 0), 1: (0, 1), 2: (0, 0), 3: (0, 1)},
+                                    {0: ([0, 1, 2, 3], 4096)}))
+
+
+@pytest.fixture
+def numa_host(tmp_path):
+    # Two packages, one NUMA node each, 2 cores x 2 threads and 4 GB per node.
+    cores = {0: (0, 0), 1: (0, 1), 4: (0, 0), 5: (0, 1),
+             2: (1, 0), 3: (1, 1), 6: (1, 0), 7: (1, 1)}
+    return read_topology(fake_sysfs(tmp_path, cores, {0: ([0, 1, 4, 5], 4096), 1: ([2, 3, 6, 7], 4096)}))
+
+
+def test_read_topology(numa_host):
+    assert numa_host.cpus == list(range(8))
+    assert numa_host.core_of[0] == numa_host.core_of[4] == (0, 0)
+    assert numa_host.core_of[3] == numa_host.core_of[7] == (1, 1)
+    assert numa_host.nodes == {0: [0, 1, 4, 5], 1: [2, 3, 6, 7]}
+    assert numa_host.node_ram_mb == {0: 4096, 1: 4096}
+    assert numa_host.describe() == "8 CPUs on 4 cores, 2 NUMA node(s), 8 GB RAM"
+
+
+def test_read_topology_without_node_dir(tmp_path):
+    # No node directory: everything on node 0.
+    topo = read_topology(fake_sysfs(tmp_path, {0: (0, 0), 1: (0, 0)}))
+    assert topo.nodes == {0: [0, 1]}
+    assert len(set(topo.core_of.values())) == 1
+
+
+def test_smt_siblings_filled_last(smt_host):
+    scheduler = CpuScheduler(smt_host)
+    assert scheduler.place("a", 2, 512).cpus == [0, 1]
+    assert scheduler.place("a", 4, 512).cpus == [0, 1, 2, 3]
+    # With one core busy, the free core is used before the sibling of the busy one.
+    scheduler.request("a", 1, 512)
+    assert scheduler.place("b", 2, 512).cpus == [1, 2]
+
+
+def test_single_numa_node_when_it_fits(numa_host):
+    scheduler = CpuScheduler(numa_host)
+    placement = scheduler.request("a", 4, 2048)
+    assert placement.node == 0
+    assert placement.cpus == [0, 1, 4, 5]
+    # The next VM goes to the emptier node instead of onto SMT siblings of the first.
+    placement = scheduler.request("b", 2, 1024)
+    assert placement.node == 1
+    assert placement.cpus == [2, 3]
+
+
+def test_numa_node_too_small(numa_host):
+    scheduler = CpuScheduler(numa_host)
+    # More vCPUs than a node has CPUs: spread over all of them, one per core first.
+    placement = scheduler.place("a", 6, 1024)
+    assert placement.node is None
+    assert placement.cpus == [0, 1, 2, 3, 4, 5]
+    # More RAM than a node has: no node is chosen.
+    placement = scheduler.place("b", 2, 6144)
+    assert placement.node is None
+    assert placement.cpus == [0, 1]
+
+
+def test_refused_above_overcommit(numa_host):
+    scheduler = CpuScheduler(numa_host)
+    scheduler.request("a", 6, 1024)
+    with pytest.raises(AdmissionError, match=r"6 of 8 are committed \(CPU overcommit 1\)"):
+        scheduler.request("b", 4, 1024)
+    with pytest.raises(AdmissionError, match=r"RAM overcommit 1\)"):
+        scheduler.request("b", 1, 8000)
+    with pytest.raises(AdmissionError, match="at most 8 vCPU"):
+        scheduler.request("b", 9, 1024)
+    assert scheduler.usage() == (6, 1024)
+    assert set(scheduler.placements()) == {"a"}
+
+
+def test_overcommit_ratios(numa_host):
+    scheduler = CpuScheduler(numa_host, cpu_ratio=1.5, ram_ratio=2.0)
+    assert (scheduler.cpu_capacity, scheduler.ram_capacity_mb) == (12, 16384)
+    scheduler.request("a", 6, 8192)
+    scheduler.request("b", 6, 8192)
+    with pytest.raises(AdmissionError, match="CPU overcommit 1.5"):
+        scheduler.request("c", 1, 1)
+
+
+def test_external_vms_counted(numa_host):
+    running = {"7": {"cmd": ["qemu-system-x86_64", "-smp", "6", "-m", "1024"], "cpus": [0, 1]}}
+    scheduler = CpuScheduler(numa_host, external=lambda: running)
+    with pytest.raises(AdmissionError, match="6 of 8 are committed"):
+        scheduler.request("a", 4, 1024)
+    running.clear()
+    assert scheduler.request("a", 4, 1024) is not None
+
+
+def test_queue_admits_in_order_on_release(numa_host):
+    scheduler = CpuScheduler(numa_host)
+    admitted = []
+    scheduler.request("a", 6, 1024)
+    assert scheduler.request("b", 4, 1024, on_admit=admitted.append) is None
+    # "c" would fit, but waits behind "b".
+    assert scheduler.request("c", 1, 1024, on_admit=admitted.append) is None
+    with pytest.raises(AdmissionError, match="other VMs are already waiting"):
+        scheduler.request("d", 1, 1024)
+    assert scheduler.queued() == ["b", "c"]
+    placements = scheduler.release("a")
+    assert [p.vm_id for p in placements] == ["b", "c"]
+    assert admitted == placements
+    assert scheduler.queued() == []
+    assert set(scheduler.placements()) == {"b", "c"}
+
+
+def test_queue_stops_at_first_that_does_not_fit(numa_host):
+    scheduler = CpuScheduler(numa_host)
+    admitted = []
+    scheduler.request("a", 4, 1024)
+    scheduler.request("b", 4, 1024)
+    scheduler.request("c", 6, 1024, on_admit=admitted.append)
+    scheduler.request("d", 1, 1024, on_admit=admitted.append)
+    assert scheduler.release("a") == []
+    assert scheduler.queued() == ["c", "d"]
+    # Dropping "c" from the queue lets "d", which fits, through.
+    assert [p.vm_id for p in scheduler.release("c")] == ["d"]
+    assert [p.vm_id for p in admitted] == ["d"]
+    assert scheduler.queued() == []
+    assert set(scheduler.placements()) == {"b", "d"}
@@ -0,0 +1,57 @@
+import os
+
+from iso_cache import DigestCache, IsoStore, sha256_file
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def make_store(tmp_path):
+    return IsoStore(str(tmp_path / "iso_store"), DigestCache(str(tmp_path / "digests.json")))
+
+
+def test_dedup_links_identical_isos(tmp_path):
+    store = make_store(tmp_path)
+    a = write(str(tmp_path / "lib1" / "debian.iso"), b"debian" * 1000)
+    b = write(str(tmp_path / "lib2" / "copy.iso"), b"debian" * 1000)
+    write(str(tmp_path / "lib2" / "other.iso"), b"other" * 10)
+    report = store.dedup_dirs([str(tmp_path / "lib1"), str(tmp_path / "lib2")])
+    assert (report["files"], report["linked"], report["bytes_freed"]) == (3, 1, 6000)
+    assert os.stat(a).st_ino == os.stat(b).st_ino
+    assert os.stat(store.object_path(sha256_file(a))).st_ino == os.stat(a).st_ino
+    assert report["collected"] == 0
+
+
+def test_collect_removes_unreferenced_objects(tmp_path):
+    store = make_store(tmp_path)
+    lib = str(tmp_path / "lib")
+    kept = write(os.path.join(lib, "kept.iso"), b"kept" * 100)
+    gone = write(os.path.join(lib, "gone.iso"), b"gone" * 250)
+    store.dedup_dirs([lib])
+    kept_obj, gone_obj = store.object_path(sha256_file(kept)), store.object_path(sha256_file(gone))
+    gone_digest = sha256_file(gone)
+    assert os.path.exists(gone_obj)
+    os.remove(gone)
+    report = store.dedup_dirs([lib])
+    assert (report["collected"], report["bytes_collected"]) == (1, 1000)
+    assert not os.path.exists(gone_obj)
+    assert os.path.exists(kept_obj)
+    # The index forgets the removed object, also after reopening the store.
+    assert gone_digest not in make_store(tmp_path)._index
+    assert store.collect() == {"collected": 0, "bytes_collected": 0}
+
+
+def test_collected_iso_is_stored_again(tmp_path):
+    store = make_store(tmp_path)
+    lib = str(tmp_path / "lib")
+    path = write(os.path.join(lib, "a.iso"), b"a" * 4096)
+    store.dedup_dirs([lib])
+    os.remove(path)
+    store.dedup_dirs([lib])
+    path = write(os.path.join(lib, "b.iso"), b"a" * 4096)
+    store.dedup_dirs([lib])
+    assert os.stat(store.object_path(sha256_file(path))).st_ino == os.stat(path).st_ino
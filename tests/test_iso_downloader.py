@@ -0,0 +1,63 @@
+import random
+import hashlib
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+from iso_downloader import InlineHasher  # noqa: E402
+
+CHUNK = 64 * 1024
+
+
+def segments(total, count):
+    size = total // count
+    return [(i * size, total if i == count - 1 else (i + 1) * size) for i in range(count)]
+
+
+def write_segment(path, hasher, data, start, end, delay):
+    # Writes in place and feeds each chunk, as SegmentedDownloader does.
+    with open(path, "r+b", buffering=0) as f:
+        for pos in range(start, end, CHUNK):
+            chunk = data[pos:min(pos + CHUNK, end)]
+            f.seek(pos)
+            f.write(chunk)
+            hasher.feed(pos, chunk)
+            delay.wait(random.random() / 2000)
+
+
+@pytest.mark.parametrize("count", (1, 4, 7))
+def test_digest_of_concurrent_segments(tmp_path, count):
+    data = random.Random(count).randbytes(3 * 1024 * 1024 + 12345)
+    path = str(tmp_path / "image.iso.part")
+    with open(path, "wb") as f:
+        f.truncate(len(data))
+    hasher = InlineHasher(path)
+    delay = threading.Event()
+    threads = [threading.Thread(target=write_segment, args=(path, hasher, data, start, end, delay))
+               for start, end in reversed(segments(len(data), count))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert hasher.pos == len(data)
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_resume_marks_bytes_already_on_disk(tmp_path):
+    # A resumed download hashes what the journal says is on disk, then the rest as it arrives.
+    data = random.Random(0).randbytes(1024 * 1024)
+    path = str(tmp_path / "image.iso.part")
+    with open(path, "wb") as f:
+        f.write(data[:300000] + bytes(len(data) - 300000))
+    with open(path, "r+b") as f:
+        f.seek(600000)
+        f.write(data[600000:700000])
+    hasher = InlineHasher(path)
+    hasher.mark_written(600000, 700000)
+    hasher.mark_written(0, 300000)
+    assert hasher.pos == 300000
+    write_segment(path, hasher, data, 300000, 600000, threading.Event())
+    assert hasher.pos == 700000
+    write_segment(path, hasher, data, 700000, len(data), threading.Event())
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
@@ -0,0 +1,168 @@
+import itertools
+
+import pytest
+
+from profile_store import QemuProfile
+from qemu_command import build_command, command_resources
+from host_caps import HostCaps
+
+# Commands are built for hosts described by HostCaps, so nothing is detected
+# on the machine running the tests.
+HUGEPAGES = "/dev/hugepages"
+HOSTS = {
+    "kvm": ("linux", "x86_64", ("kvm", "tcg")),
+    "whpx": ("win32", "x86_64", ("whpx", "tcg")),
+    "hvf": ("darwin", "aarch64", ("hvf", "tcg")),
+    "tcg": ("linux", "x86_64", ("tcg",)),
+}
+ACCEL_ARGS = {
+    "kvm": ["-accel", "kvm", "-cpu", "host"],
+    "whpx": ["-accel", "whpx"],
+    "hvf": ["-accel", "hvf", "-cpu", "host"],
+    "tcg": ["-accel", "tcg,thread=multi", "-cpu", "max"],
+}
+AIO = {"io_uring": {"io_uring": True, "aio_native": True}, "native": {"aio_native": True}}
+HUGEPAGE_ARGS = ["-object", f"memory-backend-file,id=mem0,size=2048M,mem-path={HUGEPAGES},prealloc=on",
+                 "-machine", "memory-backend=mem0"]
+NETWORK_ARGS = ["-netdev", "user,id=net0", "-device", "virtio-net-pci,netdev=net0"]
+
+
+def host(name, aio="native", hugepages_free_mb=0):
+    platform, arch, accels = HOSTS[name]
+    return HostCaps(platform, arch, accels, hugepage_path=HUGEPAGES if hugepages_free_mb else "",
+                    hugepages_free_mb=hugepages_free_mb, **AIO.get(aio, {}))
+
+
+def profile(arch="x86_64", performance=True, disk_bus="virtio-blk", hugepages=False, boot="Disk image"):
+    prof = QemuProfile("test")
+    prof.qemu_path = f"qemu-system-{arch}"
+    prof.arch = arch
+    prof.iso = "/isos/install.iso"
+    prof.disk = "/images/test.qcow2"
+    prof.disk_format = "qcow2"  # pinned, so nothing is probed
+    prof.performance = performance
+    prof.disk_bus = disk_bus
+    prof.hugepages = hugepages
+    prof.boot = boot
+    return prof
+
+
+def disk_device_args(disk_bus, boot=",bootindex=0"):
+    if disk_bus == "virtio-scsi":
+        return ["-device", "virtio-scsi-pci,id=scsi0,iothread=io0", "-device", f"scsi-hd,drive=disk0,bus=scsi0.0{boot}"]
+    return ["-device", f"virtio-blk-pci,drive=disk0,iothread=io0{boot}"]
+
+
+@pytest.mark.parametrize("accel, disk_bus, hugepages, aio",
+                         list(itertools.product(HOSTS, ("virtio-blk", "virtio-scsi"), (False, True),
+                                                 ("io_uring", "native"))))
+def test_performance_command(accel, disk_bus, hugepages, aio):
+    arch = HOSTS[accel][1]
+    caps = host(accel, aio, hugepages_free_mb=4096 if hugepages else 0)
+    cmd = build_command(profile(arch, disk_bus=disk_bus, hugepages=hugepages), caps=caps)
+    assert cmd == (
+        [f"qemu-system-{arch}"] + ACCEL_ARGS[accel] + ["-m", "2048"]
+        + (HUGEPAGE_ARGS if hugepages else [])
+        + ["-smp", "cpus=2,sockets=1,cores=2,threads=1"]
+        + ["-drive", "id=cd0,index=2,media=cdrom,file=/isos/install.iso"]
+        + ["-object", "iothread,id=io0",
+           "-drive", f"file=/images/test.qcow2,if=none,id=disk0,format=qcow2,cache=none,discard=unmap,aio={aio}"]
+        + disk_device_args(disk_bus)
+        + NETWORK_ARGS)
+
+
+@pytest.mark.parametrize("disk_bus", ("virtio-blk", "virtio-scsi"))
+def test_performance_iso_boot(disk_bus):
+    # The CD-ROM boots first; the disk gets no bootindex.
+    cmd = build_command(profile(disk_bus=disk_bus, boot="ISO (cdrom)"), caps=host("kvm", "io_uring"))
+    assert cmd == (["qemu-system-x86_64", "-accel", "kvm", "-cpu", "host", "-m", "2048",
+                    "-smp", "cpus=2,sockets=1,cores=2,threads=1", "-boot", "order=d",
+                    "-drive", "id=cd0,index=2,media=cdrom,file=/isos/install.iso",
+                    "-object", "iothread,id=io0",
+                    "-drive", "file=/images/test.qcow2,if=none,id=disk0,format=qcow2,cache=none,discard=unmap,"
+                              "aio=io_uring"]
+                   + disk_device_args(disk_bus, boot="") + NETWORK_ARGS)
+
+
+def test_no_native_aio():
+    cmd = build_command(profile(), caps=host("kvm", aio=None))
+    assert "file=/images/test.qcow2,if=none,id=disk0,format=qcow2,cache=none,discard=unmap" in cmd
+
+
+@pytest.mark.parametrize("guest, host_name, accel", [
+    ("i386", "kvm", "kvm"),
+    ("aarch64", "kvm", "tcg"),
+    ("x86_64", "hvf", "tcg"),
+    ("arm", "hvf", "hvf"),
+    ("aarch64", "whpx", "tcg"),
+])
+def test_accelerator_for_guest_arch(guest, host_name, accel):
+    # Hardware acceleration only for guests of the host's own architecture.
+    cmd = build_command(profile(guest), caps=host(host_name))
+    assert cmd[1:1 + len(ACCEL_ARGS[accel])] == ACCEL_ARGS[accel]
+
+
+@pytest.mark.parametrize("free_mb, path", [(1024, HUGEPAGES), (4096, "")])
+def test_hugepages_unavailable(free_mb, path):
+    # Too few free hugepages, or no hugetlbfs mount: normal pages.
+    caps = host("kvm")
+    caps.hugepage_path, caps.hugepages_free_mb = path, free_mb
+    cmd = build_command(profile(hugepages=True), caps=caps)
+    assert "memory-backend=mem0" not in cmd
+    assert not any(arg.startswith("memory-backend-file") for arg in cmd)
+
+
+def test_hugepages_off_in_profile():
+    cmd = build_command(profile(hugepages=False), caps=host("kvm", hugepages_free_mb=4096))
+    assert "memory-backend=mem0" not in cmd
+
+
+@pytest.mark.parametrize("mode, args", [
+    ("user (NAT)", NETWORK_ARGS),
+    ("bridged (TAP)", ["-netdev", "tap,id=net0", "-device", "virtio-net-pci,netdev=net0"]),
+    ("custom", ["-nic", "user,model=e1000"]),
+])
+def test_performance_network(mode, args):
+    prof = profile()
+    prof.network_mode = mode
+    prof.network_options = "-nic user,model=e1000"
+    assert build_command(prof, caps=host("kvm"))[-len(args):] == args
+
+
+@pytest.mark.parametrize("host_name", HOSTS)
+def test_performance_off(host_name):
+    # Without performance mode the host is not consulted: the same command everywhere.
+    prof = profile(performance=False, hugepages=True)
+    prof.network_mode = "user (NAT)"
+    assert build_command(prof, caps=host(host_name, "io_uring", hugepages_free_mb=4096)) == [
+        "qemu-system-x86_64", "-m", "2048", "-smp", "2",
+        "-drive", "file=/images/test.qcow2,format=qcow2",
+        "-drive", "id=cd0,index=2,media=cdrom,file=/isos/install.iso",
+        "-net", "nic", "-net", "user"]
+
+
+def test_performance_off_iso_boot():
+    prof = profile(performance=False, boot="ISO (cdrom)")
+    assert build_command(prof, caps=host("kvm")) == [
+        "qemu-system-x86_64", "-m", "2048", "-smp", "2",
+        "-drive", "id=cd0,index=2,media=cdrom,file=/isos/install.iso",
+        "-drive", "file=/images/test.qcow2,format=qcow2"]
+
+
+def test_usb_controller_added_once():
+    prof = profile()
+    prof.usb_devices = ["046d:c52b", "bus=1,addr=5", "bus=1"]
+    cmd = build_command(prof, caps=host("kvm"))
+    assert cmd[-len(NETWORK_ARGS) - 6:-len(NETWORK_ARGS)] == [
+        "-device", "qemu-xhci,id=xhci",
+        "-device", "usb-host,vendorid=0x046d,productid=0xc52b",
+        "-device", "usb-host,hostbus=1,hostaddr=5"]
+    prof.extra = "-usb"
+    assert "qemu-xhci,id=xhci" not in build_command(prof, caps=host("kvm"))
+
+
+@pytest.mark.parametrize("performance", (False, True))
+def test_command_resources(performance):
+    prof = profile(performance=performance)
+    prof.cpus, prof.ram = 4, 3072
+    assert command_resources(build_command(prof, caps=host("kvm"))) == (4, 3072)
@@ -0,0 +1,139 @@
+import os
+import shutil
+
+import pytest
+
+from usb_inventory import UsbInventory, read_sysfs_devices, device_spec, usb_host_args, has_usb_controller
+
+KEYBOARD = {"idVendor": "046d", "idProduct": "c52b", "manufacturer": "Logitech", "product": "USB Receiver",
+            "bDeviceClass": "00"}
+STICK = {"idVendor": "0781", "idProduct": "5581", "manufacturer": "SanDisk", "product": "Ultra", "serial": "4C53",
+         "bDeviceClass": "00"}
+HUB = {"idVendor": "05e3", "idProduct": "0610", "product": "USB2.0 Hub", "bDeviceClass": "09"}
+
+
+def plug(root, name, bus, devnum, attrs):
+    # One /sys/bus/usb/devices entry ("1-2.3") and its first interface ("1-2.3:1.0").
+    base = os.path.join(root, "bus", "usb", "devices")
+    for entry, files in ((name, dict(attrs, busnum=str(bus), devnum=str(devnum))),
+                         (f"{name}:1.0", {"bInterfaceClass": "03"})):
+        os.makedirs(os.path.join(base, entry), exist_ok=True)
+        for attr, value in files.items():
+            with open(os.path.join(base, entry, attr), "w") as f:
+                f.write(value + "\n")
+
+
+def unplug(root, name):
+    base = os.path.join(root, "bus", "usb", "devices")
+    shutil.rmtree(os.path.join(base, name))
+    shutil.rmtree(os.path.join(base, f"{name}:1.0"))
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    # Bus 1: root hub, an external hub on port 1 with the receiver behind it,
+    # and a stick on port 3. Bus 2: a second identical stick.
+    root = str(tmp_path)
+    plug(root, "usb1", 1, 1, dict(HUB, bDeviceClass="09"))
+    plug(root, "1-1", 1, 2, HUB)
+    plug(root, "1-1.2", 1, 5, KEYBOARD)
+    plug(root, "1-3", 1, 7, STICK)
+    plug(root, "2-1", 2, 3, STICK)
+    return root
+
+
+def names(devices):
+    return sorted((d.bus, d.port, d.address, d.ids) for d in devices)
+
+
+def test_read_sysfs_skips_hubs_and_interfaces(sysfs):
+    devices = read_sysfs_devices(sysfs)
+    assert names(devices) == [(1, "1.2", 5, "046d:c52b"), (1, "3", 7, "0781:5581"), (2, "1", 3, "0781:5581")]
+    stick = next(d for d in devices if d.port == "3")
+    assert (stick.manufacturer, stick.product, stick.serial) == ("SanDisk", "Ultra", "4C53")
+    assert stick.label() == "0781:5581 SanDisk Ultra (bus 1, port 3)"
+
+
+def test_incomplete_entry_skipped(sysfs):
+    # A device still being set up has no devnum yet.
+    plug(sysfs, "1-4", 1, 9, KEYBOARD)
+    os.remove(os.path.join(sysfs, "bus", "usb", "devices", "1-4", "devnum"))
+    assert "1.4" not in {d.port for d in read_sysfs_devices(sysfs)}
+
+
+def test_refresh_reports_changes(sysfs):
+    changes = []
+    inventory = UsbInventory(on_change=lambda added, removed: changes.append((names(added), names(removed))),
+                             sysfs_root=sysfs)
+    added, removed = inventory.refresh()
+    assert len(added) == 3 and removed == []
+    assert inventory.refresh() == ([], [])
+    assert len(changes) == 1
+
+    unplug(sysfs, "1-1.2")
+    added, removed = inventory.refresh()
+    assert (names(added), names(removed)) == ([], [(1, "1.2", 5, "046d:c52b")])
+
+    plug(sysfs, "1-1.4", 1, 8, KEYBOARD)
+    added, removed = inventory.refresh()
+    assert (names(added), names(removed)) == ([(1, "1.4", 8, "046d:c52b")], [])
+    assert changes[1:] == [([], [(1, "1.2", 5, "046d:c52b")]), ([(1, "1.4", 8, "046d:c52b")], [])]
+    assert inventory.error == ""
+
+
+def test_replug_with_new_devnum(sysfs):
+    inventory = UsbInventory(sysfs_root=sysfs)
+    inventory.refresh()
+    # Same port, new address: reported as removed and added again, so a
+    # bus/addr selection can follow it.
+    unplug(sysfs, "1-3")
+    plug(sysfs, "1-3", 1, 11, STICK)
+    added, removed = inventory.refresh()
+    assert (names(added), names(removed)) == ([(1, "3", 11, "0781:5581")], [(1, "3", 7, "0781:5581")])
+    assert sorted(d.address for d in inventory.snapshot()) == [3, 5, 11]
+
+
+def test_device_spec_and_host_args(sysfs):
+    inventory = UsbInventory(sysfs_root=sysfs)
+    inventory.refresh()
+    by_port = {(d.bus, d.port): d for d in inventory.snapshot()}
+    # Only one receiver: vendor:product. Two identical sticks: bus and address.
+    assert inventory.spec(by_port[1, "1.2"]) == "046d:c52b"
+    assert inventory.spec(by_port[1, "3"]) == "bus=1,addr=7"
+    assert inventory.spec(by_port[2, "1"]) == "bus=2,addr=3"
+    assert usb_host_args(inventory.spec(by_port[1, "1.2"])) == \
+        ["-device", "usb-host,vendorid=0x046d,productid=0xc52b"]
+    assert usb_host_args(inventory.spec(by_port[2, "1"])) == ["-device", "usb-host,hostbus=2,hostaddr=3"]
+    # With one stick left its spec goes back to vendor:product.
+    unplug(sysfs, "2-1")
+    inventory.refresh()
+    assert device_spec(by_port[1, "3"], inventory.snapshot()) == "0781:5581"
+
+
+@pytest.mark.parametrize("spec, args", [
+    ("046d:c52b", ["-device", "usb-host,vendorid=0x046d,productid=0xc52b"]),
+    ("0x46d:0xc52b", ["-device", "usb-host,vendorid=0x046d,productid=0xc52b"]),
+    ("bus=1,addr=5", ["-device", "usb-host,hostbus=1,hostaddr=5"]),
+    ("bus=003,addr=012", ["-device", "usb-host,hostbus=3,hostaddr=12"]),
+])
+def test_usb_host_args(spec, args):
+    assert usb_host_args(spec) == args
+
+
+@pytest.mark.parametrize("spec", ["bus=1", "bus=1,addr=", "bus=x,addr=2", "046d", "046d:zz", ""])
+def test_usb_host_args_invalid(spec):
+    with pytest.raises(ValueError):
+        usb_host_args(spec)
+
+
+@pytest.mark.parametrize("args, present", [
+    ([], False),
+    (["-usb"], True),
+    (["-device", "qemu-xhci,id=x"], True),
+    (["-device", "usb-ehci"], True),
+    (["-machine", "q35,usb=on"], True),
+    (["-M", "pc"], False),
+    (["-device", "usb-tablet"], False),
+])
+def test_has_usb_controller(args, present):
+    assert has_usb_controller(args) is present
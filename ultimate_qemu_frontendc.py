@@ -1,17 +1,33 @@
 import sys
+from startup_profiler import profiler
+if any(a.startswith("--profile-startup") for a in sys.argv):
+    profiler.enable()
 import os
-import subprocess
-import json
-import requests
+import time
 import threading
 import shutil
+from concurrent.futures import Future
 import platform
+from collections import deque
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QFileDialog, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QSpinBox, QComboBox, QTextEdit, QMessageBox, QListWidget,
-    QInputDialog, QProgressBar, QCheckBox, QGroupBox, QMenuBar, QAction
+    QLabel, QLineEdit, QSpinBox, QComboBox, QPlainTextEdit, QMessageBox, QListWidget,
+    QInputDialog, QProgressBar, QCheckBox, QGroupBox, QMenuBar, QAction, QListWidgetItem,
+    QToolButton, QDoubleSpinBox, QGridLayout, QTableView, QHeaderView, QAbstractItemView
 )
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QFileSystemWatcher, QAbstractTableModel, QModelIndex
+from PyQt5.QtGui import QPainter, QPainterPath, QColor, QPen
+from profile_store import QemuProfile, ProfileSummary, ProfileStore, PROFILE_DB_FILE
+from profile_index import ProfileIndex
+from qemu_command import (build_command, check_profile, format_command, QemuCommandError, CDROM_DRIVE_ID,
+                          qemu_img_path, performance_notes, DISK_BUSES, set_disk, pin_disk_format)
+from host_caps import host_caps
+from disk_image import inspector, describe_image, snapshot_summary, human_size, ImageFormatError
+from vm_registry import RunRegistry, registry_path, db_namespace
+from usb_inventory import usb_host_args
+# The supervisor, agent client, scheduler, fleet and telemetry modules (and
+# with them asyncio) are imported where first used, mostly on the worker
+# thread that starts VM control once the window shows.
 
 # ===== App Info & Changelog =====
 APP_VERSION = "v1.0"
@@ -25,30 +41,50 @@ CHANGELOG = """
 - About box & changelog bar added
 """
 
-try:
-    import usb.core
-    import usb.util
-    pyusb_available = True
-except ImportError:
-    pyusb_available = False
-
 CONFIG_FILE = "ultimate_qemu_profiles.json"
+DIGEST_CACHE_FILE = "ultimate_qemu_digests.json"
+ISO_STORE_DIR = "iso_store"
+ISO_INDEX_FILE = "ultimate_qemu_iso_index.json"
+UPDATE_CACHE_FILE = "ultimate_qemu_updates.json"
+EXTERNAL_VM_POLL_MS = 5000
+ADOPTED_LOG_LINES = 50
+
+# (label, operation, target format) offered by the Disk Maintenance panel.
+MAINTENANCE_ACTIONS = [
+    ("Compact (drop zeroed blocks)", "compact", None),
+    ("Compress (qcow2)", "compress", None),
+    ("Convert to qcow2", "convert", "qcow2"),
+    ("Convert to raw", "convert", "raw"),
+    ("Merge overlay into its backing file", "merge", None),
+]
+
+# Which profiles the Fleet panel acts on.
+FLEET_SELECTED = "Selected profiles"
+FLEET_LISTED = "Profiles in the list"
+FLEET_TAGGED = "Profiles tagged"
+FLEET_TARGETS = (FLEET_SELECTED, FLEET_LISTED, FLEET_TAGGED)
 
 ISO_LIST = [
     {
         "name": "Ubuntu 24.04 LTS Desktop",
+        "source": "ubuntu-lts",
         "url": "https://releases.ubuntu.com/24.04/ubuntu-24.04-desktop-amd64.iso",
-        "filename": "ubuntu-24.04-desktop-amd64.iso"
+        "filename": "ubuntu-24.04-desktop-amd64.iso",
+        "checksum_url": "https://releases.ubuntu.com/24.04/SHA256SUMS"
     },
     {
         "name": "Fedora Workstation 40",
+        "source": "fedora-workstation",
         "url": "https://download.fedoraproject.org/pub/fedora/linux/releases/40/Workstation/x86_64/iso/Fedora-Workstation-Live-x86_64-40-1.14.iso",
-        "filename": "Fedora-Workstation-Live-x86_64-40-1.14.iso"
+        "filename": "Fedora-Workstation-Live-x86_64-40-1.14.iso",
+        "checksum_url": "https://download.fedoraproject.org/pub/fedora/linux/releases/40/Workstation/x86_64/iso/Fedora-Workstation-40-1.14-x86_64-CHECKSUM"
     },
     {
         "name": "Debian 12.5.0 netinst",
+        "source": "debian-netinst",
         "url": "https://cdimage.debian.org/debian-cd/current/amd64/iso-cd/debian-12.5.0-amd64-netinst.iso",
-        "filename": "debian-12.5.0-amd64-netinst.iso"
+        "filename": "debian-12.5.0-amd64-netinst.iso",
+        "checksum_url": "https://cdimage.debian.org/debian-cd/current/amd64/iso-cd/SHA256SUMS"
     },
     {
         "name": "Windows 11 (Eval, English, x64)",
@@ -62,41 +98,332 @@ UBUNTU_URL = "https://releases.ubuntu.com/"
 FEDORA_URL = "https://getfedora.org/en/workstation/download/"
 DEBIAN_URL = "https://www.debian.org/CD/http-ftp/"
 
-class QemuProfile:
-    def __init__(self, name="Default VM"):
-        self.name = name
-        self.qemu_path = ""
-        self.arch = "x86_64"
-        self.iso = ""
-        self.disk = ""
-        self.ram = 2048
-        self.cpus = 2
-        self.boot = "ISO (cdrom)"
-        self.extra = ""
-        self.network_mode = "user"
-        self.network_options = ""
-        self.usb_devices = []
-        self.ovmf_enabled = False
-        self.ovmf_path = ""
-        self.snapshots = []
-        self.secondary_isos = []
-        self.iso_library_dir = ""
-    def to_dict(self):
-        return self.__dict__
-    @staticmethod
-    def from_dict(d):
-        p = QemuProfile()
-        p.__dict__.update(d)
-        if not hasattr(p, "usb_devices"):
-            p.usb_devices = []
-        if not hasattr(p, "snapshots"):
-            p.snapshots = []
-        if not hasattr(p, "secondary_isos"):
-            p.secondary_isos = []
-        if not hasattr(p, "iso_library_dir"):
-            p.iso_library_dir = ""
-        return p
+def usb_wanted(prof):
+    # A profile's USB devices as QEMU arguments, so old "0x46d:0xc52b" entries match too.
+    wanted = set()
+    for spec in prof.usb_devices:
+        try:
+            wanted.add(tuple(usb_host_args(spec)))
+        except ValueError:
+            pass
+    return wanted
+
+
+class CollapsibleSection(QWidget):
+    # Header button plus a body that is only constructed on first expand.
+    def __init__(self, title, builder, parent=None):
+        super().__init__(parent)
+        self.builder = builder
+        self.body = None
+        self.toggle = QToolButton()
+        self.toggle.setText(title)
+        self.toggle.setCheckable(True)
+        self.toggle.setToolButtonStyle(Qt.ToolButtonTextBesideIcon)
+        self.toggle.setArrowType(Qt.RightArrow)
+        self.toggle.setStyleSheet("QToolButton { border: none; font-weight: bold; }")
+        self.toggle.toggled.connect(self.set_expanded)
+        self.section_layout = QVBoxLayout()
+        self.section_layout.setContentsMargins(0, 0, 0, 0)
+        self.section_layout.addWidget(self.toggle)
+        self.setLayout(self.section_layout)
+
+    @property
+    def built(self):
+        return self.body is not None
+
+    def set_expanded(self, expanded):
+        if expanded and self.body is None:
+            with profiler.phase(f"build panel: {self.toggle.text()}"):
+                self.body = self.builder()
+            self.section_layout.addWidget(self.body)
+        if self.toggle.isChecked() != expanded:
+            self.toggle.setChecked(expanded)
+        self.toggle.setArrowType(Qt.DownArrow if expanded else Qt.RightArrow)
+        if self.body is not None:
+            self.body.setVisible(expanded)
+
+
+class ProfileListModel(QAbstractTableModel):
+    # Profile sidebar backed by a ProfileIndex. Saving, creating or deleting a
+    # profile and VM state changes touch only that profile's row; a new search
+    # re-filters the index in memory and resets the view once. Status comes
+    # from the supervisor's VMs, plus VMs another frontend started (external).
+    COLUMNS = ("Name", "Status")
+    STOPPED_COLOR = QColor(128, 128, 128)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.profiles = ProfileIndex()
+        self.query = ""
+        self.states = {}
+        self.external = set()
+        self.changing = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.profiles.shown)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        profile_id = self.profiles.shown[index.row()]
+        if role == Qt.DisplayRole:
+            return self.profiles.get(profile_id).name if index.column() == 0 else self.status(profile_id)
+        if role == Qt.ToolTipRole:
+            s = self.profiles.get(profile_id)
+            lines = [s.name, f"Architecture: {s.arch}", f"ISO: {s.iso or '-'}", f"Disk: {s.disk or '-'}"]
+            if s.tags:
+                lines.append("Tags: " + ", ".join(s.tags))
+            return "\n".join(lines)
+        if role == Qt.ForegroundRole and index.column() == 1 and self.status(profile_id) == "stopped":
+            return self.STOPPED_COLOR
+        if role == Qt.UserRole:
+            return profile_id
+        return None
+
+    def status(self, profile_id):
+        state = self.states.get(profile_id)
+        if state is not None:
+            from vm_supervisor import ACTIVE_STATES, CRASHED
+            if state in ACTIVE_STATES or state == CRASHED:
+                return state
+        return "running elsewhere" if profile_id in self.external else "stopped"
+
+    def profile_id(self, row):
+        return self.profiles.shown[row]
+
+    def row_of(self, profile_id):
+        return self.profiles.row(profile_id)
+
+    def reset(self, summaries):
+        self.beginResetModel()
+        self.profiles.reset(summaries)
+        self.profiles.filter(self.query)
+        self.endResetModel()
+
+    def set_query(self, query):
+        self.beginResetModel()
+        self.query = query
+        self.profiles.filter(query)
+        self.endResetModel()
+
+    def _before_change(self, change, row):
+        self.changing = True
+        if change == "inserted":
+            self.beginInsertRows(QModelIndex(), row, row)
+        elif change == "removed":
+            self.beginRemoveRows(QModelIndex(), row, row)
+
+    def _after_change(self, change, row):
+        if change == "inserted":
+            self.endInsertRows()
+        elif change == "removed":
+            self.endRemoveRows()
+        self.changing = False
+        if change == "changed":
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+    def put(self, summary):
+        change, row = self.profiles.put(summary, self._before_change)
+        self._after_change(change, row)
+
+    def remove(self, profile_id):
+        self.states.pop(profile_id, None)
+        if self.profiles.remove(profile_id, self._before_change) >= 0:
+            self._after_change("removed", -1)
+
+    def status_changed(self, profile_id):
+        row = self.profiles.row(profile_id)
+        if row >= 0:
+            self.dataChanged.emit(self.index(row, 1), self.index(row, 1))
+
+    def set_state(self, profile_id, state):
+        self.states[profile_id] = state
+        self.status_changed(profile_id)
+
+    def set_external(self, profile_ids):
+        changed = self.external ^ profile_ids
+        self.external = profile_ids
+        for profile_id in changed:
+            self.status_changed(profile_id)
+
+
+class LogView(QWidget):
+    # Output log backed by a bounded LogBuffer. append() only touches the
+    # buffer, so it is safe from any thread; the view is woken by a queued
+    # signal and adds everything that arrived since in one append per
+    # interval, so a noisy guest costs one repaint per batch, not per line.
+    # The text widget holds at most max_blocks lines; changing the source or
+    # severity filter re-renders from the buffer.
+    lines_pending = pyqtSignal()
+
+    def __init__(self, lines_per_source=5000, max_blocks=5000, interval_ms=100, parent=None):
+        super().__init__(parent)
+        from log_buffer import LogBuffer, FRONTEND, DEBUG, WARNING, ERROR
+        self.max_blocks = max_blocks
+        self.interval_ms = interval_ms
+        self.buffer = LogBuffer(lines_per_source, on_pending=self.lines_pending.emit)
+        self.names = {FRONTEND: "Frontend"}
+        self.shown = deque(maxlen=max_blocks)
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setUndoRedoEnabled(False)
+        self.text.setMaximumBlockCount(max_blocks)
+        self.source_combo = QComboBox()
+        self.source_combo.addItem("All sources", None)
+        self.source_combo.addItem("Frontend", FRONTEND)
+        self.severity_combo = QComboBox()
+        for label, severity in (("All messages", DEBUG), ("Warnings and errors", WARNING), ("Errors only", ERROR)):
+            self.severity_combo.addItem(label, severity)
+        self.source_combo.currentIndexChanged.connect(self.refilter)
+        self.severity_combo.currentIndexChanged.connect(self.refilter)
+        self.clear_btn = QPushButton("Clear")
+        self.clear_btn.clicked.connect(self.clear)
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)
+        self.lines_pending.connect(self.schedule_flush)
+        h_filter = QHBoxLayout()
+        h_filter.addWidget(self.source_combo)
+        h_filter.addWidget(self.severity_combo)
+        h_filter.addWidget(self.clear_btn)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(h_filter)
+        layout.addWidget(self.text)
+        self.setLayout(layout)
+
+    def append(self, text, source=None, severity=None):
+        # source None is the frontend itself.
+        from log_buffer import FRONTEND
+        self.buffer.append(FRONTEND if source is None else source, text, severity)
+
+    def set_source_name(self, source, name):
+        self.names[source] = name
+        index = self.source_combo.findData(source)
+        if index < 0:
+            self.source_combo.addItem(name, source)
+        else:
+            self.source_combo.setItemText(index, name)
+
+    def filters(self):
+        return self.source_combo.currentData(), self.severity_combo.currentData()
+
+    def format(self, line):
+        from log_buffer import FRONTEND
+        _, _, source, _, text = line
+        return text if source == FRONTEND else f"[{self.names.get(source, source)}] {text}"
+
+    def schedule_flush(self):
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(self.interval_ms)
+
+    def flush(self):
+        from log_buffer import matches
+        lines, dropped = self.buffer.drain()
+        source, severity = self.filters()
+        texts = [self.format(l) for l in lines[-self.max_blocks:] if matches(l, source, severity)]
+        if dropped:
+            texts.insert(0, f"... {dropped} lines not shown while the log was busy; change the filter to reload ...")
+        if not texts:
+            return
+        bar = self.text.verticalScrollBar()
+        follow = bar.value() >= bar.maximum() - 2
+        overflow = len(self.shown) + len(texts) - self.max_blocks
+        self.shown.extend(texts)
+        if overflow > self.max_blocks // 10:
+            # Trimming thousands of blocks off the top is far slower than
+            # replacing the document with what is left.
+            self.set_text(follow)
+        else:
+            self.text.appendPlainText("\n".join(texts))
+            if follow:
+                bar.setValue(bar.maximum())
+
+    def set_text(self, follow=True):
+        self.text.setPlainText("\n".join(self.shown))
+        if follow:
+            bar = self.text.verticalScrollBar()
+            bar.setValue(bar.maximum())
+
+    def refilter(self):
+        self.buffer.drain()
+        source, severity = self.filters()
+        self.shown.clear()
+        self.shown.extend(self.format(l) for l in self.buffer.lines(source, severity, self.max_blocks))
+        self.set_text()
+
+    def clear(self):
+        source, _ = self.filters()
+        self.buffer.drain()
+        self.buffer.clear(source)
+        self.shown.clear()
+        self.text.clear()
+
+    def toPlainText(self):
+        self.flush()
+        return self.text.toPlainText()
+
+
+class Sparkline(QWidget):
+    # Small line chart of one or two series (e.g. read and write) on a shared
+    # scale. NaN samples leave a gap.
+    COLORS = (QColor(40, 120, 220), QColor(220, 110, 40))
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.series = ()
+        self.setMinimumSize(120, 28)
+
+    def set_series(self, *series):
+        self.series = series
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        w, h = self.width() - 2, self.height() - 2
+        peak = max((v for s in self.series for v in s if v == v), default=0) or 1.0
+        for values, color in zip(self.series, self.COLORS):
+            if len(values) < 2:
+                continue
+            step = w / (len(values) - 1)
+            path = QPainterPath()
+            pen_down = False
+            for i, v in enumerate(values):
+                if v != v:
+                    pen_down = False
+                    continue
+                x, y = 1 + i * step, 1 + h - h * v / peak
+                if pen_down:
+                    path.lineTo(x, y)
+                else:
+                    path.moveTo(x, y)
+                    pen_down = True
+            painter.setPen(QPen(color, 1.5))
+            painter.drawPath(path)
+
+
 class UltimateQemuFrontend(QWidget):
+    startup_finished = pyqtSignal()
+    download_progress = pyqtSignal(object)
+    download_finished = pyqtSignal(str, str, str)
+    log_message = pyqtSignal(str)
+    iso_verify_finished = pyqtSignal()
+    iso_library_scanned = pyqtSignal(str, object)
+    vm_state_changed = pyqtSignal(object)
+    vm_event = pyqtSignal(object, str, object)
+    future_finished = pyqtSignal(object, object)
+    usb_changed = pyqtSignal(object, object)
+    telemetry_sampled = pyqtSignal(object)
+    maintenance_updated = pyqtSignal(object)
+    fleet_result = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
 
@@ -109,12 +436,30 @@ class UltimateQemuFrontend(QWidget):
         self.setWindowTitle("Ultimate QEMU Frontend")
         self.setMinimumSize(920, 650)
         self.layout = QHBoxLayout()
-        self.profile_list = QListWidget()
-        self.profile_list.setMaximumWidth(220)
+        self.profile_model = ProfileListModel(self)
+        # A table with fixed row heights only lays out the rows on screen,
+        # however many profiles there are.
+        self.profile_list = QTableView()
+        self.profile_list.setModel(self.profile_model)
+        self.profile_list.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Several rows can be selected for the fleet actions; the current row is the profile in the form.
+        self.profile_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.profile_list.setShowGrid(False)
+        self.profile_list.setWordWrap(False)
+        self.profile_list.verticalHeader().hide()
+        self.profile_list.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.profile_list.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.profile_list.setColumnWidth(1, 80)
+        self.profile_list.setMaximumWidth(280)
+        self.profile_search = QLineEdit()
+        self.profile_search.setPlaceholderText("Search name, arch, ISO, disk, tags")
+        self.profile_search.setClearButtonEnabled(True)
+        self.profile_search.setMaximumWidth(280)
         self.profile_list_label = QLabel("VM Profiles")
         self.profile_list_label.setAlignment(Qt.AlignCenter)
         self.profile_layout = QVBoxLayout()
         self.profile_layout.addWidget(self.profile_list_label)
+        self.profile_layout.addWidget(self.profile_search)
         self.profile_layout.addWidget(self.profile_list)
         self.new_profile_btn = QPushButton("New Profile")
         self.delete_profile_btn = QPushButton("Delete Profile")
@@ -124,6 +469,7 @@ class UltimateQemuFrontend(QWidget):
         self.right_layout = QVBoxLayout()
         self.fields = {}
         self.add_form_field("VM Name", QLineEdit, "Name of this VM profile", "Default VM")
+        self.add_form_field("Tags", QLineEdit, "Comma-separated labels to search the profile list by", "")
         self.add_form_field("QEMU Executable", QLineEdit, "Path to qemu-system-ARCH.exe", "")
         self.browse_qemu_btn = QPushButton("Browse QEMU")
         self.browse_qemu_btn.clicked.connect(self.browse_qemu)
@@ -134,11 +480,29 @@ class UltimateQemuFrontend(QWidget):
         self.browse_iso_btn.clicked.connect(self.browse_iso)
         self.download_iso_btn = QPushButton("Download ISO")
         self.download_iso_btn.clicked.connect(self.download_iso_dialog)
+        self.download_progress_bar = QProgressBar()
+        self.download_progress_bar.setVisible(False)
+        self.download_status_label = QLabel("")
+        self.download_status_label.setVisible(False)
+        self.cancel_download_btn = QPushButton("Cancel Download")
+        self.cancel_download_btn.setVisible(False)
+        self.cancel_download_btn.clicked.connect(self.cancel_download)
+        self.active_download = None
+        self._iso_store = None
+        self._snapshot_engine = None
+        self._provisioner = None
+        self._update_checker = None
+        self._maintenance = None
+        self.log_message.connect(self.output_text_append)
+        self.download_progress.connect(self.on_download_progress)
+        self.download_finished.connect(self.on_download_finished)
         self.add_form_field("Disk Image", QLineEdit, "Hard disk file", "")
         self.browse_disk_btn = QPushButton("Browse Disk")
         self.browse_disk_btn.clicked.connect(self.browse_disk)
         self.create_disk_btn = QPushButton("Create Disk")
         self.create_disk_btn.clicked.connect(self.create_disk)
+        self.disk_info_label = QLabel("")
+        self.disk_info_label.setWordWrap(True)
         self.add_form_field("RAM (MB)", QSpinBox, "Memory for VM", 2048)
         self.fields["RAM (MB)"].setRange(128, 131072)
         self.add_form_field("CPUs", QSpinBox, "CPU Cores", 2)
@@ -152,74 +516,69 @@ class UltimateQemuFrontend(QWidget):
         self.ovmf_path_input.setPlaceholderText("OVMF/UEFI firmware file (OVMF_CODE.fd)")
         self.browse_ovmf_btn = QPushButton("Browse OVMF")
         self.browse_ovmf_btn.clicked.connect(self.browse_ovmf)
-        self.network_group = QGroupBox("Network Settings")
-        self.network_layout = QHBoxLayout()
-        self.network_mode_combo = QComboBox()
-        self.network_mode_combo.addItems(["user (NAT)", "bridged (TAP)", "custom"])
-        self.network_mode_combo.setToolTip("User = NAT (default), bridged = needs TAP setup, custom = enter manually")
-        self.network_options_input = QLineEdit()
-        self.network_options_input.setPlaceholderText("e.g. -net user,hostfwd=tcp::2222-:22")
-        self.network_layout.addWidget(self.network_mode_combo)
-        self.network_layout.addWidget(self.network_options_input)
-        self.network_group.setLayout(self.network_layout)
-        self.usb_group = QGroupBox("USB Passthrough (attach host devices)")
-        self.usb_layout = QVBoxLayout()
-        self.usb_checkboxes = []
-        self.refresh_usb_btn = QPushButton("Refresh USB List")
-        self.refresh_usb_btn.clicked.connect(self.refresh_usb_list)
-        self.usb_layout.addWidget(self.refresh_usb_btn)
-        self.usb_group.setLayout(self.usb_layout)
-        self.iso_library_group = QGroupBox("ISO Library")
-        self.iso_library_layout = QVBoxLayout()
-        self.iso_library_dir_btn = QPushButton("Choose ISO Library Folder")
-        self.iso_library_dir_btn.clicked.connect(self.choose_iso_library_dir)
-        self.iso_library_list = QListWidget()
-        self.iso_library_list.itemDoubleClicked.connect(self.select_iso_from_library)
-        self.iso_library_layout.addWidget(self.iso_library_dir_btn)
-        self.iso_library_layout.addWidget(self.iso_library_list)
-        self.iso_library_group.setLayout(self.iso_library_layout)
-        self.snapshot_group = QGroupBox("Snapshots")
-        self.snapshot_layout = QHBoxLayout()
-        self.snapshot_list_btn = QPushButton("List")
-        self.snapshot_list_btn.clicked.connect(self.list_snapshots)
-        self.snapshot_create_btn = QPushButton("Create")
-        self.snapshot_create_btn.clicked.connect(self.create_snapshot)
-        self.snapshot_revert_btn = QPushButton("Revert")
-        self.snapshot_revert_btn.clicked.connect(self.revert_snapshot)
-        self.snapshot_delete_btn = QPushButton("Delete")
-        self.snapshot_delete_btn.clicked.connect(self.delete_snapshot)
-        self.snapshot_name_input = QLineEdit()
-        self.snapshot_name_input.setPlaceholderText("Snapshot name")
-        self.snapshot_layout.addWidget(self.snapshot_list_btn)
-        self.snapshot_layout.addWidget(self.snapshot_create_btn)
-        self.snapshot_layout.addWidget(self.snapshot_revert_btn)
-        self.snapshot_layout.addWidget(self.snapshot_delete_btn)
-        self.snapshot_layout.addWidget(self.snapshot_name_input)
-        self.snapshot_group.setLayout(self.snapshot_layout)
-        self.hotplug_group = QGroupBox("Hot Attach/Detach Drives/ISOs")
-        self.hotplug_layout = QVBoxLayout()
-        self.attach_iso_btn = QPushButton("Attach ISO as CD-ROM")
-        self.attach_iso_btn.clicked.connect(self.hot_attach_iso)
-        self.detach_iso_btn = QPushButton("Eject CD-ROM")
-        self.detach_iso_btn.clicked.connect(self.hot_detach_iso)
-        self.hotplug_layout.addWidget(self.attach_iso_btn)
-        self.hotplug_layout.addWidget(self.detach_iso_btn)
-        self.hotplug_group.setLayout(self.hotplug_layout)
+        self.performance_checkbox = QCheckBox("Performance mode (hardware acceleration, virtio, host CPU)")
+        self.performance_checkbox.setToolTip("Use KVM/WHPX/HVF when available, virtio disk and network with I/O threads, cache=none and native AIO")
+        self.performance_checkbox.stateChanged.connect(self.performance_toggled)
+        self.disk_bus_combo = QComboBox()
+        self.disk_bus_combo.addItems(DISK_BUSES)
+        self.disk_bus_combo.setToolTip("virtio-blk is fastest; virtio-scsi supports many disks and TRIM on older guests")
+        self.hugepages_checkbox = QCheckBox("Hugepages")
+        self.hugepages_checkbox.setToolTip("Back guest RAM with hugepages when enough are free (Linux)")
+        self.show_command_btn = QPushButton("Show Command")
+        self.show_command_btn.setToolTip("Show the QEMU command this profile would run, without starting it")
+        self.show_command_btn.clicked.connect(self.show_command)
+        self.fast_start_checkbox = QCheckBox("Fast start")
+        self.fast_start_checkbox.setToolTip("Save the machine state once the guest has booted and resume from it on "
+                                            "later starts. Disk changes made after the saved state are discarded "
+                                            "at the next fast start.")
+        self.save_state_btn = QPushButton("Save State Now")
+        self.save_state_btn.setToolTip("Save the running VM's state as its fast-start point right away")
+        self.save_state_btn.clicked.connect(self.save_fast_start_state)
+        self.discard_state_btn = QPushButton("Discard Saved State")
+        self.discard_state_btn.clicked.connect(self.discard_fast_start_state)
+        self._boot_cache = None
+        self.fast_start_runs = {}
+        self.usb_inventory = None
+        self.usb_rows = {}
+        self.iso_library_root = ""
+        self.iso_index = None
+        self.network_section = CollapsibleSection("Network Settings", self.build_network_panel)
+        self.usb_section = CollapsibleSection("USB Passthrough (attach host devices)", self.build_usb_panel)
+        self.iso_library_section = CollapsibleSection("ISO Library", self.build_iso_library_panel)
+        self.snapshot_section = CollapsibleSection("Snapshots", self.build_snapshot_panel)
+        self.hotplug_section = CollapsibleSection("Hot Attach/Detach Drives/ISOs", self.build_hotplug_panel)
+        self.template_section = CollapsibleSection("Templates && Linked Clones", self.build_template_panel)
+        self.resources_section = CollapsibleSection("Host Resources && CPU Pinning", self.build_resources_panel)
+        self.telemetry_section = CollapsibleSection("Live Telemetry", self.build_telemetry_panel)
+        self.maintenance_section = CollapsibleSection("Disk Maintenance (compact, compress, convert, merge)",
+                                                      self.build_maintenance_panel)
+        self.maintenance_rows = {}
+        self.maintenance_batch = {}
+        self.fleet_section = CollapsibleSection("Fleet (start, stop, restart many VMs)", self.build_fleet_panel)
+        self.fleet_fast_start = {}
+        self.telemetry = None
+        self.telemetry_rows = {}
         self.check_update_btn = QPushButton("Check for QEMU/ISO Updates")
         self.check_update_btn.clicked.connect(self.check_updates)
         self.start_btn = QPushButton("Start VM")
         self.stop_btn = QPushButton("Stop All VMs")
+        self.stop_vm_btn = QPushButton("Stop VM")
+        self.restart_vm_btn = QPushButton("Restart VM")
+        self.vm_status_label = QLabel("Status: stopped")
         self.save_profile_btn = QPushButton("Save Profile")
         h_btns = QHBoxLayout()
         h_btns.addWidget(self.start_btn)
+        h_btns.addWidget(self.stop_vm_btn)
+        h_btns.addWidget(self.restart_vm_btn)
         h_btns.addWidget(self.stop_btn)
         h_btns.addWidget(self.save_profile_btn)
         h_btns.addWidget(self.check_update_btn)
         self.output_label = QLabel("Output Log:")
-        self.output_text = QTextEdit()
-        self.output_text.setReadOnly(True)
+        self.output_text = LogView()
         self.right_layout.addWidget(QLabel("VM Name:"))
         self.right_layout.addWidget(self.fields["VM Name"])
+        self.right_layout.addWidget(QLabel("Tags:"))
+        self.right_layout.addWidget(self.fields["Tags"])
         self.right_layout.addWidget(QLabel("QEMU Executable:"))
         h_qemu = QHBoxLayout()
         h_qemu.addWidget(self.fields["QEMU Executable"])
@@ -233,12 +592,18 @@ class UltimateQemuFrontend(QWidget):
         h_iso.addWidget(self.browse_iso_btn)
         h_iso.addWidget(self.download_iso_btn)
         self.right_layout.addLayout(h_iso)
+        h_dl = QHBoxLayout()
+        h_dl.addWidget(self.download_progress_bar)
+        h_dl.addWidget(self.download_status_label)
+        h_dl.addWidget(self.cancel_download_btn)
+        self.right_layout.addLayout(h_dl)
         self.right_layout.addWidget(QLabel("Disk Image:"))
         h_disk = QHBoxLayout()
         h_disk.addWidget(self.fields["Disk Image"])
         h_disk.addWidget(self.browse_disk_btn)
         h_disk.addWidget(self.create_disk_btn)
         self.right_layout.addLayout(h_disk)
+        self.right_layout.addWidget(self.disk_info_label)
         self.right_layout.addWidget(QLabel("RAM (MB):"))
         self.right_layout.addWidget(self.fields["RAM (MB)"])
         self.right_layout.addWidget(QLabel("CPUs:"))
@@ -252,39 +617,484 @@ class UltimateQemuFrontend(QWidget):
         h_ovmf.addWidget(self.ovmf_path_input)
         h_ovmf.addWidget(self.browse_ovmf_btn)
         self.right_layout.addLayout(h_ovmf)
-        self.right_layout.addWidget(self.network_group)
-        self.right_layout.addWidget(self.usb_group)
-        self.right_layout.addWidget(self.iso_library_group)
-        self.right_layout.addWidget(self.snapshot_group)
-        self.right_layout.addWidget(self.hotplug_group)
+        self.right_layout.addWidget(self.performance_checkbox)
+        h_perf = QHBoxLayout()
+        h_perf.addWidget(QLabel("Disk bus:"))
+        h_perf.addWidget(self.disk_bus_combo)
+        h_perf.addWidget(self.hugepages_checkbox)
+        h_perf.addWidget(self.show_command_btn)
+        self.right_layout.addLayout(h_perf)
+        h_fast = QHBoxLayout()
+        h_fast.addWidget(self.fast_start_checkbox)
+        h_fast.addWidget(self.save_state_btn)
+        h_fast.addWidget(self.discard_state_btn)
+        h_fast.addStretch(1)
+        self.right_layout.addLayout(h_fast)
+        self.right_layout.addWidget(self.network_section)
+        self.right_layout.addWidget(self.usb_section)
+        self.right_layout.addWidget(self.iso_library_section)
+        self.right_layout.addWidget(self.snapshot_section)
+        self.right_layout.addWidget(self.hotplug_section)
+        self.right_layout.addWidget(self.template_section)
+        self.right_layout.addWidget(self.resources_section)
+        self.right_layout.addWidget(self.telemetry_section)
+        self.right_layout.addWidget(self.maintenance_section)
+        self.right_layout.addWidget(self.fleet_section)
         self.right_layout.addLayout(h_btns)
+        self.right_layout.addWidget(self.vm_status_label)
         self.right_layout.addWidget(self.output_label)
         self.right_layout.addWidget(self.output_text)
         self.layout.addLayout(self.right_layout)
 
         # Connect signals
         self.start_btn.clicked.connect(self.start_vm)
+        self.fields["Disk Image"].textChanged.connect(self.update_disk_info)
         self.save_profile_btn.clicked.connect(self.save_profile)
         self.stop_btn.clicked.connect(self.stop_all_vms)
+        self.stop_vm_btn.clicked.connect(self.stop_vm)
+        self.restart_vm_btn.clicked.connect(self.restart_vm)
+        self.vm_state_changed.connect(self.on_vm_state_changed)
+        self.vm_event.connect(self.on_vm_event)
+        self.telemetry_sampled.connect(self.on_telemetry_sampled)
+        self.maintenance_updated.connect(self.on_maintenance_updated)
+        self.fleet_result.connect(self.on_fleet_result)
+        self.future_finished.connect(lambda handler, fut: handler(fut))
         self.new_profile_btn.clicked.connect(self.new_profile)
         self.delete_profile_btn.clicked.connect(self.delete_profile)
-        self.profile_list.currentRowChanged.connect(self.load_profile_to_form)
-        self.profiles = self.load_profiles()
-        if not self.profiles:
-            self.profiles.append(QemuProfile())
-        self.refresh_profile_list()
-        self.load_profile_to_form(0)
-        self.running_processes = []
-        #self.refresh_usb_list()
-        #self.timer = QTimer()
-        #self.timer.timeout.connect(self.refresh_usb_list)
-        #self.timer.start(10000) # USB refresh every 10 seconds
+        self.profile_list.selectionModel().currentRowChanged.connect(self.on_profile_selected)
+        self.profile_search.textChanged.connect(self.filter_profiles)
+        self.profile_store = None
+        self.current_profile_id = None
+        # Registry, agent and QMP sockets all belong to this profile database.
+        self.run_registry = RunRegistry(registry_path(PROFILE_DB_FILE))
+        self.db_namespace = db_namespace(PROFILE_DB_FILE)
+        self.supervisor = None
+        self.guest_status = {}
+        self.hotplugged_disks = {}
 
         # ---- Layout with menu at the very end ----
         main_layout = QVBoxLayout()
         main_layout.setMenuBar(menubar)
         main_layout.addLayout(self.layout)
         self.setLayout(main_layout)
+        profiler.mark("window constructed")
+        # Profiles are loaded once the event loop runs, so the window paints first.
+        QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        profiler.mark("event loop running")
+        with profiler.phase("open profile store"):
+            self.profile_store = ProfileStore(PROFILE_DB_FILE, legacy_json=CONFIG_FILE)
+            summaries = self.load_profiles()
+            if not summaries:
+                self.profile_store.save(QemuProfile())
+                summaries = self.load_profiles()
+        with profiler.phase("populate profile list"):
+            self.profile_model.reset(summaries)
+            self.select_profile(summaries[0].id)
+        # Connecting to the agent (or reading the host topology without it) and
+        # tailing the logs of adopted VMs happen on a worker; the list is usable meanwhile.
+        self.update_vm_status()
+        fut = Future()
+        def run():
+            try:
+                fut.set_result(self.start_supervisor())
+            except Exception as e:
+                fut.set_exception(e)
+        threading.Thread(target=run, daemon=True).start()
+        fut.add_done_callback(lambda f: self.future_finished.emit(self.supervisor_started, f))
+
+    def start_supervisor(self):
+        # Runs on a worker thread. VMs run under the local agent, so they
+        # outlive this window and show in every other window and the CLI.
+        # Without it they run in-process.
+        # Guest output goes straight into the log's ring buffer from the supervisor thread.
+        from cpu_scheduler import DEFAULT_CPU_OVERCOMMIT, DEFAULT_RAM_OVERCOMMIT
+        from log_buffer import WARNING
+        callbacks = {"on_state": self.vm_state_changed.emit, "on_event": self.vm_event.emit,
+                     "on_output": lambda vm_id, stream, line: self.output_text.append(line, vm_id)}
+        cpu_ratio = self.profile_store.setting("cpu_overcommit", DEFAULT_CPU_OVERCOMMIT)
+        ram_ratio = self.profile_store.setting("ram_overcommit", DEFAULT_RAM_OVERCOMMIT)
+        if self.profile_store.setting("use_agent", True):
+            from vm_agent import RemoteSupervisor, AgentError, agent_endpoint, tail_lines
+            try:
+                supervisor = RemoteSupervisor(agent_endpoint(self.db_namespace), f"gui-{os.getpid()}",
+                                              registry=self.run_registry.path, **callbacks).start()
+                supervisor.set_overcommit(cpu_ratio, ram_ratio)
+                # VMs the agent kept running (from an earlier session or another
+                # frontend), with the end of their console log.
+                return supervisor, [(vm, tail_lines(supervisor, vm.vm_id, ADOPTED_LOG_LINES))
+                                    for vm in supervisor.active()]
+            except (AgentError, PermissionError) as e:
+                self.output_text.append(f"VM agent unavailable, VMs will stop with this window: {e}", severity=WARNING)
+        from vm_supervisor import VmSupervisor
+        from cpu_scheduler import CpuScheduler, read_topology
+        supervisor = VmSupervisor(registry=self.run_registry, **callbacks).start()
+        supervisor.scheduler = CpuScheduler(read_topology(), cpu_ratio, ram_ratio, external=self.run_registry.running)
+        return supervisor, []
+
+    def supervisor_started(self, fut):
+        from telemetry import TelemetryCollector, DEFAULT_INTERVAL
+        try:
+            self.supervisor, adopted = fut.result()
+        except Exception as e:
+            from log_buffer import ERROR
+            self.output_text.append(f"Could not start VM control: {e}", severity=ERROR)
+            self.update_vm_status()
+            profiler.mark("startup finished")
+            self.startup_finished.emit()
+            return
+        profiler.mark("VM control ready")
+        # Sampling costs nothing while no VM runs, so history exists before the dashboard is opened.
+        self.telemetry = TelemetryCollector(self.supervisor,
+                                            self.profile_store.setting("telemetry_interval", DEFAULT_INTERVAL),
+                                            on_sample=self.telemetry_sampled.emit).start()
+        self.adopt_running_vms(adopted)
+        # VMs started by the CLI or another window show in the status column.
+        self.external_vm_timer = QTimer(self)
+        self.external_vm_timer.timeout.connect(self.refresh_external_vms)
+        self.external_vm_timer.start(EXTERNAL_VM_POLL_MS)
+        self.refresh_external_vms()
+        if self.resources_section.built:
+            self.refresh_resources()
+        profiler.mark("startup finished")
+        self.startup_finished.emit()
+
+    def adopt_running_vms(self, adopted):
+        # (vm, last log lines) of VMs the agent kept running: their state, and the end of their console log.
+        for vm, lines in adopted:
+            self.output_text.set_source_name(vm.vm_id, vm.name)
+            for line in lines:
+                self.output_text.append(line, vm.vm_id)
+            self.output_text.append(f"{vm.name}: {vm.state} (pid {vm.pid})")
+            self.profile_model.set_state(vm.vm_id, vm.state)
+        self.update_vm_status()
+
+    def vm_control_ready(self):
+        # Until the worker has started the supervisor, VM actions are refused.
+        if self.supervisor is None:
+            QMessageBox.information(self, "Starting", "VM control is still starting; try again in a moment.")
+            return False
+        return True
+
+    # ============ Lazily built panels ============
+    def build_network_panel(self):
+        self.network_group = QGroupBox()
+        self.network_layout = QHBoxLayout()
+        self.network_mode_combo = QComboBox()
+        self.network_mode_combo.addItems(["user (NAT)", "bridged (TAP)", "custom"])
+        self.network_mode_combo.setToolTip("User = NAT (default), bridged = needs TAP setup, custom = enter manually")
+        self.network_options_input = QLineEdit()
+        self.network_options_input.setPlaceholderText("e.g. -net user,hostfwd=tcp::2222-:22")
+        self.network_layout.addWidget(self.network_mode_combo)
+        self.network_layout.addWidget(self.network_options_input)
+        self.network_group.setLayout(self.network_layout)
+        if self.current_profile_id is not None:
+            self.load_network_fields(self.current_profile())
+        return self.network_group
+
+    def build_usb_panel(self):
+        self.usb_group = QGroupBox()
+        self.usb_layout = QVBoxLayout()
+        self.refresh_usb_btn = QPushButton("Refresh USB List")
+        self.refresh_usb_btn.clicked.connect(self.refresh_usb_list)
+        self.usb_layout.addWidget(self.refresh_usb_btn)
+        self.usb_status_label = QLabel("Looking for USB devices...")
+        self.usb_layout.addWidget(self.usb_status_label)
+        self.usb_group.setLayout(self.usb_layout)
+        # The inventory watches for hotplug in the background from now on.
+        from usb_inventory import UsbInventory
+        self.usb_changed.connect(self.on_usb_changed)
+        self.usb_inventory = UsbInventory(on_change=self.usb_changed.emit).start()
+        return self.usb_group
+
+    def build_iso_library_panel(self):
+        self.iso_library_group = QGroupBox()
+        self.iso_library_layout = QVBoxLayout()
+        self.iso_library_dir_btn = QPushButton("Choose ISO Library Folder")
+        self.iso_library_dir_btn.clicked.connect(self.choose_iso_library_dir)
+        self.iso_library_list = QListWidget()
+        self.iso_library_list.itemDoubleClicked.connect(self.select_iso_from_library)
+        from iso_index import IsoLibraryIndex
+        self.iso_index = IsoLibraryIndex(ISO_INDEX_FILE)
+        self.iso_watcher = QFileSystemWatcher()
+        self.iso_watcher.directoryChanged.connect(self.on_iso_dir_changed)
+        self.iso_library_scanned.connect(self.on_iso_library_scanned)
+        self.iso_library_layout.addWidget(self.iso_library_dir_btn)
+        self.iso_library_layout.addWidget(self.iso_library_list)
+        self.iso_verify_btn = QPushButton("Verify && Deduplicate ISOs")
+        self.iso_verify_btn.setToolTip("Check ISO checksums and hardlink identical images across all profiles' library folders")
+        self.iso_verify_btn.clicked.connect(self.verify_and_dedup_isos)
+        self.iso_verify_finished.connect(lambda: self.iso_verify_btn.setEnabled(True))
+        self.iso_library_layout.addWidget(self.iso_verify_btn)
+        self.iso_library_group.setLayout(self.iso_library_layout)
+        if self.current_profile_id is not None:
+            QTimer.singleShot(0, self.refresh_iso_library)
+        return self.iso_library_group
+
+    def build_snapshot_panel(self):
+        self.snapshot_group = QGroupBox()
+        self.snapshot_layout = QVBoxLayout()
+        h_snap = QHBoxLayout()
+        self.snapshot_list_btn = QPushButton("List")
+        self.snapshot_list_btn.clicked.connect(self.list_snapshots)
+        self.snapshot_create_btn = QPushButton("Create")
+        self.snapshot_create_btn.clicked.connect(self.create_snapshot)
+        self.snapshot_revert_btn = QPushButton("Revert")
+        self.snapshot_revert_btn.clicked.connect(self.revert_snapshot)
+        self.snapshot_delete_btn = QPushButton("Delete")
+        self.snapshot_delete_btn.clicked.connect(self.delete_snapshot)
+        self.snapshot_name_input = QLineEdit()
+        self.snapshot_name_input.setPlaceholderText("Snapshot name")
+        h_snap.addWidget(self.snapshot_list_btn)
+        h_snap.addWidget(self.snapshot_create_btn)
+        h_snap.addWidget(self.snapshot_revert_btn)
+        h_snap.addWidget(self.snapshot_delete_btn)
+        h_snap.addWidget(self.snapshot_name_input)
+        self.snapshot_layout.addLayout(h_snap)
+        self.snapshot_list = QListWidget()
+        self.snapshot_list.setMaximumHeight(120)
+        self.snapshot_list.itemClicked.connect(lambda item: self.snapshot_name_input.setText(item.data(Qt.UserRole)))
+        self.snapshot_layout.addWidget(self.snapshot_list)
+        self.snapshot_all_btn = QPushButton("Snapshot All Stopped VMs")
+        self.snapshot_all_btn.setToolTip("Create the same snapshot on every disk of every stopped VM, e.g. before patching")
+        self.snapshot_all_btn.clicked.connect(self.snapshot_all_stopped)
+        self.snapshot_layout.addWidget(self.snapshot_all_btn)
+        self.snapshot_group.setLayout(self.snapshot_layout)
+        if self.current_profile_id is not None:
+            QTimer.singleShot(0, self.refresh_snapshot_list)
+        return self.snapshot_group
+
+    def build_hotplug_panel(self):
+        self.hotplug_group = QGroupBox()
+        self.hotplug_layout = QVBoxLayout()
+        self.attach_iso_btn = QPushButton("Attach ISO as CD-ROM")
+        self.attach_iso_btn.clicked.connect(self.hot_attach_iso)
+        self.detach_iso_btn = QPushButton("Eject CD-ROM")
+        self.detach_iso_btn.clicked.connect(self.hot_detach_iso)
+        self.attach_disk_btn = QPushButton("Hot-plug Disk")
+        self.attach_disk_btn.clicked.connect(self.hot_attach_disk)
+        self.detach_disk_btn = QPushButton("Unplug Disk")
+        self.detach_disk_btn.clicked.connect(self.hot_detach_disk)
+        self.hotplug_layout.addWidget(self.attach_iso_btn)
+        self.hotplug_layout.addWidget(self.detach_iso_btn)
+        self.hotplug_layout.addWidget(self.attach_disk_btn)
+        self.hotplug_layout.addWidget(self.detach_disk_btn)
+        self.hotplug_group.setLayout(self.hotplug_layout)
+        return self.hotplug_group
+    def build_template_panel(self):
+        self.template_group = QGroupBox()
+        self.template_layout = QVBoxLayout()
+        self.template_list = QListWidget()
+        self.template_list.setMaximumHeight(100)
+        self.template_layout.addWidget(self.template_list)
+        h_tmpl = QHBoxLayout()
+        self.mark_template_btn = QPushButton("Mark Disk as Template")
+        self.mark_template_btn.setToolTip("Freeze this profile's disk as a read-only golden image")
+        self.mark_template_btn.clicked.connect(self.mark_template)
+        self.clone_template_btn = QPushButton("Create Clones")
+        self.clone_template_btn.setToolTip("Create new profiles on qcow2 overlays of the selected template, using this profile's settings")
+        self.clone_template_btn.clicked.connect(self.clone_template)
+        self.unmark_template_btn = QPushButton("Unmark")
+        self.unmark_template_btn.clicked.connect(self.unmark_template)
+        self.delete_template_btn = QPushButton("Delete")
+        self.delete_template_btn.clicked.connect(self.delete_template)
+        for btn in (self.mark_template_btn, self.clone_template_btn, self.unmark_template_btn, self.delete_template_btn):
+            h_tmpl.addWidget(btn)
+        self.template_layout.addLayout(h_tmpl)
+        self.clone_progress = QProgressBar()
+        self.clone_progress.setVisible(False)
+        self.template_layout.addWidget(self.clone_progress)
+        self.template_group.setLayout(self.template_layout)
+        QTimer.singleShot(0, self.refresh_template_list)
+        return self.template_group
+
+    def build_resources_panel(self):
+        self.resources_group = QGroupBox()
+        self.resources_layout = QVBoxLayout()
+        self.resources_label = QLabel()
+        self.resources_label.setWordWrap(True)
+        self.resources_layout.addWidget(self.resources_label)
+        h_ratio = QHBoxLayout()
+        # No scheduler (in-process without one), no agent connection or VM
+        # control still starting: the stored settings.
+        from cpu_scheduler import DEFAULT_CPU_OVERCOMMIT, DEFAULT_RAM_OVERCOMMIT
+        resources = None
+        if self.supervisor is not None:
+            from vm_agent import AgentError
+            try:
+                resources = self.supervisor.resources()
+            except AgentError:
+                pass
+        if resources is None:
+            resources = {"cpu_ratio": self.profile_store.setting("cpu_overcommit", DEFAULT_CPU_OVERCOMMIT),
+                         "ram_ratio": self.profile_store.setting("ram_overcommit", DEFAULT_RAM_OVERCOMMIT)}
+        self.cpu_overcommit_spin = QDoubleSpinBox()
+        self.cpu_overcommit_spin.setRange(0.25, 16.0)
+        self.cpu_overcommit_spin.setSingleStep(0.25)
+        self.cpu_overcommit_spin.setValue(resources["cpu_ratio"])
+        self.cpu_overcommit_spin.setToolTip("vCPUs of all running VMs may total this many times the host's logical CPUs")
+        self.ram_overcommit_spin = QDoubleSpinBox()
+        self.ram_overcommit_spin.setRange(0.25, 4.0)
+        self.ram_overcommit_spin.setSingleStep(0.25)
+        self.ram_overcommit_spin.setValue(resources["ram_ratio"])
+        self.ram_overcommit_spin.setToolTip("RAM of all running VMs may total this many times the host's memory")
+        self.cpu_overcommit_spin.valueChanged.connect(self.overcommit_changed)
+        self.ram_overcommit_spin.valueChanged.connect(self.overcommit_changed)
+        h_ratio.addWidget(QLabel("CPU overcommit:"))
+        h_ratio.addWidget(self.cpu_overcommit_spin)
+        h_ratio.addWidget(QLabel("RAM overcommit:"))
+        h_ratio.addWidget(self.ram_overcommit_spin)
+        self.resources_layout.addLayout(h_ratio)
+        self.placement_list = QListWidget()
+        self.placement_list.setMaximumHeight(100)
+        self.resources_layout.addWidget(self.placement_list)
+        self.resources_group.setLayout(self.resources_layout)
+        QTimer.singleShot(0, self.refresh_resources)
+        return self.resources_group
+
+    def build_telemetry_panel(self):
+        from telemetry import DEFAULT_INTERVAL
+        self.telemetry_group = QGroupBox()
+        self.telemetry_layout = QVBoxLayout()
+        h_tel = QHBoxLayout()
+        self.telemetry_interval_spin = QDoubleSpinBox()
+        self.telemetry_interval_spin.setRange(0.5, 60.0)
+        self.telemetry_interval_spin.setSingleStep(0.5)
+        self.telemetry_interval_spin.setSuffix(" s")
+        self.telemetry_interval_spin.setValue(self.telemetry.interval if self.telemetry is not None else
+                                              self.profile_store.setting("telemetry_interval", DEFAULT_INTERVAL))
+        self.telemetry_interval_spin.setToolTip("How often each running VM is sampled")
+        self.telemetry_interval_spin.valueChanged.connect(self.telemetry_interval_changed)
+        self.export_telemetry_btn = QPushButton("Export CSV")
+        self.export_telemetry_btn.clicked.connect(self.export_telemetry)
+        self.telemetry_status_label = QLabel("No VM running.")
+        h_tel.addWidget(QLabel("Sample every:"))
+        h_tel.addWidget(self.telemetry_interval_spin)
+        h_tel.addWidget(self.export_telemetry_btn)
+        h_tel.addWidget(self.telemetry_status_label, 1)
+        self.telemetry_layout.addLayout(h_tel)
+        self.telemetry_grid = QGridLayout()
+        for col, title in enumerate(("VM", "Host CPU", "Memory (RSS)", "Disk read/write", "Network rx/tx")):
+            self.telemetry_grid.addWidget(QLabel(f"<b>{title}</b>"), 0, col)
+        self.telemetry_layout.addLayout(self.telemetry_grid)
+        self.telemetry_group.setLayout(self.telemetry_layout)
+        QTimer.singleShot(0, lambda: self.on_telemetry_sampled(list(self.telemetry.rings) if self.telemetry is not None else []))
+        return self.telemetry_group
+
+    def build_maintenance_panel(self):
+        self.maintenance_group = QGroupBox()
+        self.maintenance_layout = QVBoxLayout()
+        h_op = QHBoxLayout()
+        self.maintenance_op_combo = QComboBox()
+        for label, operation, target in MAINTENANCE_ACTIONS:
+            self.maintenance_op_combo.addItem(label, (operation, target))
+        self.maintenance_run_btn = QPushButton("Run on This VM")
+        self.maintenance_run_btn.clicked.connect(self.maintain_current)
+        self.maintenance_all_btn = QPushButton("Run on All Stopped VMs")
+        self.maintenance_all_btn.clicked.connect(self.maintain_all_stopped)
+        self.maintenance_cancel_btn = QPushButton("Cancel Selected")
+        self.maintenance_cancel_btn.clicked.connect(self.cancel_maintenance)
+        h_op.addWidget(self.maintenance_op_combo, 1)
+        h_op.addWidget(self.maintenance_run_btn)
+        h_op.addWidget(self.maintenance_all_btn)
+        h_op.addWidget(self.maintenance_cancel_btn)
+        self.maintenance_layout.addLayout(h_op)
+        h_limits = QHBoxLayout()
+        self.maintenance_jobs_spin = QSpinBox()
+        self.maintenance_jobs_spin.setRange(1, 16)
+        self.maintenance_jobs_spin.setValue(self.profile_store.setting("maintenance_jobs", 2))
+        self.maintenance_jobs_spin.setToolTip("qemu-img processes running at the same time")
+        self.maintenance_bandwidth_spin = QSpinBox()
+        self.maintenance_bandwidth_spin.setRange(0, 10000)
+        self.maintenance_bandwidth_spin.setSuffix(" MB/s")
+        self.maintenance_bandwidth_spin.setSpecialValueText("unlimited")
+        self.maintenance_bandwidth_spin.setValue(self.profile_store.setting("maintenance_bandwidth_mb", 0))
+        self.maintenance_bandwidth_spin.setToolTip("Total disk bandwidth for all jobs, shared evenly, so running VMs keep theirs")
+        self.maintenance_jobs_spin.valueChanged.connect(self.maintenance_limits_changed)
+        self.maintenance_bandwidth_spin.valueChanged.connect(self.maintenance_limits_changed)
+        h_limits.addWidget(QLabel("Parallel jobs:"))
+        h_limits.addWidget(self.maintenance_jobs_spin)
+        h_limits.addWidget(QLabel("Bandwidth cap:"))
+        h_limits.addWidget(self.maintenance_bandwidth_spin)
+        h_limits.addStretch(1)
+        self.maintenance_layout.addLayout(h_limits)
+        self.maintenance_list = QListWidget()
+        self.maintenance_list.setMaximumHeight(120)
+        self.maintenance_layout.addWidget(self.maintenance_list)
+        self.maintenance_group.setLayout(self.maintenance_layout)
+        if self._maintenance is not None:
+            for job in self._maintenance.snapshot():
+                self.on_maintenance_updated(job)
+        return self.maintenance_group
+
+    def build_fleet_panel(self):
+        self.fleet_group = QGroupBox()
+        self.fleet_layout = QVBoxLayout()
+        h_target = QHBoxLayout()
+        self.fleet_target_combo = QComboBox()
+        self.fleet_target_combo.addItems(FLEET_TARGETS)
+        self.fleet_tag_input = QLineEdit()
+        self.fleet_tag_input.setPlaceholderText("tag")
+        self.fleet_tag_input.setEnabled(False)
+        self.fleet_target_combo.currentIndexChanged.connect(
+            lambda i: self.fleet_tag_input.setEnabled(FLEET_TARGETS[i] == FLEET_TAGGED))
+        self.fleet_start_btn = QPushButton("Start")
+        self.fleet_start_btn.setToolTip("Launch a few at a time, each next one once a VM runs; "
+                                        "VMs that do not fit on the host wait in the queue")
+        self.fleet_start_btn.clicked.connect(lambda: self.run_fleet("start"))
+        self.fleet_stop_btn = QPushButton("Stop")
+        self.fleet_stop_btn.setToolTip("Power button for all at once, then QMP quit and a kill per VM that does not stop")
+        self.fleet_stop_btn.clicked.connect(lambda: self.run_fleet("stop"))
+        self.fleet_restart_btn = QPushButton("Restart")
+        self.fleet_restart_btn.clicked.connect(lambda: self.run_fleet("restart"))
+        h_target.addWidget(QLabel("Apply to:"))
+        h_target.addWidget(self.fleet_target_combo)
+        h_target.addWidget(self.fleet_tag_input, 1)
+        h_target.addWidget(self.fleet_start_btn)
+        h_target.addWidget(self.fleet_stop_btn)
+        h_target.addWidget(self.fleet_restart_btn)
+        self.fleet_layout.addLayout(h_target)
+        h_limits = QHBoxLayout()
+        settings = self.fleet_settings()
+        self.fleet_concurrency_spin = QSpinBox()
+        self.fleet_concurrency_spin.setRange(1, 64)
+        self.fleet_concurrency_spin.setValue(settings["concurrency"])
+        self.fleet_concurrency_spin.setToolTip("VMs booting at the same time, to spare the disks a boot storm")
+        self.fleet_stagger_spin = QDoubleSpinBox()
+        self.fleet_stagger_spin.setRange(0.0, 600.0)
+        self.fleet_stagger_spin.setSuffix(" s")
+        self.fleet_stagger_spin.setValue(settings["stagger"])
+        self.fleet_stagger_spin.setToolTip("At least this long between two launches")
+        self.fleet_powerdown_spin = QDoubleSpinBox()
+        self.fleet_powerdown_spin.setRange(0.0, 3600.0)
+        self.fleet_powerdown_spin.setSuffix(" s")
+        self.fleet_powerdown_spin.setSpecialValueText("skip")
+        self.fleet_powerdown_spin.setValue(settings["powerdown_timeout"])
+        self.fleet_powerdown_spin.setToolTip("Time guests get to shut down after the ACPI power button")
+        self.fleet_quit_spin = QDoubleSpinBox()
+        self.fleet_quit_spin.setRange(1.0, 600.0)
+        self.fleet_quit_spin.setSuffix(" s")
+        self.fleet_quit_spin.setValue(settings["quit_timeout"])
+        self.fleet_quit_spin.setToolTip("Then time after QMP quit before the VM is killed")
+        for spin in (self.fleet_concurrency_spin, self.fleet_stagger_spin, self.fleet_powerdown_spin, self.fleet_quit_spin):
+            spin.valueChanged.connect(self.fleet_settings_changed)
+        h_limits.addWidget(QLabel("At once:"))
+        h_limits.addWidget(self.fleet_concurrency_spin)
+        h_limits.addWidget(QLabel("Stagger:"))
+        h_limits.addWidget(self.fleet_stagger_spin)
+        h_limits.addWidget(QLabel("Power-down:"))
+        h_limits.addWidget(self.fleet_powerdown_spin)
+        h_limits.addWidget(QLabel("Quit:"))
+        h_limits.addWidget(self.fleet_quit_spin)
+        h_limits.addStretch(1)
+        self.fleet_layout.addLayout(h_limits)
+        self.fleet_list = QListWidget()
+        self.fleet_list.setMaximumHeight(120)
+        self.fleet_layout.addWidget(self.fleet_list)
+        self.fleet_group.setLayout(self.fleet_layout)
+        return self.fleet_group
+
     def show_about_dialog(self):
         text = (
             f"<b>Ultimate QEMU Frontend {APP_VERSION}</b><br>"
@@ -321,7 +1131,7 @@ class UltimateQemuFrontend(QWidget):
             self.fields["ISO Image"].setText(fname)
 
     def browse_disk(self):
-        fname, _ = QFileDialog.getOpenFileName(self, 'Select Disk image', '', 'All Files (*)')
+        fname, _ = QFileDialog.getOpenFileName(self, 'Select Disk image', '', 'Disk Images (*.qcow2 *.img *.raw *.vmdk *.vdi *.vhdx *.vhd);;All Files (*)')
         if fname:
             self.fields["Disk Image"].setText(fname)
 
@@ -331,52 +1141,128 @@ class UltimateQemuFrontend(QWidget):
             self.ovmf_path_input.setText(fname)
 
     def download_iso_dialog(self):
-        items = [iso["name"] for iso in ISO_LIST]
+        catalog = self.iso_catalog()
+        items = [iso["name"] for iso in catalog]
         item, ok = QInputDialog.getItem(self, "Download ISO", "Select an ISO to download:", items, 0, False)
         if ok and item:
-            for iso in ISO_LIST:
+            for iso in catalog:
                 if iso["name"] == item:
                     self.download_iso(iso)
                     break
 
     def download_iso(self, iso):
+        if self.active_download:
+            QMessageBox.information(self, "Download Running", "Another ISO download is still in progress.")
+            return
         save_path, _ = QFileDialog.getSaveFileName(self, "Save ISO As", iso["filename"], "ISO Files (*.iso)")
         if not save_path:
             return
         url = iso["url"]
         self.output_text.append(f"Downloading {iso['name']} from {url} ...")
+        from iso_downloader import SegmentedDownloader, DownloadCancelled, ChecksumMismatch, fetch_expected_sha256
+        store = self.iso_store()
+        dl = SegmentedDownloader(url, save_path, progress_cb=self.download_progress.emit)
+        self.active_download = dl
+        self.download_progress_bar.setValue(0)
+        self.download_progress_bar.setVisible(True)
+        self.download_status_label.setText("Connecting...")
+        self.download_status_label.setVisible(True)
+        self.cancel_download_btn.setVisible(True)
         def run():
-            r = requests.get(url, stream=True)
-            total = int(r.headers.get('content-length', 0))
-            with open(save_path, 'wb') as f:
-                downloaded = 0
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-            self.output_text.append(f"Downloaded {iso['name']} to {save_path}")
-            self.fields["ISO Image"].setText(save_path)
-        t = threading.Thread(target=run)
+            try:
+                dl.expected_sha256 = fetch_expected_sha256(iso, dl.session)
+            except Exception as e:
+                self.log_message.emit(f"Could not fetch checksum for {iso['name']}: {e}")
+            try:
+                dl.run()
+                store.digests.put(save_path, dl.sha256)
+                store.ingest(save_path, dl.sha256)
+                store.save()
+                self.log_message.emit(
+                    f"SHA-256 {dl.sha256} " + ("verified" if dl.expected_sha256 else "(no published digest to compare)")
+                )
+                if dl.resumed_bytes:
+                    self.download_finished.emit(iso["name"], save_path, f"resumed at {dl.resumed_bytes} bytes")
+                else:
+                    self.download_finished.emit(iso["name"], save_path, "")
+            except ChecksumMismatch as e:
+                self.download_finished.emit(iso["name"], "", f"rejected: {e}")
+            except DownloadCancelled:
+                self.download_finished.emit(iso["name"], "", "cancelled, partial data kept for resume")
+            except Exception as e:
+                self.download_finished.emit(iso["name"], "", f"failed: {e}")
+        t = threading.Thread(target=run, daemon=True)
         t.start()
 
+    def cancel_download(self):
+        if self.active_download:
+            self.active_download.cancel()
+            self.download_status_label.setText("Cancelling...")
+
+    def on_download_progress(self, progress):
+        from iso_downloader import format_rate, format_eta
+        self.download_progress_bar.setValue(progress.percent)
+        self.download_status_label.setText(
+            f"{progress.downloaded // (1024 * 1024)}/{progress.total // (1024 * 1024)} MiB  "
+            f"{format_rate(progress.rate)}  ETA {format_eta(progress.eta)}"
+        )
+
+    def on_download_finished(self, name, save_path, note):
+        self.active_download = None
+        self.download_progress_bar.setVisible(False)
+        self.download_status_label.setVisible(False)
+        self.cancel_download_btn.setVisible(False)
+        if save_path:
+            self.output_text.append(f"Downloaded {name} to {save_path}" + (f" ({note})" if note else ""))
+            self.fields["ISO Image"].setText(save_path)
+        else:
+            self.output_text.append(f"Download of {name} {note}")
+
+    def iso_store(self):
+        if self._iso_store is None:
+            from iso_cache import DigestCache, IsoStore
+            self._iso_store = IsoStore(ISO_STORE_DIR, DigestCache(DIGEST_CACHE_FILE))
+        return self._iso_store
+
+    def output_text_append(self, text):
+        self.output_text.append(text)
+
     def create_disk(self):
         fname, _ = QFileDialog.getSaveFileName(self, 'Create Disk Image', '', 'QCOW2 Files (*.qcow2);;Raw Files (*.img *.raw);;All Files (*)')
         if fname:
             size, ok = QInputDialog.getInt(self, "Disk Size", "Size in GB:", 10, 1, 2048)
             if not ok:
                 return
-            qemu_img = self.fields["QEMU Executable"].text().replace('qemu-system-', 'qemu-img')
-            if not os.path.exists(qemu_img):
+            qemu_img = qemu_img_path(self.fields["QEMU Executable"].text())
+            if not qemu_img:
                 QMessageBox.warning(self, "qemu-img Not Found", "Could not find qemu-img. Please check your QEMU installation.")
                 return
             fmt = "qcow2" if fname.endswith(".qcow2") else "raw"
-            cmd = [qemu_img, "create", "-f", fmt, fname, f"{size}G"]
-            try:
-                subprocess.check_call(cmd)
-                self.fields["Disk Image"].setText(fname)
-                self.output_text.append(f"Created disk image {fname}")
-            except Exception as e:
-                QMessageBox.warning(self, "Error", f"Failed to create disk: {e}")
+            from provisioning import create_blank
+            def created(path):
+                self.fields["Disk Image"].setText(path)
+                self.output_text.append(f"Created disk image {path}")
+            self.output_text.append(f"Creating {fmt} disk {fname} ({size} GB)...")
+            self.when_done(self.provisioner().submit(create_blank, qemu_img, fname, fmt, size), "Create disk", created)
+
+    def update_disk_info(self, path):
+        # Header read through the cached inspector; cheap enough to run on every edit.
+        path = path.strip()
+        if not path:
+            self.disk_info_label.setText("")
+            return
+        try:
+            chain = inspector.chain(path)
+        except ImageFormatError as e:
+            self.disk_info_label.setText(f"Unreadable image: {e}")
+            return
+        if "error" in chain[0]:
+            self.disk_info_label.setText("Image does not exist yet" if not os.path.exists(path) else chain[0]["error"])
+            return
+        text = describe_image(chain[0])
+        for backing in chain[1:]:
+            text += f"\n  ← {backing['filename']}: " + (backing.get("error") or describe_image(backing))
+        self.disk_info_label.setText(text)
 
     def choose_iso_library_dir(self):
         dirname = QFileDialog.getExistingDirectory(self, "Select ISO Library Folder")
@@ -385,39 +1271,177 @@ class UltimateQemuFrontend(QWidget):
             self.refresh_iso_library()
 
     def refresh_iso_library(self):
-        dir = self.current_profile().iso_library_dir
+        if not self.iso_library_section.built:
+            return
+        root = self.current_profile().iso_library_dir
+        self.iso_library_root = root
+        self.iso_library_list.clear()
+        if not root:
+            self.watch_iso_dirs([])
+            return
+        self.populate_iso_library(self.iso_index.cached_entries(root))
+        self.start_iso_scan(root, None)
+
+    def start_iso_scan(self, root, changed_dir):
+        def run():
+            try:
+                if changed_dir:
+                    entries = self.iso_index.rescan_dir(root, changed_dir)
+                else:
+                    entries = self.iso_index.scan(root)
+                self.iso_index.save()
+            except OSError as e:
+                self.log_message.emit(f"ISO library scan failed: {e}")
+                return
+            self.iso_library_scanned.emit(root, entries)
+        threading.Thread(target=run, daemon=True).start()
+
+    def populate_iso_library(self, entries):
+        from iso_index import describe_entry
+        self.iso_library_list.setUpdatesEnabled(False)
         self.iso_library_list.clear()
-        if dir and os.path.isdir(dir):
-            for f in os.listdir(dir):
-                if f.lower().endswith(".iso"):
-                    self.iso_library_list.addItem(f)
+        for entry in entries:
+            item = QListWidgetItem(describe_entry(entry))
+            item.setData(Qt.UserRole, entry["path"])
+            if entry.get("system"):
+                item.setToolTip(f"{entry['path']}\n{entry['system']}")
+            else:
+                item.setToolTip(entry["path"])
+            self.iso_library_list.addItem(item)
+        self.iso_library_list.setUpdatesEnabled(True)
+
+    def on_iso_library_scanned(self, root, entries):
+        if root != self.iso_library_root:
+            return
+        self.populate_iso_library(entries)
+        self.watch_iso_dirs(self.iso_index.directories(root))
+
+    def watch_iso_dirs(self, dirs):
+        watched = set(self.iso_watcher.directories())
+        wanted = set(dirs)
+        if watched - wanted:
+            self.iso_watcher.removePaths(list(watched - wanted))
+        if wanted - watched:
+            self.iso_watcher.addPaths(list(wanted - watched))
+
+    def on_iso_dir_changed(self, path):
+        if self.iso_library_root:
+            self.start_iso_scan(self.iso_library_root, path)
+
+    def verify_and_dedup_isos(self):
+        profiles = self.profile_store.all()
+        dirs = sorted({p.iso_library_dir for p in profiles if p.iso_library_dir})
+        isos = [p.iso for p in profiles if p.iso and os.path.isfile(p.iso)]
+        known = {iso["filename"]: iso.get("sha256") for iso in ISO_LIST}
+        store = self.iso_store()
+        self.iso_verify_btn.setEnabled(False)
+        self.output_text.append(f"Verifying ISOs in {len(dirs)} library folder(s)...")
+        def run():
+            try:
+                for path in isos:
+                    digest = store.digests.digest(path)
+                    expected = known.get(os.path.basename(path))
+                    if expected and expected.lower() != digest:
+                        self.log_message.emit(f"Checksum MISMATCH for {path}")
+                    else:
+                        self.log_message.emit(f"{os.path.basename(path)}: {digest}")
+                report = store.dedup_dirs(dirs, isos)
+                self.log_message.emit(
+                    f"Checked {report['files']} ISO(s), linked {report['linked']} duplicate(s), "
+                    f"freed {report['bytes_freed'] // (1024 * 1024)} MiB"
+                    + (f"; removed {report['collected']} stored ISO(s) no library file uses, "
+                       f"{report['bytes_collected'] // (1024 * 1024)} MiB" if report["collected"] else "")
+                )
+            except Exception as e:
+                self.log_message.emit(f"ISO verification failed: {e}")
+            finally:
+                self.iso_verify_finished.emit()
+        threading.Thread(target=run, daemon=True).start()
 
     def select_iso_from_library(self, item):
-        dir = self.current_profile().iso_library_dir
-        if dir:
-            self.fields["ISO Image"].setText(os.path.join(dir, item.text()))
+        path = item.data(Qt.UserRole)
+        if path:
+            self.fields["ISO Image"].setText(path)
 
     def ovmf_toggled(self, state):
         enabled = state == Qt.Checked
         self.current_profile().ovmf_enabled = enabled
         self.ovmf_path_input.setEnabled(enabled)
         self.browse_ovmf_btn.setEnabled(enabled)
+
+    def performance_toggled(self, state):
+        enabled = state == Qt.Checked
+        self.disk_bus_combo.setEnabled(enabled)
+        self.hugepages_checkbox.setEnabled(enabled)
+
+    def show_command(self):
+        # Dry run of the form as it is now (saved or not), with the reasoning
+        # behind each performance choice.
+        prof = self.form_to_profile(QemuProfile.from_dict(self.current_profile().to_dict()))
+        usb_devices = self.usb_selection(prof)
+        caps = host_caps(prof.qemu_path)
+        cmd = build_command(prof, usb_devices, caps=caps)
+        # One option per line so long performance command lines stay readable.
+        lines = [format_command(cmd[:1])]
+        for arg in cmd[1:]:
+            if arg.startswith("-"):
+                lines.append(format_command([arg]))
+            else:
+                lines[-1] += " " + format_command([arg])
+        text = "\n".join(performance_notes(prof, caps)) + "\n\n" + " \\\n    ".join(lines)
+        dialog = QMessageBox(self)
+        dialog.setWindowTitle(f"QEMU command for {prof.name}")
+        dialog.setText(text)
+        dialog.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        dialog.exec_()
+
     def current_profile(self):
-        idx = self.profile_list.currentRow()
-        if idx < 0 or idx >= len(self.profiles):
-            return self.profiles[0]
-        return self.profiles[idx]
+        # The profile in the form; a search may have hidden its row.
+        return self.profile_store.get(self.current_profile_id)
 
-    def refresh_profile_list(self):
-        self.profile_list.clear()
-        for prof in self.profiles:
-            self.profile_list.addItem(prof.name)
+    def on_profile_selected(self, current, previous):
+        # The view also moves its current row when rows are removed under it;
+        # only a selection by the user loads another profile.
+        if not self.profile_model.changing and current.isValid() and self.profile_model.profile_id(current.row()) != self.current_profile_id:
+            self.load_profile_to_form(self.profile_model.profile_id(current.row()))
 
-    def load_profile_to_form(self, idx):
-        if idx < 0 or idx >= len(self.profiles):
+    def select_profile(self, profile_id):
+        # Loads profile_id into the form and selects its row, clearing a
+        # search that hides it.
+        if self.profile_model.row_of(profile_id) < 0:
+            self.profile_search.clear()
+        index = self.profile_model.index(self.profile_model.row_of(profile_id), 0)
+        self.profile_list.setCurrentIndex(index)
+        self.profile_list.scrollTo(index)
+        if profile_id != self.current_profile_id:
+            self.load_profile_to_form(profile_id)
+
+    def filter_profiles(self, query):
+        self.profile_model.set_query(query)
+        self.show_current_row()
+
+    def show_current_row(self):
+        # Selects the form's profile, or nothing if the search hides it.
+        row = self.profile_model.row_of(self.current_profile_id) if self.current_profile_id is not None else -1
+        index = self.profile_model.index(row, 0)
+        if index.isValid():
+            self.profile_list.setCurrentIndex(index)
+            self.profile_list.scrollTo(index)
+        else:
+            self.profile_list.clearSelection()
+
+    def refresh_external_vms(self):
+        from vm_supervisor import ACTIVE_STATES
+        ids = {int(k) for k in self.run_registry.running()}
+        self.profile_model.set_external(ids - {i for i, vm in self.supervisor.vms.items() if vm.state in ACTIVE_STATES})
+
+    def load_profile_to_form(self, profile_id):
+        prof = self.profile_store.get(profile_id)
+        if prof is None:
             return
-        prof = self.profiles[idx]
+        self.current_profile_id = profile_id
         self.fields["VM Name"].setText(prof.name)
+        self.fields["Tags"].setText(", ".join(prof.tags))
         self.fields["QEMU Executable"].setText(prof.qemu_path)
         self.fields["Architecture"].setCurrentText(prof.arch)
         self.fields["ISO Image"].setText(prof.iso)
@@ -428,152 +1452,1073 @@ class UltimateQemuFrontend(QWidget):
         self.fields["Extra QEMU Options"].setText(prof.extra)
         self.ovmf_checkbox.setChecked(prof.ovmf_enabled)
         self.ovmf_path_input.setText(prof.ovmf_path)
+        self.performance_checkbox.setChecked(prof.performance)
+        self.disk_bus_combo.setCurrentText(prof.disk_bus)
+        self.hugepages_checkbox.setChecked(prof.hugepages)
+        self.fast_start_checkbox.setChecked(prof.fast_start)
+        self.performance_toggled(self.performance_checkbox.checkState())
+        self.load_network_fields(prof)
+        self.load_usb_selection(prof)
+        self.refresh_iso_library()
+        self.refresh_snapshot_list()
+        self.update_vm_status()
+
+    def load_network_fields(self, prof):
+        if not self.network_section.built:
+            return
         self.network_mode_combo.setCurrentText(prof.network_mode if "bridged" in prof.network_mode else "user (NAT)")
         self.network_options_input.setText(prof.network_options)
-        self.refresh_iso_library()
 
     def save_profile(self):
-        idx = self.profile_list.currentRow()
-        if idx < 0:
+        if self.current_profile_id is None:
             return
-        prof = self.profiles[idx]
+        prof = self.current_profile()
+        self.form_to_profile(prof)
+        self.save_profiles(prof)
+
+    def form_to_profile(self, prof):
         prof.name = self.fields["VM Name"].text()
+        prof.tags = [t.strip() for t in self.fields["Tags"].text().split(",") if t.strip()]
         prof.qemu_path = self.fields["QEMU Executable"].text()
         prof.arch = self.fields["Architecture"].currentText()
         prof.iso = self.fields["ISO Image"].text()
-        prof.disk = self.fields["Disk Image"].text()
+        set_disk(prof, self.fields["Disk Image"].text())
         prof.ram = self.fields["RAM (MB)"].value()
         prof.cpus = self.fields["CPUs"].value()
         prof.boot = self.fields["Boot Device"].currentText()
         prof.extra = self.fields["Extra QEMU Options"].text()
         prof.ovmf_enabled = self.ovmf_checkbox.isChecked()
         prof.ovmf_path = self.ovmf_path_input.text()
-        prof.network_mode = self.network_mode_combo.currentText()
-        prof.network_options = self.network_options_input.text()
-        self.refresh_profile_list()
-        self.profile_list.setCurrentRow(idx)
-        self.save_profiles()
+        prof.performance = self.performance_checkbox.isChecked()
+        prof.disk_bus = self.disk_bus_combo.currentText()
+        prof.hugepages = self.hugepages_checkbox.isChecked()
+        prof.fast_start = self.fast_start_checkbox.isChecked()
+        if self.network_section.built:
+            prof.network_mode = self.network_mode_combo.currentText()
+            prof.network_options = self.network_options_input.text()
+        if self.usb_section.built:
+            prof.usb_devices = self.usb_selection(prof)
+        return prof
 
     def new_profile(self):
         prof = QemuProfile()
-        self.profiles.append(prof)
-        self.refresh_profile_list()
-        self.profile_list.setCurrentRow(len(self.profiles)-1)
+        self.save_profiles(prof)
+        self.select_profile(prof.id)
 
     def delete_profile(self):
-        idx = self.profile_list.currentRow()
-        if idx < 0 or len(self.profiles) <= 1:
+        profile_id = self.current_profile_id
+        if profile_id is None or len(self.profile_model.profiles) <= 1:
             return
-        del self.profiles[idx]
-        self.refresh_profile_list()
-        self.profile_list.setCurrentRow(max(0, idx-1))
-        self.save_profiles()
+        row = self.profile_model.row_of(profile_id)
+        self.profile_store.delete(profile_id)
+        self.boot_cache().forget_profile(profile_id)
+        self.profile_model.remove(profile_id)
+        shown = self.profile_model.profiles.shown
+        self.select_profile(shown[max(0, row - 1)] if shown else self.profile_model.profiles.search("")[0])
 
     def load_profiles(self):
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r") as f:
-                return [QemuProfile.from_dict(d) for d in json.load(f)]
-        return []
+        return self.profile_store.summaries()
 
-    def save_profiles(self):
-        with open(CONFIG_FILE, "w") as f:
-            json.dump([p.to_dict() for p in self.profiles], f, indent=2)
+    def save_profiles(self, prof):
+        self.profile_store.save(prof)
+        self.profile_model.put(ProfileSummary.of(prof))
+        self.show_current_row()
 
     # ============ USB Passthrough ===============
     def refresh_usb_list(self):
-        if not pyusb_available:
+        self.usb_status_label.setText("Refreshing...")
+        def run():
+            self.usb_inventory.refresh()
+            self.usb_changed.emit([], [])
+        threading.Thread(target=run, daemon=True).start()
+
+    def on_usb_changed(self, added, removed):
+        # Only rows for devices that came or went are touched.
+        for dev in removed:
+            row = self.usb_rows.pop(dev.key, None)
+            if row is not None:
+                self.usb_layout.removeWidget(row[0])
+                row[0].deleteLater()
+        wanted = usb_wanted(self.current_profile()) if self.current_profile_id is not None else set()
+        for dev in added:
+            cb = QCheckBox(dev.label())
+            cb.setChecked(tuple(usb_host_args(self.usb_inventory.spec(dev))) in wanted)
+            self.usb_layout.addWidget(cb)
+            self.usb_rows[dev.key] = (cb, dev)
+        if self.usb_inventory.error:
+            self.usb_status_label.setText(self.usb_inventory.error)
+        else:
+            self.usb_status_label.setText(f"{len(self.usb_rows)} device(s); the list follows plugging and unplugging.")
+
+    def usb_selection(self, prof):
+        # Checked devices, plus the profile's devices that are not plugged in
+        # right now (QEMU attaches those by vendor:product when they appear).
+        if not self.usb_section.built:
+            return None
+        present = set()
+        selected = []
+        for cb, dev in self.usb_rows.values():
+            spec = self.usb_inventory.spec(dev)
+            present.add(tuple(usb_host_args(spec)))
+            if cb.isChecked():
+                selected.append(spec)
+        for spec in prof.usb_devices:
+            try:
+                if tuple(usb_host_args(spec)) not in present:
+                    selected.append(spec)
+            except ValueError:
+                pass
+        return selected
+
+    def load_usb_selection(self, prof):
+        if not self.usb_section.built:
             return
-        for c in self.usb_checkboxes:
-            self.usb_layout.removeWidget(c)
-            c.setParent(None)
-        self.usb_checkboxes.clear()
-        try:
-            devs = usb.core.find(find_all=True)
-            for dev in devs:
-                name = f"{hex(dev.idVendor)}:{hex(dev.idProduct)}"
-                cb = QCheckBox(name)
-                self.usb_layout.addWidget(cb)
-                self.usb_checkboxes.append(cb)
-        except Exception as e:
-            self.output_text.append(f"USB error: {e}")
+        wanted = usb_wanted(prof)
+        for cb, dev in self.usb_rows.values():
+            cb.setChecked(tuple(usb_host_args(self.usb_inventory.spec(dev))) in wanted)
 
     # ============ QEMU Control ==================
     def start_vm(self):
+        if not self.vm_control_ready():
+            return
+        from vm_supervisor import ACTIVE_STATES, QUEUED
+        from qmp_client import allocate_qmp_endpoint
         prof = self.current_profile()
-        exe = prof.qemu_path
-        if not exe or not os.path.exists(exe):
-            QMessageBox.warning(self, "QEMU Not Found", "Set the correct QEMU executable.")
-            return
-        cmd = [exe]
-        cmd += ["-m", str(prof.ram)]
-        cmd += ["-smp", str(prof.cpus)]
-        if prof.boot == "ISO (cdrom)":
-            if prof.iso:
-                cmd += ["-cdrom", prof.iso]
-            if prof.disk:
-                cmd += ["-drive", f"file={prof.disk},format=qcow2"]
-        else:
-            if prof.disk:
-                cmd += ["-drive", f"file={prof.disk},format=qcow2"]
-            if prof.iso:
-                cmd += ["-cdrom", prof.iso]
-        if prof.ovmf_enabled and prof.ovmf_path:
-            cmd += ["-drive", f"if=pflash,format=raw,readonly=on,file={prof.ovmf_path}"]
-        if prof.extra:
-            cmd += prof.extra.split()
-        # USB
-        if pyusb_available:
-            for c in self.usb_checkboxes:
-                if c.isChecked():
-                    cmd += ["-device", f"usb-host,hostdevice={c.text()}"]
-        # Networking
-        if prof.network_mode == "user (NAT)":
-            cmd += ["-net", "nic", "-net", "user"]
-        elif prof.network_mode == "bridged (TAP)":
-            cmd += ["-net", "nic", "-net", "tap"]
-        elif prof.network_mode == "custom" and prof.network_options:
-            cmd += prof.network_options.split()
         try:
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.running_processes.append(proc)
-            self.output_text.append(f"Started VM: {' '.join(cmd)}")
+            check_profile(prof)
+        except QemuCommandError as e:
+            QMessageBox.warning(self, "QEMU Not Found", str(e))
+            return
+        usb_devices = self.usb_selection(prof)
+        if self.supervisor.state(prof.id) in ACTIVE_STATES:
+            QMessageBox.information(self, "Already Running", f"{prof.name} is already running.")
+            return
+        busy = self.disk_under_maintenance(prof)
+        if busy:
+            QMessageBox.information(self, "Disk Maintenance", f"{os.path.basename(busy)} is being rewritten; "
+                                                              f"start {prof.name} when the job has finished.")
+            return
+        if pin_disk_format(prof):
+            self.save_profiles(prof)
+        qmp = allocate_qmp_endpoint(prof.id, self.db_namespace)
+        cmd = build_command(prof, usb_devices, qmp=qmp)
+        saved = self.boot_cache().lookup(prof, cmd) if prof.fast_start else None
+        try:
+            self.hotplugged_disks.pop(prof.id, None)
+            vm = self.launch_vm(prof, cmd + self.boot_cache().restore_args(saved) if saved else cmd, qmp)
+            if vm is not None:
+                self.output_text.append(f"{'Queued' if vm.state == QUEUED else 'Started'} VM: {format_command(vm.cmd)}")
+                if prof.fast_start:
+                    self.fast_start_launched(prof, cmd, saved)
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Could not start VM: {e}")
 
+    def launch_vm(self, prof, cmd, qmp):
+        # Admission control: a VM that would overcommit the host is refused,
+        # or queued until running VMs exit if the user agrees.
+        from cpu_scheduler import AdmissionError
+        self.output_text.set_source_name(prof.id, prof.name)
+        try:
+            vm = self.supervisor.launch(prof.id, prof.name, cmd, qmp=qmp)
+        except AdmissionError as e:
+            answer = QMessageBox.question(
+                self, "Host Is Full", f"{prof.name} {e}.\n\nQueue it and start it when other VMs stop?",
+                QMessageBox.Yes | QMessageBox.No)
+            if answer != QMessageBox.Yes:
+                return None
+            vm = self.supervisor.launch(prof.id, prof.name, cmd, queue=True, qmp=qmp)
+        if vm.placement is not None:
+            self.output_text.append(f"{prof.name}: placed {vm.placement}")
+        return vm
+
+    def stop_vm(self):
+        if not self.vm_control_ready():
+            return
+        from vm_supervisor import ACTIVE_STATES
+        prof = self.current_profile()
+        if self.supervisor.state(prof.id) in ACTIVE_STATES:
+            self.supervisor.stop(prof.id, wait=False)
+
+    def restart_vm(self):
+        if not self.vm_control_ready():
+            return
+        prof = self.current_profile()
+        if self.supervisor.state(prof.id) is None:
+            self.start_vm()
+            return
+        threading.Thread(target=self.supervisor.restart, args=(prof.id,), daemon=True).start()
+
     def stop_all_vms(self):
-        for proc in self.running_processes:
+        # Gracefully and in parallel, with the fleet deadlines.
+        if not self.vm_control_ready():
+            return
+        from fleet import stop_fleet
+        vm_ids = [vm.vm_id for vm in self.supervisor.active()]
+        if not vm_ids:
+            self.output_text.append("No VM is running.")
+            return
+        settings = self.fleet_settings()
+        self.output_text.append(f"Stopping all {len(vm_ids)} running VM(s).")
+        self.submit_fleet("stop", stop_fleet(self.supervisor, vm_ids, settings["powerdown_timeout"],
+                                             settings["quit_timeout"], self.fleet_result.emit))
+
+    def on_vm_state_changed(self, info):
+        from vm_supervisor import ACTIVE_STATES, RUNNING, EXITED, CRASHED
+        text = f"{info['name']}: {info['state']}"
+        if info["exit_code"] is not None and info["state"] not in ACTIVE_STATES:
+            text += f" (exit code {info['exit_code']})"
+        if info["error"]:
+            text += f" - {info['error']}"
+        if info["state"] == "restarting":
+            text += f" (restart {info['restarts']})"
+        self.output_text.append(text)
+        self.profile_model.set_state(info["id"], info["state"])
+        self.update_vm_status()
+        if self.resources_section.built:
+            self.refresh_resources()
+        run = self.fast_start_runs.get(info["id"])
+        if run is not None and info["state"] in (EXITED, CRASHED):
+            self.fast_start_ended(info, *self.fast_start_runs.pop(info["id"]))
+        row = self.telemetry_rows.get(info["id"])
+        if row is not None:
+            row[0].setText(info["name"] if info["state"] == RUNNING else f"{info['name']} ({info['state']})")
+
+    def overcommit_changed(self):
+        cpu_ratio = self.cpu_overcommit_spin.value()
+        ram_ratio = self.ram_overcommit_spin.value()
+        if self.supervisor is not None:
+            self.supervisor.set_overcommit(cpu_ratio, ram_ratio)
+        self.profile_store.set_setting("cpu_overcommit", cpu_ratio)
+        self.profile_store.set_setting("ram_overcommit", ram_ratio)
+        self.refresh_resources()
+
+    def refresh_resources(self):
+        if self.supervisor is None:
+            return  # refreshed once VM control has started
+        from vm_agent import AgentError
+        try:
+            resources = self.supervisor.resources()
+        except AgentError:
+            return
+        if resources is None:
+            return
+        self.resources_label.setText(
+            f"Host: {resources['host']}\n"
+            f"Committed: {resources['vcpus']} of {resources['cpu_capacity']} vCPUs, "
+            f"{resources['ram_mb']} of {resources['ram_capacity_mb']} MB RAM")
+        self.placement_list.clear()
+        for vm_id, placement in resources["placements"]:
+            vm = self.supervisor.vms.get(vm_id)
+            pinned = f", {len(vm.pinned)} pinned" if vm and vm.pinned else ""
+            self.placement_list.addItem(f"{vm.name if vm else vm_id}: {placement}{pinned}")
+        for vm_id in resources["queued"]:
+            vm = self.supervisor.vms.get(vm_id)
+            self.placement_list.addItem(f"{vm.name if vm else vm_id}: queued")
+
+    # ============ Live Telemetry =============
+    def telemetry_interval_changed(self, value):
+        if self.telemetry is not None:
+            self.telemetry.interval = value
+        self.profile_store.set_setting("telemetry_interval", value)
+
+    def on_telemetry_sampled(self, vm_ids):
+        # Redraws only while the dashboard is open; the rings keep filling regardless.
+        if not self.telemetry_section.built or not self.telemetry_group.isVisible() or self.telemetry is None:
+            return
+        from telemetry import format_rate
+        from vm_supervisor import RUNNING
+        for vm_id in vm_ids:
+            ring = self.telemetry.rings.get(vm_id)
+            if ring is None:
+                continue
+            row = self.telemetry_rows.get(vm_id)
+            if row is None:
+                row = self.telemetry_rows[vm_id] = self.add_telemetry_row(len(self.telemetry_rows) + 1)
+            latest = ring.latest()
+            disk = ("disk_read_bps", "disk_write_bps")
+            if latest["disk_read_bps"] != latest["disk_read_bps"]:
+                disk = ("io_read_bps", "io_write_bps")  # no QMP: host-side I/O of the QEMU process
+            row[0].setText(self.telemetry.names.get(vm_id, str(vm_id)))
+            values = (
+                ((ring.series("cpu_pct"),), "-" if latest["cpu_pct"] != latest["cpu_pct"] else f"{latest['cpu_pct']:.0f}%"),
+                ((ring.series("rss_mb"),), f"{latest['rss_mb']:.0f} MB"),
+                ((ring.series(disk[0]), ring.series(disk[1])), f"{format_rate(latest[disk[0]])} / {format_rate(latest[disk[1]])}"),
+                ((ring.series("net_rx_bps"), ring.series("net_tx_bps")),
+                 f"{format_rate(latest['net_rx_bps'])} / {format_rate(latest['net_tx_bps'])}"),
+            )
+            for (spark, label), (series, text) in zip(row[1], values):
+                spark.set_series(*series)
+                label.setText(text)
+        running = sum(1 for vm in self.supervisor.active() if vm.state == RUNNING)
+        self.telemetry_status_label.setText(
+            f"{running} VM(s) running; last pass {1000 * self.telemetry.last_pass_cpu:.1f} ms CPU" if running
+            else "No VM running.")
+
+    def add_telemetry_row(self, grid_row):
+        name = QLabel()
+        cells = []
+        for col in range(1, 5):
+            spark = Sparkline()
+            label = QLabel()
+            cell = QVBoxLayout()
+            cell.setSpacing(0)
+            cell.addWidget(spark)
+            cell.addWidget(label)
+            self.telemetry_grid.addLayout(cell, grid_row, col)
+            cells.append((spark, label))
+        self.telemetry_grid.addWidget(name, grid_row, 0)
+        return name, cells
+
+    def export_telemetry(self):
+        if self.telemetry is None or not self.telemetry.rings:
+            QMessageBox.information(self, "Export Telemetry", "No samples yet; start a VM first.")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export Telemetry", "vm_telemetry.csv", "CSV files (*.csv)")
+        if not path:
+            return
+        try:
+            rows = self.telemetry.export_csv(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Export Telemetry", f"Could not write {path}: {e}")
+            return
+        self.output_text.append(f"Exported {rows} telemetry samples to {path}")
+
+    def update_vm_status(self):
+        if self.current_profile_id is None:
+            return
+        if self.supervisor is None:
+            self.vm_status_label.setText("Status: starting VM control...")
+            return
+        from vm_supervisor import ACTIVE_STATES
+        vm = self.supervisor.vms.get(self.current_profile().id)
+        if vm is None:
+            self.vm_status_label.setText("Status: stopped")
+            return
+        text = f"Status: {vm.state}"
+        if vm.pid and vm.state in ACTIVE_STATES:
+            text += f" (pid {vm.pid})"
+            if vm.qmp_ready and vm.vm_id in self.guest_status:
+                text += f", guest {self.guest_status[vm.vm_id]}"
+        elif vm.exit_code is not None:
+            text += f" (exit code {vm.exit_code})"
+        self.vm_status_label.setText(text + f" - log: {vm.log_path}")
+
+    # ============ Live Control (QMP) =============
+    def live_vm(self, action):
+        # Returns the current profile if its VM has a connected QMP socket.
+        if not self.vm_control_ready():
+            return None
+        from vm_supervisor import ACTIVE_STATES
+        prof = self.current_profile()
+        vm = self.supervisor.vms.get(prof.id)
+        if vm is None or vm.state not in ACTIVE_STATES:
+            QMessageBox.information(self, action, f"{prof.name} is not running.")
+            return None
+        if not vm.qmp_ready:
+            QMessageBox.information(self, action, f"{prof.name} has no QMP connection yet.")
+            return None
+        return prof
+
+    def when_done(self, fut, label, on_result=None):
+        # Futures complete on worker threads (QMP, snapshot jobs); handle them on the GUI thread.
+        def handle(f):
             try:
-                proc.terminate()
-            except Exception:
-                pass
-        self.output_text.append("Stopped all running VMs.")
-        self.running_processes.clear()
+                result = f.result()
+            except Exception as e:
+                self.output_text.append(f"{label} failed: {e}")
+                return
+            if on_result:
+                on_result(result)
+            else:
+                self.output_text.append(f"{label}: done")
+        fut.add_done_callback(lambda f: self.future_finished.emit(handle, f))
+
+    def on_vm_event(self, vm_id, name, data):
+        # Events sent while the agent connection was starting arrive before its result.
+        if self.supervisor is None:
+            self.output_text.append(f"{vm_id}: {name} {data or ''}".rstrip())
+            return
+        if name in ("QMP_READY", "STOP", "RESUME", "RESET"):
+            def set_status(result):
+                self.guest_status[vm_id] = result.get("status", "?")
+                self.update_vm_status()
+            self.when_done(self.supervisor.qmp_call(vm_id, "query-status"), "query-status", set_status)
+        if name == "VCPUS_PINNED" and self.resources_section.built:
+            self.refresh_resources()
+        if name not in ("QMP_READY", "RTC_CHANGE"):
+            vm = self.supervisor.vms.get(vm_id)
+            self.output_text.append(f"{vm.name if vm else vm_id}: {name} {data or ''}".rstrip())
+
+    def snapshot_name(self, action):
+        name = self.snapshot_name_input.text().strip()
+        if not name or any(c.isspace() for c in name):
+            QMessageBox.warning(self, action, "Enter a snapshot name without spaces.")
+            return None
+        return name
+
+    def snapshot_engine(self):
+        if self._snapshot_engine is None:
+            from snapshot_engine import SnapshotEngine
+            self._snapshot_engine = SnapshotEngine(is_running=self.vm_is_running)
+        return self._snapshot_engine
+
+    def vm_is_running(self, prof):
+        # Also sees VMs started from the CLI, through the shared run registry
+        # (the only source while VM control is still starting).
+        if self.supervisor is not None:
+            from vm_supervisor import ACTIVE_STATES
+            if self.supervisor.state(prof.id) in ACTIVE_STATES:
+                return True
+        return str(prof.id) in self.run_registry.running()
 
-    # ============ Snapshot, Hotplug, and Updates =============
     def list_snapshots(self):
-        QMessageBox.information(self, "Not Implemented", "Snapshot list not implemented in this sample.")
+        prof = self.current_profile()
+        if not prof.disk:
+            QMessageBox.information(self, "List Snapshots", f"{prof.name} has no disk image.")
+            return
+        self.refresh_snapshot_list(report=True)
+
+    def refresh_snapshot_list(self, report=False):
+        # Listings come from the qcow2 snapshot tables (cached per image until its
+        # mtime changes); QEMU updates them at savevm/delvm, so running VMs work too.
+        if not self.snapshot_section.built or self.current_profile_id is None:
+            return
+        prof = self.current_profile()
+        from snapshot_engine import sync_profile_snapshots
+        self.snapshot_list.clear()
+        lines = []
+        for disk, snaps in self.snapshot_engine().list_profile(prof).items():
+            if isinstance(snaps, Exception):
+                lines.append(f"{os.path.basename(disk)}: {snaps}")
+                continue
+            lines += [f"{os.path.basename(disk)}: {snapshot_summary(snap)}" for snap in snaps]
+            for snap in snaps:
+                item = QListWidgetItem(f"{snap['name']}  ({os.path.basename(disk)})")
+                item.setData(Qt.UserRole, snap["name"])
+                self.snapshot_list.addItem(item)
+        if report:
+            self.output_text.append(f"Snapshots of {prof.name}: " + ("\n  " + "\n  ".join(lines) if lines else "(none)"))
+        if sync_profile_snapshots(self.snapshot_engine(), prof):
+            self.profile_store.save(prof)
+
+    def snapshot_action(self, action, operation, hmp_command, confirm=None):
+        prof = self.current_profile()
+        name = self.snapshot_name(action)
+        if not name:
+            return
+        if confirm and QMessageBox.question(self, action, confirm.format(name=name, vm=prof.name)) != QMessageBox.Yes:
+            return
+        from vm_supervisor import ACTIVE_STATES
+        vm = self.supervisor.vms.get(prof.id) if self.supervisor is not None else None
+        if vm is not None and vm.state in ACTIVE_STATES:
+            # Live: QEMU snapshots every writable disk plus RAM through QMP.
+            if self.live_vm(action) is None:
+                return
+            fut = self.supervisor.qmp_run(prof.id, lambda c: c.hmp(f"{hmp_command} {name}", check=True))
+            def done(_):
+                self.output_text.append(f"{hmp_command} {name}: done")
+                self.refresh_snapshot_list()
+            self.when_done(fut, f"{hmp_command} {name}", done)
+            return
+        if self.vm_is_running(prof):
+            QMessageBox.information(self, action, f"{prof.name} was started elsewhere; stop it first.")
+            return
+        futures = self.snapshot_engine().submit(prof, operation, name)
+        if not futures:
+            QMessageBox.information(self, action, f"{prof.name} has no disk image.")
+            return
+        self.watch_snapshot_jobs(futures, f"{action} {name!r}")
+
+    def watch_snapshot_jobs(self, futures, label):
+        # Reports each job as it ends and refreshes listings once all are done.
+        remaining = [len(futures)]
+        failed = []
+        def one_done(result):
+            remaining[0] -= 1
+            if not result.ok:
+                failed.append(result)
+            self.output_text.append(str(result))
+            if remaining[0] == 0:
+                self.output_text.append(f"{label}: {len(futures) - len(failed)}/{len(futures)} disk(s) ok")
+                self.sync_snapshot_fields({f.result().profile.id: f.result().profile for f in futures})
+        for fut in futures:
+            self.when_done(fut, label, one_done)
+
+    def sync_snapshot_fields(self, profiles):
+        from snapshot_engine import sync_profile_snapshots
+        engine = self.snapshot_engine()
+        for prof in profiles.values():
+            if sync_profile_snapshots(engine, prof):
+                self.profile_store.save(prof)
+        if self.current_profile().id in profiles:
+            self.refresh_snapshot_list()
 
     def create_snapshot(self):
-        QMessageBox.information(self, "Not Implemented", "Snapshot creation not implemented in this sample.")
+        from snapshot_engine import CREATE
+        self.snapshot_action("Create Snapshot", CREATE, "savevm")
 
     def revert_snapshot(self):
-        QMessageBox.information(self, "Not Implemented", "Snapshot revert not implemented in this sample.")
+        from snapshot_engine import APPLY
+        self.snapshot_action("Revert Snapshot", APPLY, "loadvm",
+                             "Revert {vm} to snapshot '{name}'? Changes since then are lost.")
 
     def delete_snapshot(self):
-        QMessageBox.information(self, "Not Implemented", "Snapshot delete not implemented in this sample.")
+        from snapshot_engine import DELETE
+        self.snapshot_action("Delete Snapshot", DELETE, "delvm", "Delete snapshot '{name}' of {vm}?")
+
+    def snapshot_all_stopped(self):
+        from snapshot_engine import CREATE, profile_disks
+        default = time.strftime("pre-patch-%Y%m%d")
+        name, ok = QInputDialog.getText(self, "Snapshot All Stopped VMs", "Snapshot name:", text=default)
+        name = name.strip()
+        if not ok or not name:
+            return
+        if any(c.isspace() for c in name):
+            QMessageBox.warning(self, "Snapshot All Stopped VMs", "Snapshot names cannot contain spaces.")
+            return
+        profiles = [p for p in self.profile_store.all() if profile_disks(p) and not self.vm_is_running(p)]
+        if not profiles:
+            QMessageBox.information(self, "Snapshot All Stopped VMs", "No stopped VMs with disk images.")
+            return
+        futures = self.snapshot_engine().bulk(profiles, CREATE, name)
+        self.output_text.append(f"Snapshotting {len(futures)} disk(s) of {len(profiles)} stopped VM(s) as {name!r}")
+        self.watch_snapshot_jobs(futures, f"Snapshot all stopped VMs {name!r}")
 
     def hot_attach_iso(self):
-        QMessageBox.information(self, "Not Implemented", "Hot attach not implemented in this sample.")
+        prof = self.live_vm("Attach ISO")
+        if prof is None:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Insert ISO", "", "ISO Images (*.iso);;All Files (*)")
+        if not path:
+            return
+        fut = self.supervisor.qmp_call(prof.id, "blockdev-change-medium",
+                                       {"device": CDROM_DRIVE_ID, "filename": path, "format": "raw"})
+        self.when_done(fut, f"Insert {os.path.basename(path)}")
 
     def hot_detach_iso(self):
-        QMessageBox.information(self, "Not Implemented", "Hot detach not implemented in this sample.")
+        prof = self.live_vm("Eject CD-ROM")
+        if prof is None:
+            return
+        fut = self.supervisor.qmp_call(prof.id, "eject", {"device": CDROM_DRIVE_ID, "force": True})
+        self.when_done(fut, "Eject CD-ROM")
+
+    def hot_attach_disk(self):
+        prof = self.live_vm("Hot-plug Disk")
+        if prof is None:
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Hot-plug Disk", "", "Disk Images (*.qcow2 *.img *.raw);;All Files (*)")
+        if not path:
+            return
+        disks = self.hotplugged_disks.setdefault(prof.id, {})
+        n = 0
+        while f"hp{n}" in disks:
+            n += 1
+        dev_id = f"hp{n}"
+        fmt = inspector.format_of(path)
+        import qmp_client
+        async def plug(client):
+            await client.execute("blockdev-add", {"driver": fmt, "node-name": f"{dev_id}-node",
+                                                  "file": {"driver": "file", "filename": path}})
+            try:
+                await client.execute("device_add", {"driver": "virtio-blk-pci", "id": dev_id, "drive": f"{dev_id}-node"})
+            except qmp_client.QmpError:
+                await client.execute("blockdev-del", {"node-name": f"{dev_id}-node"})
+                raise
+        def plugged(_):
+            disks[dev_id] = path
+            self.output_text.append(f"Hot-plugged {path} as {dev_id}")
+        self.when_done(self.supervisor.qmp_run(prof.id, plug), f"Hot-plug {os.path.basename(path)}", plugged)
+
+    def hot_detach_disk(self):
+        prof = self.live_vm("Unplug Disk")
+        if prof is None:
+            return
+        disks = self.hotplugged_disks.get(prof.id, {})
+        if not disks:
+            QMessageBox.information(self, "Unplug Disk", "No disks were hot-plugged into this VM.")
+            return
+        items = [f"{dev_id}: {path}" for dev_id, path in disks.items()]
+        item, ok = QInputDialog.getItem(self, "Unplug Disk", "Disk:", items, 0, False)
+        if not ok:
+            return
+        dev_id = item.split(":", 1)[0]
+        import asyncio
+        async def unplug(client):
+            # The guest must release the device before its block node can go away.
+            deleted = client.expect_event("DEVICE_DELETED", device=dev_id)
+            await client.execute("device_del", {"id": dev_id})
+            await asyncio.wait_for(deleted, 30.0)
+            await client.execute("blockdev-del", {"node-name": f"{dev_id}-node"})
+        def unplugged(_):
+            path = disks.pop(dev_id, "")
+            self.output_text.append(f"Unplugged {dev_id} ({path})")
+        self.when_done(self.supervisor.qmp_run(prof.id, unplug), f"Unplug {dev_id}", unplugged)
+
+    # ============ Templates & Linked Clones =============
+    def provisioner(self):
+        if self._provisioner is None:
+            from provisioning import Provisioner
+            self._provisioner = Provisioner(self.profile_store, is_running=self.vm_is_running)
+        return self._provisioner
+
+    def refresh_template_list(self):
+        if not self.template_section.built or self.profile_store is None:
+            return
+        self.template_list.clear()
+        for t in self.profile_store.templates():
+            clones = len(self.profile_store.clones(t["path"]))
+            item = QListWidgetItem(f"{t['name']}  ({clones} clone(s)) - {t['path']}")
+            item.setData(Qt.UserRole, t["path"])
+            self.template_list.addItem(item)
+
+    def selected_template(self, action):
+        item = self.template_list.currentItem()
+        if item is None:
+            QMessageBox.information(self, action, "Select a template first.")
+            return None
+        return item.data(Qt.UserRole)
+
+    def mark_template(self):
+        from provisioning import TemplateError
+        prof = self.current_profile()
+        if not prof.disk:
+            QMessageBox.information(self, "Mark as Template", f"{prof.name} has no disk image.")
+            return
+        msg = (f"Make {os.path.basename(prof.disk)} a read-only template?\n\n"
+               f"{prof.name} will be moved onto its own linked clone so it keeps working.")
+        if QMessageBox.question(self, "Mark as Template", msg) != QMessageBox.Yes:
+            return
+        try:
+            template = self.provisioner().mark_template(prof.disk)
+        except (TemplateError, OSError) as e:
+            QMessageBox.warning(self, "Mark as Template", str(e))
+            return
+        self.refresh_template_list()
+        def rebased(path):
+            self.output_text.append(f"{prof.name} now runs from {path}")
+            self.profile_model.put(ProfileSummary.of(self.profile_store.get(prof.id)))
+            if self.current_profile_id == prof.id:
+                self.fields["Disk Image"].setText(path)
+        self.when_done(self.provisioner().submit(self.provisioner().rebase_profile, template, prof),
+                       f"Move {prof.name} onto a clone", rebased)
+
+    def clone_template(self):
+        template = self.selected_template("Create Clones")
+        if template is None:
+            return
+        source = self.current_profile()
+        count, ok = QInputDialog.getInt(self, "Create Clones", f"Number of clones (settings from {source.name}):", 5, 1, 500)
+        if not ok:
+            return
+        prefix, ok = QInputDialog.getText(self, "Create Clones", "Name prefix:", text=source.name + "-clone")
+        if not ok or not prefix.strip():
+            return
+        from provisioning import TemplateError
+        try:
+            futures = self.provisioner().clone(template, source, count, prefix.strip())
+        except TemplateError as e:
+            QMessageBox.warning(self, "Create Clones", str(e))
+            return
+        self.clone_progress.setRange(0, len(futures))
+        self.clone_progress.setValue(0)
+        self.clone_progress.setVisible(True)
+        failed = []
+        def one_done(result):
+            self.clone_progress.setValue(self.clone_progress.value() + 1)
+            if result.ok:
+                self.profile_model.put(ProfileSummary.of(result.profile))
+            else:
+                failed.append(result)
+                self.output_text.append(str(result))
+            if self.clone_progress.value() == len(futures):
+                self.clone_progress.setVisible(False)
+                self.output_text.append(f"Created {len(futures) - len(failed)}/{len(futures)} clone(s) of {os.path.basename(template)}")
+                self.refresh_template_list()
+        for fut in futures:
+            self.when_done(fut, "Clone", one_done)
+
+    def unmark_template(self):
+        self.remove_template(unmark=True)
+
+    def delete_template(self):
+        self.remove_template(unmark=False)
+
+    def remove_template(self, unmark):
+        from provisioning import TemplateError
+        template = self.selected_template("Unmark Template" if unmark else "Delete Template")
+        if template is None:
+            return
+        if not unmark and QMessageBox.question(self, "Delete Template", f"Delete {template} from disk?") != QMessageBox.Yes:
+            return
+        try:
+            if unmark:
+                self.provisioner().unmark_template(template)
+            else:
+                self.provisioner().delete_template(template)
+        except (TemplateError, OSError) as e:
+            QMessageBox.warning(self, "Template In Use", str(e))
+            return
+        self.output_text.append(f"{'Unmarked' if unmark else 'Deleted'} template {template}")
+        self.refresh_template_list()
+
+    # ============ Fast Start =============
+    def boot_cache(self):
+        if self._boot_cache is None:
+            from boot_cache import BootCache, DEFAULT_MAX_BYTES
+            from vm_supervisor import ACTIVE_STATES
+            self._boot_cache = BootCache(max_bytes=self.profile_store.setting("boot_cache_max_bytes", DEFAULT_MAX_BYTES),
+                                         is_running=lambda profile_id: self.supervisor is not None and
+                                         self.supervisor.state(profile_id) in ACTIVE_STATES)
+        return self._boot_cache
+
+    def fast_start_launched(self, prof, cmd, saved):
+        # A resumed VM is watched for disk writes, which void its saved state;
+        # a cold one has its state saved once the guest settles after booting.
+        from boot_cache import BootCache, fast_start_backend
+        key = BootCache.key(prof, cmd)
+        self.fast_start_runs[prof.id] = (key, saved is not None, prof)
+        if saved:
+            self.output_text.append(f"{prof.name}: resuming the state saved {time.strftime('%Y-%m-%d %H:%M', time.localtime(saved['created']))}")
+            self.supervisor.call(self.boot_cache().track_resumed(self.supervisor, prof.id, key, prof), wait=False)
+            return
+        backend, why_not = fast_start_backend(prof, cmd)
+        if backend is None:
+            self.output_text.append(f"{prof.name}: fast start is not available: {why_not}")
+            return
+        self.output_text.append(f"{prof.name}: cold boot; its state is saved for fast starts once the guest settles")
+        fut = self.supervisor.call(self.boot_cache().capture_when_ready(
+            self.supervisor, prof.id, prof, cmd, qemu_img_path(prof.qemu_path)), wait=False)
+        self.when_done(fut, f"Save {prof.name} state", lambda entry: self.fast_start_saved(prof, entry))
+
+    def fast_start_saved(self, prof, entry):
+        if entry is None:
+            return
+        self.output_text.append(f"{prof.name}: state saved for fast starts ({human_size(entry['size'])}, "
+                                f"{entry['seconds']:.1f}s); boot cache holds {human_size(self.boot_cache().total_bytes())}")
+
+    def fast_start_ended(self, info, key, resumed, prof):
+        from boot_cache import RESUME_GRACE
+        from vm_supervisor import CRASHED
+        if info["state"] == CRASHED and resumed and info["ended_at"] - info["started_at"] < RESUME_GRACE:
+            self.boot_cache().discard(key)
+            self.output_text.append(f"{prof.name}: could not resume from the saved state; it was discarded, "
+                                    f"the next start boots cold")
+        elif key in self.boot_cache().entries and not self.boot_cache().settle(key, prof):
+            self.output_text.append(f"{prof.name}: wrote to its disks, so the saved state was discarded; "
+                                    f"the next start saves it again")
+
+    def save_fast_start_state(self):
+        prof = self.live_vm("Save State")
+        if prof is None:
+            return
+        vm = self.supervisor.vms[prof.id]
+        fut = self.supervisor.call(self.boot_cache().capture(vm.qmp, prof, vm.cmd, qemu_img_path(prof.qemu_path)), wait=False)
+        run = self.fast_start_runs.get(prof.id)
+        self.fast_start_runs[prof.id] = (self.boot_cache().key(prof, vm.cmd), run[1] if run else False, prof)
+        self.when_done(fut, f"Save {prof.name} state", lambda entry: self.fast_start_saved(prof, entry))
+
+    def discard_fast_start_state(self):
+        prof = self.current_profile()
+        self.boot_cache().forget_profile(prof.id)
+        self.output_text.append(f"{prof.name}: saved state discarded; the next start boots cold")
+
+    # ============ Fleet =============
+    def fleet_settings(self):
+        from fleet import FLEET_CONCURRENCY, FLEET_STAGGER, POWERDOWN_TIMEOUT, QUIT_TIMEOUT
+        setting = self.profile_store.setting
+        return {"concurrency": setting("fleet_concurrency", FLEET_CONCURRENCY),
+                "stagger": setting("fleet_stagger", FLEET_STAGGER),
+                "powerdown_timeout": setting("fleet_powerdown_timeout", POWERDOWN_TIMEOUT),
+                "quit_timeout": setting("fleet_quit_timeout", QUIT_TIMEOUT)}
+
+    def fleet_settings_changed(self):
+        self.profile_store.set_setting("fleet_concurrency", self.fleet_concurrency_spin.value())
+        self.profile_store.set_setting("fleet_stagger", self.fleet_stagger_spin.value())
+        self.profile_store.set_setting("fleet_powerdown_timeout", self.fleet_powerdown_spin.value())
+        self.profile_store.set_setting("fleet_quit_timeout", self.fleet_quit_spin.value())
+
+    def fleet_profiles(self):
+        target = self.fleet_target_combo.currentText()
+        index = self.profile_model.profiles
+        if target == FLEET_TAGGED:
+            ids = index.tagged(self.fleet_tag_input.text().strip()) if self.fleet_tag_input.text().strip() else []
+        elif target == FLEET_LISTED:
+            ids = list(index.shown)
+        else:
+            ids = sorted(self.profile_model.profile_id(i.row()) for i in self.profile_list.selectionModel().selectedRows())
+        return [prof for prof in map(self.profile_store.get, ids) if prof is not None]
+
+    def run_fleet(self, action):
+        if not self.vm_control_ready():
+            return
+        from fleet import start_fleet, stop_fleet, restart_fleet, START, STOP
+        from vm_supervisor import ACTIVE_STATES
+        profiles = self.fleet_profiles()
+        if not profiles:
+            QMessageBox.information(self, "Fleet", "No profiles to act on: select some in the list, "
+                                                   "or give a tag that profiles carry.")
+            return
+        settings = self.fleet_settings()
+        if action == STOP:
+            vm_ids = [prof.id for prof in profiles if self.supervisor.state(prof.id) in ACTIVE_STATES]
+            if not vm_ids:
+                self.output_text.append("Fleet stop: none of the profiles is running.")
+                return
+            self.submit_fleet(action, stop_fleet(self.supervisor, vm_ids, settings["powerdown_timeout"],
+                                                 settings["quit_timeout"], self.fleet_result.emit))
+            return
+        if len(profiles) > 1 and QMessageBox.question(self, "Fleet", f"{action.capitalize()} {len(profiles)} VM(s)?") != QMessageBox.Yes:
+            return
+        rejected = []
+        launches = self.fleet_launches(profiles, rejected)
+        if action == START:
+            coro = start_fleet(self.supervisor, launches, settings["concurrency"], settings["stagger"],
+                               on_result=self.fleet_result.emit)
+        else:
+            coro = restart_fleet(self.supervisor, launches, settings["concurrency"], settings["stagger"],
+                                 powerdown_timeout=settings["powerdown_timeout"], quit_timeout=settings["quit_timeout"],
+                                 on_result=self.fleet_result.emit)
+        self.submit_fleet(action, coro, rejected)
+
+    def fleet_launches(self, profiles, rejected):
+        # What start_vm would launch, minus the questions: VMs that do not fit
+        # are queued, and USB passthrough is the profile's own.
+        from fleet import FleetResult, START, FAILED
+        from qmp_client import allocate_qmp_endpoint
+        launches = []
+        for prof in profiles:
+            try:
+                check_profile(prof)
+                busy = self.disk_under_maintenance(prof)
+                if busy:
+                    raise QemuCommandError(f"{os.path.basename(busy)} is being rewritten")
+            except QemuCommandError as e:
+                result = FleetResult(prof.id, prof.name, START, FAILED, error=str(e))
+                rejected.append(result)
+                self.on_fleet_result(result)
+                continue
+            if pin_disk_format(prof):
+                self.save_profiles(prof)
+            qmp = allocate_qmp_endpoint(prof.id, self.db_namespace)
+            cmd = build_command(prof, qmp=qmp)
+            saved = self.boot_cache().lookup(prof, cmd) if prof.fast_start else None
+            if prof.fast_start:
+                self.fleet_fast_start[prof.id] = (prof, cmd, saved)
+            self.output_text.set_source_name(prof.id, prof.name)
+            launches.append((prof.id, prof.name, cmd + self.boot_cache().restore_args(saved) if saved else cmd,
+                             {"queue": True, "qmp": qmp}))
+        return launches
+
+    def submit_fleet(self, action, coro, rejected=()):
+        if self.fleet_section.built:
+            self.fleet_list.clear()
+        started = time.monotonic()
+        fut = self.supervisor.call(coro, wait=False)
+        self.when_done(fut, f"Fleet {action}", lambda results: self.fleet_done(action, list(rejected) + results, started))
+
+    def on_fleet_result(self, result):
+        from fleet import START, FAILED, ALREADY_RUNNING
+        from log_buffer import WARNING
+        self.output_text.append(str(result), severity=None if result.ok else WARNING)
+        if self.fleet_section.built:
+            self.fleet_list.addItem(str(result))
+        if result.action != START:
+            return
+        run = self.fleet_fast_start.pop(result.vm_id, None)
+        if result.outcome not in (FAILED, ALREADY_RUNNING):
+            self.hotplugged_disks.pop(result.vm_id, None)
+            if run is not None:
+                self.fast_start_launched(*run)
+
+    def fleet_done(self, action, results, started):
+        from fleet import tally
+        text = f"Fleet {action}: {tally(results) or 'nothing to do'} in {time.monotonic() - started:.1f}s"
+        self.output_text.append(text)
+        if self.fleet_section.built:
+            self.fleet_list.addItem(text)
+
+    # ============ Disk Maintenance =============
+    def maintenance(self):
+        if self._maintenance is None:
+            from image_maintenance import MaintenanceQueue
+            bandwidth = self.profile_store.setting("maintenance_bandwidth_mb", 0)
+            self._maintenance = MaintenanceQueue(
+                self.profile_store.setting("maintenance_jobs", 2), bandwidth * 1024 * 1024 or None,
+                in_use=self.disk_in_use, dependents=lambda path: self.provisioner().dependents(path),
+                on_update=self.maintenance_updated.emit)
+        return self._maintenance
+
+    def maintenance_limits_changed(self):
+        jobs = self.maintenance_jobs_spin.value()
+        bandwidth = self.maintenance_bandwidth_spin.value()
+        self.profile_store.set_setting("maintenance_jobs", jobs)
+        self.profile_store.set_setting("maintenance_bandwidth_mb", bandwidth)
+        if self._maintenance is not None:
+            self._maintenance.set_limits(jobs, bandwidth * 1024 * 1024 or None)
+
+    def disk_in_use(self, path):
+        # Name of a running VM with path in its disks' backing chains; called
+        # on the maintenance thread when each job starts.
+        from image_maintenance import disk_user
+        prof = disk_user([p for p in self.profile_store.all() if self.vm_is_running(p)], path)
+        return prof.name if prof is not None else None
+
+    def disk_under_maintenance(self, prof):
+        # The first image of prof's disks or their backing files that a maintenance job will write.
+        if self._maintenance is None:
+            return None
+        from snapshot_engine import profile_disks
+        for disk in profile_disks(prof):
+            try:
+                chain = [link["filename"] for link in inspector.chain(disk)]
+            except ImageFormatError:
+                chain = [disk]
+            for path in chain:
+                if self._maintenance.busy(path):
+                    return path
+        return None
+
+    def maintain_current(self):
+        prof = self.current_profile()
+        if self.vm_is_running(prof):
+            QMessageBox.information(self, "Disk Maintenance", f"Stop {prof.name} first; running disks are not rewritten.")
+            return
+        self.run_maintenance([prof])
+
+    def maintain_all_stopped(self):
+        from snapshot_engine import profile_disks
+        profiles = [p for p in self.profile_store.all() if profile_disks(p) and not self.vm_is_running(p)]
+        if not profiles:
+            QMessageBox.information(self, "Disk Maintenance", "No stopped VMs with disk images.")
+            return
+        label = self.maintenance_op_combo.currentText()
+        if QMessageBox.question(self, "Disk Maintenance", f"{label} the disks of {len(profiles)} stopped VM(s)?") != QMessageBox.Yes:
+            return
+        self.run_maintenance(profiles)
+
+    def run_maintenance(self, profiles):
+        from snapshot_engine import profile_disks
+        operation, target = self.maintenance_op_combo.currentData()
+        queue = self.maintenance()
+        jobs = []
+        for prof in profiles:
+            qemu_img = qemu_img_path(prof.qemu_path)
+            for disk in profile_disks(prof):
+                if os.path.exists(disk):
+                    jobs.append(queue.submit(prof, disk, operation, target, qemu_img=qemu_img))
+        if not jobs:
+            QMessageBox.information(self, "Disk Maintenance", "No disk images found.")
+            return
+        for job in jobs:
+            self.maintenance_batch[job.job_id] = job
+        self.output_text.append(f"Queued {len(jobs)} disk maintenance job(s): {self.maintenance_op_combo.currentText()}")
+
+    def cancel_maintenance(self):
+        item = self.maintenance_list.currentItem()
+        if item is None or self._maintenance is None:
+            QMessageBox.information(self, "Disk Maintenance", "Select a queued or running job first.")
+            return
+        self._maintenance.cancel(item.data(Qt.UserRole))
+
+    def on_maintenance_updated(self, job):
+        if self.maintenance_section.built:
+            item = self.maintenance_rows.get(job.job_id)
+            if item is None:
+                item = self.maintenance_rows[job.job_id] = QListWidgetItem()
+                item.setData(Qt.UserRole, job.job_id)
+                self.maintenance_list.addItem(item)
+            item.setText(job.describe())
+        if not job.finished or job.job_id not in self.maintenance_batch:
+            return
+        self.output_text.append(job.describe())
+        if job.new_path or job.new_format:
+            self.move_profile_disk(job.profile, job.disk, job.new_path or job.disk, job.new_format)
+        if all(j.finished for j in self.maintenance_batch.values()):
+            done = [j for j in self.maintenance_batch.values() if j.reclaimed is not None]
+            self.output_text.append(f"Disk maintenance finished: {len(done)}/{len(self.maintenance_batch)} image(s) ok, "
+                                    f"{human_size(max(0, sum(j.reclaimed for j in done)))} reclaimed")
+            self.maintenance_batch = {}
+
+    def move_profile_disk(self, prof, old, new, new_format=None):
+        # A format change renamed the image (disk.raw -> disk.qcow2); point the profile at it.
+        from image_maintenance import retarget_profile
+        prof = self.profile_store.get(prof.id)
+        if retarget_profile(prof, old, new, new_format):
+            self.save_profiles(prof)
+            if self.current_profile().id == prof.id:
+                self.fields["Disk Image"].setText(prof.disk)
+
+    # ============ Updates =============
+    # ============ Update Checker =============
+    def update_checker(self):
+        if self._update_checker is None:
+            from update_checker import UpdateChecker
+            self._update_checker = UpdateChecker(cache_path=UPDATE_CACHE_FILE)
+        return self._update_checker
+
+    def iso_catalog(self):
+        # ISO_LIST moved to the newest releases found by the last update check (from its cache, no network).
+        from update_checker import apply_updates
+        return apply_updates(ISO_LIST, self.update_checker().cache.results)
 
     def check_updates(self):
-        QMessageBox.information(self, "Not Implemented", "Update checker not implemented in this sample.")
+        # All mirrors are queried at once on a worker thread; within the cache
+        # TTL the last results are shown without any request.
+        from update_checker import UPDATE_SOURCES, current_version
+        listed = {iso.get("source"): iso["filename"] for iso in self.iso_catalog()}
+        current = {s["id"]: current_version(s, listed.get(s["id"])) for s in UPDATE_SOURCES}
+        checker = self.update_checker()
+        self.check_update_btn.setEnabled(False)
+        self.output_text.append("Checking for QEMU and ISO updates...")
+        fut = Future()
+        def run():
+            try:
+                fut.set_result(checker.check(current=current))
+            except Exception as e:
+                fut.set_exception(e)
+        threading.Thread(target=run, daemon=True).start()
+        fut.add_done_callback(lambda f: self.future_finished.emit(self.updates_checked, f))
+
+    def updates_checked(self, fut):
+        from update_checker import format_size
+        self.check_update_btn.setEnabled(True)
+        try:
+            results = fut.result()
+        except Exception as e:
+            self.output_text.append(f"Update check failed: {e}")
+            return
+        lines = []
+        for r in results:
+            if r["error"]:
+                lines.append(f"{r['id']}: could not check ({r['error']})")
+            elif r["newer"]:
+                lines.append(f"{r['label']} is available ({format_size(r['size'])}); the list had {r['current']}.")
+            elif r["current"]:
+                lines.append(f"{r['label']}: up to date.")
+            else:
+                lines.append(f"{r['label']} ({format_size(r['size'])}): {r['url']}")
+        checker = self.update_checker()
+        age = int((time.time() - checker.cache.checked) / 60)
+        checked = ("Checked just now." if age < 1 else
+                   f"Last checked {age} min ago; mirrors are asked again after {checker.ttl / 3600:g} hours.")
+        for line in lines:
+            self.output_text.append(line)
+        newer = any(r["newer"] for r in results)
+        QMessageBox.information(self, "QEMU/ISO Updates", "\n".join(lines) + f"\n\n{checked}" +
+                                ("\n\"Download ISO\" now offers the newest releases." if newer else ""))
 
 # ---- Main Entry Point ----
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = UltimateQemuFrontend()
+    with profiler.phase("QApplication"):
+        app = QApplication(sys.argv)
+    with profiler.phase("UltimateQemuFrontend.__init__"):
+        window = UltimateQemuFrontend()
     window.show()
+    profiler.mark("window shown")
+    if profiler.enabled:
+        # Report and exit once deferred startup completes, for scripted timing runs.
+        def report():
+            print(profiler.report(as_json="--profile-startup-json" in sys.argv))
+            app.quit()
+        window.startup_finished.connect(report)
     sys.exit(app.exec_())
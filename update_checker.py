@@ -0,0 +1,283 @@
+import os
+import re
+import json
+import time
+import threading
+from urllib.parse import urljoin, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+UPDATE_CACHE_FILE = "ultimate_qemu_updates.json"
+UPDATE_CACHE_VERSION = 1
+DEFAULT_TTL = 6 * 3600
+ERROR_TTL = 15 * 60  # retry sooner when a source failed last time
+REQUEST_TIMEOUT = 15
+MAX_WORKERS = 8
+RELEASES_TRIED = 3
+
+# Each source is found by walking mirror index pages: `index` is listed,
+# `release` (optional) picks the newest matching sub-directory, `path` is
+# appended inside it, and `file` picks the newest matching file there. The
+# patterns capture the version; `checksum` matches the SUMS file next to it.
+# Windows is not listed: Microsoft's download links are per-session.
+UPDATE_SOURCES = [
+    {"id": "ubuntu-lts", "label": "Ubuntu {version} LTS Desktop", "index": "https://releases.ubuntu.com/",
+     "release": r"^(\d[02468]\.04)/$", "file": r"^ubuntu-(\d+\.\d+(?:\.\d+)?)-desktop-amd64\.iso$",
+     "checksum": r"^SHA256SUMS$"},
+    {"id": "fedora-workstation", "label": "Fedora Workstation {version}",
+     "index": "https://download.fedoraproject.org/pub/fedora/linux/releases/",
+     "release": r"^(\d+)/$", "path": "Workstation/x86_64/iso/",
+     "file": r"^Fedora-Workstation-Live-(?:x86_64-)?(\d+-[\d.]+?)(?:\.x86_64)?\.iso$",
+     "checksum": r"^Fedora-Workstation-.*CHECKSUM$"},
+    {"id": "debian-netinst", "label": "Debian {version} netinst",
+     "index": "https://cdimage.debian.org/debian-cd/current/amd64/iso-cd/",
+     "file": r"^debian-(\d+\.\d+\.\d+)-amd64-netinst\.iso$", "checksum": r"^SHA256SUMS$"},
+    {"id": "qemu-w64", "label": "QEMU for Windows {version}", "index": "https://qemu.weilnetz.de/w64/",
+     "release": r"^(20\d\d)/$", "file": r"^qemu-w64-setup-(\d{8})\.exe$"},
+]
+
+_HREF_RE = re.compile(r"""href\s*=\s*["']?([^"' >]+)""", re.I)
+
+
+def parse_links(html):
+    # Entries of an autoindex page (Apache, nginx, lighttpd): relative names
+    # only, so sort links, parent directory and absolute URLs are skipped.
+    links = []
+    for href in _HREF_RE.findall(html):
+        if href.startswith(("?", "/", "#", "../")) or "://" in href or href.startswith("mailto:"):
+            continue
+        name = unquote(href[2:] if href.startswith("./") else href)
+        if name and name not in links:
+            links.append(name)
+    return links
+
+
+def version_key(version):
+    return tuple(int(n) for n in re.findall(r"\d+", version or ""))
+
+
+def is_newer(version, current):
+    return bool(version and current) and version_key(version) > version_key(current)
+
+
+def ranked(links, pattern):
+    # [(name, version)] of the matching links, newest first. The version is
+    # the pattern's first group, or the whole name if it has none.
+    regex = re.compile(pattern)
+    found = []
+    for name in links:
+        m = regex.match(name)
+        if m:
+            found.append((name, m.group(1) if regex.groups else name))
+    found.sort(key=lambda nv: version_key(nv[1]), reverse=True)
+    return found
+
+
+def newest(links, pattern):
+    found = ranked(links, pattern)
+    return found[0] if found else (None, None)
+
+
+def current_version(source, filename):
+    m = re.match(source["file"], filename or "")
+    return m.group(1) if m else ""
+
+
+class UpdateCache:
+    # Validators and parsed links of every index page fetched, sizes of
+    # release files (their names are versioned, so one HEAD is enough), and
+    # the results of the last full check with its time.
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.pages = {}
+        self.heads = {}
+        self.results = []
+        self.checked = 0
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == UPDATE_CACHE_VERSION:
+                    self.pages = data.get("pages", {})
+                    self.heads = data.get("heads", {})
+                    self.results = data.get("results", [])
+                    self.checked = data.get("checked", 0)
+            except (OSError, ValueError):
+                pass
+
+    def page(self, url):
+        with self._lock:
+            return self.pages.get(url)
+
+    def put_page(self, url, entry):
+        with self._lock:
+            self.pages[url] = entry
+
+    def head(self, url):
+        with self._lock:
+            return self.heads.get(url)
+
+    def put_head(self, url, entry):
+        with self._lock:
+            self.heads[url] = entry
+
+    def save(self):
+        with self._lock:
+            data = {"version": UPDATE_CACHE_VERSION, "checked": self.checked, "results": self.results,
+                    "pages": self.pages, "heads": self.heads}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+
+class UpdateChecker:
+    # Finds the newest release of every source at once, one thread per
+    # source over one pooled session. Index pages are fetched with
+    # If-None-Match / If-Modified-Since, so an unchanged mirror answers 304
+    # and its links come from the cache. Within `ttl` of the last check,
+    # check() returns the cached results without any request.
+    #
+    # Results are dicts: id, label, version, current, newer, url, filename,
+    # size, last_modified, checksum_url and error ("" when the check worked).
+    def __init__(self, sources=UPDATE_SOURCES, cache_path=UPDATE_CACHE_FILE, ttl=DEFAULT_TTL, session=None,
+                 max_workers=MAX_WORKERS):
+        self.sources = sources
+        self.cache = UpdateCache(cache_path)
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._session = session
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "not_modified": 0, "bytes": 0}
+
+    @property
+    def session(self):
+        if self._session is None:
+            from iso_downloader import make_session
+            self._session = make_session(pool_size=min(self.max_workers, len(self.sources)))
+        return self._session
+
+    def cached(self):
+        # The last results if they are younger than the TTL, else None.
+        ttl = min(self.ttl, ERROR_TTL) if any(r["error"] for r in self.cache.results) else self.ttl
+        if self.cache.results and time.time() - self.cache.checked < ttl:
+            return self.cache.results
+        return None
+
+    def check(self, force=False, current=None):
+        # current: {source id: installed or listed version}, to set "newer".
+        results = None if force else self.cached()
+        if results is None:
+            workers = max(1, min(self.max_workers, len(self.sources)))
+            with ThreadPoolExecutor(workers, thread_name_prefix="update-check") as pool:
+                results = list(pool.map(self._check_source, self.sources))
+            self.cache.results = results
+            self.cache.checked = time.time()
+            try:
+                self.cache.save()
+            except OSError:
+                pass
+        current = current or {}
+        for r in results:
+            r["current"] = current.get(r["id"], "")
+            r["newer"] = is_newer(r["version"], r["current"])
+        return results
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _links(self, url):
+        # (final URL after redirects, links) of one index page.
+        entry = self.cache.page(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        r = self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        self._count("requests")
+        if r.status_code == 304 and entry:
+            self._count("not_modified")
+            return entry["base"], entry["links"]
+        r.raise_for_status()
+        self._count("bytes", len(r.content))
+        links = parse_links(r.text)
+        self.cache.put_page(url, {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified"),
+                                  "base": r.url, "links": links})
+        return r.url, links
+
+    def _head(self, url):
+        entry = self.cache.head(url)
+        if entry is None:
+            r = self.session.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+            self._count("requests")
+            r.raise_for_status()
+            length = r.headers.get("Content-Length")
+            entry = {"size": int(length) if length and length.isdigit() else None,
+                     "last_modified": r.headers.get("Last-Modified")}
+            self.cache.put_head(url, entry)
+        return entry
+
+    def _check_source(self, source):
+        result = {"id": source["id"], "label": source["label"], "version": "", "url": "", "filename": "",
+                  "size": None, "last_modified": None, "checksum_url": "", "error": ""}
+        try:
+            index, links = self._links(source["index"])
+            if source.get("release"):
+                # The newest directory can exist before its images are published.
+                for release, _ in ranked(links, source["release"])[:RELEASES_TRIED]:
+                    base, files = self._links(urljoin(index, release + source.get("path", "")))
+                    filename, version = newest(files, source["file"])
+                    if filename:
+                        break
+                else:
+                    raise LookupError(f"no release with a matching file in {index}")
+            else:
+                base, files = index, links
+                filename, version = newest(files, source["file"])
+                if filename is None:
+                    raise LookupError(f"no matching file in {index}")
+            url = urljoin(base, filename)
+            head = self._head(url)
+            result.update(version=version, label=source["label"].format(version=version), url=url,
+                          filename=filename, size=head["size"], last_modified=head["last_modified"])
+            if source.get("checksum"):
+                sums, _ = newest(files, source["checksum"])
+                if sums:
+                    result["checksum_url"] = urljoin(base, sums)
+        except Exception as e:  # network errors, HTTP errors and unexpected page layouts alike
+            result["error"] = str(e) or type(e).__name__
+        return result
+
+
+def apply_updates(iso_list, results):
+    # A copy of an ISO download list with entries that name a "source" moved
+    # to the newest release found. A stale literal sha256 is dropped, so the
+    # new checksum file is used instead.
+    found = {r["id"]: r for r in results if r["version"] and not r["error"]}
+    updated = []
+    for iso in iso_list:
+        r = found.get(iso.get("source"))
+        if r is None or r["filename"] == iso["filename"]:
+            updated.append(iso)
+            continue
+        entry = dict(iso, name=r["label"], url=r["url"], filename=r["filename"])
+        entry.pop("sha256", None)
+        if r["checksum_url"]:
+            entry["checksum_url"] = r["checksum_url"]
+        else:
+            entry.pop("checksum_url", None)
+        updated.append(entry)
+    return updated
+
+
+def format_size(size):
+    if size is None:
+        return "size unknown"
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
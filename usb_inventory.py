@@ -0,0 +1,243 @@
+import os
+import sys
+import time
+import select
+import socket
+import threading
+
+SYSFS_ROOT = "/sys"
+HUB_CLASS = 0x09
+DEFAULT_POLL_INTERVAL = 5.0
+UEVENT_SETTLE = 0.3  # a plug produces a burst of uevents; refresh once after it
+
+_pyusb = None
+
+
+def load_pyusb():
+    # pyusb is optional and slow to import; only touch it when USB is used.
+    global _pyusb
+    if _pyusb is None:
+        try:
+            import usb.core
+            _pyusb = usb.core
+        except ImportError:
+            _pyusb = False
+    return _pyusb or None
+
+
+class UsbDevice:
+    __slots__ = ("bus", "address", "port", "vendor_id", "product_id", "manufacturer", "product", "serial")
+
+    def __init__(self, bus, address, port, vendor_id, product_id, manufacturer="", product="", serial=""):
+        self.bus = bus
+        self.address = address
+        self.port = port
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.manufacturer = manufacturer
+        self.product = product
+        self.serial = serial
+
+    @property
+    def key(self):
+        # Stable while the device stays in the same port; the address changes on replug.
+        return (self.bus, self.port, self.vendor_id, self.product_id)
+
+    @property
+    def ids(self):
+        return f"{self.vendor_id:04x}:{self.product_id:04x}"
+
+    def label(self):
+        name = " ".join(p for p in (self.manufacturer, self.product) if p) or "USB device"
+        return f"{self.ids} {name} (bus {self.bus}, port {self.port or '?'})"
+
+
+def device_spec(dev, devices):
+    # What a profile stores for a device: vendor:product when it is the only
+    # one of its kind, so the choice survives replugging; otherwise its bus
+    # and address, since QEMU would take the first matching device.
+    if sum(1 for d in devices if (d.vendor_id, d.product_id) == (dev.vendor_id, dev.product_id)) > 1:
+        return f"bus={dev.bus},addr={dev.address}"
+    return dev.ids
+
+
+def usb_host_args(spec):
+    # "046d:c52b" (also the old "0x46d:0xc52b") or "bus=1,addr=5" -> -device usb-host,...
+    # Raises ValueError for anything else.
+    if spec.startswith("bus="):
+        fields = dict(f.split("=", 1) for f in spec.split(",") if "=" in f)
+        if "addr" not in fields:
+            raise ValueError(f"no addr= in USB device {spec!r}")
+        return ["-device", f"usb-host,hostbus={int(fields['bus'])},hostaddr={int(fields['addr'])}"]
+    vendor, product = spec.split(":", 1)
+    return ["-device", f"usb-host,vendorid=0x{int(vendor, 16):04x},productid=0x{int(product, 16):04x}"]
+
+
+# Neither the default pc machine nor q35 has a USB bus; usb-host devices need one.
+USB_CONTROLLER_ARGS = ["-device", "qemu-xhci,id=xhci"]
+_USB_CONTROLLERS = ("qemu-xhci", "nec-usb-xhci", "usb-ehci", "ich9-usb-", "piix3-usb-uhci", "piix4-usb-uhci",
+                    "pci-ohci", "sysbus-ohci")
+
+
+def has_usb_controller(args):
+    # True if a command line (e.g. the extra options) already adds a USB bus.
+    for opt, val in zip(args, args[1:] + [""]):
+        if opt == "-usb":
+            return True
+        if opt == "-device" and val.split(",", 1)[0].startswith(_USB_CONTROLLERS):
+            return True
+        if opt in ("-machine", "-M") and "usb=on" in val.split(","):
+            return True
+    return False
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def read_sysfs_devices(root=SYSFS_ROOT):
+    # /sys/bus/usb/devices has one entry per device ("1-2.3") and per
+    # interface ("1-2.3:1.0"); root hubs ("usb1") and other hubs are skipped.
+    base = os.path.join(root, "bus", "usb", "devices")
+    devices = []
+    for name in sorted(os.listdir(base)):
+        if ":" in name or name.startswith("usb"):
+            continue
+        path = os.path.join(base, name)
+        try:
+            vendor = int(_read(os.path.join(path, "idVendor")), 16)
+            product = int(_read(os.path.join(path, "idProduct")), 16)
+            bus = int(_read(os.path.join(path, "busnum")))
+            address = int(_read(os.path.join(path, "devnum")))
+        except ValueError:
+            continue
+        if _read(os.path.join(path, "bDeviceClass")) == f"{HUB_CLASS:02x}":
+            continue
+        devices.append(UsbDevice(bus, address, name.split("-", 1)[1] if "-" in name else "", vendor, product,
+                                 _read(os.path.join(path, "manufacturer")), _read(os.path.join(path, "product")),
+                                 _read(os.path.join(path, "serial"))))
+    return devices
+
+
+def read_pyusb_devices(usb_core):
+    # No string descriptors: reading them opens each device and can block.
+    devices = []
+    for dev in usb_core.find(find_all=True):
+        if dev.bDeviceClass == HUB_CLASS:
+            continue
+        ports = getattr(dev, "port_numbers", None) or ()
+        devices.append(UsbDevice(dev.bus, dev.address, ".".join(str(p) for p in ports), dev.idVendor, dev.idProduct))
+    return devices
+
+
+def has_sysfs(root=SYSFS_ROOT):
+    return os.path.isdir(os.path.join(root, "bus", "usb", "devices"))
+
+
+class UsbInventory:
+    # Cached table of host USB devices keyed by (bus, port, vendor, product).
+    # refresh() re-enumerates (sysfs where available, pyusb otherwise) and
+    # reports what was added and removed; on_change(added, removed) is only
+    # called when something changed. start() watches in a background thread:
+    # kernel uevents on Linux, so a plug is seen at once and nothing is read
+    # while idle; polling every poll_interval seconds elsewhere.
+    def __init__(self, on_change=None, sysfs_root=SYSFS_ROOT, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.on_change = on_change
+        self.sysfs_root = sysfs_root
+        self.poll_interval = poll_interval
+        self.devices = {}
+        self.error = ""
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enumerate(self):
+        if has_sysfs(self.sysfs_root):
+            return read_sysfs_devices(self.sysfs_root)
+        usb_core = load_pyusb()
+        if usb_core is None:
+            raise OSError("USB passthrough needs pyusb (pip install pyusb) on this platform.")
+        return read_pyusb_devices(usb_core)
+
+    def refresh(self):
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        try:
+            found = {dev.key: dev for dev in self.enumerate()}
+            self.error = ""
+        except Exception as e:  # pyusb raises backend-specific errors
+            self.error = str(e)
+            return [], []
+        with self._lock:
+            added = [dev for key, dev in found.items() if key not in self.devices]
+            removed = [dev for key, dev in self.devices.items() if key not in found]
+            # Same port and ids but a new address: the device was replugged.
+            for key, dev in found.items():
+                old = self.devices.get(key)
+                if old is not None and old.address != dev.address:
+                    removed.append(old)
+                    added.append(dev)
+            self.devices = found
+        if (added or removed) and self.on_change:
+            self.on_change(added, removed)
+        return added, removed
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.devices.values())
+
+    def spec(self, dev):
+        return device_spec(dev, self.snapshot())
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="usb-inventory", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
+
+    def _uevent_socket(self):
+        if not sys.platform.startswith("linux") or self.sysfs_root != SYSFS_ROOT:
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, 15)  # NETLINK_KOBJECT_UEVENT
+            sock.bind((0, 1))  # kernel uevent multicast group
+            return sock
+        except (OSError, AttributeError):
+            return None
+
+    def _watch(self):
+        sock = self._uevent_socket()
+        try:
+            self.refresh()
+            while not self._stop.is_set():
+                if sock is None:
+                    self._stop.wait(self.poll_interval)
+                    self.refresh()
+                    continue
+                ready, _, _ = select.select([sock], [], [], 1.0)
+                if not ready:
+                    continue
+                usb_event = False
+                deadline = time.monotonic() + 2.0
+                while ready and time.monotonic() < deadline:
+                    usb_event |= b"SUBSYSTEM=usb\0" in sock.recv(8192)
+                    ready, _, _ = select.select([sock], [], [], UEVENT_SETTLE)
+                if usb_event:
+                    self.refresh()
+        finally:
+            if sock is not None:
+                sock.close()
@@ -0,0 +1,885 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import itertools
+import threading
+import subprocess
+from collections import Counter
+
+from vm_registry import RunRegistry, REGISTRY_FILE, LOG_DIR
+from qmp_client import QmpClient, QmpError, QmpConnectionError, open_endpoint, has_unix_sockets, run_dir, STREAM_LIMIT
+from vm_supervisor import VmSupervisor, ACTIVE_STATES, EXITED
+from cpu_scheduler import CpuScheduler, AdmissionError, read_topology, DEFAULT_CPU_OVERCOMMIT, DEFAULT_RAM_OVERCOMMIT
+
+# Local agent that owns the QEMU processes, so VMs outlive the GUI and every
+# frontend (GUI windows, the CLI) sees the same VMs.
+#
+# Wire format: one compact JSON object per line, both ways.
+#   request  {"i": id, "m": method, "a": {arguments}}
+#   reply    {"i": id, "r": result}  or  {"i": id, "e": message, "k": kind}
+#   push     {"p": "sync" | "state" | "event" | "out", "d": data}
+# Pushes only go to subscribed clients: "sync" (every VM, described) once on
+# subscribe, then "state" (VmProcess.info()), "event" ([vm_id, name, data])
+# and, if asked for, "out" ([vm_id, stream, line]).
+
+AGENT_PROTOCOL = 1
+IDLE_EXIT = 60.0  # seconds without clients or VMs before the agent exits; 0 = never
+OUTPUT_BACKLOG = 1024 * 1024  # a client this far behind misses console lines...
+CLIENT_BACKLOG = 16 * 1024 * 1024  # ...and is disconnected this far behind
+CONNECT_TIMEOUT = 10.0
+AGENT_LOG = "agent.log"
+
+
+class AgentError(RuntimeError):
+    def __init__(self, message, kind="error"):
+        super().__init__(message)
+        self.kind = kind
+
+
+class AgentUnavailable(AgentError):
+    pass
+
+
+def agent_endpoint(namespace=""):
+    # Per user and profile database (see vm_registry.db_namespace), since the
+    # agent keys VMs by profile id: a socket next to the QMP sockets, or a
+    # named pipe on Windows.
+    suffix = f"-{namespace}" if namespace else ""
+    if has_unix_sockets():
+        return "unix:" + os.path.join(run_dir(), f"agent{suffix}.sock")
+    user = "".join(c for c in os.environ.get("USERNAME", "") if c.isalnum()) or "user"
+    return rf"pipe:\\.\pipe\ultimate-qemu-agent-{user}{suffix}"
+
+
+def _encode(msg):
+    return json.dumps(msg, separators=(",", ":")).encode() + b"\n"
+
+
+def _error_reply(req_id, e):
+    if isinstance(e, QmpError):
+        return {"i": req_id, "e": e.desc, "k": "qmp", "c": e.error_class}
+    if isinstance(e, AdmissionError):
+        kind = "admission"
+    elif isinstance(e, QmpConnectionError):
+        kind = "qmp-connection"
+    elif isinstance(e, asyncio.TimeoutError):
+        kind = "timeout"
+    elif isinstance(e, LookupError):
+        kind = "not-found"
+    else:
+        kind = "error"
+    return {"i": req_id, "e": str(e) or type(e).__name__, "k": kind}
+
+
+def _remote_error(msg):
+    # The exception the in-process supervisor would have raised.
+    kind, text = msg.get("k"), msg.get("e", "")
+    if kind == "admission":
+        return AdmissionError(text)
+    if kind == "qmp":
+        return QmpError(msg.get("c", "GenericError"), text)
+    if kind == "qmp-connection":
+        return QmpConnectionError(text)
+    if kind == "timeout":
+        return asyncio.TimeoutError(text)
+    return AgentError(text, kind)
+
+
+def describe(vm):
+    # info() plus what a client needs to adopt a VM it did not launch.
+    return dict(vm.info(), cmd=vm.cmd, placement=str(vm.placement) if vm.placement else None,
+                greeting=vm.qmp.greeting if vm.qmp is not None else None)
+
+
+def read_tail(path, lines, chunk=64 * 1024):
+    # Last lines of a log, reading backwards only as far as needed.
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = pos = f.tell()
+            data = b""
+            while pos > 0 and data.count(b"\n") <= lines:
+                pos = max(0, pos - chunk)
+                f.seek(pos)
+                data = f.read(end - pos)
+    except OSError:
+        return []
+    return [line.decode("utf-8", "replace").rstrip("\r") for line in data.splitlines()[-lines:]]
+
+
+# ---- Agent (server) ----
+class _Peer:
+    def __init__(self, writer):
+        self.writer = writer
+        self.name = ""
+        self.subscribed = False
+        self.output = False
+        self.dropped = 0
+
+    def backlog(self):
+        return self.writer.transport.get_write_buffer_size()
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class VmAgent:
+    # Serves one VmSupervisor to any number of local clients. The server,
+    # every client connection and all VMs share the supervisor's event loop;
+    # pushes are encoded once and written to each subscriber without waiting,
+    # and a subscriber that stops reading first loses console output, then
+    # its connection, so it cannot stall the loop or the other clients.
+    def __init__(self, endpoint=None, log_dir=LOG_DIR, registry=REGISTRY_FILE, idle_exit=IDLE_EXIT,
+                 cpu_ratio=DEFAULT_CPU_OVERCOMMIT, ram_ratio=DEFAULT_RAM_OVERCOMMIT):
+        self.endpoint = endpoint or agent_endpoint()
+        self.idle_exit = idle_exit
+        self.cpu_ratio = cpu_ratio
+        self.ram_ratio = ram_ratio
+        self.supervisor = VmSupervisor(log_dir=os.path.abspath(log_dir), on_state=self._on_state,
+                                       on_output=self._on_output, on_event=self._on_event,
+                                       registry=RunRegistry(os.path.abspath(registry)))
+        self.peers = set()
+        self.stats = Counter()
+        self.started_at = time.time()
+        self._stop = None
+        self._loop_thread = None
+        self._lock_file = None
+        self._methods = {name[4:]: getattr(self, name) for name in dir(self) if name.startswith("rpc_")}
+
+    # ---- Lifecycle ----
+    def serve(self):
+        # Blocks until shutdown or SIGTERM, then stops every VM.
+        sup = self.supervisor.start()
+        sup.scheduler = CpuScheduler(read_topology(), self.cpu_ratio, self.ram_ratio, external=sup.registry.running)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: self.request_stop())
+        try:
+            sup.call(self._serve())
+        finally:
+            sup.shutdown()
+            self._log(f"stopped after {time.time() - self.started_at:.0f}s")
+
+    def request_stop(self):
+        loop = self.supervisor.loop
+        if loop is not None and self._stop is not None:
+            loop.call_soon_threadsafe(self._stop.set)
+
+    async def _serve(self):
+        self._stop = asyncio.Event()
+        self._loop_thread = threading.current_thread()
+        close = await self._listen()
+        self._log(f"serving {self.endpoint} (pid {os.getpid()}, protocol {AGENT_PROTOCOL})")
+        watchdog = asyncio.get_running_loop().create_task(self._idle_watchdog())
+        try:
+            await self._stop.wait()
+        finally:
+            watchdog.cancel()
+            close()
+            for peer in list(self.peers):
+                peer.writer.close()
+
+    async def _listen(self):
+        # Returns a function closing the listener. A second agent for the same
+        # endpoint fails here: on POSIX it cannot take the lock file, on
+        # Windows it cannot create the first instance of the pipe.
+        kind, _, addr = self.endpoint.partition(":")
+        if kind == "unix":
+            import fcntl
+            self._lock_file = open(addr + ".lock", "a")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise AgentError(f"another agent is serving {self.endpoint}")
+            if os.path.exists(addr):
+                os.remove(addr)
+            server = await asyncio.start_unix_server(self._serve_peer, addr, limit=STREAM_LIMIT)
+            os.chmod(addr, 0o600)
+            def close():
+                server.close()
+                if os.path.exists(addr):
+                    os.remove(addr)
+            return close
+        if kind == "pipe":
+            loop = asyncio.get_running_loop()
+            def protocol():
+                return asyncio.StreamReaderProtocol(asyncio.StreamReader(limit=STREAM_LIMIT, loop=loop),
+                                                    self._serve_peer, loop=loop)
+            servers = await loop.start_serving_pipe(protocol, addr)
+            return lambda: [s.close() for s in servers]
+        raise ValueError(f"unsupported agent endpoint {self.endpoint!r}")
+
+    async def _idle_watchdog(self):
+        if not self.idle_exit:
+            return
+        idle_since = time.monotonic()
+        while True:
+            await asyncio.sleep(min(1.0, self.idle_exit / 4))
+            if self.peers or self.supervisor.active():
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= self.idle_exit:
+                self._log(f"idle for {self.idle_exit:.0f}s, exiting")
+                self._stop.set()
+                return
+
+    def _log(self, text):
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {text}", flush=True)
+
+    # ---- Connections ----
+    async def _serve_peer(self, reader, writer):
+        peer = _Peer(writer)
+        self.peers.add(peer)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                # Requests run concurrently: a slow stop never holds up a list.
+                loop.create_task(self._handle(peer, msg))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.peers.discard(peer)
+            writer.close()
+
+    async def _handle(self, peer, msg):
+        req_id = msg.get("i")
+        self.stats["requests"] += 1
+        try:
+            method = self._methods.get(msg.get("m"))
+            if method is None:
+                raise LookupError(f"unknown method {msg.get('m')!r}")
+            reply = {"i": req_id, "r": await method(peer, **(msg.get("a") or {}))}
+        except Exception as e:
+            reply = _error_reply(req_id, e)
+        peer.send(_encode(reply))
+
+    def _push(self, kind, data, output=False):
+        # Supervisor callbacks run on the loop, except a QUEUED state from a
+        # launch made on another thread.
+        if threading.current_thread() is not self._loop_thread:
+            self.supervisor.loop.call_soon_threadsafe(self._push, kind, data, output)
+            return
+        encoded = None
+        for peer in list(self.peers):
+            if not peer.subscribed or (output and not peer.output):
+                continue
+            backlog = peer.backlog()
+            if backlog > CLIENT_BACKLOG:
+                self._log(f"disconnecting {peer.name or 'client'}: {backlog} bytes behind")
+                self.peers.discard(peer)
+                peer.writer.transport.abort()
+                continue
+            if output and backlog > OUTPUT_BACKLOG:
+                peer.dropped += 1
+                self.stats["dropped"] += 1
+                continue
+            if encoded is None:
+                encoded = _encode({"p": kind, "d": data})
+            peer.send(encoded)
+            self.stats["pushed"] += 1
+
+    def _on_state(self, info):
+        self._push("state", info)
+
+    def _on_event(self, vm_id, name, data):
+        if name == "QMP_READY":
+            vm = self.supervisor.vms.get(vm_id)
+            if vm is not None and vm.qmp is not None:
+                data = dict(data, greeting=vm.qmp.greeting)
+        self._push("event", [vm_id, name, data])
+
+    def _on_output(self, vm_id, stream, line):
+        self._push("out", [vm_id, stream, line], output=True)
+
+    # ---- RPC methods: rpc_<name>(peer, **arguments) ----
+    async def rpc_hello(self, peer, name=""):
+        peer.name = name
+        return {"protocol": AGENT_PROTOCOL, "pid": os.getpid(), "endpoint": self.endpoint,
+                "log_dir": self.supervisor.log_dir, "registry": self.supervisor.registry.path}
+
+    async def rpc_subscribe(self, peer, output=True):
+        # Every VM as one "sync" push, atomically with the subscription.
+        peer.subscribed = True
+        peer.output = output
+        peer.send(_encode({"p": "sync", "d": [describe(vm) for vm in list(self.supervisor.vms.values())]}))
+        return len(self.supervisor.vms)
+
+    async def rpc_list(self, peer):
+        return [describe(vm) for vm in list(self.supervisor.vms.values())]
+
+    async def rpc_launch(self, peer, vm_id, name, cmd, queue=False, admit=True, policy=None):
+        vm = await self.supervisor.launch_async(vm_id, name, cmd, queue=queue, admit=admit, **(policy or {}))
+        return describe(vm)
+
+    async def rpc_stop(self, peer, vm_id, quit_timeout=10, powerdown=0):
+        vm = await self.supervisor.stop_async(vm_id, quit_timeout, powerdown)
+        if vm is None:
+            raise LookupError(f"no VM {vm_id}")
+        return vm.info()
+
+    async def rpc_stop_all(self, peer, quit_timeout=10, powerdown=0):
+        vms = self.supervisor.active()
+        await asyncio.gather(*(self.supervisor.stop_async(vm.vm_id, quit_timeout, powerdown) for vm in vms))
+        return len(vms)
+
+    async def rpc_restart(self, peer, vm_id, quit_timeout=10):
+        vm = await self.supervisor.restart_async(vm_id, quit_timeout)
+        if vm is None:
+            raise LookupError(f"no VM {vm_id}")
+        return describe(vm)
+
+    async def rpc_qmp(self, peer, vm_id, command, arguments=None, qmp_timeout=30.0):
+        return await self.supervisor.execute_qmp(vm_id, command, arguments, qmp_timeout)
+
+    async def rpc_resources(self, peer):
+        return self.supervisor.resources()
+
+    async def rpc_set_overcommit(self, peer, cpu_ratio, ram_ratio):
+        self.supervisor.set_overcommit(cpu_ratio, ram_ratio)
+        return self.supervisor.resources()
+
+    async def rpc_tail(self, peer, vm_id, lines=200):
+        vm = self.supervisor.vms.get(vm_id)
+        if vm is None:
+            raise LookupError(f"no VM {vm_id}")
+        return await asyncio.get_running_loop().run_in_executor(None, read_tail, vm.log_path, lines)
+
+    async def rpc_status(self, peer):
+        return {"pid": os.getpid(), "protocol": AGENT_PROTOCOL, "endpoint": self.endpoint,
+                "uptime": time.time() - self.started_at, "clients": sorted(p.name for p in self.peers),
+                "vms": len(self.supervisor.vms), "active": len(self.supervisor.active()),
+                "log_dir": self.supervisor.log_dir, "stats": dict(self.stats)}
+
+    async def rpc_shutdown(self, peer, stop_vms=False):
+        # Refused while VMs run, unless they are to be stopped.
+        active = self.supervisor.active()
+        if active and not stop_vms:
+            raise AgentError(f"{len(active)} VM(s) still running")
+        self._stop.set()
+        return len(active)
+
+
+# ---- Client ----
+class AgentClient:
+    # One connection to the agent, used from a single asyncio loop. Requests
+    # can overlap freely; on_push(kind, data) runs in the reader task in the
+    # order the agent sent them, and on_close() once the connection is gone.
+    def __init__(self, on_push=None, on_close=None):
+        self.on_push = on_push
+        self.on_close = on_close
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self, endpoint):
+        self._reader, self._writer = await open_endpoint(endpoint)
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+        return self
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                if "p" in msg:
+                    try:
+                        if self.on_push:
+                            self.on_push(msg["p"], msg.get("d"))
+                    except Exception:
+                        pass  # a failing callback must not drop the connection
+                    continue
+                fut, on_reply = self._pending.pop(msg.get("i"), (None, None))
+                if fut is None or fut.done():
+                    continue
+                if "e" in msg:
+                    fut.set_exception(_remote_error(msg))
+                    continue
+                try:
+                    fut.set_result(on_reply(msg.get("r")) if on_reply else msg.get("r"))
+                except Exception as e:
+                    fut.set_exception(e)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._fail_pending()
+            if self._writer is not None:
+                self._writer.close()
+            if self.on_close:
+                self.on_close()
+
+    def _fail_pending(self):
+        for fut, _ in self._pending.values():
+            if not fut.done():
+                fut.set_exception(AgentUnavailable("connection to the VM agent lost"))
+        self._pending.clear()
+
+    async def request(self, method, timeout=None, on_reply=None, **arguments):
+        # on_reply(result), if given, runs in the reader in order with the
+        # pushes, and its return value becomes the result.
+        if not self.connected:
+            raise AgentUnavailable("not connected to the VM agent")
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = (fut, on_reply)
+        self._writer.write(_encode({"i": req_id, "m": method, "a": arguments}))
+        try:
+            await self._writer.drain()
+            return await asyncio.wait_for(fut, timeout)
+        except ConnectionError:
+            raise AgentUnavailable("connection to the VM agent lost")
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def close(self):
+        self.on_close = None
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+
+
+def spawn_agent(endpoint=None, log_dir=LOG_DIR, registry=REGISTRY_FILE):
+    # Starts a detached agent that outlives this process; output goes to
+    # log_dir/agent.log.
+    log_dir = os.path.abspath(log_dir)
+    os.makedirs(log_dir, exist_ok=True)
+    cmd = [sys.executable, os.path.abspath(__file__), "--log-dir", log_dir, "--registry", os.path.abspath(registry)]
+    if endpoint:
+        cmd += ["--endpoint", endpoint]
+    kwargs = {}
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS
+    else:
+        kwargs["start_new_session"] = True
+    with open(os.path.join(log_dir, AGENT_LOG), "ab") as log:
+        return subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                close_fds=True, **kwargs)
+
+
+async def connect_agent(endpoint=None, spawn=True, timeout=CONNECT_TIMEOUT, log_dir=LOG_DIR,
+                        registry=REGISTRY_FILE, on_push=None, on_close=None):
+    # Connects, first starting an agent if none answers and spawn is set.
+    try:
+        endpoint = endpoint or agent_endpoint()
+    except PermissionError as e:
+        raise AgentUnavailable(str(e))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    proc = None
+    while True:
+        try:
+            return await AgentClient(on_push, on_close).connect(endpoint)
+        except (OSError, ValueError) as e:
+            if not spawn or loop.time() >= deadline:
+                raise AgentUnavailable(f"no VM agent at {endpoint}: {e}" +
+                                       (f" (see {os.path.join(log_dir, AGENT_LOG)})" if proc else ""))
+            if proc is None:
+                proc = spawn_agent(endpoint, log_dir, registry)
+            elif proc.poll() is not None:
+                # Ours failed, maybe because another client started one at the
+                # same time: give that one a moment, not the whole timeout.
+                deadline = min(deadline, loop.time() + 1.0)
+            await asyncio.sleep(0.05)
+
+
+class RemoteVm:
+    # Client-side mirror of a VmProcess in the agent, kept current by pushes.
+    # proc is always None: the process belongs to the agent.
+    proc = None
+
+    def __init__(self, info):
+        self.cmd = []
+        self.placement = None
+        self.qmp = None
+        self.update(info)
+
+    def update(self, info):
+        self._info = {k: v for k, v in info.items() if k not in ("cmd", "placement", "greeting")}
+        self.vm_id = info["id"]
+        self.name = info["name"]
+        self.state = info["state"]
+        self.pid = info["pid"]
+        self.exit_code = info["exit_code"]
+        self.restarts = info["restarts"]
+        self.started_at = info["started_at"]
+        self.ended_at = info["ended_at"]
+        self.log_path = info["log_path"]
+        self.error = info["error"]
+        self.stopped_by = info["stopped_by"]
+        self.qmp_endpoint = info["qmp"]
+        self.qmp_ready = info["qmp_ready"]
+        self.pinned = info["pinned"]
+        if "cmd" in info:
+            self.cmd = info["cmd"]
+        if "placement" in info:
+            self.placement = info["placement"]
+
+    def info(self):
+        return dict(self._info, state=self.state, error=self.error, qmp_ready=self.qmp_ready)
+
+
+class RemoteQmp(QmpClient):
+    # QMP of an agent-side VM: commands go through the agent and its events
+    # arrive as pushes, so expect_event(), hmp() and friends work unchanged.
+    def __init__(self, agent, vm_id, greeting=None):
+        super().__init__()
+        self.agent = agent
+        self.vm_id = vm_id
+        self.greeting = greeting
+
+    @property
+    def connected(self):
+        return self.agent.connected
+
+    async def execute(self, command, arguments=None, timeout=30.0):
+        return await self.agent.request("qmp", vm_id=self.vm_id, command=command, arguments=arguments,
+                                        qmp_timeout=timeout)
+
+    async def close(self):
+        self._fail_pending(QmpConnectionError("QMP connection closed"))
+
+
+class RemoteSupervisor:
+    # Same interface as VmSupervisor, backed by the agent: the VMs run in the
+    # agent process and survive this one. vms holds every VM the agent runs,
+    # launched from here or elsewhere. Callbacks run on this client's loop
+    # thread, as they would on the supervisor thread. If the connection
+    # drops, it reconnects (starting a new agent if needed) and re-syncs.
+    scheduler = None
+
+    def __init__(self, endpoint=None, name="", log_dir=LOG_DIR, on_state=None, on_output=None, on_event=None,
+                 registry=REGISTRY_FILE, spawn=True):
+        self.endpoint = endpoint or agent_endpoint()
+        self.name = name
+        self.log_dir = log_dir
+        self.registry_path = registry
+        self.spawn = spawn
+        self.on_state = on_state
+        self.on_output = on_output
+        self.on_event = on_event
+        self.vms = {}
+        self.launched = set()
+        self.agent = None
+        self.agent_info = {}
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._closing = False
+        self._reconnecting = None
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    # ---- Loop management ----
+    def start(self, timeout=CONNECT_TIMEOUT):
+        # Raises AgentUnavailable when no agent answers (or can be started).
+        if self._thread:
+            return self
+        self._thread = threading.Thread(target=self._run_loop, name="vm-agent-client", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        try:
+            self.call(self._connect(timeout))
+        except Exception:
+            self._stop_loop()
+            raise
+        return self
+
+    def _run_loop(self):
+        if sys.platform == "win32":
+            self.loop = asyncio.ProactorEventLoop()
+        else:
+            self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def _stop_loop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+        self._thread = None
+
+    def call(self, coro, wait=True, timeout=None):
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return fut.result(timeout) if wait else fut
+
+    def shutdown(self, stop_vms=True, timeout=10):
+        # Only the VMs launched through this client are stopped; the agent
+        # keeps running everything else.
+        if not self._thread:
+            return
+        if stop_vms and self.agent is not None:
+            futs = [self.call(self._request("stop", vm_id=vm_id, quit_timeout=timeout), wait=False)
+                    for vm_id in self.launched if self.state(vm_id) in ACTIVE_STATES]
+            for f in futs:
+                try:
+                    f.result()
+                except AgentError:
+                    pass
+        self._closing = True
+        self.call(self._close())
+        self._stop_loop()
+
+    # ---- Public, thread-safe API ----
+    def launch(self, vm_id, name, cmd, queue=False, admit=True, **policy):
+        return self.call(self.launch_async(vm_id, name, cmd, queue, admit, **policy))
+
+    def stop(self, vm_id, timeout=10, wait=True, powerdown=0):
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            return None
+        fut = self.call(self._request("stop", vm_id=vm_id, quit_timeout=timeout, powerdown=powerdown), wait=False)
+        if wait:
+            fut.result()
+        return vm
+
+    def stop_all(self, timeout=10, powerdown=0):
+        self.call(self._request("stop_all", quit_timeout=timeout, powerdown=powerdown))
+
+    def restart(self, vm_id, timeout=10):
+        if vm_id not in self.vms:
+            return None
+        return self.call(self._adopt_reply("restart", vm_id=vm_id, quit_timeout=timeout))
+
+    def qmp_call(self, vm_id, command, arguments=None, timeout=30.0):
+        return self.call(self.execute_qmp(vm_id, command, arguments, timeout), wait=False)
+
+    def qmp_run(self, vm_id, coro_fn):
+        return self.call(self._qmp_run(vm_id, coro_fn), wait=False)
+
+    def state(self, vm_id):
+        vm = self.vms.get(vm_id)
+        return vm.state if vm else None
+
+    def snapshot(self):
+        with self._lock:
+            return [vm.info() for vm in self.vms.values()]
+
+    def active(self):
+        return [vm for vm in list(self.vms.values()) if vm.state in ACTIVE_STATES]
+
+    def wait_all(self, poll=0.2, vm_ids=None):
+        while any(vm_ids is None or vm.vm_id in vm_ids for vm in self.active()):
+            time.sleep(poll)
+
+    def resources(self):
+        return self.call(self._request("resources"))
+
+    def set_overcommit(self, cpu_ratio, ram_ratio):
+        self.call(self._request("set_overcommit", cpu_ratio=cpu_ratio, ram_ratio=ram_ratio))
+
+    def tail(self, vm_id, lines=200):
+        return self.call(self._request("tail", vm_id=vm_id, lines=lines))
+
+    def status(self):
+        return self.call(self._request("status"))
+
+    def stop_agent(self, stop_vms=False):
+        # Refused by the agent while VMs run, unless stop_vms.
+        self._closing = True
+        try:
+            return self.call(self._request("shutdown", stop_vms=stop_vms))
+        except AgentError:
+            self._closing = False
+            raise
+
+    # ---- Loop-side API, for code already running on this client's loop ----
+    async def launch_async(self, vm_id, name, cmd, queue=False, admit=True, **policy):
+        vm = await self._adopt_reply("launch", vm_id=vm_id, name=name, cmd=cmd, queue=queue, admit=admit,
+                                     policy=policy)
+        self.launched.add(vm_id)
+        return vm
+
+    async def stop_async(self, vm_id, timeout=10, powerdown=0):
+        vm = self.vms.get(vm_id)
+        if vm is not None:
+            await self._request("stop", vm_id=vm_id, quit_timeout=timeout, powerdown=powerdown)
+        return vm
+
+    async def restart_async(self, vm_id, timeout=10):
+        if vm_id not in self.vms:
+            return None
+        return await self._adopt_reply("restart", vm_id=vm_id, quit_timeout=timeout)
+
+    async def execute_qmp(self, vm_id, command, arguments=None, timeout=30.0):
+        return await self._request("qmp", vm_id=vm_id, command=command, arguments=arguments, qmp_timeout=timeout)
+
+    # ---- Loop-side implementation ----
+    async def _request(self, method, **arguments):
+        if self.agent is None or not self.agent.connected:
+            raise AgentUnavailable("not connected to the VM agent")
+        return await self.agent.request(method, **arguments)
+
+    async def _qmp_run(self, vm_id, coro_fn):
+        vm = self.vms.get(vm_id)
+        if vm is None or vm.state not in ACTIVE_STATES:
+            raise QmpConnectionError("VM is not running")
+        if vm.qmp is None or not vm.qmp_ready:
+            raise QmpConnectionError("QMP is not connected for this VM")
+        return await coro_fn(vm.qmp)
+
+    async def _connect(self, timeout=CONNECT_TIMEOUT):
+        agent = await connect_agent(self.endpoint, self.spawn, timeout, self.log_dir, self.registry_path,
+                                    on_push=self._on_push, on_close=self._on_close)
+        try:
+            hello = await agent.request("hello", name=self.name, timeout=timeout)
+            if hello["protocol"] != AGENT_PROTOCOL:
+                raise AgentUnavailable(f"the VM agent (pid {hello['pid']}) speaks protocol {hello['protocol']}, "
+                                       f"not {AGENT_PROTOCOL}; stop it and try again")
+            self.agent = agent
+            await agent.request("subscribe", output=self.on_output is not None, timeout=timeout)
+        except BaseException:
+            await agent.close()
+            raise
+        self.agent_info = hello
+        self.connections += 1
+
+    def _on_close(self):
+        if not self._closing:
+            self._reconnecting = self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 0.1
+        while not self._closing:
+            try:
+                await self._connect()
+                return
+            except AgentError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    async def _close(self):
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        if self.agent is not None:
+            await self.agent.close()
+
+    async def _adopt_reply(self, method, **arguments):
+        return await self._request(method, on_reply=self._adopt, **arguments)
+
+    def _adopt(self, info):
+        # A described VM, taken in order with the pushes (from the reader).
+        vm = self.vms.get(info["id"])
+        if vm is None:
+            with self._lock:
+                vm = self.vms[info["id"]] = RemoteVm(info)
+        else:
+            vm.update(info)
+        if not vm.qmp_ready and vm.qmp is not None:
+            vm.qmp._fail_pending(QmpConnectionError("QMP connection closed"))
+            vm.qmp = None
+        elif vm.qmp_ready and vm.qmp is None:
+            vm.qmp = RemoteQmp(self.agent, vm.vm_id, info["greeting"])
+        elif vm.qmp is not None:
+            vm.qmp.agent = self.agent
+        return vm
+
+    def _on_push(self, kind, data):
+        if kind == "out":
+            if self.on_output:
+                self.on_output(*data)
+        elif kind == "state":
+            self._state(data)
+        elif kind == "event":
+            self._event(*data)
+        elif kind == "sync":
+            self._sync(data)
+
+    def _state(self, info):
+        vm = self.vms.get(info["id"])
+        if vm is None:
+            with self._lock:
+                vm = self.vms[info["id"]] = RemoteVm(info)
+        else:
+            vm.update(info)
+        if not vm.qmp_ready and vm.qmp is not None:
+            vm.qmp._fail_pending(QmpConnectionError("QMP connection closed"))
+            vm.qmp = None
+        if self.on_state:
+            try:
+                self.on_state(info)
+            except Exception:
+                pass
+
+    def _event(self, vm_id, name, data):
+        vm = self.vms.get(vm_id)
+        if vm is not None and name == "QMP_READY":
+            vm.qmp_ready = True
+            vm.qmp = RemoteQmp(self.agent, vm_id, data.pop("greeting", None))
+        if vm is not None and vm.qmp is not None:
+            vm.qmp._dispatch_event({"event": name, "data": data})
+        if self.on_event:
+            self.on_event(vm_id, name, data)
+
+    def _sync(self, described):
+        # After (re)connecting: adopt every VM the agent has, and end those it
+        # no longer knows (the agent was restarted meanwhile). Only VMs seen
+        # before whose state changed are reported through on_state.
+        seen = set()
+        for info in described:
+            seen.add(info["id"])
+            vm = self.vms.get(info["id"])
+            changed = vm is not None and vm.state != info["state"]
+            self._adopt(info)
+            if changed:
+                self._state(info)
+        for vm in list(self.vms.values()):
+            if vm.vm_id not in seen and vm.state in ACTIVE_STATES:
+                vm.state = EXITED
+                vm.error = "the VM agent went away"
+                vm.qmp_ready = False
+                self._state(vm.info())
+
+
+def tail_lines(supervisor, vm_id, lines=200):
+    # Log tail of a VM under either supervisor.
+    if isinstance(supervisor, RemoteSupervisor):
+        return supervisor.tail(vm_id, lines)
+    vm = supervisor.vms.get(vm_id)
+    return read_tail(vm.log_path, lines) if vm else []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vm_agent", description="Local agent that owns QEMU processes "
+                                                                   "for the Ultimate QEMU Frontend GUI and CLI.")
+    parser.add_argument("--endpoint", help="unix:PATH or pipe:NAME (default: per-user socket or pipe)")
+    parser.add_argument("--log-dir", default=LOG_DIR, help="per-VM logs (default: %(default)s)")
+    parser.add_argument("--registry", default=REGISTRY_FILE, help="running-VM registry file (default: %(default)s)")
+    parser.add_argument("--idle-exit", type=float, default=IDLE_EXIT, metavar="SECONDS",
+                        help="exit after this long without clients or VMs, 0 to never (default: %(default)s)")
+    parser.add_argument("--cpu-overcommit", type=float, default=DEFAULT_CPU_OVERCOMMIT, metavar="RATIO")
+    parser.add_argument("--ram-overcommit", type=float, default=DEFAULT_RAM_OVERCOMMIT, metavar="RATIO")
+    args = parser.parse_args(argv)
+    agent = VmAgent(args.endpoint, args.log_dir, args.registry, args.idle_exit, args.cpu_overcommit, args.ram_overcommit)
+    try:
+        agent.serve()
+    except (AgentError, OSError) as e:
+        print(f"vm_agent: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
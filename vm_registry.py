@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import threading
+
+REGISTRY_FILE = "ultimate_qemu_running.json"
+LOG_DIR = "vm_logs"
+
+
+def registry_path(db_path):
+    # One registry per profile database, next to it, since both key VMs by
+    # profile id; the default database keeps the original file name.
+    root, _ = os.path.splitext(db_path)
+    if os.path.basename(root) == "ultimate_qemu_profiles":
+        return os.path.join(os.path.dirname(db_path), REGISTRY_FILE)
+    return root + "_running.json"
+
+
+def db_namespace(db_path):
+    # Short stable tag of a profile database, so agent and QMP sockets (which
+    # are per user) of different databases never share a profile id.
+    key = os.path.normcase(os.path.realpath(db_path))
+    return hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()[:12]
+
+
+def pid_alive(pid):
+    if sys.platform == "win32":
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        try:
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        finally:
+            kernel32.CloseHandle(handle)
+        return code.value == STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # No waitpid here: reaping would steal the exit status of a child that
+    # asyncio.subprocess (the supervisor) is waiting for.
+    return True
+
+
+def terminate_pid(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+        return True
+    except OSError:
+        return False
+
+
+class RunRegistry:
+    # Small JSON file of VMs launched by any frontend (GUI or CLI), keyed by
+    # profile id, so other processes can list and stop them.
+    def __init__(self, path=REGISTRY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, data):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def running(self):
+        with self._lock:
+            data = self._read()
+            live = {k: v for k, v in data.items() if pid_alive(v["pid"])}
+            if len(live) != len(data):
+                self._write(live)
+        return live
+
+    def add(self, profile_id, name, pid, cmd, qmp=None, cpus=None):
+        with self._lock:
+            data = self._read()
+            data[str(profile_id)] = {"name": name, "pid": pid, "cmd": cmd, "qmp": qmp, "cpus": cpus,
+                                     "started": time.time()}
+            self._write(data)
+
+    def remove(self, profile_id):
+        with self._lock:
+            data = self._read()
+            if data.pop(str(profile_id), None) is not None:
+                self._write(data)
+
+
+def vm_log_path(name):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name) or "vm"
+    return os.path.join(LOG_DIR, safe + ".log")
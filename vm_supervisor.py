@@ -0,0 +1,518 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+
+from vm_registry import LOG_DIR
+from qmp_client import QmpClient, QmpConnectionError, QmpError
+from qemu_command import command_resources
+from cpu_scheduler import pin_vcpu_threads, format_cpulist
+
+QUEUED = "queued"
+STARTING = "starting"
+RUNNING = "running"
+STOPPING = "stopping"
+RESTARTING = "restarting"
+EXITED = "exited"
+CRASHED = "crashed"
+ACTIVE_STATES = (QUEUED, STARTING, RUNNING, STOPPING, RESTARTING)
+
+# How a stop request ended a VM, in escalation order.
+STOP_POWERDOWN = "powerdown"
+STOP_QUIT = "quit"
+STOP_TERMINATE = "terminate"
+STOP_KILL = "kill"
+
+RESTART_NEVER = "never"
+RESTART_ON_FAILURE = "on-failure"
+RESTART_ALWAYS = "always"
+RESTART_POLICIES = (RESTART_NEVER, RESTART_ON_FAILURE, RESTART_ALWAYS)
+
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+READ_CHUNK = 64 * 1024
+OUTPUT_LINE_MAX = 64 * 1024  # output without a newline is passed on as a line at this size
+
+
+class RotatingLog:
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._f = open(path, "ab")
+        self._size = self._f.tell()
+
+    def write(self, data):
+        if self._size + len(data) > self.max_bytes and self._size:
+            self._rotate()
+        self._f.write(data)
+        self._size += len(data)
+
+    def flush(self):
+        self._f.flush()
+
+    def _rotate(self):
+        self._f.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self._f = open(self.path, "wb")
+        self._size = 0
+
+    def close(self):
+        self._f.close()
+
+
+def _safe_name(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name) or "vm"
+
+
+class VmProcess:
+    def __init__(self, vm_id, name, cmd, restart_policy=RESTART_NEVER, max_restarts=5,
+                 backoff=1.0, max_backoff=60.0, stable_after=60.0, log_dir=LOG_DIR, qmp=None):
+        if restart_policy not in RESTART_POLICIES:
+            raise ValueError(f"unknown restart policy {restart_policy!r}")
+        self.vm_id = vm_id
+        self.name = name
+        self.cmd = list(cmd)
+        self.restart_policy = restart_policy
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.log_path = os.path.join(log_dir, _safe_name(name) + ".log")
+        self.state = STARTING
+        self.pid = None
+        self.exit_code = None
+        self.restarts = 0
+        self.started_at = None
+        self.ended_at = None
+        self.error = ""
+        self.proc = None
+        self.spawning = None  # future, set while the process is being created
+        self.stop_requested = False
+        self.stopped_by = None
+        self.task = None
+        self.qmp_endpoint = qmp
+        self.qmp = None
+        self.qmp_ready = False
+        self.placement = None
+        self.pinned = {}
+
+    def info(self):
+        return {
+            "id": self.vm_id,
+            "name": self.name,
+            "state": self.state,
+            "pid": self.pid,
+            "exit_code": self.exit_code,
+            "restarts": self.restarts,
+            "started_at": self.started_at,
+            "ended_at": self.ended_at,
+            "log_path": self.log_path,
+            "error": self.error,
+            "stopped_by": self.stopped_by,
+            "qmp": self.qmp_endpoint,
+            "qmp_ready": self.qmp_ready,
+            "cpus": self.placement.cpus if self.placement else None,
+            "pinned": dict(self.pinned),
+        }
+
+
+class VmSupervisor:
+    # Owns every QEMU child on one asyncio loop running in a background thread.
+    # stdout/stderr of all VMs are drained there into rotating per-VM logs, exits
+    # are observed as they happen and restart policies are applied with backoff.
+    # Callbacks run on the supervisor thread; GUI users must marshal them.
+    # With a CpuScheduler, launches are admitted against host capacity (or
+    # queued) and vCPU threads are pinned to their placement once QMP is up.
+    def __init__(self, log_dir=LOG_DIR, on_state=None, on_output=None, on_event=None, registry=None, scheduler=None):
+        self.log_dir = log_dir
+        self.on_state = on_state
+        self.on_output = on_output
+        self.on_event = on_event
+        self.registry = registry
+        self.scheduler = scheduler
+        self.vms = {}
+        self._lock = threading.Lock()
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    # ---- Loop management ----
+    def start(self):
+        if self._thread:
+            return self
+        self._thread = threading.Thread(target=self._run_loop, name="vm-supervisor", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run_loop(self):
+        if sys.platform == "win32":
+            self.loop = asyncio.ProactorEventLoop()
+        else:
+            self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    def call(self, coro, wait=True, timeout=None):
+        fut = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return fut.result(timeout) if wait else fut
+
+    def shutdown(self, stop_vms=True, timeout=10):
+        if not self._thread:
+            return
+        if stop_vms:
+            self.stop_all(timeout=timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # ---- Public, thread-safe API ----
+    def launch(self, vm_id, name, cmd, queue=False, admit=True, **policy):
+        # Raises cpu_scheduler.AdmissionError if the host is full, unless
+        # queue is set: the VM then waits in the QUEUED state for capacity.
+        # admit=False skips admission control (and so pinning) for this VM.
+        vm = self._register(vm_id, name, cmd, queue, admit, policy)
+        if vm.state != QUEUED:
+            self.call(self._start_task(vm))
+        return vm
+
+    def _register(self, vm_id, name, cmd, queue, admit, policy):
+        with self._lock:
+            vm = self.vms.get(vm_id)
+            if vm and vm.state in ACTIVE_STATES:
+                raise RuntimeError(f"{name} is already {vm.state}")
+            vm = VmProcess(vm_id, name, cmd, log_dir=self.log_dir, **policy)
+            if self.scheduler is not None and admit:
+                vcpus, ram_mb = command_resources(cmd)
+                vm.placement = self.scheduler.request(vm_id, vcpus, ram_mb,
+                                                      (lambda p: self._admitted(vm, p)) if queue else None)
+            self.vms[vm_id] = vm
+        if vm.placement is None and self.scheduler is not None and admit:
+            self._set_state(vm, QUEUED)
+        return vm
+
+    def _admitted(self, vm, placement):
+        # Called by the scheduler, possibly on the loop thread, so never waits.
+        vm.placement = placement
+        self.call(self._start_task(vm), wait=False)
+
+    def stop(self, vm_id, timeout=10, wait=True, powerdown=0):
+        # powerdown > 0 first asks the guest to shut down for that many seconds.
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            return None
+        fut = self.call(self._stop(vm, timeout, powerdown), wait=False)
+        if wait:
+            fut.result()
+        return vm
+
+    def stop_all(self, timeout=10, powerdown=0):
+        futs = [self.call(self._stop(vm, timeout, powerdown), wait=False) for vm in list(self.vms.values())]
+        for f in futs:
+            f.result()
+
+    def restart(self, vm_id, timeout=10):
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            return None
+        self.stop(vm_id, timeout)
+        return self.launch(vm_id, vm.name, vm.cmd, queue=True, **self._policy(vm))
+
+    def qmp_call(self, vm_id, command, arguments=None, timeout=30.0):
+        # Returns a concurrent.futures.Future so GUI callers never block.
+        return self.call(self.execute_qmp(vm_id, command, arguments, timeout), wait=False)
+
+    def qmp_run(self, vm_id, coro_fn):
+        # Runs coro_fn(client) on the supervisor loop for multi-step QMP sequences.
+        return self.call(self._qmp_run(vm_id, coro_fn), wait=False)
+
+    def state(self, vm_id):
+        vm = self.vms.get(vm_id)
+        return vm.state if vm else None
+
+    def snapshot(self):
+        with self._lock:
+            return [vm.info() for vm in self.vms.values()]
+
+    def active(self):
+        return [vm for vm in list(self.vms.values()) if vm.state in ACTIVE_STATES]
+
+    def wait_all(self, poll=0.2, vm_ids=None):
+        while any(vm_ids is None or vm.vm_id in vm_ids for vm in self.active()):
+            time.sleep(poll)
+
+    def resources(self):
+        # Admission state for display: None without a scheduler.
+        scheduler = self.scheduler
+        if scheduler is None:
+            return None
+        vcpus, ram_mb = scheduler.usage()
+        return {"host": scheduler.topology.describe(), "vcpus": vcpus, "cpu_capacity": scheduler.cpu_capacity,
+                "ram_mb": ram_mb, "ram_capacity_mb": scheduler.ram_capacity_mb,
+                "cpu_ratio": scheduler.cpu_ratio, "ram_ratio": scheduler.ram_ratio,
+                "placements": [[vm_id, str(p)] for vm_id, p in scheduler.placements().items()],
+                "queued": list(scheduler.queued())}
+
+    def set_overcommit(self, cpu_ratio, ram_ratio):
+        if self.scheduler is not None:
+            self.scheduler.cpu_ratio = cpu_ratio
+            self.scheduler.ram_ratio = ram_ratio
+
+    # ---- Loop-side API, for code already running on the supervisor loop ----
+    async def launch_async(self, vm_id, name, cmd, queue=False, admit=True, **policy):
+        vm = self._register(vm_id, name, cmd, queue, admit, policy)
+        if vm.state != QUEUED:
+            await self._start_task(vm)
+        return vm
+
+    async def stop_async(self, vm_id, timeout=10, powerdown=0):
+        vm = self.vms.get(vm_id)
+        if vm is not None:
+            await self._stop(vm, timeout, powerdown)
+        return vm
+
+    async def restart_async(self, vm_id, timeout=10):
+        vm = await self.stop_async(vm_id, timeout)
+        if vm is None:
+            return None
+        return await self.launch_async(vm_id, vm.name, vm.cmd, queue=True, **self._policy(vm))
+
+    async def execute_qmp(self, vm_id, command, arguments=None, timeout=30.0):
+        return await self._client(vm_id).execute(command, arguments, timeout)
+
+    # ---- Loop-side implementation ----
+    def _client(self, vm_id):
+        vm = self.vms.get(vm_id)
+        if vm is None or vm.state not in ACTIVE_STATES:
+            raise QmpConnectionError("VM is not running")
+        if vm.qmp is None or not vm.qmp_ready:
+            raise QmpConnectionError("QMP is not connected for this VM")
+        return vm.qmp
+
+    def _policy(self, vm):
+        return {"restart_policy": vm.restart_policy, "max_restarts": vm.max_restarts, "backoff": vm.backoff,
+                "max_backoff": vm.max_backoff, "stable_after": vm.stable_after, "qmp": vm.qmp_endpoint}
+
+    async def _qmp_run(self, vm_id, coro_fn):
+        return await coro_fn(self._client(vm_id))
+
+    async def _connect_qmp(self, vm):
+        def on_event(name, data, ts):
+            if self.on_event:
+                self.on_event(vm.vm_id, name, data)
+        client = QmpClient(on_event=on_event)
+        try:
+            await client.connect(vm.qmp_endpoint, timeout=30.0)
+        except (QmpConnectionError, OSError, ValueError) as e:
+            vm.error = f"QMP: {e}"
+            return
+        if vm.proc is None or vm.proc.returncode is not None:
+            await client.close()
+            return
+        vm.qmp = client
+        vm.qmp_ready = True
+        # Synthetic event (not sent by QEMU) so listeners know live control is available.
+        if self.on_event:
+            self.on_event(vm.vm_id, "QMP_READY", {"endpoint": vm.qmp_endpoint})
+        if vm.placement is not None:
+            await self._pin_vcpus(vm)
+
+    async def _pin_vcpus(self, vm):
+        try:
+            threads = await vm.qmp.execute("query-cpus-fast")
+        except (QmpError, QmpConnectionError) as e:
+            vm.error = f"vCPU pinning: {e}"
+            return
+        vm.pinned = pin_vcpu_threads(vm.placement, threads)
+        if self.on_event:
+            # Synthetic, like QMP_READY.
+            self.on_event(vm.vm_id, "VCPUS_PINNED", {"cpus": format_cpulist(set(vm.pinned.values())),
+                                                     "node": vm.placement.node, "vcpus": len(vm.pinned)})
+
+    async def _disconnect_qmp(self, vm):
+        vm.qmp_ready = False
+        if vm.qmp is not None:
+            await vm.qmp.close()
+            vm.qmp = None
+
+    def _set_state(self, vm, state):
+        vm.state = state
+        if self.registry is not None:
+            if state == RUNNING:
+                self.registry.add(vm.vm_id, vm.name, vm.pid, vm.cmd, qmp=vm.qmp_endpoint,
+                                  cpus=vm.placement.cpus if vm.placement else None)
+            elif state in (EXITED, CRASHED, RESTARTING):
+                self.registry.remove(vm.vm_id)
+        if self.scheduler is not None and state in (EXITED, CRASHED):
+            vm.placement = None
+            self.scheduler.release(vm.vm_id)
+        if self.on_state:
+            try:
+                self.on_state(vm.info())
+            except Exception:
+                pass
+
+    async def _start_task(self, vm):
+        vm.task = self.loop.create_task(self._supervise(vm))
+
+    async def _spawn(self, vm):
+        kwargs = {}
+        if sys.platform == "win32":
+            kwargs["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
+        return await asyncio.create_subprocess_exec(
+            *vm.cmd, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs
+        )
+
+    async def _drain(self, vm, stream, label, log):
+        pending = b""
+        while True:
+            data = await stream.read(READ_CHUNK)
+            if not data:
+                break
+            # Flushed per read so the log can be tailed while the VM runs.
+            log.write(data)
+            log.flush()
+            if self.on_output:
+                pending += data
+                *lines, pending = pending.split(b"\n")
+                if len(pending) >= OUTPUT_LINE_MAX:
+                    lines.append(pending)
+                    pending = b""
+                for line in lines:
+                    self.on_output(vm.vm_id, label, line.decode("utf-8", "replace").rstrip("\r"))
+        if pending and self.on_output:
+            self.on_output(vm.vm_id, label, pending.decode("utf-8", "replace"))
+        log.flush()
+
+    async def _supervise(self, vm):
+        log = RotatingLog(vm.log_path)
+        try:
+            while True:
+                if vm.stop_requested:
+                    # Stopped before its (next) process was spawned.
+                    if vm.state != EXITED:
+                        self._set_state(vm, EXITED)
+                    return
+                vm.exit_code = None
+                vm.stopped_by = None
+                vm.error = ""
+                self._set_state(vm, STARTING)
+                vm.spawning = self.loop.create_future()
+                try:
+                    vm.proc = await self._spawn(vm)
+                except OSError as e:
+                    vm.error = str(e)
+                    vm.ended_at = time.time()
+                    self._set_state(vm, CRASHED)
+                    return
+                finally:
+                    vm.spawning.set_result(None)
+                    vm.spawning = None
+                vm.pid = vm.proc.pid
+                vm.started_at = time.time()
+                log.write(f"=== {time.strftime('%Y-%m-%d %H:%M:%S')} started pid {vm.pid}\n".encode())
+                self._set_state(vm, RUNNING)
+                qmp_task = self.loop.create_task(self._connect_qmp(vm)) if vm.qmp_endpoint else None
+                await asyncio.gather(
+                    self._drain(vm, vm.proc.stdout, "stdout", log),
+                    self._drain(vm, vm.proc.stderr, "stderr", log),
+                )
+                vm.exit_code = await vm.proc.wait()
+                vm.ended_at = time.time()
+                if qmp_task is not None:
+                    qmp_task.cancel()
+                await self._disconnect_qmp(vm)
+                log.write(f"=== {time.strftime('%Y-%m-%d %H:%M:%S')} exited with code {vm.exit_code}\n".encode())
+                log.flush()
+                failed = vm.exit_code != 0 and not vm.stop_requested
+                if vm.stop_requested or not self._should_restart(vm, failed):
+                    self._set_state(vm, CRASHED if failed else EXITED)
+                    return
+                if vm.ended_at - vm.started_at >= vm.stable_after:
+                    vm.restarts = 0
+                delay = min(vm.backoff * (2 ** vm.restarts), vm.max_backoff)
+                vm.restarts += 1
+                self._set_state(vm, RESTARTING)
+                await asyncio.sleep(delay)
+        finally:
+            log.close()
+
+    def _should_restart(self, vm, failed):
+        if vm.restart_policy == RESTART_NEVER or vm.restarts >= vm.max_restarts:
+            return False
+        return vm.restart_policy == RESTART_ALWAYS or failed
+
+    async def _stop(self, vm, timeout, powerdown=0):
+        # Escalates: the ACPI power button for powerdown seconds (if asked and
+        # QMP is up), then QMP quit (SIGTERM without QMP) for timeout seconds,
+        # then SIGKILL. vm.stopped_by records the step that ended the VM.
+        vm.stop_requested = True
+        if vm.state == QUEUED:
+            self._set_state(vm, EXITED)
+            return
+        if vm.state == RESTARTING and vm.task:
+            vm.task.cancel()
+            self._set_state(vm, EXITED)
+            return
+        if vm.spawning is not None:
+            # Stopped while STARTING: stop the process once it exists rather
+            # than dropping the request and leaving the new VM running.
+            await asyncio.shield(vm.spawning)
+        proc = vm.proc
+        if proc is None or proc.returncode is not None:
+            return
+        self._set_state(vm, STOPPING)
+        if powerdown > 0 and vm.qmp_ready:
+            vm.stopped_by = STOP_POWERDOWN
+            if await self._ask_to_exit(vm, "system_powerdown", powerdown):
+                return
+        if vm.qmp_ready:
+            vm.stopped_by = STOP_QUIT
+            if await self._ask_to_exit(vm, "quit", timeout):
+                return
+        else:
+            vm.stopped_by = STOP_TERMINATE
+            try:
+                proc.terminate()
+            except ProcessLookupError:
+                pass
+            if await self._exited_within(vm, timeout):
+                return
+        vm.stopped_by = STOP_KILL
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        try:
+            await vm.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _ask_to_exit(self, vm, command, timeout):
+        # QEMU may drop the connection before it replies to quit.
+        deadline = self.loop.time() + timeout
+        try:
+            await vm.qmp.execute(command, timeout=timeout)
+        except (QmpError, QmpConnectionError, asyncio.TimeoutError):
+            pass
+        return await self._exited_within(vm, max(0.0, deadline - self.loop.time()))
+
+    async def _exited_within(self, vm, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(vm.task), timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            pass
+        return True